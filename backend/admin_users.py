@@ -0,0 +1,92 @@
+"""Aggregation behind the admin user listing.
+
+One pipeline returns a page of users with their role names and paid-payment
+totals joined in with ``$lookup``, instead of two extra queries per user.
+Only the listed user fields are projected, so password hashes never leave
+the database. The counts shown above the listing (sign-in method, admins)
+come from a second pipeline that counts every matching user in one
+``$facet``, not just the page.
+"""
+import re
+from typing import List, Optional
+
+# User fields returned to the admin UI
+USER_FIELDS = ("id", "email", "name", "picture", "auth_type", "is_active", "current_plan", "created_at")
+
+# Sort keys accepted by the listing; the computed ones need the joins to run before sorting
+USER_SORT_FIELDS = {"created_at", "name", "email", "current_plan", "is_active"}
+COMPUTED_SORT_FIELDS = {"payments_count", "total_paid"}
+
+
+def user_search_filter(search: Optional[str]) -> dict:
+    """Case-insensitive substring match on name or email"""
+    if not search or not search.strip():
+        return {}
+    pattern = {"$regex": re.escape(search.strip()), "$options": "i"}
+    return {"$or": [{"name": pattern}, {"email": pattern}]}
+
+
+def _joins() -> List[dict]:
+    return [
+        {"$lookup": {
+            "from": "user_roles",
+            "localField": "id",
+            "foreignField": "user_id",
+            "as": "roles"
+        }},
+        {"$lookup": {
+            "from": "payment_transactions",
+            "let": {"user_id": "$id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$and": [
+                    {"$eq": ["$user_id", "$$user_id"]},
+                    {"$eq": ["$payment_status", "paid"]}
+                ]}}},
+                {"$group": {"_id": None, "count": {"$sum": 1}, "total": {"$sum": "$amount"}}}
+            ],
+            "as": "payments"
+        }},
+        {"$addFields": {
+            "roles": "$roles.role",
+            "payments_count": {"$ifNull": [{"$arrayElemAt": ["$payments.count", 0]}, 0]},
+            "total_paid": {"$ifNull": [{"$arrayElemAt": ["$payments.total", 0]}, 0]}
+        }},
+        {"$project": {"payments": 0}}
+    ]
+
+
+def user_listing_pipeline(search: Optional[str] = None, sort: str = "created_at", descending: bool = True,
+                          skip: int = 0, limit: int = 50) -> List[dict]:
+    """Pipeline for one page of the admin user listing"""
+    if sort not in USER_SORT_FIELDS | COMPUTED_SORT_FIELDS:
+        raise ValueError(f"Unsupported sort field: {sort}")
+
+    order = {"$sort": {sort: -1 if descending else 1, "id": 1}}
+    page = [{"$skip": skip}, {"$limit": limit}]
+    match = {"$match": user_search_filter(search)}
+    project = {"$project": {"_id": 0, **{field: 1 for field in USER_FIELDS}}}
+    if sort in COMPUTED_SORT_FIELDS:
+        # Totals only exist after the joins, so every matching user is joined before paging
+        return [match, project] + _joins() + [order] + page
+    # Page first (the sort can use an index) so only the returned users are joined
+    return [match, order] + page + [project] + _joins()
+
+
+USER_COUNTS = {
+    "total": [],
+    "google": [{"$match": {"$or": [{"auth_type": "google"}, {"auth_type": None, "password_hash": None}]}}],
+    "traditional": [{"$match": {"$or": [{"auth_type": "traditional"}, {"password_hash": {"$nin": [None, ""]}}]}}],
+    "admins": [
+        {"$lookup": {"from": "user_roles", "localField": "id", "foreignField": "user_id", "as": "roles"}},
+        {"$match": {"roles.role": "admin"}}
+    ],
+}
+
+
+def user_counts_pipeline(search: Optional[str] = None) -> List[dict]:
+    """Pipeline returning one document with the ``USER_COUNTS`` of every user matching ``search``"""
+    return [
+        {"$match": user_search_filter(search)},
+        {"$facet": {name: stages + [{"$count": "count"}] for name, stages in USER_COUNTS.items()}},
+        {"$project": {name: {"$ifNull": [{"$arrayElemAt": [f"${name}.count", 0]}, 0]} for name in USER_COUNTS}}
+    ]
@@ -0,0 +1,356 @@
+"""ICS feed and CalDAV sync of a user's calendar events.
+
+Both are reached through a per-user feed token (``db.calendar_feeds``), as
+calendar apps cannot sign in with a session. Neither rebuilds the calendar on
+every poll:
+
+* The ICS feed is versioned by the user's latest change, the newest
+  ``updated_at`` of their events or ``deleted_at`` of their tombstones, each
+  read from the top of an index. It is served as ``ETag``/``Last-Modified``,
+  so an unchanged calendar costs two index lookups and a 304. A changed one is
+  streamed from the cursor, event by event.
+* The CalDAV collection hands out sync tokens carrying that same moment. A
+  ``sync-collection`` report returns only events updated since the token and
+  tombstones of events deleted since (``db.calendar_tombstones``, kept
+  ``TOMBSTONE_RETENTION``); older tokens are refused and the client resyncs.
+  Reads look back ``SYNC_OVERLAP`` to cover writes committed out of order,
+  which at worst reports a change twice.
+
+Recurring masters are exported with their RRULE, cancelled occurrences as
+EXDATE and edited ones as RECURRENCE-ID overrides. Times of a series are
+given in its time zone by IANA id, which calendar apps resolve themselves.
+"""
+import io
+import re
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, List, Optional, Tuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import XMLGenerator
+from zoneinfo import ZoneInfo
+
+from pymongo import ASCENDING, DESCENDING
+
+from recurrence import EXCEPTION_KEY_FORMAT, OVERRIDE_FIELDS
+
+PRODID = "-//YouroCRM//Calendar//EN"
+CALENDAR_NAME = "YouroCRM"
+SYNC_TOKEN_PREFIX = "urn:yourocrm:calendar-sync:"
+SYNC_OVERLAP = timedelta(seconds=5)
+TOMBSTONE_RETENTION = timedelta(days=90)
+CHUNK_SIZE = 16 * 1024
+
+NS_DAV = "DAV:"
+NS_CALDAV = "urn:ietf:params:xml:ns:caldav"
+NS_CALSERVER = "http://calendarserver.org/ns/"
+CALENDAR_CONTENT_TYPE = "text/calendar; charset=utf-8"
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+def format_utc(moment: datetime) -> str:
+    return _aware(moment).astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def escape_text(value) -> str:
+    return (str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def fold(line: str) -> str:
+    """Fold a content line at 75 octets without splitting a UTF-8 character"""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:
+            end -= 1
+        parts.append(encoded[start:end].decode("utf-8"))
+        start, limit = end, 74
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def _event_uid(event: dict) -> str:
+    return f"{event['id']}@yourocrm"
+
+
+def _times(event: dict, start: datetime, end: datetime) -> List[str]:
+    if event.get("all_day"):
+        start_day = _aware(start).date()
+        end_day = max(_aware(end).date(), start_day) + timedelta(days=1)
+        return [f"DTSTART;VALUE=DATE:{start_day:%Y%m%d}", f"DTEND;VALUE=DATE:{end_day:%Y%m%d}"]
+    zone = event.get("time_zone")
+    if event.get("rrule") and zone and zone != "UTC":
+        # Local times keep a series at the same hour across daylight saving changes
+        local = ZoneInfo(zone)
+        return [f"DTSTART;TZID={zone}:{_aware(start).astimezone(local):%Y%m%dT%H%M%S}",
+                f"DTEND;TZID={zone}:{_aware(end).astimezone(local):%Y%m%dT%H%M%S}"]
+    return [f"DTSTART:{format_utc(start)}", f"DTEND:{format_utc(end)}"]
+
+
+def _text_lines(fields: dict) -> List[str]:
+    lines = [f"SUMMARY:{escape_text(fields['title'])}"] if fields.get("title") else []
+    if fields.get("description"):
+        lines.append(f"DESCRIPTION:{escape_text(fields['description'])}")
+    if fields.get("location"):
+        lines.append(f"LOCATION:{escape_text(fields['location'])}")
+    return lines
+
+
+def _alarm(event: dict) -> List[str]:
+    minutes = event.get("reminder_minutes")
+    if minutes is None:
+        return []
+    return ["BEGIN:VALARM", "ACTION:DISPLAY", f"DESCRIPTION:{escape_text(event['title'])}",
+            f"TRIGGER:-PT{int(minutes)}M", "END:VALARM"]
+
+
+def event_lines(event: dict) -> Iterator[str]:
+    """Unfolded content lines of the VEVENT (and overrides) of one event"""
+    stamp = format_utc(event.get("updated_at") or event.get("created_at") or datetime.now(timezone.utc))
+    yield "BEGIN:VEVENT"
+    yield f"UID:{_event_uid(event)}"
+    yield f"DTSTAMP:{stamp}"
+    yield f"LAST-MODIFIED:{stamp}"
+    yield from _times(event, event["start_date"], event["end_date"])
+    yield from _text_lines(event)
+    if event.get("event_type"):
+        yield f"CATEGORIES:{escape_text(event['event_type'])}"
+    exceptions = (event.get("recurrence_exceptions") or {}) if event.get("rrule") else {}
+    if event.get("rrule"):
+        yield f"RRULE:{event['rrule'].upper().removeprefix('RRULE:')}"
+        cancelled = sorted(key for key, exception in exceptions.items() if exception.get("cancelled"))
+        if cancelled:
+            yield f"EXDATE:{','.join(cancelled)}"
+    yield from _alarm(event)
+    yield "END:VEVENT"
+
+    duration = _aware(event["end_date"]) - _aware(event["start_date"])
+    for key, override in sorted(exceptions.items()):
+        if override.get("cancelled"):
+            continue
+        original = datetime.strptime(key, EXCEPTION_KEY_FORMAT).replace(tzinfo=timezone.utc)
+        fields = {**event, **{field: override[field] for field in OVERRIDE_FIELDS if field in override}}
+        start = fields["start_date"] if "start_date" in override else original
+        end = fields["end_date"] if "end_date" in override else original + duration
+        yield "BEGIN:VEVENT"
+        yield f"UID:{_event_uid(event)}"
+        yield f"DTSTAMP:{stamp}"
+        yield f"RECURRENCE-ID:{key}"
+        yield f"DTSTART:{format_utc(start)}"
+        yield f"DTEND:{format_utc(end)}"
+        yield from _text_lines(fields)
+        yield from _alarm(fields)
+        yield "END:VEVENT"
+
+
+def _calendar_header() -> str:
+    return "".join(fold(line) for line in (
+        "BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{PRODID}", "CALSCALE:GREGORIAN",
+        f"X-WR-CALNAME:{CALENDAR_NAME}"))
+
+
+def event_resource(event: dict) -> str:
+    """A whole VCALENDAR object holding one event, as served for a CalDAV resource"""
+    return _calendar_header() + "".join(fold(line) for line in event_lines(event)) + fold("END:VCALENDAR")
+
+
+async def iter_calendar(events: AsyncIterable[dict]) -> AsyncIterator[bytes]:
+    """Stream a VCALENDAR of ``events`` in chunks of about CHUNK_SIZE bytes"""
+    pending = [_calendar_header()]
+    size = len(pending[0])
+    async for event in events:
+        text = "".join(fold(line) for line in event_lines(event))
+        pending.append(text)
+        size += len(text)
+        if size >= CHUNK_SIZE:
+            yield "".join(pending).encode("utf-8")
+            pending, size = [], 0
+    pending.append(fold("END:VCALENDAR"))
+    yield "".join(pending).encode("utf-8")
+
+
+def feed_query(user_id: str, since: datetime) -> dict:
+    """Events of the feed: everything starting after ``since`` and every recurring series"""
+    return {"user_id": user_id, "$or": [{"start_date": {"$gte": since}}, {"recurring": True}]}
+
+
+def entity_tag(moment: Optional[datetime]) -> str:
+    return f'"{int(_aware(moment).timestamp() * 1000) if moment else 0}"'
+
+
+def http_date(moment: datetime) -> str:
+    return format_datetime(_aware(moment).astimezone(timezone.utc), usegmt=True)
+
+
+def not_modified(if_none_match: Optional[str], if_modified_since: Optional[str], version: Optional[datetime]) -> bool:
+    """Whether a conditional GET can be answered with 304 (If-None-Match takes precedence)"""
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or entity_tag(version) in tags
+    if if_modified_since and version is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        # HTTP dates have whole seconds
+        return _aware(version).replace(microsecond=0) <= _aware(since)
+    return False
+
+
+def sync_token(moment: Optional[datetime]) -> str:
+    return f"{SYNC_TOKEN_PREFIX}{int(_aware(moment).timestamp() * 1000) if moment else 0}"
+
+
+def parse_sync_token(token: str) -> datetime:
+    """Moment carried by a sync token; ValueError if it is not one of ours"""
+    if not token or not token.startswith(SYNC_TOKEN_PREFIX):
+        raise ValueError("Unknown sync token")
+    try:
+        millis = int(token[len(SYNC_TOKEN_PREFIX):])
+    except ValueError:
+        raise ValueError("Unknown sync token")
+    return datetime.fromtimestamp(millis / 1000, tz=timezone.utc)
+
+
+def changes_query(user_id: str, since: datetime) -> dict:
+    return {"user_id": user_id, "updated_at": {"$gte": since - SYNC_OVERLAP}}
+
+
+def tombstones_query(user_id: str, since: datetime) -> dict:
+    return {"user_id": user_id, "deleted_at": {"$gte": since - SYNC_OVERLAP}}
+
+
+async def latest_change(db, user_id: str) -> Optional[datetime]:
+    """Newest ``updated_at`` or ``deleted_at`` of the user's calendar, from the top of two indexes"""
+    moments = []
+    for collection, field in ((db.calendar_events, "updated_at"), (db.calendar_tombstones, "deleted_at")):
+        newest = await collection.find_one({"user_id": user_id}, {"_id": 0, field: 1}, sort=[(field, DESCENDING)])
+        if newest and newest.get(field):
+            moments.append(_aware(newest[field]))
+    return max(moments) if moments else None
+
+
+async def record_tombstone(db, user_id: str, event_id: str):
+    await db.calendar_tombstones.update_one(
+        {"user_id": user_id, "event_id": event_id},
+        {"$set": {"deleted_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+
+
+async def ensure_indexes(db):
+    await db.calendar_events.create_index([("user_id", ASCENDING), ("updated_at", ASCENDING)])
+    await db.calendar_tombstones.create_index([("user_id", ASCENDING), ("deleted_at", ASCENDING)])
+    await db.calendar_tombstones.create_index(
+        "deleted_at", name="tombstone_ttl", expireAfterSeconds=int(TOMBSTONE_RETENTION.total_seconds()))
+    await db.calendar_feeds.create_index("token", unique=True)
+    await db.calendar_feeds.create_index("user_id", unique=True)
+
+
+# WebDAV/CalDAV requests and responses
+
+def parse_report(body: bytes) -> Tuple[str, Optional[str], List[str], bool]:
+    """Kind (local name of the root), sync token, hrefs and whether calendar-data is wanted"""
+    try:
+        root = ElementTree.fromstring(body)
+    except ElementTree.ParseError:
+        raise ValueError("Malformed REPORT body")
+    kind = root.tag.rpartition("}")[2]
+    token = root.findtext(f"{{{NS_DAV}}}sync-token")
+    hrefs = [href.text.strip() for href in root.iter(f"{{{NS_DAV}}}href") if href.text]
+    wants_data = root.find(f".//{{{NS_CALDAV}}}calendar-data") is not None
+    return kind, token, hrefs, wants_data
+
+
+Prop = Tuple[str, object]  # ("D:getetag", '"123"'); the value may be text, None or a list of (name, attrs) children
+
+
+def collection_props(latest: Optional[datetime]) -> List[Prop]:
+    return [
+        ("D:resourcetype", [("D:collection", {}), ("C:calendar", {})]),
+        ("D:displayname", CALENDAR_NAME),
+        ("C:supported-calendar-component-set", [("C:comp", {"name": "VEVENT"})]),
+        ("CS:getctag", sync_token(latest)),
+        ("D:sync-token", sync_token(latest)),
+    ]
+
+
+def resource_props(event: dict, with_data: bool) -> List[Prop]:
+    props: List[Prop] = [("D:getetag", entity_tag(event.get("updated_at"))),
+                         ("D:getcontenttype", f"{CALENDAR_CONTENT_TYPE}; component=vevent")]
+    if with_data:
+        props.append(("C:calendar-data", event_resource(event)))
+    return props
+
+
+class _MultistatusWriter:
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.xml = XMLGenerator(self.buffer, encoding="utf-8", short_empty_elements=True)
+
+    def leaf(self, name: str, text: Optional[str] = None, attrs: Optional[dict] = None):
+        self.xml.startElement(name, attrs or {})
+        if text is not None:
+            self.xml.characters(text)
+        self.xml.endElement(name)
+
+    def response(self, href: str, props: Optional[Iterable[Prop]]):
+        self.xml.startElement("D:response", {})
+        self.leaf("D:href", href)
+        if props is None:
+            self.leaf("D:status", "HTTP/1.1 404 Not Found")
+        else:
+            self.xml.startElement("D:propstat", {})
+            self.xml.startElement("D:prop", {})
+            for name, value in props:
+                if isinstance(value, list):
+                    self.xml.startElement(name, {})
+                    for child, attrs in value:
+                        self.leaf(child, attrs=attrs)
+                    self.xml.endElement(name)
+                else:
+                    self.leaf(name, value)
+            self.xml.endElement("D:prop")
+            self.leaf("D:status", "HTTP/1.1 200 OK")
+            self.xml.endElement("D:propstat")
+        self.xml.endElement("D:response")
+
+    def drain(self) -> bytes:
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+async def iter_multistatus(responses: AsyncIterable[Tuple[str, Optional[List[Prop]]]],
+                           token: Optional[str] = None) -> AsyncIterator[bytes]:
+    """Stream a 207 multistatus body; a response without props is reported as 404 (deleted)"""
+    w = _MultistatusWriter()
+    w.xml.startDocument()
+    w.xml.startElement("D:multistatus", {"xmlns:D": NS_DAV, "xmlns:C": NS_CALDAV, "xmlns:CS": NS_CALSERVER})
+    async for href, props in responses:
+        w.response(href, props)
+        if w.buffer.tell() >= CHUNK_SIZE:
+            yield w.drain()
+    if token is not None:
+        w.leaf("D:sync-token", token)
+    w.xml.endElement("D:multistatus")
+    yield w.drain()
+
+
+# RFC 6578 precondition: the client discards its token and syncs from scratch
+SYNC_TOKEN_ERROR = (f'<?xml version="1.0" encoding="utf-8"?>\n'
+                    f'<D:error xmlns:D="{NS_DAV}"><D:valid-sync-token/></D:error>')
+
+
+_RESOURCE_NAME = re.compile(r"([^/]+)\.ics$")
+
+
+def event_id_from_href(href: str) -> Optional[str]:
+    match = _RESOURCE_NAME.search(href)
+    return match.group(1) if match else None
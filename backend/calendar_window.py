@@ -0,0 +1,91 @@
+"""Date-window queries over calendar events.
+
+An event overlaps the window [start, end) when it starts before ``end`` and
+ends after ``start``. The second condition alone cannot bound an index scan
+on ``start_date``: it would read every older event. Events are therefore
+split by length. Short events (at most ``MAX_SHORT_SPAN``, nearly all of
+them) must have started within ``MAX_SHORT_SPAN`` before the window, which
+bounds the ``(user_id, start_date)`` range scan. The rare long events carry
+``long_span: true`` and are found through a small partial index on
+``(user_id, end_date)``. Either way the cost follows the size of the window,
+not the length of the calendar's history. Recurring masters are left out and
+expanded separately (see ``recurrence``).
+"""
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from typing import Dict, Iterable, List, Tuple
+
+from pymongo import ASCENDING
+
+MAX_SHORT_SPAN = timedelta(days=7)
+MAX_WINDOW = timedelta(days=366)
+
+
+def is_long_span(start_date: datetime, end_date: datetime) -> bool:
+    return end_date - start_date > MAX_SHORT_SPAN
+
+
+def check_window(start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+    """Normalize a requested window to UTC; ValueError if it is empty or too large"""
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if end <= start:
+        raise ValueError("end must be after start")
+    if end - start > MAX_WINDOW:
+        raise ValueError(f"Windows cover at most {MAX_WINDOW.days} days")
+    return start, end
+
+
+def window_query(user_id: str, start: datetime, end: datetime) -> dict:
+    """Events of ``user_id`` overlapping [start, end); point events at ``start`` included"""
+    # Zero-length events (deadlines) overlap when they fall inside the window
+    overlaps = {"$or": [{"end_date": {"$gt": start}}, {"start_date": {"$gte": start}}]}
+    return {"user_id": user_id, "recurring": {"$ne": True}, "$or": [
+        {"long_span": {"$ne": True}, "start_date": {"$gte": start - MAX_SHORT_SPAN, "$lt": end}, **overlaps},
+        {"long_span": True, "end_date": {"$gt": start}, "start_date": {"$lt": end}}
+    ]}
+
+
+async def ensure_indexes(collection):
+    await collection.create_index([("user_id", ASCENDING), ("start_date", ASCENDING)])
+    await collection.create_index([("user_id", ASCENDING), ("end_date", ASCENDING)],
+                                  name="long_span_end", partialFilterExpression={"long_span": True})
+
+
+async def backfill_long_span(collection):
+    """Set long_span on events stored before it was maintained"""
+    await collection.update_many(
+        {"long_span": {"$exists": False}},
+        [{"$set": {"long_span": {"$gt": [{"$subtract": ["$end_date", "$start_date"]},
+                                         int(MAX_SHORT_SPAN.total_seconds() * 1000)]}}}]
+    )
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+def sort_by_start(events: List[dict]):
+    """Sort stored (naive UTC) and expanded (aware) events together, earliest first"""
+    events.sort(key=lambda event: _aware(event["start_date"]))
+
+
+def day_counts(events: Iterable[dict], start: datetime, end: datetime, tz: tzinfo = timezone.utc) -> Dict[str, int]:
+    """Events per local day of the window; a multi-day event counts on every day it touches"""
+    first_day = start.astimezone(tz).date()
+    last_day = (end - timedelta(microseconds=1)).astimezone(tz).date()
+    counts: Dict[str, int] = {}
+    for event in events:
+        event_start = _aware(event["start_date"]).astimezone(tz).date()
+        event_end = _aware(event["end_date"])
+        # An event ending exactly at midnight does not touch the next day
+        if event_end > _aware(event["start_date"]):
+            event_end -= timedelta(microseconds=1)
+        event_end = event_end.astimezone(tz).date()
+        day: date = max(event_start, first_day)
+        while day <= min(event_end, last_day):
+            key = day.isoformat()
+            counts[key] = counts.get(key, 0) + 1
+            day += timedelta(days=1)
+    return counts
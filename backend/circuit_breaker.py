@@ -0,0 +1,168 @@
+"""Circuit breakers and per-request deadline budgets for upstream calls.
+
+A breaker counts consecutive failures (errors, timeouts and responses the
+caller classifies as failures) of one upstream. Past ``failure_threshold`` it
+opens and every call fails immediately with CircuitOpenError instead of
+waiting on a dependency that is known to be down. After
+``recovery_timeout`` it lets a limited number of probe calls through
+(half-open): a successful probe closes it again, a failed one reopens it.
+
+Every call is also bounded by the request's deadline budget: the handler sets
+a budget once (``start_deadline``) and each upstream call gets at most the
+time that is left, so a request that makes two slow calls cannot take twice
+the upstream timeout. A call cut short by the budget rather than by the
+breaker's own timeout says nothing about the upstream and is not counted as
+a failure.
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+_deadline: ContextVar[Optional[float]] = ContextVar("upstream_deadline", default=None)
+
+
+class UpstreamUnavailableError(Exception):
+    """An upstream call was not attempted or did not finish in time"""
+
+    def __init__(self, upstream: str, reason: str, retry_after: Optional[float] = None):
+        super().__init__(f"{upstream} unavailable: {reason}")
+        self.upstream = upstream
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(UpstreamUnavailableError):
+    pass
+
+
+class DeadlineExceededError(UpstreamUnavailableError):
+    pass
+
+
+def start_deadline(seconds: float):
+    """Give the current request ``seconds`` in total for its upstream calls"""
+    _deadline.set(time.monotonic() + seconds)
+
+
+def clear_deadline():
+    _deadline.set(None)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left in the current request's budget, or None without a deadline"""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 5, recovery_timeout: float = 30.0,
+                 timeout: float = 10.0, half_open_max_calls: int = 1,
+                 clock: Callable[[], float] = time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.timeout = timeout
+        self.half_open_max_calls = half_open_max_calls
+        self.clock = clock
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self.stats = {
+            "calls": 0, "successes": 0, "failures": 0, "timeouts": 0,
+            "rejected": 0, "deadline_rejected": 0, "deadline_timeouts": 0, "opened": 0
+        }
+
+    def _admit(self):
+        if self.state == OPEN:
+            waited = self.clock() - self._opened_at
+            if waited < self.recovery_timeout:
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(self.name, "circuit open", retry_after=self.recovery_timeout - waited)
+            self.state = HALF_OPEN
+            self._probes = 0
+        if self.state == HALF_OPEN:
+            if self._probes >= self.half_open_max_calls:
+                self.stats["rejected"] += 1
+                raise CircuitOpenError(self.name, "circuit half-open, probe in flight", retry_after=1.0)
+            self._probes += 1
+
+    def _call_timeout(self) -> float:
+        budget = remaining_budget()
+        if budget is None:
+            return self.timeout
+        if budget <= 0:
+            self.stats["deadline_rejected"] += 1
+            raise DeadlineExceededError(self.name, "request deadline exceeded")
+        return min(self.timeout, budget)
+
+    def record_success(self):
+        self.stats["successes"] += 1
+        self._failures = 0
+        self.state = CLOSED
+
+    def record_failure(self):
+        self.stats["failures"] += 1
+        self._failures += 1
+        if self.state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.stats["opened"] += 1
+            self.state = OPEN
+            self._opened_at = self.clock()
+
+    async def call(self, fn: Callable[[], Awaitable[T]],
+                   is_failure: Optional[Callable[[Any], bool]] = None,
+                   is_client_error: Optional[Callable[[Exception], bool]] = None) -> T:
+        """Run ``fn()`` through the breaker
+
+        Exceptions and timeouts count as failures; ``is_failure`` can flag a
+        returned value (an HTTP 5xx response, say) as one too, while still
+        returning it to the caller. Exceptions ``is_client_error`` accepts
+        (the upstream answered and rejected the request) are re-raised but
+        count as a success, since the upstream itself is up.
+        """
+        timeout = self._call_timeout()
+        self._admit()
+        self.stats["calls"] += 1
+        probing = self.state == HALF_OPEN
+        try:
+            result = await asyncio.wait_for(fn(), timeout)
+        except asyncio.TimeoutError:
+            if timeout < self.timeout:
+                self.stats["deadline_timeouts"] += 1
+                raise DeadlineExceededError(self.name, f"request deadline exceeded after {timeout:.1f}s")
+            self.stats["timeouts"] += 1
+            self.record_failure()
+            raise DeadlineExceededError(self.name, f"no response within {timeout:.1f}s")
+        except Exception as e:
+            if is_client_error is not None and is_client_error(e):
+                self.record_success()
+            else:
+                self.record_failure()
+            raise
+        finally:
+            if probing:
+                self._probes -= 1
+
+        if is_failure is not None and is_failure(result):
+            self.record_failure()
+        else:
+            self.record_success()
+        return result
+
+    def metrics(self) -> dict:
+        return {
+            **self.stats,
+            "state": self.state,
+            "consecutive_failures": self._failures,
+            "failure_threshold": self.failure_threshold,
+            "recovery_timeout": self.recovery_timeout,
+            "timeout": self.timeout
+        }
@@ -0,0 +1,188 @@
+"""Custom field values for contacts, accounts, products and invoices.
+
+Definitions in ``db.custom_fields`` apply to every tenant (``tenant_id`` is
+None, created by an admin) or to a single tenant's user; a tenant definition
+overrides a global one with the same name. For each (tenant, entity type)
+the definitions are compiled once into a pydantic model that validates the
+``custom_fields`` dict stored on the entity. Compiled schemas are cached and
+invalidated when a definition changes.
+
+Fields marked ``filterable`` get a partial index on
+``(user_id, custom_fields.<name>)`` when they are defined, and only those
+fields can be used as ``cf.<name>=value`` list filters, so every custom-field
+filter is index-backed.
+"""
+import re
+import time
+from datetime import date, datetime, timezone
+from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Type
+
+from pydantic import BaseModel, ConfigDict, Field, TypeAdapter, ValidationError, create_model
+
+ENTITY_TYPES = ("contacts", "accounts", "products", "invoices")
+FIELD_TYPES = ("text", "number", "date", "select", "boolean")
+FILTER_PREFIX = "cf."
+TEXT_MAX_LENGTH = 1000
+
+_FIELD_NAME = re.compile(r"^[a-z][a-z0-9_]{0,63}$")
+
+
+class CustomFieldError(ValueError):
+    pass
+
+
+def check_definition(entity_type: str, field_name: str, field_type: str, field_options: Optional[List[str]]):
+    """Reject definitions that could not be compiled or stored"""
+    if entity_type not in ENTITY_TYPES:
+        raise CustomFieldError(f"Unsupported entity type: {entity_type}")
+    if not _FIELD_NAME.match(field_name or ""):
+        raise CustomFieldError("Field names use lowercase letters, digits and underscores, starting with a letter")
+    if field_type not in FIELD_TYPES:
+        raise CustomFieldError(f"Unsupported field type: {field_type}")
+    if field_type == "select" and not field_options:
+        raise CustomFieldError("Select fields need at least one option")
+
+
+def definitions_query(tenant_id: str, entity_type: str) -> dict:
+    return {"entity_type": entity_type, "$or": [{"tenant_id": None}, {"tenant_id": tenant_id}]}
+
+
+def field_annotation(definition: dict) -> Any:
+    field_type = definition["field_type"]
+    if field_type == "number":
+        return float
+    if field_type == "date":
+        return date
+    if field_type == "boolean":
+        return bool
+    if field_type == "select":
+        return Literal[tuple(definition["field_options"])]
+    return str
+
+
+def compile_schema(entity_type: str, definitions: List[dict]) -> Type[BaseModel]:
+    """Pydantic model for one entity type's custom values; unknown fields are rejected"""
+    fields = {}
+    for index, definition in enumerate(definitions):
+        annotation = field_annotation(definition)
+        extra = {"max_length": TEXT_MAX_LENGTH} if definition["field_type"] == "text" else {}
+        if definition.get("required"):
+            fields[f"field_{index}"] = (annotation, Field(..., alias=definition["field_name"], **extra))
+        else:
+            fields[f"field_{index}"] = (Optional[annotation], Field(None, alias=definition["field_name"], **extra))
+    # Aliased positional names keep field names like "model_id" clear of pydantic's namespace
+    return create_model(f"{entity_type.title()}CustomFields", __config__=ConfigDict(extra="forbid"), **fields)
+
+
+def _storable(value: Any) -> Any:
+    # BSON has no date type: dates are stored as midnight UTC
+    if isinstance(value, date) and not isinstance(value, datetime):
+        return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+    return value
+
+
+class CustomFieldSchema:
+    def __init__(self, entity_type: str, definitions: List[dict]):
+        self.entity_type = entity_type
+        self.definitions = {definition["field_name"]: definition for definition in definitions}
+        self.model = compile_schema(entity_type, list(self.definitions.values()))
+        self._adapters: Dict[str, TypeAdapter] = {}
+
+    def validate(self, values: Optional[dict], stored: Optional[dict] = None) -> dict:
+        """Validated values ready to store; unset optional fields are left out
+
+        ``values`` are merged over the ``stored`` ones (None clears a field),
+        and required fields are checked on the result.
+        """
+        try:
+            parsed = self.model.model_validate({**(stored or {}), **(values or {})})
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+                               for error in e.errors())
+            raise CustomFieldError(f"Invalid custom fields: {errors}")
+        return {name: _storable(value) for name, value in parsed.model_dump(by_alias=True).items()
+                if value is not None}
+
+    def filters(self, params: Dict[str, str]) -> dict:
+        """Query on ``custom_fields`` for ``cf.<name>`` query parameters"""
+        query = {}
+        for key, raw in params.items():
+            name = key[len(FILTER_PREFIX):]
+            definition = self.definitions.get(name)
+            if definition is None:
+                raise CustomFieldError(f"Unknown custom field: {name}")
+            if not definition.get("filterable"):
+                raise CustomFieldError(f"Custom field {name} is not filterable")
+            adapter = self._adapters.get(name)
+            if adapter is None:
+                adapter = self._adapters[name] = TypeAdapter(field_annotation(definition))
+            try:
+                value = adapter.validate_strings(raw)
+            except ValidationError:
+                raise CustomFieldError(f"Invalid value for custom field {name}: {raw}")
+            query[f"custom_fields.{name}"] = _storable(value)
+        return query
+
+
+def merge_definitions(definitions: List[dict]) -> List[dict]:
+    """Tenant definitions override global ones with the same name"""
+    merged: Dict[str, dict] = {}
+    for definition in sorted(definitions, key=lambda d: d.get("tenant_id") is not None):
+        merged[definition["field_name"]] = definition
+    return sorted(merged.values(), key=lambda d: d.get("created_at") or datetime.min)
+
+
+def index_spec(field_name: str) -> Tuple[List[Tuple[str, int]], dict]:
+    """Keys and options of the partial index behind ``cf.<field_name>`` filters"""
+    path = f"custom_fields.{field_name}"
+    return [("user_id", 1), (path, 1)], {"name": f"cf_{field_name}",
+                                         "partialFilterExpression": {path: {"$exists": True}}}
+
+
+DefinitionLoader = Callable[[str, str], Any]
+
+
+class CustomFieldSchemas:
+    """Compiled schemas per (tenant, entity type), cached for ``ttl`` seconds
+
+    Changes made in this process invalidate right away; ``ttl`` bounds how
+    long another process keeps using an old schema.
+    """
+
+    def __init__(self, load: DefinitionLoader, ttl: float = 300.0, max_entries: int = 10000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.load = load
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._schemas: Dict[Tuple[str, str], Tuple[float, CustomFieldSchema]] = {}
+        self._generation = 0
+        self.stats = {"hits": 0, "compiles": 0, "invalidations": 0}
+
+    async def get(self, tenant_id: str, entity_type: str) -> CustomFieldSchema:
+        key = (tenant_id, entity_type)
+        cached = self._schemas.get(key)
+        if cached is not None and cached[0] > self.clock():
+            self.stats["hits"] += 1
+            return cached[1]
+
+        generation = self._generation
+        definitions = merge_definitions(await self.load(tenant_id, entity_type))
+        schema = CustomFieldSchema(entity_type, definitions)
+        self.stats["compiles"] += 1
+        if generation == self._generation:
+            # Not cached if definitions changed while they were being read
+            if len(self._schemas) >= self.max_entries:
+                now = self.clock()
+                self._schemas = {k: v for k, v in self._schemas.items() if v[0] > now}
+            self._schemas[key] = (self.clock() + self.ttl, schema)
+        return schema
+
+    def invalidate(self, tenant_id: Optional[str] = None):
+        """Drop compiled schemas of ``tenant_id``, or of every tenant for a global definition"""
+        self.stats["invalidations"] += 1
+        self._generation += 1
+        if tenant_id is None:
+            self._schemas.clear()
+        else:
+            self._schemas = {key: value for key, value in self._schemas.items() if key[0] != tenant_id}
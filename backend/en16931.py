@@ -0,0 +1,189 @@
+"""EN16931 / Peppol BIS 3.0 business-rule validation for outgoing invoices.
+
+The rule set is declared once as data and compiled at import time into plain
+Python predicates that run directly over the invoice, buyer account and
+seller dicts, the same inputs ``peppol_ubl`` renders. Validation therefore
+costs a handful of dict lookups per rule instead of building the UBL document
+and running a schematron engine over it, which keeps batch sends cheap.
+
+Only rules that can be violated by our data model are included; rules on
+elements the generator always emits correctly (specification identifier,
+invoice type code, tax scheme, ...) are guaranteed by construction. That
+includes the document totals (BR-CO-10, BR-S-09, BR-CO-15): the generator
+derives them from the rounded line amounts and never emits the unrounded
+totals stored on the invoice, so those are not checked either.
+"""
+import re
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from eu_countries import EU_COUNTRY_NAMES, normalize_vat_number
+from peppol_ubl import (
+    UBLDocument, invoice_totals, line_amount, party_country_code, party_endpoint, tax_category
+)
+
+FATAL = "fatal"
+WARNING = "warning"
+
+_CURRENCY = re.compile(r"^[A-Z]{3}$")
+_VAT_PREFIXES = set(EU_COUNTRY_NAMES) - {"GR"} | {"EL"}
+
+
+@dataclass
+class RuleViolation:
+    rule_id: str
+    severity: str
+    message: str
+    field: str
+    line: Optional[int] = None
+
+
+@dataclass
+class ValidationReport:
+    invoice_id: Optional[str]
+    invoice_number: Optional[str]
+    errors: List[RuleViolation] = field(default_factory=list)
+    warnings: List[RuleViolation] = field(default_factory=list)
+
+    @property
+    def valid(self) -> bool:
+        return not self.errors
+
+    def to_dict(self) -> dict:
+        return {
+            "invoice_id": self.invoice_id,
+            "invoice_number": self.invoice_number,
+            "valid": self.valid,
+            "errors": [asdict(v) for v in self.errors],
+            "warnings": [asdict(v) for v in self.warnings]
+        }
+
+
+class _Context:
+    """Values shared by several rules, computed once per invoice"""
+    __slots__ = ("invoice", "buyer", "seller", "product_names", "_totals")
+
+    def __init__(self, invoice: dict, buyer: dict, seller: dict, products: Optional[List[dict]]):
+        self.invoice = invoice
+        self.buyer = buyer or {}
+        self.seller = seller or {}
+        self.product_names = {p["id"]: p.get("name") for p in products or []}
+        self._totals = None
+
+    @property
+    def totals(self) -> dict:
+        if self._totals is None:
+            self._totals = invoice_totals(self.invoice)
+        return self._totals
+
+
+# Rule declarations -------------------------------------------------------
+#
+# Document rules: (rule id, severity, field, message, check(ctx) -> bool)
+# Line rules:     (rule id, severity, field, message, check(ctx, item) -> bool)
+# ``check`` may also be a dotted path string, compiled to a "value present" test.
+
+def _present(value) -> bool:
+    return value is not None and value != "" and value != []
+
+
+def _vat_has_prefix(vat_number: Optional[str]) -> bool:
+    clean = normalize_vat_number(vat_number)
+    return clean is None or clean[:2] in _VAT_PREFIXES
+
+
+DOCUMENT_RULES = [
+    ("BR-02", FATAL, "invoice_number", "An Invoice shall have an Invoice number", "invoice.invoice_number"),
+    ("BR-03", FATAL, "issue_date", "An Invoice shall have an Invoice issue date", "invoice.issue_date"),
+    ("BR-05", FATAL, "currency", "An Invoice shall have an Invoice currency code", "invoice.currency"),
+    ("BR-CL-04", FATAL, "currency", "Invoice currency code must be an ISO 4217 code",
+     lambda ctx: _CURRENCY.match(ctx.invoice.get("currency") or "EUR") is not None),
+    ("BR-06", FATAL, "seller.name", "An Invoice shall contain the Seller name", "seller.name"),
+    ("BR-07", FATAL, "buyer.name", "An Invoice shall contain the Buyer name", "buyer.name"),
+    ("BR-09", FATAL, "seller.country", "The Seller postal address shall contain a Seller country code",
+     lambda ctx: party_country_code(ctx.seller) is not None),
+    ("BR-11", FATAL, "buyer.country", "The Buyer postal address shall contain a Buyer country code",
+     lambda ctx: party_country_code(ctx.buyer) is not None),
+    ("BR-16", FATAL, "items", "An Invoice shall have at least one Invoice line", "invoice.items"),
+    ("BR-CO-09", FATAL, "seller.vat_number", "The Seller VAT identifier shall have an ISO country code prefix",
+     lambda ctx: _vat_has_prefix(ctx.seller.get("vat_number"))),
+    ("BR-CO-09", FATAL, "buyer.vat_number", "The Buyer VAT identifier shall have an ISO country code prefix",
+     lambda ctx: _vat_has_prefix(ctx.buyer.get("vat_number"))),
+    ("BR-S-02", FATAL, "seller.vat_number",
+     "An Invoice with a standard rated VAT category shall contain the Seller VAT identifier",
+     lambda ctx: tax_category(ctx.totals["percent"]) != "S" or _present(ctx.seller.get("vat_number"))),
+    ("BR-CO-25", FATAL, "due_date", "A positive amount due requires a payment due date or payment terms",
+     lambda ctx: ctx.invoice.get("invoice_type") == "credit_note" or ctx.totals["payable"] <= 0
+     or _present(ctx.invoice.get("due_date"))),
+    ("PEPPOL-EN16931-R020", FATAL, "seller.endpoint", "Seller electronic address (VAT number or email) is required",
+     lambda ctx: party_endpoint(ctx.seller) is not None),
+    ("PEPPOL-EN16931-R010", FATAL, "buyer.endpoint", "Buyer electronic address (VAT number or email) is required",
+     lambda ctx: party_endpoint(ctx.buyer) is not None),
+    ("BR-IC-BUYER-VAT", WARNING, "buyer.vat_number", "Buyer VAT identifier is recommended for B2B invoices",
+     "buyer.vat_number"),
+]
+
+LINE_RULES = [
+    ("BR-22", FATAL, "quantity", "Each Invoice line shall have an Invoiced quantity",
+     lambda ctx, item: item.get("quantity") is not None),
+    ("BR-24", FATAL, "quantity", "Each Invoice line shall have a non-zero Invoice line net amount",
+     lambda ctx, item: line_amount(item) != 0),
+    ("BR-25", FATAL, "description", "Each Invoice line shall contain the Item name",
+     lambda ctx, item: _present(item.get("description") or ctx.product_names.get(item.get("product_id")))),
+    ("BR-26", FATAL, "unit_price", "Each Invoice line shall contain the Item net price",
+     lambda ctx, item: item.get("unit_price") is not None),
+    ("BR-27", FATAL, "unit_price", "The Item net price shall NOT be negative",
+     lambda ctx, item: (item.get("unit_price") or 0) >= 0),
+]
+
+
+# Compilation -------------------------------------------------------------
+
+Compiled = Tuple[str, str, str, str, Callable]
+
+
+def _compile_path(path: str) -> Callable:
+    scope, key = path.split(".", 1)
+    if scope == "invoice":
+        return lambda ctx: _present(ctx.invoice.get(key))
+    if scope == "buyer":
+        return lambda ctx: _present(ctx.buyer.get(key))
+    if scope == "seller":
+        return lambda ctx: _present(ctx.seller.get(key))
+    raise ValueError(f"Unknown rule scope: {path}")
+
+
+def compile_rules(rules) -> List[Compiled]:
+    compiled = []
+    for rule_id, severity, field_name, message, check in rules:
+        predicate = _compile_path(check) if isinstance(check, str) else check
+        compiled.append((rule_id, severity, field_name, message, predicate))
+    return compiled
+
+
+_DOCUMENT_CHECKS = compile_rules(DOCUMENT_RULES)
+_LINE_CHECKS = compile_rules(LINE_RULES)
+
+
+def validate_invoice(invoice: dict, buyer: dict, seller: dict, products: Optional[List[dict]] = None) -> ValidationReport:
+    """Validate one invoice with its buyer account and seller party (see ``peppol_ubl.supplier_party``)"""
+    ctx = _Context(invoice, buyer, seller, products)
+    report = ValidationReport(invoice_id=invoice.get("id"), invoice_number=invoice.get("invoice_number"))
+
+    for rule_id, severity, field_name, message, predicate in _DOCUMENT_CHECKS:
+        if not predicate(ctx):
+            target = report.errors if severity == FATAL else report.warnings
+            target.append(RuleViolation(rule_id, severity, message, field_name))
+
+    for line_number, item in enumerate(invoice.get("items") or [], start=1):
+        for rule_id, severity, field_name, message, predicate in _LINE_CHECKS:
+            if not predicate(ctx, item):
+                target = report.errors if severity == FATAL else report.warnings
+                target.append(RuleViolation(rule_id, severity, message, f"items[{line_number}].{field_name}", line_number))
+
+    return report
+
+
+def validate_invoices(documents: Iterable[UBLDocument]) -> List[ValidationReport]:
+    """Validate a batch of (invoice, buyer, seller, products) documents"""
+    return [validate_invoice(*document) for document in documents]
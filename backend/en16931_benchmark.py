@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the compiled EN16931 validator.
+
+Reports invoices validated per second over synthetic invoices, alongside the
+cost of rendering the same invoices to UBL for comparison:
+
+    python backend/en16931_benchmark.py --invoices 20000 --lines 10
+"""
+
+import argparse
+import time
+
+from en16931 import validate_invoices
+from peppol_ubl import iter_invoice_ubl
+from ubl_benchmark import make_document
+
+
+def main(invoices: int, lines: int):
+    invoice, account, supplier, products = make_document(lines)
+    documents = [
+        ({**invoice, "invoice_number": f"INV-BENCH-{i:06d}"}, account, supplier, products)
+        for i in range(invoices)
+    ]
+
+    start = time.perf_counter()
+    reports = validate_invoices(documents)
+    elapsed = time.perf_counter() - start
+    invalid = sum(1 for report in reports if not report.valid)
+    print(f"validate: {invoices} invoices x {lines} lines in {elapsed:.2f}s "
+          f"-> {invoices / elapsed:,.0f} invoices/s ({invalid} invalid)")
+
+    sample = documents[:min(invoices, 2000)]
+    start = time.perf_counter()
+    for document in sample:
+        for _ in iter_invoice_ubl(*document):
+            pass
+    render = (time.perf_counter() - start) / len(sample)
+    print(f"render UBL for comparison: {1 / render:,.0f} invoices/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=20000)
+    parser.add_argument("--lines", type=int, default=10)
+    args = parser.parse_args()
+    main(args.invoices, args.lines)
@@ -0,0 +1,149 @@
+"""Per-user entitlements resolved once from the user's plan and roles.
+
+Admin and feature checks used to read ``user_roles`` on every request and
+looked only at ``current_plan``, so a paid ``premium_user`` role never
+unlocked anything. An Entitlements object folds both together: the effective
+plan is the highest of the stored plan and the plans implied by the user's
+roles. Objects are cached per user for ``ttl`` seconds and dropped when a
+role or plan changes in this process. Every role or plan write also bumps
+``entitlements_version`` on the user document, which each request reads
+anyway; a cached entry whose version or plan no longer matches it (changed
+by another process) is reloaded on the spot.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+DEFAULT_PLAN = "starter"
+
+# User document counter, incremented by every role or plan write
+VERSION_FIELD = "entitlements_version"
+
+# Plans from lowest to highest
+PLAN_ORDER = ("starter", "professional", "enterprise")
+
+# Roles that carry a plan with them (granted by payments or by an admin)
+ROLE_PLANS = {
+    "premium_user": "professional",
+    "professional_user": "professional",
+    "enterprise_user": "enterprise",
+}
+
+
+class Entitlements:
+    __slots__ = ("user_id", "current_plan", "plan_id", "roles", "limits", "version")
+
+    def __init__(self, user_id: str, current_plan: str, plan_id: str, roles: frozenset, limits: dict,
+                 version: int = 0):
+        self.user_id = user_id
+        self.current_plan = current_plan
+        self.plan_id = plan_id
+        self.roles = roles
+        self.limits = limits
+        self.version = version
+
+    @property
+    def is_admin(self) -> bool:
+        return "admin" in self.roles
+
+    def has_role(self, role: str) -> bool:
+        return role in self.roles
+
+    def has_feature(self, feature: str) -> bool:
+        return bool(self.limits.get(feature, False))
+
+    def limit(self, name: str, default: int = 0) -> int:
+        return self.limits.get(name, default)
+
+
+def effective_plan(current_plan: Optional[str], roles: Iterable[str]) -> str:
+    """Highest plan among the stored one and those implied by ``roles``"""
+    candidates = [current_plan if current_plan in PLAN_ORDER else DEFAULT_PLAN]
+    candidates += [ROLE_PLANS[role] for role in roles if role in ROLE_PLANS]
+    return max(candidates, key=PLAN_ORDER.index)
+
+
+def resolve_entitlements(user_id: str, current_plan: Optional[str], roles: Iterable[str],
+                         plan_limits: Dict[str, dict], version: int = 0) -> Entitlements:
+    roles = frozenset(roles)
+    plan_id = effective_plan(current_plan, roles)
+    return Entitlements(user_id, current_plan or DEFAULT_PLAN, plan_id, roles,
+                        plan_limits.get(plan_id, plan_limits.get(DEFAULT_PLAN, {})), version)
+
+
+class EntitlementCache:
+    """TTL + LRU cache of Entitlements keyed by user id
+
+    Concurrent misses for one user share a single load, and a load that was
+    running while the user was invalidated is not stored.
+    """
+
+    def __init__(self, load: Callable[[str], Awaitable[Entitlements]], ttl: float = 300.0,
+                 max_entries: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.load = load
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries: "OrderedDict[str, Tuple[float, Entitlements]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._generation: Dict[str, int] = {}
+        self.stats = {"hits": 0, "loads": 0, "coalesced": 0, "invalidations": 0, "stale": 0}
+
+    async def get(self, user_id: str, current_plan: Optional[str] = None,
+                  version: Optional[int] = None) -> Entitlements:
+        """Entitlements for ``user_id``
+
+        ``current_plan`` and ``version`` come from a fresh read of the user
+        document and detect entries made stale by another process.
+        """
+        cached = self._entries.get(user_id)
+        if cached is not None and cached[0] > self.clock():
+            entitlements = cached[1]
+            if ((current_plan is None or entitlements.current_plan == current_plan)
+                    and (version is None or entitlements.version == version)):
+                self._entries.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return entitlements
+            self.stats["stale"] += 1
+            self.invalidate(user_id)
+
+        task = self._inflight.get(user_id)
+        if task is None:
+            self.stats["loads"] += 1
+            generation = self._generation.get(user_id, 0)
+            task = self._inflight[user_id] = asyncio.create_task(self._load(user_id, generation))
+        else:
+            self.stats["coalesced"] += 1
+        # Shielded: a cancelled request must not abort the load other requests wait for
+        return await asyncio.shield(task)
+
+    async def _load(self, user_id: str, generation: int) -> Entitlements:
+        try:
+            entitlements = await self.load(user_id)
+            if self._generation.get(user_id, 0) == generation:
+                self._entries[user_id] = (self.clock() + self.ttl, entitlements)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return entitlements
+        finally:
+            del self._inflight[user_id]
+
+    def invalidate(self, user_id: str):
+        """Forget ``user_id``'s entitlements after a role or plan change"""
+        self.stats["invalidations"] += 1
+        self._entries.pop(user_id, None)
+        if user_id in self._inflight:
+            # The running load may have read the old roles; keep it from being cached
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+        else:
+            self._generation.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
+        for user_id in self._inflight:
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+
+    def metrics(self) -> dict:
+        return {**self.stats, "entries": len(self._entries), "ttl": self.ttl}
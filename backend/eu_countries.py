@@ -0,0 +1,46 @@
+"""EU member state reference data shared by the VIES and Peppol code."""
+from typing import Optional
+
+EU_COUNTRY_NAMES = {
+    'AT': 'Austria', 'BE': 'Belgium', 'BG': 'Bulgaria', 'CY': 'Cyprus',
+    'CZ': 'Czech Republic', 'DE': 'Germany', 'DK': 'Denmark', 'EE': 'Estonia',
+    'ES': 'Spain', 'FI': 'Finland', 'FR': 'France', 'GR': 'Greece',
+    'HR': 'Croatia', 'HU': 'Hungary', 'IE': 'Ireland', 'IT': 'Italy',
+    'LT': 'Lithuania', 'LU': 'Luxembourg', 'LV': 'Latvia', 'MT': 'Malta',
+    'NL': 'Netherlands', 'PL': 'Poland', 'PT': 'Portugal', 'RO': 'Romania',
+    'SE': 'Sweden', 'SI': 'Slovenia', 'SK': 'Slovakia'
+}
+
+# VAT numbers and VIES use "EL" for Greece where ISO 3166 uses "GR"
+VAT_PREFIX_TO_ISO = {'EL': 'GR'}
+
+_NAME_TO_ISO = {name.lower(): code for code, name in EU_COUNTRY_NAMES.items()}
+
+
+def normalize_vat_number(vat_number: Optional[str]) -> Optional[str]:
+    """Strip separators and upper-case a VAT number ("be 0123.456.789" -> "BE0123456789")"""
+    if not vat_number:
+        return None
+    clean = ''.join(ch for ch in vat_number if ch.isalnum()).upper()
+    return clean or None
+
+
+def country_code(value: Optional[str]) -> Optional[str]:
+    """Resolve an ISO code, VAT prefix or English country name to an ISO 3166 alpha-2 code"""
+    if not value:
+        return None
+    value = value.strip()
+    upper = value.upper()
+    if upper in VAT_PREFIX_TO_ISO:
+        return VAT_PREFIX_TO_ISO[upper]
+    if len(upper) == 2 and upper.isalpha():
+        return upper
+    return _NAME_TO_ISO.get(value.lower())
+
+
+def vat_country_code(vat_number: Optional[str]) -> Optional[str]:
+    """ISO country code of a VAT number, based on its two-letter prefix"""
+    clean = normalize_vat_number(vat_number)
+    if not clean or len(clean) < 3 or not clean[:2].isalpha():
+        return None
+    return country_code(clean[:2])
@@ -0,0 +1,164 @@
+"""Durable event inbox with a background consumer.
+
+Producers (webhooks, route handlers) record an event with a single upsert
+keyed on its ``event_id`` and return immediately; a unique index makes
+redelivered events no-ops. Background workers claim pending events under a
+lease, hand them to the handler and mark them processed, retrying failures
+with exponential backoff, so slow side effects never hold up the producer.
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+PROCESSING = "processing"
+PROCESSED = "processed"
+FAILED = "failed"
+
+
+class EventConsumer:
+    def __init__(self, collection, handler: Callable[[dict], Awaitable[None]], name: str = "events",
+                 batch_size: int = 50, max_attempts: int = 8, base_delay: float = 2.0, max_delay: float = 600.0,
+                 poll_interval: float = 5.0, lease_seconds: float = 60.0):
+        self.collection = collection
+        self.handler = handler
+        self.name = name
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.worker_id = str(uuid.uuid4())
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("event_id", unique=True)
+        await self.collection.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+
+    async def publish(self, event_id: str, event: dict, delay: float = 0) -> bool:
+        """Record an event in one write; returns False if it was already recorded
+
+        A producer that handles the event itself passes a ``delay`` and calls
+        complete() when done; the consumer only takes over if it never does.
+        """
+        now = datetime.now(timezone.utc)
+        try:
+            result = await self.collection.update_one(
+                {"event_id": event_id},
+                {"$setOnInsert": {
+                    **event,
+                    "event_id": event_id,
+                    "status": PENDING,
+                    "attempts": 0,
+                    "next_attempt_at": now + timedelta(seconds=delay),
+                    "received_at": now
+                }},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # A concurrent delivery of the same event won the upsert
+            return False
+        if result.upserted_id is None:
+            return False
+        if not delay:
+            self._wakeup.set()
+        return True
+
+    async def complete(self, event_id: str):
+        """Mark an event its producer handled inline as processed"""
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(
+            {"event_id": event_id, "status": PENDING},
+            {"$set": {"status": PROCESSED, "processed_at": now, "updated_at": now}}
+        )
+
+    def start(self, workers: int = 1):
+        for _ in range(workers):
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = await self.process_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.name} consumer error: {e}")
+                processed = 0
+
+            if not processed:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": PENDING, "next_attempt_at": {"$lte": now}},
+                # Events whose worker died mid-handling are picked up again once the lease lapses
+                {"status": PROCESSING, "lease_until": {"$lt": now}}
+            ]},
+            {"$set": {"status": PROCESSING, "lease_until": now + timedelta(seconds=self.lease_seconds),
+                      "claimed_by": self.worker_id},
+             "$inc": {"attempts": 1}},
+            sort=[("next_attempt_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def process_pending(self) -> int:
+        """Handle up to ``batch_size`` due events; returns how many were claimed"""
+        claimed = 0
+        while claimed < self.batch_size:
+            event = await self._claim()
+            if event is None:
+                break
+            claimed += 1
+            await self._handle(event)
+        return claimed
+
+    def backoff(self, attempts: int) -> float:
+        """Exponential backoff with jitter for the given attempt number"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def _handle(self, event: dict):
+        owned = {"_id": event["_id"], "claimed_by": self.worker_id, "status": PROCESSING}
+        try:
+            await self.handler(event)
+        except Exception as e:
+            now = datetime.now(timezone.utc)
+            if event["attempts"] < self.max_attempts:
+                update = {"status": PENDING, "last_error": str(e),
+                          "next_attempt_at": now + timedelta(seconds=self.backoff(event["attempts"]))}
+            else:
+                logger.warning(f"{self.name} event {event['event_id']} failed permanently: {e}")
+                update = {"status": FAILED, "last_error": str(e)}
+            await self.collection.update_one(owned, {"$set": {**update, "updated_at": now}})
+            return
+
+        now = datetime.now(timezone.utc)
+        await self.collection.update_one(owned, {"$set": {
+            "status": PROCESSED, "processed_at": now, "last_error": None, "updated_at": now
+        }})
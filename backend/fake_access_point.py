@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a Peppol access point, for offline development and load tests.
+
+Implements the submission API used by peppol_dispatch.AccessPointClient:
+
+    POST /documents          UBL XML body, X-Document-ID header -> 202 {"message_id": ...}
+    GET  /documents/{id}     delivery record
+    GET  /stats              counters
+
+Latency and failure behaviour are configurable through the environment:
+
+    FAKE_AP_LATENCY_MS=50 FAKE_AP_FAILURE_RATE=0.05 python backend/fake_access_point.py --port 8099
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import uuid
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, HTTPException, Request
+
+LATENCY_MS = float(os.environ.get("FAKE_AP_LATENCY_MS", "50"))
+FAILURE_RATE = float(os.environ.get("FAKE_AP_FAILURE_RATE", "0.0"))
+REJECT_INVALID_XML = os.environ.get("FAKE_AP_REJECT_INVALID_XML", "true").lower() == "true"
+
+app = FastAPI(title="Fake Peppol access point")
+
+messages = {}  # message_id -> delivery record
+message_ids_by_document = {}  # X-Document-ID -> message_id, so resubmissions are idempotent
+stats = {"received": 0, "accepted": 0, "duplicates": 0, "failed": 0, "rejected": 0}
+
+
+@app.post("/documents", status_code=202)
+async def submit_document(request: Request):
+    stats["received"] += 1
+    body = await request.body()
+    document_id = request.headers.get("X-Document-ID") or str(uuid.uuid4())
+
+    if LATENCY_MS:
+        await asyncio.sleep(random.expovariate(1000.0 / LATENCY_MS))
+
+    if random.random() < FAILURE_RATE:
+        stats["failed"] += 1
+        raise HTTPException(status_code=503, detail="Simulated access point outage")
+
+    if document_id in message_ids_by_document:
+        stats["duplicates"] += 1
+        return {"message_id": message_ids_by_document[document_id]}
+
+    if REJECT_INVALID_XML:
+        try:
+            ET.fromstring(body)
+        except ET.ParseError as e:
+            stats["rejected"] += 1
+            raise HTTPException(status_code=400, detail=f"Invalid UBL document: {e}")
+
+    message_id = str(uuid.uuid4())
+    message_ids_by_document[document_id] = message_id
+    messages[message_id] = {
+        "message_id": message_id,
+        "document_id": document_id,
+        "size": len(body),
+        "received_at": datetime.now(timezone.utc).isoformat()
+    }
+    stats["accepted"] += 1
+    return {"message_id": message_id}
+
+
+@app.get("/documents/{message_id}")
+async def get_document(message_id: str):
+    if message_id not in messages:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return messages[message_id]
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -0,0 +1,189 @@
+"""Free/busy and double-booking checks over a user's calendar.
+
+The busy intervals of a window are indexed once as an implicit interval tree:
+intervals sorted by start, each array position the root of the subtree of
+its half, annotated with the latest end in that subtree. An overlap query
+descends only into subtrees that can still overlap, so it costs O(log n + k)
+for k results. The union of the intervals is kept alongside for free-slot
+search by bisection, and a sweep over the sorted starts finds every
+double-booked pair without comparing all pairs.
+
+Indexes are built lazily for the requested window (widened to whole UTC
+days, so nearby requests share one) and cached per user. Writes in this
+process invalidate the user's indexes at once; ``ttl`` bounds how long
+another process serves an index built before a write.
+"""
+import bisect
+import heapq
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class Interval(NamedTuple):
+    start: datetime
+    end: datetime
+    event_id: str
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+def busy_intervals(events: Iterable[dict]) -> List[Interval]:
+    """Intervals of events that block time; all-day entries and point events (deadlines, due dates) do not"""
+    intervals = []
+    for event in events:
+        if event.get("all_day"):
+            continue
+        start, end = _aware(event["start_date"]), _aware(event["end_date"])
+        if end > start:
+            intervals.append(Interval(start, end, event["id"]))
+    return intervals
+
+
+class IntervalIndex:
+    def __init__(self, intervals: Iterable[Interval]):
+        self.intervals = sorted(intervals)
+        self._max_end: List[Optional[datetime]] = [None] * len(self.intervals)
+        self._annotate(0, len(self.intervals))
+        self.busy = self._merge()
+        self._busy_ends = [end for _, end in self.busy]
+
+    def _annotate(self, lo: int, hi: int) -> Optional[datetime]:
+        # Subtree [lo, hi) is rooted at its middle; depth is log n, so recursion is safe
+        if lo >= hi:
+            return None
+        mid = (lo + hi) // 2
+        latest = self.intervals[mid].end
+        for child in (self._annotate(lo, mid), self._annotate(mid + 1, hi)):
+            if child is not None and child > latest:
+                latest = child
+        self._max_end[mid] = latest
+        return latest
+
+    def _merge(self) -> List[Tuple[datetime, datetime]]:
+        busy: List[List[datetime]] = []
+        for interval in self.intervals:
+            if busy and interval.start <= busy[-1][1]:
+                busy[-1][1] = max(busy[-1][1], interval.end)
+            else:
+                busy.append([interval.start, interval.end])
+        return [(start, end) for start, end in busy]
+
+    def overlapping(self, start: datetime, end: datetime) -> List[Interval]:
+        """Intervals overlapping [start, end), ordered by start"""
+        start, end = _aware(start), _aware(end)
+        found = []
+        stack = [(0, len(self.intervals))]
+        while stack:
+            lo, hi = stack.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_end[mid] <= start:
+                continue
+            interval = self.intervals[mid]
+            if interval.start < end:
+                if interval.end > start:
+                    found.append(interval)
+                stack.append((mid + 1, hi))
+            stack.append((lo, mid))
+        found.sort()
+        return found
+
+    def free_slots(self, start: datetime, end: datetime, min_duration: timedelta) -> List[Tuple[datetime, datetime]]:
+        """Gaps of at least ``min_duration`` between busy time inside [start, end)"""
+        start, end = _aware(start), _aware(end)
+        slots = []
+        cursor = start
+        for busy_start, busy_end in self.busy[bisect.bisect_right(self._busy_ends, start):]:
+            if busy_start >= end:
+                break
+            if busy_start - cursor >= min_duration:
+                slots.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+        if end - cursor >= min_duration:
+            slots.append((cursor, end))
+        return slots
+
+    def busy_within(self, start: datetime, end: datetime) -> List[Tuple[datetime, datetime]]:
+        start, end = _aware(start), _aware(end)
+        blocks = []
+        for busy_start, busy_end in self.busy[bisect.bisect_right(self._busy_ends, start):]:
+            if busy_start >= end:
+                break
+            blocks.append((max(busy_start, start), min(busy_end, end)))
+        return blocks
+
+    def conflicts(self, start: datetime, end: datetime) -> List[Tuple[str, str]]:
+        """Pairs of events double-booked inside [start, end), by a sweep over the sorted starts
+
+        Two intervals that both overlap the window and each other always overlap inside it.
+        """
+        pairs = []
+        active: List[Tuple[datetime, str]] = []
+        for interval in self.overlapping(start, end):
+            while active and active[0][0] <= interval.start:
+                heapq.heappop(active)
+            pairs.extend((other, interval.event_id) for _, other in active)
+            heapq.heappush(active, (interval.end, interval.event_id))
+        return pairs
+
+
+def day_bounds(start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+    """The window widened to whole UTC days"""
+    start, end = _aware(start).astimezone(timezone.utc), _aware(end).astimezone(timezone.utc)
+    first = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    last = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    if last < end:
+        last += timedelta(days=1)
+    return first, last
+
+
+EventLoader = Callable[[str, datetime, datetime], Awaitable[List[dict]]]
+
+
+class BusyIndexes:
+    """Interval indexes per user and window, reused by any request inside a cached window"""
+
+    def __init__(self, load: EventLoader, ttl: float = 60.0, max_users: int = 2000,
+                 clock: Callable[[], float] = time.monotonic):
+        self.load = load
+        self.ttl = ttl
+        self.max_users = max_users
+        self.clock = clock
+        # user -> (window start, window end) -> (expiry, index); least recently used users first
+        self._indexes: "OrderedDict[str, Dict[Tuple[datetime, datetime], Tuple[float, IntervalIndex]]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self.stats = {"hits": 0, "builds": 0, "invalidations": 0}
+
+    async def get(self, user_id: str, start: datetime, end: datetime) -> IntervalIndex:
+        start, end = _aware(start), _aware(end)
+        windows = self._indexes.get(user_id, {})
+        now = self.clock()
+        for (window_start, window_end), (expires, index) in list(windows.items()):
+            if expires <= now:
+                del windows[(window_start, window_end)]
+            elif window_start <= start and end <= window_end:
+                self._indexes.move_to_end(user_id)
+                self.stats["hits"] += 1
+                return index
+
+        generation = self._generations.get(user_id, 0)
+        window = day_bounds(start, end)
+        index = IntervalIndex(busy_intervals(await self.load(user_id, *window)))
+        self.stats["builds"] += 1
+        # Not cached if an event changed while it was being loaded
+        if generation == self._generations.get(user_id, 0):
+            self._indexes.setdefault(user_id, {})[window] = (self.clock() + self.ttl, index)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_users:
+                self._indexes.popitem(last=False)
+        return index
+
+    def invalidate(self, user_id: str):
+        self.stats["invalidations"] += 1
+        self._generations[user_id] = self._generations.get(user_id, 0) + 1
+        self._indexes.pop(user_id, None)
@@ -0,0 +1,69 @@
+"""Shared outbound HTTP clients, one connection pool per upstream.
+
+Opening an ``httpx.AsyncClient`` per call pays a TCP and TLS handshake every
+time. The clients here are created once at startup (or on first use, for
+scripts that import the server without running it), keep connections alive
+between calls and are closed by the application's shutdown hook. Each
+upstream gets its own limits and timeouts so a slow PayPal cannot exhaust the
+connections VIES lookups need.
+"""
+import importlib.util
+import logging
+from typing import Dict, NamedTuple, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# HTTP/2 needs the optional "h2" package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class UpstreamConfig(NamedTuple):
+    base_url: str
+    timeout: float = 10.0
+    connect_timeout: float = 5.0
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+
+
+class HttpClients:
+    def __init__(self, upstreams: Dict[str, UpstreamConfig], transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.upstreams = upstreams
+        self._transport = transport
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _create(self, name: str) -> httpx.AsyncClient:
+        config = self.upstreams[name]
+        http2 = config.http2 and HTTP2_AVAILABLE
+        if config.http2 and not HTTP2_AVAILABLE:
+            logger.warning(f"HTTP/2 requested for {name} but the h2 package is not installed, using HTTP/1.1")
+        return httpx.AsyncClient(
+            base_url=config.base_url,
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry
+            ),
+            http2=http2,
+            transport=self._transport
+        )
+
+    async def start(self):
+        for name in self.upstreams:
+            self.get(name)
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """The pooled client for ``name``; requests use paths relative to its base URL"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._clients[name] = self._create(name)
+        return client
+
+    async def close(self):
+        clients, self._clients = self._clients, {}
+        for client in clients.values():
+            await client.aclose()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Import supplier UBL invoices from files or directories as purchase invoices.
+
+    python backend/ingest_ubl.py USER_ID inbox/ more/invoice.xml --chunk-size 500
+
+Directories are walked recursively for *.xml files. Files are opened and
+parsed one at a time, so thousands of documents go through in bounded memory.
+"""
+
+import asyncio
+import json
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+import typer
+
+from server import client, ingest_ubl_for_user
+
+app = typer.Typer(add_completion=False)
+
+
+def iter_sources(paths: List[Path]) -> Iterator[Tuple[str, str]]:
+    for path in paths:
+        if path.is_dir():
+            for file in sorted(path.rglob("*.xml")):
+                yield str(file), str(file)
+        else:
+            yield str(path), str(path)
+
+
+@app.command()
+def ingest(
+    user_id: str = typer.Argument(..., help="Owner of the imported purchase invoices"),
+    paths: List[Path] = typer.Argument(..., exists=True, help="UBL files or directories"),
+    chunk_size: int = typer.Option(200, help="Documents resolved and inserted per round trip"),
+):
+    """Import UBL invoices for USER_ID"""
+    try:
+        stats = asyncio.run(ingest_ubl_for_user(user_id, iter_sources(paths), chunk_size=chunk_size))
+    finally:
+        client.close()
+
+    for error in stats["errors"]:
+        typer.echo(f"{error['source']}: {error['error']}", err=True)
+    typer.echo(json.dumps({k: v for k, v in stats.items() if k != "errors"} | {"errors": len(stats["errors"])}))
+
+
+if __name__ == "__main__":
+    app()
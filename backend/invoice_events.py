@@ -0,0 +1,144 @@
+"""Calendar events for invoice due dates, kept in sync with the invoices.
+
+Every open invoice with a ``due_date`` has one ``invoice_due`` event, found
+by ``(user_id, related_id)``; an event a user created by hand for the invoice
+is adopted rather than duplicated. Invoice routes record a change in an
+outbox (an EventConsumer over ``db.invoice_events``) before writing the
+invoice, delayed, then project the written invoice themselves and complete
+the record; the consumer only runs it if the route died before that. The
+projection reads the invoice's current state instead of trusting the outbox
+payload, upserting or deleting its event, so changes applied out of order or
+twice converge, and a crash between the outbox record and the invoice write
+leaves nothing stale.
+
+Invoices that existed before are covered by a one-time backfill that upserts
+their events with ``bulk_write`` in ``_id`` order, checkpointed in a
+JobLease so a restart resumes where it stopped.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from pymongo import ASCENDING, UpdateOne
+
+from calendar_feed import record_tombstone
+from job_lease import JobLease
+
+logger = logging.getLogger(__name__)
+
+INVOICE_DUE = "invoice_due"
+CLOSED_STATUSES = ("paid", "cancelled")
+
+
+def due_event_filter(user_id: str, invoice_id: str) -> dict:
+    return {"user_id": user_id, "related_id": invoice_id, "event_type": INVOICE_DUE}
+
+
+def due_event_fields(invoice: Optional[dict], now: datetime) -> Optional[dict]:
+    """Fields of the invoice's due event, or None if it should have none"""
+    if not invoice or not invoice.get("due_date") or invoice.get("status") in CLOSED_STATUSES:
+        return None
+    amount = invoice.get("total_amount")
+    return {
+        "title": f"Invoice {invoice['invoice_number']} due",
+        "description": f"Amount due: {amount:.2f}" if amount is not None else None,
+        "start_date": invoice["due_date"],
+        "end_date": invoice["due_date"],
+        "related_type": "invoice",
+        "all_day": True,
+        "long_span": False,
+        # Due dates are shown, not announced
+        "reminder_minutes": None,
+        "remind_at": None,
+        "remind_for": None,
+        "updated_at": now
+    }
+
+
+def due_event_update(fields: dict, now: datetime) -> dict:
+    return {"$set": fields, "$setOnInsert": {"id": str(uuid.uuid4()), "created_at": now}}
+
+
+def due_event_upsert(invoice: dict, fields: dict, now: datetime) -> UpdateOne:
+    return UpdateOne(due_event_filter(invoice["user_id"], invoice["id"]), due_event_update(fields, now), upsert=True)
+
+
+class InvoiceDueEvents:
+    def __init__(self, db, batch_size: int = 500, lease: Optional[JobLease] = None):
+        self.db = db
+        self.batch_size = batch_size
+        self.lease = lease or JobLease(db.job_leases, "invoice_due_backfill")
+        self._task: Optional[asyncio.Task] = None
+
+    async def ensure_indexes(self):
+        await self.db.calendar_events.create_index(
+            [("user_id", ASCENDING), ("related_id", ASCENDING)],
+            name="invoice_due_events", partialFilterExpression={"event_type": INVOICE_DUE}
+        )
+
+    async def handle(self, change: dict):
+        """Outbox handler: bring the due event of ``change['invoice_id']`` in line with the invoice"""
+        user_id, invoice_id = change["user_id"], change["invoice_id"]
+        now = datetime.now(timezone.utc)
+        invoice = await self.db.invoices.find_one({"id": invoice_id, "user_id": user_id}, {"_id": 0})
+        fields = due_event_fields(invoice, now)
+        if fields is not None:
+            await self.db.calendar_events.update_one(
+                due_event_filter(user_id, invoice_id), due_event_update(fields, now), upsert=True)
+            return
+        deleted = await self.db.calendar_events.find_one_and_delete(
+            due_event_filter(user_id, invoice_id), {"_id": 0, "id": 1})
+        if deleted:
+            await record_tombstone(self.db, user_id, deleted["id"])
+
+    def start_backfill(self):
+        self._task = asyncio.create_task(self._backfill())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _backfill(self):
+        try:
+            await self.backfill()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Invoice due backfill error: {e}")
+
+    async def backfill(self) -> Optional[dict]:
+        """Upsert the due events of existing invoices; None if another worker holds the lease"""
+        checkpoint = await self.lease.acquire()
+        if checkpoint is None:
+            return None
+        if checkpoint.get("done"):
+            await self.lease.release()
+            return {"upserted": checkpoint.get("upserted", 0)}
+
+        upserted = checkpoint.get("upserted", 0)
+        query = {"due_date": {"$ne": None}, "status": {"$nin": list(CLOSED_STATUSES)}}
+        while True:
+            if "last_id" in checkpoint:
+                query["_id"] = {"$gt": checkpoint["last_id"]}
+            invoices = await self.db.invoices.find(query).sort("_id", ASCENDING).limit(
+                self.batch_size).to_list(self.batch_size)
+            if not invoices:
+                break
+            now = datetime.now(timezone.utc)
+            ops = [due_event_upsert(invoice, due_event_fields(invoice, now), now) for invoice in invoices]
+            await self.db.calendar_events.bulk_write(ops, ordered=False)
+            upserted += len(ops)
+            checkpoint = {"last_id": invoices[-1]["_id"], "upserted": upserted}
+            if not await self.lease.save(checkpoint):
+                logger.warning("Invoice due backfill lease lost, stopping")
+                return None
+
+        await self.lease.save({"done": True, "upserted": upserted})
+        await self.lease.release()
+        if upserted:
+            logger.info(f"Invoice due backfill done: {upserted} events")
+        return {"upserted": upserted}
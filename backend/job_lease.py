@@ -0,0 +1,68 @@
+"""Lease and checkpoint document for singleton background jobs.
+
+Every API worker process starts the same background jobs; a lease stored in
+``db.job_leases`` makes sure only one of them runs a given job at a time. The
+lease document also carries the job's checkpoint, so a job interrupted by a
+restart (or whose worker died) resumes where the last holder stopped once the
+lease lapses.
+"""
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class JobLease:
+    def __init__(self, collection, name: str, lease_seconds: float = 600, owner: Optional[str] = None):
+        self.collection = collection
+        self.name = name
+        self.lease_seconds = lease_seconds
+        self.owner = owner or str(uuid.uuid4())
+
+    def _expiry(self) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=self.lease_seconds)
+
+    async def acquire(self) -> Optional[dict]:
+        """Take (or renew) the lease; return the saved checkpoint, or None if another worker holds it"""
+        now = datetime.now(timezone.utc)
+        try:
+            doc = await self.collection.find_one_and_update(
+                {"_id": self.name, "$or": [
+                    {"lease_until": None},
+                    {"lease_until": {"$lt": now}},
+                    {"lease_owner": self.owner}
+                ]},
+                {"$set": {"lease_owner": self.owner, "lease_until": self._expiry()},
+                 "$setOnInsert": {"checkpoint": {}}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The document exists but the filter did not match: the lease is held
+            return None
+        return doc.get("checkpoint") or {}
+
+    async def save(self, checkpoint: dict) -> bool:
+        """Store the checkpoint and extend the lease; False if the lease was lost meanwhile"""
+        result = await self.collection.update_one(
+            {"_id": self.name, "lease_owner": self.owner},
+            {"$set": {"checkpoint": checkpoint, "lease_until": self._expiry(),
+                      "updated_at": datetime.now(timezone.utc)}}
+        )
+        return result.matched_count == 1
+
+    async def renew(self) -> bool:
+        """Extend the lease without touching the checkpoint; False if the lease was lost meanwhile"""
+        result = await self.collection.update_one(
+            {"_id": self.name, "lease_owner": self.owner},
+            {"$set": {"lease_until": self._expiry()}}
+        )
+        return result.matched_count == 1
+
+    async def release(self):
+        await self.collection.update_one(
+            {"_id": self.name, "lease_owner": self.owner},
+            {"$set": {"lease_until": None}}
+        )
@@ -0,0 +1,129 @@
+"""Push-style payment status for clients waiting on a checkout.
+
+Clients used to poll the status route, and every poll asked Stripe. Now a
+waiting client is parked on a long-poll: it returns as soon as the payment
+is recorded as paid (the webhook consumer calls notify() in this process,
+other processes are seen through a cheap Mongo read every
+``poll_interval``), and only falls back to asking the upstream every
+``upstream_interval``. Upstream checks for one session are shared by all of
+its waiters and cached for ``upstream_ttl`` seconds.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+StatusLoader = Callable[[str], Awaitable[Optional[dict]]]
+
+
+class CoalescingCache:
+    """Short-TTL cache whose concurrent misses for a key share one fetch"""
+
+    def __init__(self, ttl: float, max_entries: int = 10000, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._values: Dict[str, Tuple[float, Any]] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {"hits": 0, "fetches": 0, "coalesced": 0}
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        cached = self._values.get(key)
+        if cached is not None and cached[0] > self.clock():
+            self.stats["hits"] += 1
+            return cached[1]
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["fetches"] += 1
+            task = self._inflight[key] = asyncio.create_task(self._fetch(key, fetch))
+        else:
+            self.stats["coalesced"] += 1
+        # Shielded: one waiter disconnecting must not cancel the fetch the others wait for
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            value = await fetch()
+            if len(self._values) >= self.max_entries:
+                now = self.clock()
+                self._values = {k: v for k, v in self._values.items() if v[0] > now}
+            self._values[key] = (self.clock() + self.ttl, value)
+            return value
+        finally:
+            del self._inflight[key]
+
+    def invalidate(self, key: str):
+        self._values.pop(key, None)
+
+
+def is_final(status: Optional[dict]) -> bool:
+    return bool(status) and (status.get("payment_status") == "paid" or status.get("status") == "expired")
+
+
+class PaymentStatusWatcher:
+    def __init__(self, load_status: StatusLoader, fetch_upstream: StatusLoader, upstream_ttl: float = 5.0,
+                 poll_interval: float = 1.0, upstream_interval: float = 10.0):
+        self.load_status = load_status
+        self.fetch_upstream = fetch_upstream
+        self.poll_interval = poll_interval
+        self.upstream_interval = upstream_interval
+        self.upstream = CoalescingCache(upstream_ttl)
+        self._events: Dict[str, asyncio.Event] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def notify(self, session_id: str):
+        """Wake everyone waiting on ``session_id`` (its stored status changed)"""
+        self.upstream.invalidate(session_id)
+        event = self._events.get(session_id)
+        if event is not None:
+            event.set()
+            self._events[session_id] = asyncio.Event()
+
+    async def upstream_status(self, session_id: str) -> Optional[dict]:
+        return await self.upstream.get(session_id, lambda: self.fetch_upstream(session_id))
+
+    async def wait(self, session_id: str, timeout: float) -> Optional[dict]:
+        """Return the status once final, or the latest known status after ``timeout`` seconds"""
+        deadline = time.monotonic() + timeout
+        next_upstream = time.monotonic() + self.upstream_interval
+        self._waiters[session_id] = self._waiters.get(session_id, 0) + 1
+        self._events.setdefault(session_id, asyncio.Event())
+        try:
+            while True:
+                status = await self.load_status(session_id)
+                if is_final(status):
+                    return status
+
+                now = time.monotonic()
+                if now >= next_upstream:
+                    # The webhook may be late or lost: ask the upstream, shared with other waiters
+                    try:
+                        status = await self.upstream_status(session_id) or status
+                    except Exception as e:
+                        logger.warning(f"Upstream status check for {session_id} failed: {e}")
+                    if is_final(status):
+                        return status
+                    next_upstream = time.monotonic() + self.upstream_interval
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return status
+                try:
+                    await asyncio.wait_for(self._events[session_id].wait(), min(self.poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters[session_id] -= 1
+            if not self._waiters[session_id]:
+                del self._waiters[session_id]
+                self._events.pop(session_id, None)
+
+    def metrics(self) -> dict:
+        return {
+            "waiting_sessions": len(self._waiters),
+            "waiters": sum(self._waiters.values()),
+            "upstream": dict(self.upstream.stats)
+        }
@@ -0,0 +1,277 @@
+"""Persistent Peppol outbound queue.
+
+Invoices are never sent from a request handler. The API only records a job in
+``db.peppol_outbox``; background workers claim jobs in batches, send them to
+the configured access point with bounded concurrency, retry transient failures
+with exponential backoff and write the outcome back to ``peppol_outbox`` and
+the invoice's ``peppol_status``/``peppol_message_id``.
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from en16931 import ValidationReport, validate_invoice
+from peppol_ubl import UBLDocument
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+DEFAULT_ACCESS_POINT = "default"
+
+
+class AccessPointError(Exception):
+    """Delivery failure reported by (or while reaching) an access point"""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class AccessPointClient:
+    """HTTP client for a Peppol access point's document submission API
+
+    Documents are POSTed as UBL XML to ``{base_url}/documents`` with the
+    job's document id as ``X-Document-ID``, so that access points can dedupe
+    retries; an explicit resend gets a new one. Requests go through the
+    shared pool's client for the access point (see http_clients.py), which
+    owns its connections.
+    """
+
+    def __init__(self, get_client: Callable[[], httpx.AsyncClient], token: Optional[str] = None):
+        self.get_client = get_client
+        self.headers = {"Authorization": f"Bearer {token}"} if token else {}
+
+    async def send(self, document_id: str, document: bytes) -> str:
+        try:
+            response = await self.get_client().post(
+                "/documents",
+                content=document,
+                headers={**self.headers, "Content-Type": "application/xml", "X-Document-ID": document_id}
+            )
+        except httpx.HTTPError as e:
+            raise AccessPointError(f"Access point unreachable: {e}")
+
+        if response.status_code in (200, 201, 202):
+            return response.json()["message_id"]
+
+        retryable = response.status_code >= 500 or response.status_code in (408, 429)
+        raise AccessPointError(f"Access point returned {response.status_code}: {response.text[:200]}", retryable)
+
+
+class PeppolDispatcher:
+    """Mongo-backed outbound queue with async workers"""
+
+    def __init__(self, db, render_document: Callable[[dict], Awaitable[bytes]],
+                 access_points: Dict[str, AccessPointClient], concurrency_per_access_point: int = 4,
+                 batch_size: int = 20, max_attempts: int = 8, base_delay: float = 30.0,
+                 max_delay: float = 3600.0, poll_interval: float = 2.0, lease_seconds: int = 300):
+        self.db = db
+        self.render_document = render_document
+        self.access_points = access_points
+        self.semaphores = {name: asyncio.Semaphore(concurrency_per_access_point) for name in access_points}
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.worker_id = uuid.uuid4().hex
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.db.peppol_outbox.create_index("invoice_id", unique=True)
+        await self.db.peppol_outbox.create_index([("status", ASCENDING), ("next_attempt_at", ASCENDING)])
+        await self.db.peppol_outbox.create_index([("status", ASCENDING), ("lease_until", ASCENDING)])
+
+    async def enqueue(self, invoice: dict, access_point: str = DEFAULT_ACCESS_POINT, resend: bool = False) -> bool:
+        """Queue an invoice for delivery
+
+        Returns False if it is being sent right now, or was already delivered
+        and ``resend`` is not set; the outbox row is left untouched then. A
+        resend goes out under a new document id, so the access point does not
+        drop it as a duplicate of the first delivery.
+        """
+        if access_point not in self.access_points:
+            raise ValueError(f"Unknown access point: {access_point}")
+
+        now = datetime.now(timezone.utc)
+        busy = [SENDING] if resend else [SENDING, SENT]
+        fields = {
+            "user_id": invoice["user_id"],
+            "access_point": access_point,
+            "status": QUEUED,
+            "attempts": 0,
+            "next_attempt_at": now,
+            "last_error": None,
+            "updated_at": now
+        }
+        inserted = {"id": str(uuid.uuid4()), "created_at": now}
+        if resend:
+            fields["document_id"] = str(uuid.uuid4())
+        else:
+            inserted["document_id"] = invoice["id"]
+        try:
+            await self.db.peppol_outbox.update_one(
+                {"invoice_id": invoice["id"], "status": {"$nin": busy}},
+                {"$set": fields, "$setOnInsert": inserted},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+
+        await self.db.invoices.update_one(
+            {"id": invoice["id"]},
+            {"$set": {"peppol_status": "pending", "updated_at": now}}
+        )
+        self._wakeup.set()
+        return True
+
+    async def submit(self, document: UBLDocument, access_point: str = DEFAULT_ACCESS_POINT,
+                     resend: bool = False) -> Tuple[ValidationReport, bool]:
+        """Validate a document against EN16931 and queue its invoice if it passes
+
+        Returns the report and whether the invoice was queued; invalid
+        documents are never queued, since the access point would reject them.
+        """
+        report = validate_invoice(*document)
+        if not report.valid:
+            return report, False
+        return report, await self.enqueue(document[0], access_point, resend)
+
+    def start(self, workers: int = 1):
+        for _ in range(workers):
+            self._tasks.append(asyncio.create_task(self._run()))
+
+    async def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                processed = await self.process_batch()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Peppol dispatch worker error: {e}")
+                processed = 0
+
+            if not processed:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def process_batch(self) -> int:
+        """Claim and dispatch one batch of due jobs; returns the number processed"""
+        jobs = await self._claim_batch()
+        if not jobs:
+            return 0
+
+        results = await asyncio.gather(*(self._dispatch(job) for job in jobs))
+        await self._record(results)
+        return len(jobs)
+
+    async def _claim_batch(self) -> List[dict]:
+        now = datetime.now(timezone.utc)
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        claimable = {"$or": [
+            {"status": QUEUED, "next_attempt_at": {"$lte": now}},
+            # Jobs whose worker died mid-send are picked up again once the lease lapses
+            {"status": SENDING, "lease_until": {"$lt": now}}
+        ]}
+
+        jobs = []
+        for _ in range(self.batch_size):
+            job = await self.db.peppol_outbox.find_one_and_update(
+                claimable,
+                {"$set": {"status": SENDING, "lease_until": lease_until, "claimed_by": self.worker_id},
+                 "$inc": {"attempts": 1}},
+                sort=[("next_attempt_at", ASCENDING)],
+                return_document=ReturnDocument.AFTER
+            )
+            if job is None:
+                break
+            jobs.append(job)
+        return jobs
+
+    async def _dispatch(self, job: dict) -> tuple:
+        access_point = self.access_points.get(job["access_point"])
+        if access_point is None:
+            return job, None, AccessPointError(f"Unknown access point: {job['access_point']}", retryable=False)
+
+        try:
+            document = await self.render_document(job)
+        except Exception as e:
+            return job, None, AccessPointError(f"Could not render document: {e}", retryable=False)
+
+        async with self.semaphores[job["access_point"]]:
+            try:
+                message_id = await access_point.send(job.get("document_id", job["invoice_id"]), document)
+                return job, message_id, None
+            except AccessPointError as e:
+                return job, None, e
+
+    def backoff(self, attempts: int) -> float:
+        """Exponential backoff with jitter for the given attempt number"""
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    async def _record(self, results: List[tuple]):
+        outbox_ops, invoice_ops = self.outcome_ops(results, datetime.now(timezone.utc))
+        if outbox_ops:
+            await self.db.peppol_outbox.bulk_write(outbox_ops, ordered=False)
+        if invoice_ops:
+            await self.db.invoices.bulk_write(invoice_ops, ordered=False)
+
+    def outcome_ops(self, results: List[tuple], now: datetime) -> Tuple[List[UpdateOne], List[UpdateOne]]:
+        """Outbox and invoice updates for (job, message_id, error) results
+
+        Only jobs this worker still owns are updated; retryable failures are
+        requeued with backoff until ``max_attempts``, everything else fails.
+        """
+        outbox_ops = []
+        invoice_ops = []
+
+        for job, message_id, error in results:
+            owned = {"id": job["id"], "claimed_by": self.worker_id, "status": SENDING}
+            if error is None:
+                outbox_ops.append(UpdateOne(owned, {"$set": {
+                    "status": SENT, "message_id": message_id, "sent_at": now,
+                    "last_error": None, "updated_at": now
+                }}))
+                invoice_ops.append(UpdateOne({"id": job["invoice_id"]}, {"$set": {
+                    "peppol_status": "sent", "peppol_message_id": message_id, "updated_at": now
+                }}))
+            elif error.retryable and job["attempts"] < self.max_attempts:
+                outbox_ops.append(UpdateOne(owned, {"$set": {
+                    "status": QUEUED, "last_error": str(error), "updated_at": now,
+                    "next_attempt_at": now + timedelta(seconds=self.backoff(job["attempts"]))
+                }}))
+            else:
+                logger.warning(f"Peppol delivery of invoice {job['invoice_id']} failed: {error}")
+                outbox_ops.append(UpdateOne(owned, {"$set": {
+                    "status": FAILED, "last_error": str(error), "updated_at": now
+                }}))
+                invoice_ops.append(UpdateOne({"id": job["invoice_id"]}, {"$set": {
+                    "peppol_status": "failed", "updated_at": now
+                }}))
+        return outbox_ops, invoice_ops
@@ -0,0 +1,287 @@
+"""Inbound UBL invoice ingestion.
+
+Supplier documents are parsed with ``ET.iterparse`` and every element is
+detached from the tree as soon as it has been read, so memory per document is
+bounded by the depth of the XML rather than its size. Parsed documents flow
+through the pipeline in chunks: one indexed ``$in`` query resolves the supplier
+accounts of a whole chunk by VAT number, missing accounts are upserted with one
+``bulk_write`` and the purchase records are bulk-inserted.
+
+Accounts created here carry ``supplier_vat_key`` under a unique partial
+index, so concurrent ingests of the same supplier (an upload next to the CLI)
+create one account; accounts users made themselves are not constrained.
+"""
+import asyncio
+import xml.etree.ElementTree as ET
+from datetime import datetime, timezone
+from itertools import islice
+from typing import BinaryIO, Callable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from eu_countries import EU_COUNTRY_NAMES, normalize_vat_number
+
+UBLSource = Union[str, BinaryIO]
+
+# Paths below the document root, as tuples of local element names
+_HEADER_FIELDS = {
+    ("ID",): "supplier_invoice_number",
+    ("IssueDate",): "issue_date",
+    ("DueDate",): "due_date",
+    ("DocumentCurrencyCode",): "currency",
+    ("TaxTotal", "TaxAmount"): "tax_amount",
+    ("LegalMonetaryTotal", "TaxExclusiveAmount"): "subtotal",
+    ("LegalMonetaryTotal", "PayableAmount"): "total_amount",
+}
+_SUPPLIER = ("AccountingSupplierParty", "Party")
+_SUPPLIER_FIELDS = {
+    _SUPPLIER + ("PartyName", "Name"): "name",
+    _SUPPLIER + ("PartyLegalEntity", "RegistrationName"): "registration_name",
+    _SUPPLIER + ("PartyTaxScheme", "CompanyID"): "vat_number",
+    _SUPPLIER + ("PostalAddress", "StreetName"): "street",
+    _SUPPLIER + ("PostalAddress", "CityName"): "city",
+    _SUPPLIER + ("PostalAddress", "PostalZone"): "postal_code",
+    _SUPPLIER + ("PostalAddress", "Country", "IdentificationCode"): "country_code",
+    _SUPPLIER + ("Contact", "ElectronicMail"): "email",
+}
+_LINE_TAGS = {"InvoiceLine", "CreditNoteLine"}
+_LINE_FIELDS = {
+    ("ID",): "line_id",
+    ("InvoicedQuantity",): "quantity",
+    ("CreditedQuantity",): "quantity",
+    ("LineExtensionAmount",): "line_total",
+    ("Item", "Name"): "description",
+    ("Item", "SellersItemIdentification", "ID"): "supplier_item_id",
+    ("Price", "PriceAmount"): "unit_price",
+}
+_AMOUNT_FIELDS = {"tax_amount", "subtotal", "total_amount", "quantity", "line_total", "unit_price"}
+
+
+class UBLParseError(ValueError):
+    pass
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def _value(field: str, text: Optional[str]):
+    text = (text or "").strip()
+    if not text:
+        return None
+    if field in _AMOUNT_FIELDS:
+        return float(text)
+    return text
+
+
+def _parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return datetime.strptime(value[:10], "%Y-%m-%d").replace(tzinfo=timezone.utc)
+
+
+def parse_ubl_invoice(source: UBLSource) -> dict:
+    """Parse a UBL Invoice or CreditNote into header, supplier and line fields"""
+    document = {"supplier": {}, "items": []}
+    path: List[str] = []
+    parents: List[ET.Element] = []
+    line: Optional[dict] = None
+    line_depth = 0
+
+    try:
+        for event, elem in ET.iterparse(source, events=("start", "end")):
+            if event == "start":
+                name = _local(elem.tag)
+                if not parents:
+                    if name not in ("Invoice", "CreditNote"):
+                        raise UBLParseError(f"Not a UBL invoice: <{name}>")
+                    document["document_type"] = "credit_note" if name == "CreditNote" else "invoice"
+                else:
+                    path.append(name)
+                    if len(path) == 1 and name in _LINE_TAGS:
+                        line = {}
+                        line_depth = 1
+                parents.append(elem)
+                continue
+
+            # end event: read the element, then detach it so the tree never grows
+            parents.pop()
+            if not parents:
+                break
+            key = tuple(path)
+            if line is not None and len(path) > line_depth:
+                field = _LINE_FIELDS.get(key[line_depth:])
+                if field and field not in line:
+                    line[field] = _value(field, elem.text)
+            elif key in _HEADER_FIELDS:
+                document.setdefault(_HEADER_FIELDS[key], _value(_HEADER_FIELDS[key], elem.text))
+            elif key in _SUPPLIER_FIELDS:
+                document["supplier"].setdefault(_SUPPLIER_FIELDS[key], _value(_SUPPLIER_FIELDS[key], elem.text))
+
+            if line is not None and len(path) == line_depth:
+                document["items"].append(line)
+                line = None
+
+            path.pop()
+            elem.clear()
+            parents[-1].remove(elem)
+    except ET.ParseError as e:
+        raise UBLParseError(f"Malformed XML: {e}")
+
+    if not document.get("supplier_invoice_number"):
+        raise UBLParseError("Document has no invoice number")
+    document["issue_date"] = _parse_date(document.get("issue_date"))
+    document["due_date"] = _parse_date(document.get("due_date"))
+    return document
+
+
+def supplier_account_fields(supplier: dict) -> dict:
+    """Account fields for a supplier that is not yet known"""
+    country_code = supplier.get("country_code")
+    return {
+        "name": supplier.get("registration_name") or supplier.get("name") or supplier.get("vat_number") or "Unknown supplier",
+        "street": supplier.get("street"),
+        "postal_code": supplier.get("postal_code"),
+        "city": supplier.get("city"),
+        "country": EU_COUNTRY_NAMES.get(country_code, country_code),
+        "vat_number": supplier.get("vat_number"),
+        "notes": "Created from an inbound UBL invoice"
+    }
+
+
+def purchase_fields(document: dict, account_id: str, source_name: Optional[str]) -> dict:
+    """Purchase record fields for a parsed document"""
+    items = [
+        {
+            "description": item.get("description"),
+            "quantity": item.get("quantity") or 0,
+            "unit_price": item.get("unit_price") or 0,
+            "line_total": item.get("line_total"),
+            "supplier_item_id": item.get("supplier_item_id")
+        }
+        for item in document["items"]
+    ]
+    subtotal = document.get("subtotal")
+    if subtotal is None:
+        subtotal = sum(item["line_total"] or item["quantity"] * item["unit_price"] for item in items)
+    return {
+        "account_id": account_id,
+        "supplier_invoice_number": document["supplier_invoice_number"],
+        "supplier_vat_number": normalize_vat_number(document["supplier"].get("vat_number")),
+        "document_type": document["document_type"],
+        "issue_date": document.get("issue_date"),
+        "due_date": document.get("due_date"),
+        "currency": document.get("currency") or "EUR",
+        "subtotal": subtotal,
+        "tax_amount": document.get("tax_amount") or 0,
+        "total_amount": document.get("total_amount") if document.get("total_amount") is not None else subtotal,
+        "items": items,
+        "source_name": source_name
+    }
+
+
+def parse_sources(sources: Iterable[Tuple[str, UBLSource]]) -> Iterator[Tuple[str, Optional[dict], Optional[str]]]:
+    """Parse (name, source) pairs lazily, yielding (name, document, error)"""
+    for name, source in sources:
+        try:
+            yield name, parse_ubl_invoice(source), None
+        except (UBLParseError, ValueError) as e:
+            yield name, None, str(e)
+
+
+async def ingest_parsed_chunk(db, user_id: str, parsed: List[Tuple[str, Optional[dict], Optional[str]]],
+                              make_account: Callable[[dict], dict], make_purchase: Callable[[dict], dict],
+                              stats: dict):
+    """Resolve accounts and insert purchase records for one chunk of parsed documents"""
+    documents = []
+    for name, document, error in parsed:
+        if error:
+            stats["errors"].append({"source": name, "error": error})
+        else:
+            documents.append((name, document))
+    if not documents:
+        return
+
+    # One indexed lookup for every supplier VAT number in the chunk
+    vat_keys = {normalize_vat_number(doc["supplier"].get("vat_number")) for _, doc in documents}
+    vat_keys.discard(None)
+    accounts_by_vat = {}
+    if vat_keys:
+        cursor = db.accounts.find({"user_id": user_id, "vat_key": {"$in": list(vat_keys)}}, {"id": 1, "vat_key": 1})
+        async for account in cursor:
+            accounts_by_vat.setdefault(account["vat_key"], account["id"])
+
+    new_accounts = {}
+    for _, document in documents:
+        vat_key = normalize_vat_number(document["supplier"].get("vat_number"))
+        if vat_key and vat_key not in accounts_by_vat and vat_key not in new_accounts:
+            new_accounts[vat_key] = make_account(supplier_account_fields(document["supplier"]))
+    if new_accounts:
+        ops = [UpdateOne({"user_id": user_id, "supplier_vat_key": vat_key},
+                         {"$setOnInsert": {**account, "supplier_vat_key": vat_key}}, upsert=True)
+               for vat_key, account in new_accounts.items()]
+        try:
+            result = await db.accounts.bulk_write(ops, ordered=False)
+            stats["accounts_created"] += result.upserted_count
+        except BulkWriteError as e:
+            # A concurrent ingest inserted the same supplier first; its account is read back below
+            stats["accounts_created"] += e.details.get("nUpserted", 0)
+        cursor = db.accounts.find({"user_id": user_id, "supplier_vat_key": {"$in": list(new_accounts)}},
+                                  {"id": 1, "supplier_vat_key": 1})
+        async for account in cursor:
+            accounts_by_vat[account["supplier_vat_key"]] = account["id"]
+
+    records = []
+    for name, document in documents:
+        vat_key = normalize_vat_number(document["supplier"].get("vat_number"))
+        if not vat_key:
+            stats["errors"].append({"source": name, "error": "Supplier has no VAT number"})
+            continue
+        records.append(make_purchase(purchase_fields(document, accounts_by_vat[vat_key], name)))
+    if not records:
+        return
+
+    try:
+        result = await db.purchase_invoices.insert_many(records, ordered=False)
+        stats["imported"] += len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Duplicate supplier invoices hit the unique index and are skipped
+        stats["imported"] += e.details.get("nInserted", 0)
+        stats["duplicates"] += sum(1 for err in e.details.get("writeErrors", []) if err.get("code") == 11000)
+
+
+def new_ingest_stats() -> dict:
+    return {"imported": 0, "duplicates": 0, "accounts_created": 0, "errors": []}
+
+
+async def ingest_ubl_sources(db, user_id: str, sources: Iterable[Tuple[str, UBLSource]],
+                             make_account: Callable[[dict], dict], make_purchase: Callable[[dict], dict],
+                             chunk_size: int = 200) -> dict:
+    """Ingest (name, source) pairs; sources are opened and parsed one at a time
+
+    Parsing is CPU bound, so each chunk is parsed in a worker thread to keep
+    the event loop responsive.
+    """
+    stats = new_ingest_stats()
+    parsed = parse_sources(sources)
+    while True:
+        chunk = await asyncio.to_thread(lambda: list(islice(parsed, chunk_size)))
+        if not chunk:
+            return stats
+        await ingest_parsed_chunk(db, user_id, chunk, make_account, make_purchase, stats)
+
+
+async def ensure_inbound_indexes(db):
+    await db.accounts.create_index([("user_id", 1), ("vat_key", 1)])
+    await db.accounts.create_index([("user_id", 1), ("supplier_vat_key", 1)], unique=True,
+                                   partialFilterExpression={"supplier_vat_key": {"$exists": True}})
+    # A credit note may reuse the number of the invoice it corrects
+    indexes = await db.purchase_invoices.index_information()
+    if "user_id_1_supplier_vat_number_1_supplier_invoice_number_1" in indexes:
+        await db.purchase_invoices.drop_index("user_id_1_supplier_vat_number_1_supplier_invoice_number_1")
+    await db.purchase_invoices.create_index(
+        [("user_id", 1), ("supplier_vat_number", 1), ("document_type", 1), ("supplier_invoice_number", 1)],
+        unique=True
+    )
+    await db.purchase_invoices.create_index([("user_id", 1), ("issue_date", -1)])
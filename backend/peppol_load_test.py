@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the Peppol dispatch pipeline.
+
+Seeds synthetic invoices into a scratch database, queues them and drains the
+queue against the fake access point, then reports throughput:
+
+    python backend/fake_access_point.py --port 8099 &
+    MONGO_URL=mongodb://localhost:27017 python backend/peppol_load_test.py --invoices 5000
+"""
+
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from http_clients import HttpClients, UpstreamConfig
+from peppol_dispatch import AccessPointClient, PeppolDispatcher
+from peppol_ubl import iter_invoice_ubl
+
+ACCOUNT = {
+    "name": "Acme NV", "street": "Wetstraat", "street_nr": "16", "postal_code": "1000",
+    "city": "Brussel", "country": "Belgium", "vat_number": "BE0123456749"
+}
+SUPPLIER = {"name": "Load Test", "email": "load@example.com", "vat_number": "BE0403170701"}
+
+
+def make_invoice(user_id: str, number: int) -> dict:
+    items = [{"product_id": "p1", "quantity": 1 + i, "unit_price": 25.0} for i in range(5)]
+    subtotal = sum(item["quantity"] * item["unit_price"] for item in items)
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "invoice_number": f"INV-LOAD-{number:06d}",
+        "account_id": "load-account",
+        "items": items,
+        "subtotal": subtotal,
+        "tax_amount": subtotal * 0.21,
+        "total_amount": subtotal * 1.21,
+        "currency": "EUR",
+        "issue_date": datetime.now(timezone.utc),
+        "invoice_type": "invoice",
+        "status": "sent"
+    }
+
+
+async def run(args):
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[args.database]
+    await db.invoices.drop()
+    await db.peppol_outbox.drop()
+
+    user_id = str(uuid.uuid4())
+    invoices = [make_invoice(user_id, i) for i in range(args.invoices)]
+    await db.invoices.insert_many(invoices)
+    by_id = {invoice["id"]: invoice for invoice in invoices}
+
+    async def render_document(job):
+        return b"".join(iter_invoice_ubl(by_id[job["invoice_id"]], ACCOUNT, SUPPLIER))
+
+    http_clients = HttpClients({"peppol": UpstreamConfig(args.access_point, timeout=30.0, max_connections=args.concurrency,
+                                                         max_keepalive_connections=args.concurrency)})
+    dispatcher = PeppolDispatcher(
+        db,
+        render_document,
+        {"default": AccessPointClient(lambda: http_clients.get("peppol"))},
+        concurrency_per_access_point=args.concurrency,
+        batch_size=args.batch_size,
+        base_delay=0.5,
+        max_delay=5.0,
+        poll_interval=0.2
+    )
+    await dispatcher.ensure_indexes()
+
+    start = time.perf_counter()
+    for invoice in invoices:
+        await dispatcher.enqueue(invoice)
+    enqueued = time.perf_counter()
+
+    dispatcher.start(workers=args.workers)
+    while await db.peppol_outbox.count_documents({"status": {"$in": ["queued", "sending"]}}):
+        await asyncio.sleep(0.5)
+    elapsed = time.perf_counter() - enqueued
+    await dispatcher.stop()
+    await http_clients.close()
+
+    sent = await db.invoices.count_documents({"peppol_status": "sent"})
+    failed = await db.invoices.count_documents({"peppol_status": "failed"})
+    print(f"enqueue: {args.invoices} jobs in {enqueued - start:.2f}s")
+    print(f"dispatch: {sent} sent, {failed} failed in {elapsed:.2f}s -> {sent / elapsed:,.0f} invoices/s")
+
+    await client.drop_database(args.database)
+    client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--access-point", default="http://127.0.0.1:8099")
+    parser.add_argument("--database", default="peppol_load_test")
+    asyncio.run(run(parser.parse_args()))
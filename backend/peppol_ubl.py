@@ -0,0 +1,374 @@
+"""Streaming UBL 2.1 (Peppol BIS Billing 3.0 / EN16931) generation for invoices.
+
+Documents are written element by element through ``XMLGenerator`` and handed
+out in small byte chunks, so no DOM tree is ever built and memory use stays
+flat regardless of how many lines an invoice has.
+"""
+import io
+import zipfile
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from typing import BinaryIO, Iterable, Iterator, List, Optional, Tuple
+from xml.sax.saxutils import XMLGenerator
+
+from eu_countries import country_code, normalize_vat_number, vat_country_code
+
+CUSTOMIZATION_ID = "urn:cen.eu:en16931:2017#compliant#urn:fdc:peppol.eu:2017:poacc:billing:3.0"
+PROFILE_ID = "urn:fdc:peppol.eu:2017:poacc:billing:01:1.0"
+
+NS_INVOICE = "urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+NS_CREDIT_NOTE = "urn:oasis:names:specification:ubl:schema:xsd:CreditNote-2"
+NS_CAC = "urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+NS_CBC = "urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2"
+
+# Peppol Electronic Address Scheme (EAS) codes for VAT-number based endpoints
+PEPPOL_VAT_EAS = {
+    'AT': '9914', 'BE': '9925', 'BG': '9926', 'CY': '9928', 'CZ': '9929',
+    'DE': '9930', 'DK': '0184', 'EE': '9931', 'ES': '9920', 'FI': '0213',
+    'FR': '9957', 'GR': '9933', 'HR': '9934', 'HU': '9910', 'IE': '9935',
+    'IT': '0211', 'LT': '9937', 'LU': '9938', 'LV': '9939', 'MT': '9943',
+    'NL': '9944', 'PL': '9945', 'PT': '9946', 'RO': '9947', 'SE': '9955',
+    'SI': '9949', 'SK': '9950'
+}
+EMAIL_EAS = "EM"
+
+DEFAULT_TAX_PERCENT = Decimal("21")  # Belgium VAT rate, as used by create_invoice
+UNIT_CODE = "C62"  # UN/ECE rec 20 "one", invoice items carry no unit of measure
+CHUNK_SIZE = 16 * 1024
+
+_CENT = Decimal("0.01")
+
+# (invoice, account, supplier, products) as loaded from Mongo
+UBLDocument = Tuple[dict, dict, dict, List[dict]]
+
+
+def money(value) -> Decimal:
+    """Round an amount to cents the way it appears in the document"""
+    return Decimal(str(value or 0)).quantize(_CENT, rounding=ROUND_HALF_UP)
+
+
+def _amount(value) -> str:
+    return str(money(value))
+
+
+def _quantity(value) -> str:
+    return format(Decimal(str(value or 0)).normalize(), "f")
+
+
+def _date(value) -> Optional[str]:
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d')
+    return str(value)[:10]
+
+
+def invoice_tax_percent(invoice: dict) -> Decimal:
+    """VAT rate applied to an invoice, derived from its stored totals"""
+    subtotal = Decimal(str(invoice.get("subtotal") or 0))
+    if not subtotal:
+        return DEFAULT_TAX_PERCENT
+    tax = Decimal(str(invoice.get("tax_amount") or 0))
+    return (tax / subtotal * 100).quantize(_CENT, rounding=ROUND_HALF_UP).normalize()
+
+
+def line_amount(item: dict) -> Decimal:
+    """Line net amount (BT-131): quantity x net price, rounded to cents"""
+    return money(Decimal(str(item.get("quantity") or 0)) * Decimal(str(item.get("unit_price") or 0)))
+
+
+def invoice_totals(invoice: dict) -> dict:
+    """Document totals derived from the rounded line amounts
+
+    The stored subtotal/tax/total are unrounded floats; deriving the totals
+    from the lines keeps the sums in the document exact (BR-CO-10, BR-CO-15)
+    instead of off by a cent after independent rounding.
+    """
+    percent = invoice_tax_percent(invoice)
+    line_extension = sum((line_amount(item) for item in invoice.get("items") or []), Decimal("0.00"))
+    tax = money(line_extension * percent / 100)
+    return {
+        "percent": percent,
+        "line_extension": line_extension,
+        "tax": tax,
+        "payable": line_extension + tax
+    }
+
+
+def tax_category(percent: Decimal) -> str:
+    """UNCL5305 tax category: standard rate or zero rated"""
+    return "S" if percent > 0 else "Z"
+
+
+def party_endpoint(party: dict) -> Optional[Tuple[str, str]]:
+    """Peppol endpoint (scheme, identifier) for a party, preferring its VAT number"""
+    vat_number = normalize_vat_number(party.get("vat_number"))
+    if vat_number:
+        scheme = PEPPOL_VAT_EAS.get(vat_country_code(vat_number))
+        if scheme:
+            return scheme, vat_number
+    if party.get("email"):
+        return EMAIL_EAS, party["email"]
+    return None
+
+
+def party_country_code(party: dict) -> Optional[str]:
+    return country_code(party.get("country")) or vat_country_code(party.get("vat_number"))
+
+
+SUPPLIER_FIELDS = ("vat_number", "street", "street_nr", "box", "postal_code", "city", "country")
+
+
+def supplier_party(user: dict) -> dict:
+    """Seller party of an issuing user, taken from their company profile
+
+    The legal name falls back to the user's name; the user's email stays the
+    seller contact and the fallback endpoint.
+    """
+    company = user.get("company") or {}
+    party = {key: company.get(key) for key in SUPPLIER_FIELDS}
+    party["name"] = company.get("legal_name") or user.get("name")
+    party["email"] = user.get("email")
+    return party
+
+
+class _ChunkedXMLWriter:
+    """Thin wrapper around XMLGenerator that buffers output for chunked draining"""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.xml = XMLGenerator(self.buffer, encoding="utf-8", short_empty_elements=True)
+
+    def start(self, name: str, attrs: Optional[dict] = None):
+        self.xml.startElement(name, attrs or {})
+
+    def end(self, name: str):
+        self.xml.endElement(name)
+
+    def leaf(self, name: str, text, attrs: Optional[dict] = None):
+        """Write a simple element; ``None`` values are omitted entirely"""
+        if text is None:
+            return
+        self.xml.startElement(name, attrs or {})
+        self.xml.characters(str(text))
+        self.xml.endElement(name)
+
+    def pending(self) -> int:
+        return self.buffer.tell()
+
+    def drain(self) -> bytes:
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+def _write_party(w: _ChunkedXMLWriter, wrapper: str, party: dict):
+    w.start(wrapper)
+    w.start("cac:Party")
+
+    endpoint = party_endpoint(party)
+    if endpoint:
+        w.leaf("cbc:EndpointID", endpoint[1], {"schemeID": endpoint[0]})
+
+    w.start("cac:PartyName")
+    w.leaf("cbc:Name", party.get("name"))
+    w.end("cac:PartyName")
+
+    w.start("cac:PostalAddress")
+    street = " ".join(p for p in (party.get("street"), party.get("street_nr")) if p)
+    w.leaf("cbc:StreetName", street or None)
+    if party.get("box"):
+        w.leaf("cbc:AdditionalStreetName", f"box {party['box']}")
+    w.leaf("cbc:CityName", party.get("city"))
+    w.leaf("cbc:PostalZone", party.get("postal_code"))
+    w.start("cac:Country")
+    w.leaf("cbc:IdentificationCode", party_country_code(party))
+    w.end("cac:Country")
+    w.end("cac:PostalAddress")
+
+    vat_number = normalize_vat_number(party.get("vat_number"))
+    if vat_number:
+        w.start("cac:PartyTaxScheme")
+        w.leaf("cbc:CompanyID", vat_number)
+        w.start("cac:TaxScheme")
+        w.leaf("cbc:ID", "VAT")
+        w.end("cac:TaxScheme")
+        w.end("cac:PartyTaxScheme")
+
+    w.start("cac:PartyLegalEntity")
+    w.leaf("cbc:RegistrationName", party.get("name"))
+    w.end("cac:PartyLegalEntity")
+
+    if party.get("email"):
+        w.start("cac:Contact")
+        w.leaf("cbc:ElectronicMail", party["email"])
+        w.end("cac:Contact")
+
+    w.end("cac:Party")
+    w.end(wrapper)
+
+
+def _write_tax_category(w: _ChunkedXMLWriter, name: str, percent: Decimal):
+    w.start(name)
+    w.leaf("cbc:ID", tax_category(percent))
+    w.leaf("cbc:Percent", format(percent, "f"))
+    w.start("cac:TaxScheme")
+    w.leaf("cbc:ID", "VAT")
+    w.end("cac:TaxScheme")
+    w.end(name)
+
+
+def iter_invoice_ubl(invoice: dict, account: dict, supplier: dict, products: Optional[List[dict]] = None,
+                     chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield a UBL 2.1 Invoice (or CreditNote) document as UTF-8 byte chunks
+
+    ``supplier`` is the seller party built by ``supplier_party`` from the
+    issuing user's company profile.
+    """
+    is_credit_note = invoice.get("invoice_type") == "credit_note"
+    root = "CreditNote" if is_credit_note else "Invoice"
+    line_tag = "cac:CreditNoteLine" if is_credit_note else "cac:InvoiceLine"
+    quantity_tag = "cbc:CreditedQuantity" if is_credit_note else "cbc:InvoicedQuantity"
+    currency = invoice.get("currency") or "EUR"
+    amount_attrs = {"currencyID": currency}
+    totals = invoice_totals(invoice)
+    percent = totals["percent"]
+    product_names = {p["id"]: p.get("name") for p in products or []}
+
+    w = _ChunkedXMLWriter()
+    w.xml.startDocument()
+    w.start(root, {
+        "xmlns": NS_CREDIT_NOTE if is_credit_note else NS_INVOICE,
+        "xmlns:cac": NS_CAC,
+        "xmlns:cbc": NS_CBC,
+    })
+    w.leaf("cbc:CustomizationID", CUSTOMIZATION_ID)
+    w.leaf("cbc:ProfileID", PROFILE_ID)
+    w.leaf("cbc:ID", invoice["invoice_number"])
+    w.leaf("cbc:IssueDate", _date(invoice.get("issue_date")))
+    if not is_credit_note:
+        w.leaf("cbc:DueDate", _date(invoice.get("due_date")))
+    w.leaf("cbc:CreditNoteTypeCode" if is_credit_note else "cbc:InvoiceTypeCode",
+           "381" if is_credit_note else "380")
+    w.leaf("cbc:Note", invoice.get("notes") or None)
+    w.leaf("cbc:DocumentCurrencyCode", currency)
+    w.leaf("cbc:BuyerReference", invoice["invoice_number"])
+
+    _write_party(w, "cac:AccountingSupplierParty", supplier)
+    _write_party(w, "cac:AccountingCustomerParty", account)
+
+    w.start("cac:TaxTotal")
+    w.leaf("cbc:TaxAmount", totals["tax"], amount_attrs)
+    w.start("cac:TaxSubtotal")
+    w.leaf("cbc:TaxableAmount", totals["line_extension"], amount_attrs)
+    w.leaf("cbc:TaxAmount", totals["tax"], amount_attrs)
+    _write_tax_category(w, "cac:TaxCategory", percent)
+    w.end("cac:TaxSubtotal")
+    w.end("cac:TaxTotal")
+
+    w.start("cac:LegalMonetaryTotal")
+    w.leaf("cbc:LineExtensionAmount", totals["line_extension"], amount_attrs)
+    w.leaf("cbc:TaxExclusiveAmount", totals["line_extension"], amount_attrs)
+    w.leaf("cbc:TaxInclusiveAmount", totals["payable"], amount_attrs)
+    w.leaf("cbc:PayableAmount", totals["payable"], amount_attrs)
+    w.end("cac:LegalMonetaryTotal")
+
+    for line_number, item in enumerate(invoice.get("items") or [], start=1):
+        w.start(line_tag)
+        w.leaf("cbc:ID", line_number)
+        w.leaf(quantity_tag, _quantity(item.get("quantity")), {"unitCode": UNIT_CODE})
+        w.leaf("cbc:LineExtensionAmount", line_amount(item), amount_attrs)
+        w.start("cac:Item")
+        w.leaf("cbc:Name", item.get("description") or product_names.get(item.get("product_id")) or "Product")
+        if item.get("product_id"):
+            w.start("cac:SellersItemIdentification")
+            w.leaf("cbc:ID", item["product_id"])
+            w.end("cac:SellersItemIdentification")
+        _write_tax_category(w, "cac:ClassifiedTaxCategory", percent)
+        w.end("cac:Item")
+        w.start("cac:Price")
+        w.leaf("cbc:PriceAmount", _amount(item.get("unit_price")), amount_attrs)
+        w.end("cac:Price")
+        w.end(line_tag)
+
+        if w.pending() >= chunk_size:
+            yield w.drain()
+
+    w.end(root)
+    w.xml.endDocument()
+    yield w.drain()
+
+
+def write_invoice_ubl(out: BinaryIO, invoice: dict, account: dict, supplier: dict,
+                      products: Optional[List[dict]] = None) -> int:
+    """Write a UBL document to a binary stream, returning the number of bytes written"""
+    written = 0
+    for chunk in iter_invoice_ubl(invoice, account, supplier, products):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def ubl_filename(invoice: dict) -> str:
+    return f"{invoice['invoice_number']}.xml"
+
+
+def write_ubl_batch(out: BinaryIO, documents: Iterable[UBLDocument]) -> int:
+    """Write many UBL documents into a zip archive, one entry at a time
+
+    ``documents`` may be a lazy iterable; only one document is held in memory
+    while it is being rendered. Returns the number of documents written.
+    """
+    count = 0
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for invoice, account, supplier, products in documents:
+            with archive.open(ubl_filename(invoice), "w") as entry:
+                write_invoice_ubl(entry, invoice, account, supplier, products)
+            count += 1
+    return count
+
+
+class _ZipSink:
+    """Write-only, unseekable output; ZipFile then streams entries with data descriptors"""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, data) -> int:
+        return self.buffer.write(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+
+class UBLZipStream:
+    """A zip of UBL documents produced incrementally
+
+    Each ``write`` adds a batch of documents and returns the archive bytes
+    produced so far, so a response can stream the zip while later batches are
+    still being loaded; only the current batch is ever held in memory.
+    """
+
+    def __init__(self):
+        self._sink = _ZipSink()
+        self._archive = zipfile.ZipFile(self._sink, "w", compression=zipfile.ZIP_DEFLATED)
+        self.count = 0
+
+    def write(self, documents: Iterable[UBLDocument]) -> bytes:
+        for invoice, account, supplier, products in documents:
+            with self._archive.open(ubl_filename(invoice), "w") as entry:
+                write_invoice_ubl(entry, invoice, account, supplier, products)
+            self.count += 1
+        return self._sink.drain()
+
+    def close(self) -> bytes:
+        """Finish the archive, returning its remaining bytes (the central directory)"""
+        self._archive.close()
+        return self._sink.drain()
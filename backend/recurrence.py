@@ -0,0 +1,337 @@
+"""Recurring calendar events: one master document plus exceptions.
+
+A master event stores an RRULE-style rule (``rrule``), the time zone its
+times repeat in (``time_zone``) and an ``recurrence_exceptions`` map keyed by
+the original start of an occurrence (``20261001T090000Z``): a cancelled
+occurrence is ``{"cancelled": true}``, an edited one holds the fields it
+overrides. Occurrences are never stored.
+
+Supported rules, a subset of RFC 5545:
+
+    FREQ=DAILY[;INTERVAL=n]
+    FREQ=WEEKLY[;INTERVAL=n][;BYDAY=MO,WE,...]
+    FREQ=MONTHLY[;INTERVAL=n][;BYMONTHDAY=1,15,-1]
+    FREQ=YEARLY[;INTERVAL=n]
+
+each with an optional ``COUNT`` or ``UNTIL``. Expansion is lazy and jumps
+arithmetically to the first period that can reach the requested window, so
+the work per request depends on the window and not on how long ago the
+series started. Parsed series are cached per master version.
+"""
+import calendar
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from pymongo import ASCENDING
+
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+MAX_COUNT = 5000
+# Periods without any occurrence (BYMONTHDAY=31 in short months, Feb 29) tolerated in a row
+MAX_EMPTY_PERIODS = 100
+EXCEPTION_KEY_FORMAT = "%Y%m%dT%H%M%SZ"
+OVERRIDE_FIELDS = ("title", "description", "start_date", "end_date", "location")
+
+
+class RecurrenceRule(NamedTuple):
+    freq: str
+    interval: int = 1
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+    by_day: Tuple[int, ...] = ()
+    by_month_day: Tuple[int, ...] = ()
+
+
+def _parse_until(value: str) -> datetime:
+    for fmt in ("%Y%m%dT%H%M%SZ", "%Y%m%dT%H%M%S", "%Y%m%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y%m%d":
+            # A date-only UNTIL includes the whole day
+            parsed += timedelta(days=1, microseconds=-1)
+        return parsed.replace(tzinfo=timezone.utc)
+    raise ValueError(f"Invalid UNTIL: {value}")
+
+
+def parse_rrule(text: str) -> RecurrenceRule:
+    """Parse an RRULE value (with or without the ``RRULE:`` prefix); ValueError if unsupported"""
+    if text.upper().startswith("RRULE:"):
+        text = text[6:]
+    parts = {}
+    for part in filter(None, text.strip().split(";")):
+        name, _, value = part.partition("=")
+        parts[name.strip().upper()] = value.strip().upper()
+
+    freq = parts.pop("FREQ", None)
+    if freq not in FREQUENCIES:
+        raise ValueError(f"Unsupported FREQ: {freq}")
+    try:
+        interval = int(parts.pop("INTERVAL", "1"))
+        count = int(parts["COUNT"]) if "COUNT" in parts else None
+    except ValueError:
+        raise ValueError("INTERVAL and COUNT must be integers")
+    parts.pop("COUNT", None)
+    if interval < 1:
+        raise ValueError("INTERVAL must be at least 1")
+    if count is not None and not 1 <= count <= MAX_COUNT:
+        raise ValueError(f"COUNT must be between 1 and {MAX_COUNT}")
+    until = _parse_until(parts.pop("UNTIL")) if "UNTIL" in parts else None
+    if count is not None and until is not None:
+        raise ValueError("COUNT and UNTIL cannot be combined")
+
+    by_day: Tuple[int, ...] = ()
+    if "BYDAY" in parts:
+        if freq != "WEEKLY":
+            raise ValueError("BYDAY is only supported with FREQ=WEEKLY")
+        days = parts.pop("BYDAY").split(",")
+        if any(day not in WEEKDAYS for day in days):
+            raise ValueError("BYDAY takes MO, TU, WE, TH, FR, SA or SU")
+        by_day = tuple(sorted({WEEKDAYS.index(day) for day in days}))
+
+    by_month_day: Tuple[int, ...] = ()
+    if "BYMONTHDAY" in parts:
+        if freq != "MONTHLY":
+            raise ValueError("BYMONTHDAY is only supported with FREQ=MONTHLY")
+        try:
+            by_month_day = tuple(sorted({int(day) for day in parts.pop("BYMONTHDAY").split(",")}))
+        except ValueError:
+            raise ValueError("BYMONTHDAY takes day numbers")
+        if any(day == 0 or not -31 <= day <= 31 for day in by_month_day):
+            raise ValueError("BYMONTHDAY days are 1 to 31 or -31 to -1")
+
+    if parts:
+        raise ValueError(f"Unsupported rule parts: {', '.join(sorted(parts))}")
+    return RecurrenceRule(freq, interval, count, until, by_day, by_month_day)
+
+
+def exception_key(original_start: datetime) -> str:
+    if original_start.tzinfo is None:
+        original_start = original_start.replace(tzinfo=timezone.utc)
+    return original_start.astimezone(timezone.utc).strftime(EXCEPTION_KEY_FORMAT)
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+def load_zone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown time zone: {name}")
+
+
+class RecurringSeries:
+    """A master event's rule, time zone and exceptions, ready to expand"""
+
+    def __init__(self, master: dict):
+        self.master = master
+        self.rule = parse_rrule(master["rrule"])
+        self.zone = load_zone(master.get("time_zone"))
+        self.first_start = _aware(master["start_date"])
+        self.duration = _aware(master["end_date"]) - self.first_start
+        local = self.first_start.astimezone(self.zone)
+        self.local_date = local.date()
+        self.local_time = local.time().replace(tzinfo=None)
+        self.exceptions: Dict[str, dict] = master.get("recurrence_exceptions") or {}
+        # Edited occurrences may have been moved; they are matched against windows separately
+        self.moved = {key: (_aware(override["start_date"]), _aware(override.get("end_date") or override["start_date"]))
+                      for key, override in self.exceptions.items() if override.get("start_date")}
+        rule = self.rule
+        self.by_day = rule.by_day or (self.local_date.weekday(),)
+        self.by_month_day = rule.by_month_day or (self.local_date.day,)
+        self._week_anchor = self.local_date - timedelta(days=self.local_date.weekday())
+
+    # Candidate local dates of period p (the p-th day, week, month or year of the series)
+    def _period_dates(self, p: int) -> List[date]:
+        rule = self.rule
+        if rule.freq == "DAILY":
+            return [self.local_date + timedelta(days=p * rule.interval)]
+        if rule.freq == "WEEKLY":
+            week = self._week_anchor + timedelta(weeks=p * rule.interval)
+            dates = [week + timedelta(days=day) for day in self.by_day]
+            return [day for day in dates if day >= self.local_date] if p == 0 else dates
+        if rule.freq == "MONTHLY":
+            month_index = self.local_date.year * 12 + self.local_date.month - 1 + p * rule.interval
+            year, month = divmod(month_index, 12)
+            month += 1
+            length = calendar.monthrange(year, month)[1]
+            days = sorted({day if day > 0 else length + day + 1 for day in self.by_month_day
+                           if -length <= day <= length})
+            dates = [date(year, month, day) for day in days]
+            return [day for day in dates if day >= self.local_date] if p == 0 else dates
+        year = self.local_date.year + p * rule.interval
+        if self.local_date.month == 2 and self.local_date.day == 29 and not calendar.isleap(year):
+            return []
+        return [self.local_date.replace(year=year)]
+
+    def _period_of(self, local_day: date) -> int:
+        """Index of the last period starting on or before ``local_day`` (0 before the series)"""
+        rule = self.rule
+        if local_day <= self.local_date:
+            return 0
+        if rule.freq == "DAILY":
+            return (local_day - self.local_date).days // rule.interval
+        if rule.freq == "WEEKLY":
+            return (local_day - self._week_anchor).days // 7 // rule.interval
+        if rule.freq == "MONTHLY":
+            months = (local_day.year - self.local_date.year) * 12 + local_day.month - self.local_date.month
+            return months // rule.interval
+        return (local_day.year - self.local_date.year) // rule.interval
+
+    def _occurrences_before(self, p: int) -> int:
+        """Number of occurrences in periods 0..p-1 (only needed with COUNT)"""
+        if p == 0:
+            return 0
+        if self.rule.freq == "DAILY":
+            return p
+        if self.rule.freq == "WEEKLY":
+            return len(self._period_dates(0)) + (p - 1) * len(self.by_day)
+        return sum(len(self._period_dates(i)) for i in range(p))
+
+    def _to_utc(self, day: date) -> datetime:
+        return datetime.combine(day, self.local_time).replace(tzinfo=self.zone).astimezone(timezone.utc)
+
+    def starts(self, after: Optional[datetime] = None) -> Iterator[datetime]:
+        """Original occurrence starts in order, from the period that contains ``after``"""
+        p = self._period_of(after.astimezone(self.zone).date()) if after is not None else 0
+        if self.rule.count is not None:
+            emitted = self._occurrences_before(p)
+            if emitted >= self.rule.count:
+                return
+        else:
+            emitted = 0
+        empty = 0
+        while True:
+            dates = self._period_dates(p)
+            empty = 0 if dates else empty + 1
+            if empty > MAX_EMPTY_PERIODS:
+                return
+            for day in dates:
+                start = self._to_utc(day)
+                if self.rule.until is not None and start > self.rule.until:
+                    return
+                yield start
+                emitted += 1
+                if self.rule.count is not None and emitted >= self.rule.count:
+                    return
+            p += 1
+
+    def is_occurrence(self, original_start: datetime) -> bool:
+        original_start = _aware(original_start)
+        for start in self.starts(original_start):
+            if start >= original_start:
+                return start == original_start
+        return False
+
+    def bounds(self) -> Tuple[datetime, Optional[datetime]]:
+        """Start of the earliest and end of the last occurrence, moved ones included
+
+        The end is None for a series without COUNT or UNTIL.
+        """
+        first, last = self.first_start, None
+        if self.rule.until is not None:
+            last = self.rule.until + self.duration
+        elif self.rule.count is not None:
+            last = self.first_start
+            for last in self.starts():
+                pass
+            last += self.duration
+        for moved_start, moved_end in self.moved.values():
+            first = min(first, moved_start)
+            if last is not None:
+                last = max(last, moved_end)
+        return first, last
+
+    def _occurrence(self, original_start: datetime, key: str) -> dict:
+        occurrence = {k: v for k, v in self.master.items()
+                      if k not in ("_id", "rrule", "recurrence_exceptions", "recurring", "series_start", "series_end")}
+        occurrence.update({
+            "id": f"{self.master['id']}:{key}",
+            "recurrence_id": self.master["id"],
+            "original_start": original_start,
+            "start_date": original_start,
+            "end_date": original_start + self.duration
+        })
+        override = self.exceptions.get(key)
+        if override:
+            occurrence.update({field: override[field] for field in OVERRIDE_FIELDS if field in override})
+        return occurrence
+
+    def occurrences(self, start: datetime, end: datetime, limit: int = 1000) -> Iterator[dict]:
+        """Occurrences overlapping [start, end), at most ``limit``, with exceptions applied"""
+        produced = 0
+        # An occurrence started up to one duration before the window can still overlap it
+        for original in self.starts(start - self.duration):
+            if original >= end or produced >= limit:
+                break
+            key = original.strftime(EXCEPTION_KEY_FORMAT)
+            override = self.exceptions.get(key)
+            if override and (override.get("cancelled") or key in self.moved):
+                continue
+            if original + self.duration > start or original >= start:
+                produced += 1
+                yield self._occurrence(original, key)
+
+        for key, (moved_start, moved_end) in self.moved.items():
+            if produced >= limit:
+                break
+            if self.exceptions[key].get("cancelled"):
+                continue
+            if moved_start < end and (moved_end > start or moved_start >= start):
+                produced += 1
+                original = datetime.strptime(key, EXCEPTION_KEY_FORMAT).replace(tzinfo=timezone.utc)
+                yield self._occurrence(original, key)
+
+
+class SeriesCache:
+    """Parsed series per master version (id and updated_at), least recently used evicted first"""
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._series: "OrderedDict[Tuple[str, Optional[datetime]], RecurringSeries]" = OrderedDict()
+        self.stats = {"hits": 0, "parses": 0}
+
+    def get(self, master: dict) -> RecurringSeries:
+        key = (master["id"], master.get("updated_at"))
+        series = self._series.get(key)
+        if series is not None:
+            self._series.move_to_end(key)
+            self.stats["hits"] += 1
+            return series
+        series = RecurringSeries(master)
+        self.stats["parses"] += 1
+        self._series[key] = series
+        if len(self._series) > self.max_entries:
+            self._series.popitem(last=False)
+        return series
+
+
+def expand(masters: List[dict], cache: SeriesCache, start: datetime, end: datetime,
+           limit: int = 1000) -> List[dict]:
+    """Occurrences of ``masters`` overlapping [start, end), at most ``limit`` per master"""
+    occurrences = []
+    for master in masters:
+        occurrences.extend(cache.get(master).occurrences(start, end, limit))
+    return occurrences
+
+
+def masters_query(user_id: str, start: datetime, end: datetime) -> dict:
+    """Recurring masters of ``user_id`` with occurrences that can overlap [start, end)"""
+    return {"user_id": user_id, "recurring": True, "series_start": {"$lt": end},
+            "$or": [{"series_end": None}, {"series_end": {"$gt": start}}]}
+
+
+def series_fields(master: dict) -> dict:
+    """Storage-only fields of a master that let ``masters_query`` find it"""
+    series_start, series_end = RecurringSeries(master).bounds()
+    return {"recurring": True, "series_start": series_start, "series_end": series_end}
+
+
+async def ensure_indexes(collection):
+    await collection.create_index([("user_id", ASCENDING), ("series_start", ASCENDING)],
+                                  name="recurring_series", partialFilterExpression={"recurring": True})
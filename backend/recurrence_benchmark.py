@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark for expanding recurring calendar events.
+
+Builds a daily series that has been running for the requested number of
+years and times the expansion of a month window at its start, a month window
+at its end and a full year, against expanding every occurrence from the
+first one and filtering (what a naive expansion does):
+
+    python backend/recurrence_benchmark.py --years 10 --repeat 200
+"""
+
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+from recurrence import RecurringSeries
+
+
+def naive_occurrences(series: RecurringSeries, start: datetime, end: datetime):
+    occurrences = []
+    for original in series.starts():
+        if original >= end:
+            break
+        if original + series.duration > start:
+            occurrences.append(original)
+    return occurrences
+
+
+def timed(label: str, repeat: int, expand):
+    count = len(expand())
+    start = time.perf_counter()
+    for _ in range(repeat):
+        expand()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label}: {count} occurrences in {elapsed * 1000:.3f}ms")
+
+
+def main(years: int, repeat: int):
+    first = datetime.now(timezone.utc).replace(hour=9, minute=0, second=0, microsecond=0) - timedelta(days=365 * years)
+    series = RecurringSeries({"id": "bench", "rrule": "FREQ=DAILY", "time_zone": "Europe/Brussels",
+                              "start_date": first, "end_date": first + timedelta(minutes=30)})
+    last = first + timedelta(days=365 * years)
+    windows = [
+        ("first month", first, first + timedelta(days=31)),
+        ("last month", last - timedelta(days=31), last),
+        ("last year", last - timedelta(days=365), last),
+    ]
+    for label, start, end in windows:
+        timed(f"lazy, {label}", repeat, lambda: list(series.occurrences(start, end, limit=1000)))
+        timed(f"naive, {label}", repeat, lambda: naive_occurrences(series, start, end))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+    main(args.years, args.repeat)
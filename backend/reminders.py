@@ -0,0 +1,363 @@
+"""Calendar reminders from ``reminder_minutes``, delivered over server-sent events.
+
+Every event stores the fire time of its next reminder (``remind_at``) and the
+start of the occurrence it is for (``remind_for``); for a recurring master
+that is the next occurrence. One worker, holding a JobLease, loads the
+reminders due within ``horizon`` through the ``remind_at`` index into a heap,
+refills it every ``refill_interval`` and takes new or moved events pushed by
+the routes of its own process right away.
+
+A due reminder is first written to ``db.reminder_notifications``, upserted
+on ``(event_id, start_date)``, and then claimed with a conditional update
+that moves ``remind_at`` to the next occurrence (or clears it). A worker that
+dies between the two steps leaves the reminder to be fired again, and the
+upsert makes that second write a no-op, so every reminder is stored exactly
+once even when the lease changes hands or the event was edited after it was
+loaded. Every process polls the notifications for the users connected to it
+and pushes them down their stream; a reconnecting stream gets the ones it
+missed after its ``Last-Event-ID``.
+"""
+import asyncio
+import heapq
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from pymongo import ASCENDING, UpdateOne
+
+from job_lease import JobLease
+from recurrence import EXCEPTION_KEY_FORMAT, RecurringSeries
+
+logger = logging.getLogger(__name__)
+
+# Reminders found later than this after their fire time (worker down) are dropped, not delivered
+MAX_LATENESS = timedelta(hours=1)
+
+
+def _aware(moment: datetime) -> datetime:
+    return moment if moment.tzinfo is not None else moment.replace(tzinfo=timezone.utc)
+
+
+def _next_start(event: dict, after: datetime) -> Optional[datetime]:
+    if not event.get("rrule"):
+        start = _aware(event["start_date"])
+        return start if start > after else None
+
+    series = RecurringSeries(event)
+    candidates = [moved for moved, _ in series.moved.values() if moved > after]
+    for original in series.starts(after):
+        if original <= after:
+            continue
+        override = series.exceptions.get(original.strftime(EXCEPTION_KEY_FORMAT))
+        if not override or not (override.get("cancelled") or override.get("start_date")):
+            candidates.append(original)
+            break
+    return min(candidates) if candidates else None
+
+
+def reminder_fields(event: dict, after: Optional[datetime] = None) -> dict:
+    """``remind_at`` and ``remind_for`` of the next occurrence starting after ``after`` (now)"""
+    minutes = event.get("reminder_minutes")
+    start = _next_start(event, after or datetime.now(timezone.utc)) if minutes is not None else None
+    if start is None:
+        return {"remind_at": None, "remind_for": None}
+    return {"remind_at": start - timedelta(minutes=minutes), "remind_for": start}
+
+
+def reminder_notification(event: dict, now: datetime) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": event["user_id"],
+        "event_id": event["id"],
+        "title": event["title"],
+        "location": event.get("location"),
+        "start_date": _aware(event["remind_for"]),
+        "reminder_minutes": event.get("reminder_minutes"),
+        "created_at": now
+    }
+
+
+def sse_message(notification: dict) -> str:
+    data = {key: value.isoformat() if isinstance(value, datetime) else value
+            for key, value in notification.items() if key not in ("_id", "user_id")}
+    return f"id: {notification['id']}\nevent: reminder\ndata: {json.dumps(data)}\n\n"
+
+
+async def backfill_reminders(collection, batch_size: int = 500):
+    """Set remind_at on upcoming events stored before reminders were scheduled"""
+    now = datetime.now(timezone.utc)
+    cursor = collection.find(
+        {"remind_at": {"$exists": False}, "$or": [{"start_date": {"$gt": now}}, {"recurring": True}]},
+        {"_id": 0}
+    )
+    ops: List[UpdateOne] = []
+    async for event in cursor:
+        ops.append(UpdateOne({"id": event["id"]}, {"$set": reminder_fields(event, now)}))
+        if len(ops) >= batch_size:
+            await collection.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await collection.bulk_write(ops, ordered=False)
+
+
+Deliver = Callable[[dict], Awaitable[None]]
+
+
+class ReminderScheduler:
+    def __init__(self, db, deliver: Deliver, horizon: float = 600, refill_interval: float = 30,
+                 batch_size: int = 1000, lease: Optional[JobLease] = None):
+        self.collection = db.calendar_events
+        self.deliver = deliver
+        self.horizon = timedelta(seconds=horizon)
+        self.refill_interval = refill_interval
+        self.batch_size = batch_size
+        self.lease = lease or JobLease(db.job_leases, "reminder_scheduler", lease_seconds=refill_interval * 3)
+        self._heap: List[Tuple[datetime, str]] = []
+        self._queued: Set[Tuple[datetime, str]] = set()
+        self._holding = False
+        self._next_refill: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._wakeup = asyncio.Event()
+        self.stats = {"loaded": 0, "fired": 0, "missed": 0, "stale": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index([("remind_at", ASCENDING)])
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._holding:
+            await self.lease.release()
+
+    def schedule(self, event: dict):
+        """Take a created or changed event into the heap if it is due within the horizon"""
+        remind_at = event.get("remind_at")
+        if not self._holding or remind_at is None:
+            return
+        if _aware(remind_at) <= datetime.now(timezone.utc) + self.horizon:
+            self._push(_aware(remind_at), event["id"])
+            self._wakeup.set()
+
+    def _push(self, remind_at: datetime, event_id: str):
+        entry = (remind_at, event_id)
+        if entry not in self._queued:
+            self._queued.add(entry)
+            heapq.heappush(self._heap, entry)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            timeout = self.refill_interval
+            try:
+                timeout = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Reminder scheduler error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_once(self) -> float:
+        """Refill and fire what is due; returns the seconds until there is work again"""
+        self._holding = await self.lease.acquire() is not None
+        if not self._holding:
+            self._heap, self._queued, self._next_refill = [], set(), None
+            return self.refill_interval
+
+        now = datetime.now(timezone.utc)
+        if self._next_refill is None or now >= self._next_refill:
+            await self.refill(now)
+        await self.fire_due()
+
+        now = datetime.now(timezone.utc)
+        wake = min(self._next_refill, self._heap[0][0]) if self._heap else self._next_refill
+        return max((wake - now).total_seconds(), 0)
+
+    async def refill(self, now: datetime):
+        due = await self.collection.find(
+            {"remind_at": {"$lte": now + self.horizon}}, {"_id": 0, "id": 1, "remind_at": 1}
+        ).sort("remind_at", ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+        for event in due:
+            self._push(_aware(event["remind_at"]), event["id"])
+        self.stats["loaded"] += len(due)
+        # A full batch means a backlog: load the next one as soon as this one has fired
+        self._next_refill = now if len(due) == self.batch_size else now + timedelta(seconds=self.refill_interval)
+
+    async def fire_due(self) -> int:
+        fired = 0
+        while self._heap and self._heap[0][0] <= datetime.now(timezone.utc):
+            entry = heapq.heappop(self._heap)
+            self._queued.discard(entry)
+            if await self._fire(*entry):
+                fired += 1
+        return fired
+
+    async def _fire(self, remind_at: datetime, event_id: str) -> bool:
+        event = await self.collection.find_one({"id": event_id, "remind_at": remind_at}, {"_id": 0})
+        if event is None:
+            # Edited, deleted or already fired since it was loaded
+            self.stats["stale"] += 1
+            return False
+
+        now = datetime.now(timezone.utc)
+        late = now - remind_at > MAX_LATENESS
+        if not late:
+            # Delivered before the claim: delivery is idempotent, a lost claim is not
+            await self.deliver(reminder_notification(event, now))
+        claimed = await self.collection.update_one(
+            {"id": event_id, "remind_at": remind_at},
+            {"$set": reminder_fields(event, _aware(event["remind_for"]))}
+        )
+        if claimed.modified_count != 1:
+            self.stats["stale"] += 1
+            return False
+        if late:
+            self.stats["missed"] += 1
+            return False
+        self.stats["fired"] += 1
+        return True
+
+
+class ReminderHub:
+    """Fired reminders, stored once and pushed to the streams connected to this process
+
+    Notifications are polled by ``created_at``, looking back ``overlap``
+    seconds to catch inserts from other processes that became visible late;
+    ids already pushed are skipped. A stream that subscribes with the id of
+    the last notification it received is first sent the ones stored after it.
+    """
+
+    def __init__(self, collection, poll_interval: float = 1.0, overlap: float = 5.0, retention: int = 86400,
+                 queue_size: int = 100):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.overlap = timedelta(seconds=overlap)
+        self.retention = retention
+        self.queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._seen: Dict[str, datetime] = {}
+        self._replays: List[Tuple[str, asyncio.Queue, str]] = []
+        self._since = datetime.now(timezone.utc)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.stats = {"published": 0, "pushed": 0, "dropped": 0}
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=self.retention)
+        await self.collection.create_index([("event_id", ASCENDING), ("start_date", ASCENDING)], unique=True)
+        await self.collection.create_index([("user_id", ASCENDING), ("created_at", ASCENDING)])
+
+    async def publish(self, notification: dict):
+        """Store a fired reminder; publishing the same occurrence again leaves the first one"""
+        result = await self.collection.update_one(
+            {"event_id": notification["event_id"], "start_date": notification["start_date"]},
+            {"$setOnInsert": notification}, upsert=True
+        )
+        if result.upserted_id is not None:
+            self.stats["published"] += 1
+
+    def subscribe(self, user_id: str, last_event_id: Optional[str] = None) -> asyncio.Queue:
+        """Queue of the user's notifications, starting after ``last_event_id`` when given"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(user_id, set()).add(queue)
+        if last_event_id:
+            self._replays.append((user_id, queue, last_event_id))
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Reminder hub error: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def _put(self, queue: asyncio.Queue, notification: dict) -> int:
+        try:
+            queue.put_nowait(notification)
+            return 1
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            return 0
+
+    async def _replay(self) -> Dict[asyncio.Queue, Set[str]]:
+        """Push what reconnected streams missed; returns the ids pushed to each queue"""
+        replayed: Dict[asyncio.Queue, Set[str]] = {}
+        replays, self._replays = self._replays, []
+        for user_id, queue, last_event_id in replays:
+            if queue not in self._subscribers.get(user_id, ()):
+                continue
+            last = await self.collection.find_one({"id": last_event_id, "user_id": user_id}, {"_id": 0, "created_at": 1})
+            if last is None:
+                # Unknown or past retention: nothing to replay from
+                continue
+            missed = await self.collection.find(
+                {"user_id": user_id, "created_at": {"$gte": last["created_at"]}, "id": {"$ne": last_event_id}},
+                {"_id": 0}
+            ).sort("created_at", ASCENDING).limit(self.queue_size).to_list(self.queue_size)
+            for notification in missed:
+                self.stats["pushed"] += self._put(queue, notification)
+            replayed[queue] = {notification["id"] for notification in missed}
+        return replayed
+
+    async def poll(self) -> int:
+        if not self._subscribers:
+            # Streams that reconnect later replay what they missed from their Last-Event-ID
+            self._since, self._seen, self._replays = datetime.now(timezone.utc), {}, []
+            return 0
+
+        replayed = await self._replay() if self._replays else {}
+        since = self._since - self.overlap
+        notifications = await self.collection.find(
+            {"created_at": {"$gt": since}, "user_id": {"$in": list(self._subscribers)}}, {"_id": 0}
+        ).sort("created_at", ASCENDING).to_list(None)
+
+        pushed = 0
+        for notification in notifications:
+            created_at = _aware(notification["created_at"])
+            self._since = max(self._since, created_at)
+            if notification["id"] in self._seen:
+                continue
+            self._seen[notification["id"]] = created_at
+            for queue in self._subscribers.get(notification["user_id"], ()):
+                if notification["id"] not in replayed.get(queue, ()):
+                    pushed += self._put(queue, notification)
+        # Older notifications fall outside the next query anyway
+        horizon = self._since - self.overlap
+        self._seen = {key: seen for key, seen in self._seen.items() if seen > horizon}
+        self.stats["pushed"] += pushed
+        return pushed
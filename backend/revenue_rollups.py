@@ -0,0 +1,303 @@
+"""Daily revenue rollups behind the admin reports.
+
+MRR, churn, plan distribution and payment success rates would otherwise
+mean scanning ``payment_transactions``, ``user_subscriptions`` and ``users``
+on every report view. A background job aggregates them instead into one
+document per UTC day in ``revenue_daily`` (``_id`` is ``YYYY-MM-DD``), written
+with ``$merge``, and the report reads only those documents.
+
+Each source updates its own top-level field of the day document, so the
+pipelines never overwrite each other:
+
+- ``payments``: attempts, paid/failed/expired counts and paid revenue, by
+  the day the transaction was created
+- ``new_subscriptions`` / ``churned_subscriptions``: by start day and by
+  expiry day (expired or cancelled subscriptions)
+- ``snapshot``: plan distribution, paying users and MRR, taken from the
+  users' effective plans on the day the job ran: the highest of the stored
+  plan and the plans their roles carry, as in ``resolve_entitlements``, so a
+  payment-granted ``premium_user`` counts as a paying professional user
+- ``active_subscriptions``: active subscriptions on the day the job ran
+
+Churn is measured on subscriptions: those that ended in the period over
+those active at its start plus those started during it, so a user who
+cancels several subscriptions cannot push the rate past 1.
+
+After the first run (a full backfill) only the last ``lookback_days`` days
+are recomputed, which picks up payments that settled after their day.
+"""
+import asyncio
+import logging
+import time
+from datetime import date, datetime, timezone, timedelta
+from typing import Dict, List, Optional
+
+from pymongo import ASCENDING
+
+from entitlements import PLAN_ORDER, ROLE_PLANS
+from job_lease import JobLease
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_COLLECTION = "revenue_daily"
+SETTLED_STATUSES = ("paid", "failed", "expired")
+CHURNED_STATUSES = ("expired", "cancelled")
+
+
+def day_key(field: str) -> dict:
+    return {"$dateToString": {"format": "%Y-%m-%d", "date": field}}
+
+
+def start_of_day(moment: datetime) -> datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def price_of(plan_field: str, plan_prices: Dict[str, float]) -> dict:
+    """Expression for the monthly price of the plan id held in ``plan_field``"""
+    return {"$switch": {
+        "branches": [{"case": {"$eq": [plan_field, plan_id]}, "then": price} for plan_id, price in plan_prices.items()],
+        "default": 0
+    }}
+
+
+def _merge(into: str) -> dict:
+    return {"$merge": {"into": into, "on": "_id", "whenMatched": "merge", "whenNotMatched": "insert"}}
+
+
+def _count_if(condition: dict) -> dict:
+    return {"$sum": {"$cond": [condition, 1, 0]}}
+
+
+def payments_pipeline(since: Optional[datetime], into: str = ROLLUP_COLLECTION) -> List[dict]:
+    is_paid = {"$eq": ["$payment_status", "paid"]}
+    return [
+        {"$match": {"created_at": {"$gte": since}} if since else {}},
+        {"$group": {
+            "_id": day_key("$created_at"),
+            "attempts": {"$sum": 1},
+            **{status: _count_if({"$eq": ["$payment_status", status]}) for status in SETTLED_STATUSES},
+            "revenue": {"$sum": {"$cond": [is_paid, "$amount", 0]}}
+        }},
+        {"$project": {
+            "payments": {"attempts": "$attempts", "revenue": "$revenue",
+                         **{status: f"${status}" for status in SETTLED_STATUSES}},
+            "updated_at": "$$NOW"
+        }},
+        _merge(into)
+    ]
+
+
+def _subscriptions_by_day(day_field: str, output: str, plan_prices: Dict[str, float], into: str) -> List[dict]:
+    return [
+        {"$group": {"_id": {"day": day_key(day_field), "plan": "$plan_id"}, "count": {"$sum": 1}}},
+        {"$group": {
+            "_id": "$_id.day",
+            "count": {"$sum": "$count"},
+            "mrr": {"$sum": {"$multiply": ["$count", price_of("$_id.plan", plan_prices)]}},
+            "by_plan": {"$push": {"k": "$_id.plan", "v": "$count"}}
+        }},
+        {"$project": {
+            output: {"count": "$count", "mrr": "$mrr", "by_plan": {"$arrayToObject": "$by_plan"}},
+            "updated_at": "$$NOW"
+        }},
+        _merge(into)
+    ]
+
+
+def new_subscriptions_pipeline(since: Optional[datetime], plan_prices: Dict[str, float],
+                               into: str = ROLLUP_COLLECTION) -> List[dict]:
+    match = {"started_at": {"$gte": since}} if since else {}
+    return [{"$match": match}] + _subscriptions_by_day("$started_at", "new_subscriptions", plan_prices, into)
+
+
+def churned_subscriptions_pipeline(since: Optional[datetime], plan_prices: Dict[str, float],
+                                   into: str = ROLLUP_COLLECTION) -> List[dict]:
+    # Served by the (status, expires_at) index on user_subscriptions
+    match = {"status": {"$in": list(CHURNED_STATUSES)},
+             "expires_at": {"$gte": since} if since else {"$ne": None}}
+    return [{"$match": match}] + _subscriptions_by_day("$expires_at", "churned_subscriptions", plan_prices, into)
+
+
+def active_subscriptions_pipeline(day: str, into: str = ROLLUP_COLLECTION) -> List[dict]:
+    return [
+        # Served by the (status, expires_at) index on user_subscriptions
+        {"$match": {"status": "active"}},
+        {"$group": {"_id": day, "count": {"$sum": 1}}},
+        {"$project": {"active_subscriptions": "$count", "updated_at": "$$NOW"}},
+        _merge(into)
+    ]
+
+
+def _rank_of(field: str, plans: Dict[str, str], default: int) -> dict:
+    """Expression for the PLAN_ORDER rank of the plan ``plans`` maps the value of ``field`` to"""
+    return {"$switch": {
+        "branches": [{"case": {"$eq": [field, key]}, "then": PLAN_ORDER.index(plan)} for key, plan in plans.items()],
+        "default": default
+    }}
+
+
+def effective_plan_stages(default_plan: str) -> List[dict]:
+    """Stages setting ``plan`` to each user's effective plan, mirroring ``entitlements.effective_plan``"""
+    stored_rank = _rank_of("$current_plan", {plan: plan for plan in PLAN_ORDER}, PLAN_ORDER.index(default_plan))
+    return [
+        # Served by the unique (user_id, role) index on user_roles
+        {"$lookup": {"from": "user_roles", "localField": "id", "foreignField": "user_id", "as": "roles"}},
+        {"$unwind": {"path": "$roles", "preserveNullAndEmptyArrays": True}},
+        {"$group": {"_id": "$_id", "rank": {"$max": {"$max": [stored_rank, _rank_of("$roles.role", ROLE_PLANS, -1)]}}}},
+        {"$project": {"plan": {"$arrayElemAt": [list(PLAN_ORDER), "$rank"]}}},
+    ]
+
+
+def snapshot_pipeline(day: str, plan_prices: Dict[str, float], default_plan: str = "starter",
+                      into: str = ROLLUP_COLLECTION) -> List[dict]:
+    return [
+        {"$match": {"is_active": {"$ne": False}}},
+        *effective_plan_stages(default_plan),
+        {"$group": {"_id": "$plan", "count": {"$sum": 1}}},
+        {"$addFields": {"price": price_of("$_id", plan_prices)}},
+        {"$group": {
+            "_id": day,
+            "users": {"$sum": "$count"},
+            "paying_users": {"$sum": {"$cond": [{"$gt": ["$price", 0]}, "$count", 0]}},
+            "mrr": {"$sum": {"$multiply": ["$count", "$price"]}},
+            "plans": {"$push": {"k": "$_id", "v": "$count"}}
+        }},
+        {"$project": {
+            "snapshot": {"users": "$users", "paying_users": "$paying_users", "mrr": "$mrr",
+                         "plans": {"$arrayToObject": "$plans"}},
+            "updated_at": "$$NOW"
+        }},
+        _merge(into)
+    ]
+
+
+def revenue_report(rollups: List[dict]) -> dict:
+    """Totals and per-day series over rollup documents sorted by day"""
+    days = []
+    totals = {"revenue": 0.0, "attempts": 0, "new_subscriptions": 0, "new_mrr": 0.0,
+              "churned_subscriptions": 0, "churned_mrr": 0.0,
+              **{status: 0 for status in SETTLED_STATUSES}}
+    for rollup in rollups:
+        payments = rollup.get("payments", {})
+        new = rollup.get("new_subscriptions", {})
+        churned = rollup.get("churned_subscriptions", {})
+        for status in SETTLED_STATUSES:
+            totals[status] += payments.get(status, 0)
+        totals["attempts"] += payments.get("attempts", 0)
+        totals["revenue"] += payments.get("revenue", 0)
+        totals["new_subscriptions"] += new.get("count", 0)
+        totals["new_mrr"] += new.get("mrr", 0)
+        totals["churned_subscriptions"] += churned.get("count", 0)
+        totals["churned_mrr"] += churned.get("mrr", 0)
+        days.append({
+            "date": rollup["_id"],
+            "revenue": payments.get("revenue", 0),
+            "payments": payments.get("attempts", 0),
+            "success_rate": success_rate(payments),
+            "new_subscriptions": new.get("count", 0),
+            "churned_subscriptions": churned.get("count", 0),
+            "mrr": rollup.get("snapshot", {}).get("mrr")
+        })
+
+    snapshots = [rollup["snapshot"] for rollup in rollups if rollup.get("snapshot")]
+    latest = snapshots[-1] if snapshots else {}
+    active_at_start = next((rollup["active_subscriptions"] for rollup in rollups if "active_subscriptions" in rollup), 0)
+    exposed = active_at_start + totals["new_subscriptions"]
+    return {
+        "from": rollups[0]["_id"] if rollups else None,
+        "to": rollups[-1]["_id"] if rollups else None,
+        "mrr": latest.get("mrr"),
+        "paying_users": latest.get("paying_users"),
+        "plan_distribution": latest.get("plans", {}),
+        "payment_success_rate": success_rate(totals),
+        "subscription_churn_rate": round(totals["churned_subscriptions"] / exposed, 4) if exposed else None,
+        "totals": totals,
+        "days": days
+    }
+
+
+def success_rate(counts: dict) -> Optional[float]:
+    """Share of settled payments (paid, failed or expired) that were paid"""
+    settled = sum(counts.get(status, 0) for status in SETTLED_STATUSES)
+    return round(counts.get("paid", 0) / settled, 4) if settled else None
+
+
+class RevenueRollups:
+    def __init__(self, db, plan_prices: Dict[str, float], interval: float = 3600, lookback_days: int = 3,
+                 default_plan: str = "starter", lease: Optional[JobLease] = None):
+        self.db = db
+        self.plan_prices = plan_prices
+        self.interval = interval
+        self.lookback_days = lookback_days
+        self.default_plan = default_plan
+        self.rollups = db[ROLLUP_COLLECTION]
+        self.lease = lease or JobLease(db.job_leases, "revenue_rollups")
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.db.payment_transactions.create_index("created_at")
+        await self.db.user_subscriptions.create_index("started_at")
+        await self.db.user_subscriptions.create_index([("status", ASCENDING), ("expires_at", ASCENDING)])
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Revenue rollup error: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _aggregate(self, collection, pipeline: List[dict]):
+        # $merge writes the output; the cursor itself is empty
+        await collection.aggregate(pipeline).to_list(None)
+
+    async def run(self) -> Optional[dict]:
+        """Refresh the rollups; None if another worker holds the lease"""
+        checkpoint = await self.lease.acquire()
+        if checkpoint is None:
+            return None
+
+        started = time.monotonic()
+        now = datetime.now(timezone.utc)
+        last_run = checkpoint.get("last_run")
+        if last_run is not None and last_run.tzinfo is None:
+            last_run = last_run.replace(tzinfo=timezone.utc)
+        since = start_of_day(last_run - timedelta(days=self.lookback_days)) if last_run else None
+
+        try:
+            await self._aggregate(self.db.payment_transactions, payments_pipeline(since))
+            await self._aggregate(self.db.user_subscriptions, new_subscriptions_pipeline(since, self.plan_prices))
+            await self._aggregate(self.db.user_subscriptions, churned_subscriptions_pipeline(since, self.plan_prices))
+            await self._aggregate(self.db.users, snapshot_pipeline(now.date().isoformat(), self.plan_prices,
+                                                                  self.default_plan))
+            await self._aggregate(self.db.user_subscriptions, active_subscriptions_pipeline(now.date().isoformat()))
+            await self.lease.save({"last_run": now})
+        finally:
+            await self.lease.release()
+
+        stats = {"since": since, "duration": round(time.monotonic() - started, 3)}
+        logger.info(f"Revenue rollups refreshed: {stats}")
+        return stats
+
+    async def report(self, start: date, end: date) -> dict:
+        """Report for the days from ``start`` to ``end`` inclusive, read from the rollups only"""
+        rollups = await self.rollups.find(
+            {"_id": {"$gte": start.isoformat(), "$lte": end.isoformat()}}
+        ).sort("_id", ASCENDING).to_list(None)
+        return revenue_report(rollups)
@@ -1,14 +1,18 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, Response, UploadFile, File
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 import uuid
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import httpx
 import io
 import base64
@@ -25,6 +29,39 @@ import secrets
 from stdnum.eu import vat
 from stdnum import util
 import xml.etree.ElementTree as ET
+from eu_countries import EU_COUNTRY_NAMES, normalize_vat_number
+from peppol_ubl import UBLZipStream, iter_invoice_ubl, supplier_party, ubl_filename
+from peppol_dispatch import AccessPointClient, PeppolDispatcher, DEFAULT_ACCESS_POINT
+from peppol_inbound import ensure_inbound_indexes, ingest_ubl_sources
+from en16931 import validate_invoice, validate_invoices
+from vies_cache import UNAVAILABLE as VIES_UNAVAILABLE, ViesCache, ViesUnavailableError
+from vies_address import parse_vies_address
+from http_clients import HttpClients, UpstreamConfig
+from token_cache import AccessTokenCache
+from event_consumer import EventConsumer
+from payment_status import PaymentStatusWatcher
+from admin_users import user_counts_pipeline, user_listing_pipeline
+from entitlements import VERSION_FIELD, Entitlements, EntitlementCache, resolve_entitlements
+from custom_fields import (CustomFieldError, CustomFieldSchemas, ENTITY_TYPES, FILTER_PREFIX, check_definition,
+                           definitions_query, index_spec)
+from circuit_breaker import CircuitBreaker, UpstreamUnavailableError, start_deadline
+from vat_validation import run_batch as run_vat_batch
+from vat_revalidation import VatRevalidator
+from revenue_rollups import RevenueRollups
+from subscription_expiry import SubscriptionExpiry
+from calendar_window import (backfill_long_span, check_window, day_counts, is_long_span, sort_by_start, window_query,
+                             ensure_indexes as ensure_calendar_indexes)
+from recurrence import (RecurringSeries, SeriesCache, exception_key, expand, masters_query, series_fields,
+                        ensure_indexes as ensure_recurrence_indexes)
+from reminders import ReminderHub, ReminderScheduler, backfill_reminders, reminder_fields, sse_message
+from calendar_feed import (CALENDAR_CONTENT_TYPE, SYNC_TOKEN_ERROR, TOMBSTONE_RETENTION, changes_query, collection_props, entity_tag,
+                           event_id_from_href, event_resource, feed_query, http_date, iter_calendar, iter_multistatus,
+                           latest_change, not_modified, parse_report, parse_sync_token, record_tombstone,
+                           resource_props, sync_token, tombstones_query, ensure_indexes as ensure_feed_indexes)
+from freebusy import BusyIndexes
+from invoice_events import InvoiceDueEvents
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError, OperationFailure
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -41,6 +78,17 @@ app = FastAPI()
 api_router = APIRouter(prefix="/api")
 
 # Pydantic Models
+class CompanyProfile(BaseModel):
+    """Seller details of a user's company, used as the supplier party on invoices"""
+    legal_name: Optional[str] = None
+    vat_number: Optional[str] = None
+    street: Optional[str] = None
+    street_nr: Optional[str] = None
+    box: Optional[str] = None
+    postal_code: Optional[str] = None
+    city: Optional[str] = None
+    country: Optional[str] = None
+
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     email: EmailStr
@@ -50,6 +98,8 @@ class User(BaseModel):
     auth_type: str = "google"  # "google" or "traditional"
     is_active: bool = True
     current_plan: str = "starter"  # starter, professional, enterprise
+    entitlements_version: int = 0  # bumped on every role or plan change
+    company: Optional[CompanyProfile] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Session(BaseModel):
@@ -69,6 +119,7 @@ class Contact(BaseModel):
     position: Optional[str] = None
     address: Optional[str] = None
     notes: Optional[str] = None
+    custom_fields: Dict[str, Any] = Field(default_factory=dict)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -89,7 +140,10 @@ class Account(BaseModel):
     city: Optional[str] = None
     country: Optional[str] = None
     vat_number: Optional[str] = None  # Important for Peppol and VIES
+    vat_valid: Optional[bool] = None  # Last VIES outcome, None = not checked yet
+    vat_checked_at: Optional[datetime] = None
     notes: Optional[str] = None
+    custom_fields: Dict[str, Any] = Field(default_factory=dict)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -104,6 +158,7 @@ class Product(BaseModel):
     sku: Optional[str] = None
     category: Optional[str] = None
     active: bool = True
+    custom_fields: Dict[str, Any] = Field(default_factory=dict)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -133,6 +188,7 @@ class Invoice(BaseModel):
     xml_url: Optional[str] = None
     notes: Optional[str] = None
     invoice_type: str = "invoice"  # invoice, credit_note
+    custom_fields: Dict[str, Any] = Field(default_factory=dict)
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -149,9 +205,39 @@ class CalendarEvent(BaseModel):
     location: Optional[str] = None
     all_day: bool = False
     reminder_minutes: Optional[int] = 30
+    rrule: Optional[str] = None  # e.g. FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10
+    time_zone: Optional[str] = None  # zone the rule repeats in, UTC by default
+    recurrence_exceptions: Dict[str, Dict[str, Any]] = Field(default_factory=dict)
+    recurrence_id: Optional[str] = None  # set on expanded occurrences: ID of the series
+    original_start: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class PurchaseInvoiceItem(BaseModel):
+    description: Optional[str] = None
+    quantity: float
+    unit_price: float
+    line_total: Optional[float] = None
+    supplier_item_id: Optional[str] = None
+
+class PurchaseInvoice(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str
+    account_id: str  # Supplier account, resolved by VAT number
+    supplier_invoice_number: str
+    supplier_vat_number: Optional[str] = None
+    document_type: str = "invoice"  # invoice, credit_note
+    items: List[PurchaseInvoiceItem]
+    subtotal: float
+    tax_amount: float
+    total_amount: float
+    currency: str = "EUR"
+    issue_date: Optional[datetime] = None
+    due_date: Optional[datetime] = None
+    status: str = "received"  # received, approved, paid
+    source_name: Optional[str] = None  # Uploaded file name or path
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
 # Create models for API requests
 class ContactCreate(BaseModel):
     name: str
@@ -161,6 +247,8 @@ class ContactCreate(BaseModel):
     position: Optional[str] = None
     address: Optional[str] = None
     notes: Optional[str] = None
+    # None on update keeps the stored values
+    custom_fields: Optional[Dict[str, Any]] = None
 
 class AccountCreate(BaseModel):
     name: str
@@ -178,6 +266,7 @@ class AccountCreate(BaseModel):
     country: Optional[str] = None
     vat_number: Optional[str] = None
     notes: Optional[str] = None
+    custom_fields: Optional[Dict[str, Any]] = None
 
 class ProductCreate(BaseModel):
     name: str
@@ -187,6 +276,7 @@ class ProductCreate(BaseModel):
     tax_rate: float = 0.21
     sku: Optional[str] = None
     category: Optional[str] = None
+    custom_fields: Optional[Dict[str, Any]] = None
 
 class CalendarEventCreate(BaseModel):
     title: str
@@ -199,6 +289,15 @@ class CalendarEventCreate(BaseModel):
     location: Optional[str] = None
     all_day: bool = False
     reminder_minutes: Optional[int] = 30
+    rrule: Optional[str] = None
+    time_zone: Optional[str] = None
+
+class CalendarOccurrenceUpdate(BaseModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    location: Optional[str] = None
 
 # Payment Models
 class PaymentTransaction(BaseModel):
@@ -304,6 +403,8 @@ class CustomField(BaseModel):
     field_type: str  # text, number, date, select, boolean
     field_options: Optional[List[str]] = None  # for select fields
     required: bool = False
+    filterable: bool = False  # indexed, usable as a cf.<field_name> list filter
+    tenant_id: Optional[str] = None  # owning user; None = every tenant
     created_by: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -338,6 +439,33 @@ async def get_current_user(request: Request) -> User:
     
     return User(**user)
 
+# Plan and roles folded into one cached object per user (see entitlements.py)
+ENTITLEMENT_CACHE_TTL = float(os.environ.get("ENTITLEMENT_CACHE_TTL", "300"))
+
+async def load_entitlements(user_id: str) -> Entitlements:
+    # Version before roles: writers change roles before bumping the version, so
+    # roles read after a version are never older than it
+    user = await db.users.find_one({"id": user_id}, {"_id": 0, "current_plan": 1, VERSION_FIELD: 1}) or {}
+    roles = await db.user_roles.distinct("role", {"user_id": user_id})
+    plan_limits = {plan_id: plan.limits for plan_id, plan in SUBSCRIPTION_PLANS.items()}
+    return resolve_entitlements(user_id, user.get("current_plan"), roles, plan_limits, user.get(VERSION_FIELD, 0))
+
+entitlement_cache = EntitlementCache(load_entitlements, ttl=ENTITLEMENT_CACHE_TTL)
+
+async def entitlements_changed(user_id: str):
+    """Record a role change so every worker reloads the user's entitlements"""
+    await db.users.update_one({"id": user_id}, {"$inc": {VERSION_FIELD: 1}})
+    entitlement_cache.invalidate(user_id)
+
+async def get_entitlements(current_user: User = Depends(get_current_user)) -> Entitlements:
+    return await entitlement_cache.get(current_user.id, current_user.current_plan, current_user.entitlements_version)
+
+async def require_admin(current_user: User = Depends(get_current_user),
+                        entitlements: Entitlements = Depends(get_entitlements)) -> User:
+    if not entitlements.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 # Authentication routes
 @api_router.get("/auth/profile")
 async def get_profile(request: Request):
@@ -347,17 +475,17 @@ async def get_profile(request: Request):
         raise HTTPException(status_code=400, detail="Missing session_id")
     
     # Call Emergent auth API
-    async with httpx.AsyncClient() as client:
-        headers = {"X-Session-ID": session_id}
-        response = await client.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers=headers
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid session")
-        
-        user_data = response.json()
+    start_deadline(UPSTREAM_REQUEST_BUDGET)
+    headers = {"X-Session-ID": session_id}
+    response = await breakers["auth"].call(
+        lambda: http_clients.get("auth").get("/env/oauth/session-data", headers=headers),
+        is_failure=upstream_failed
+    )
+    
+    if response.status_code != 200:
+        raise HTTPException(status_code=401, detail="Invalid session")
+    
+    user_data = response.json()
     
     # Check if user exists
     existing_user = await db.users.find_one({"email": user_data["email"]})
@@ -496,8 +624,9 @@ async def select_plan(plan_selection: PlanSelection, current_user: User = Depend
     # Update user's current plan
     await db.users.update_one(
         {"id": current_user.id},
-        {"$set": {"current_plan": plan_selection.plan_id}}
+        {"$set": {"current_plan": plan_selection.plan_id}, "$inc": {VERSION_FIELD: 1}}
     )
+    entitlement_cache.invalidate(current_user.id)
     
     # Create subscription record
     subscription = UserSubscription(
@@ -506,12 +635,19 @@ async def select_plan(plan_selection: PlanSelection, current_user: User = Depend
     )
     await db.user_subscriptions.insert_one(subscription.dict())
     
+    # The new subscription replaces the running ones: they end now (counted as churn in the revenue rollups)
+    await db.user_subscriptions.update_many(
+        {"user_id": current_user.id, "status": "active", "id": {"$ne": subscription.id}},
+        {"$set": {"status": "cancelled", "expires_at": subscription.started_at, "updated_at": subscription.started_at}}
+    )
+    
     return {"message": "Plan selected successfully", "plan": SUBSCRIPTION_PLANS[plan_selection.plan_id]}
 
 @api_router.get("/users/current-plan")
-async def get_current_user_plan(current_user: User = Depends(get_current_user)):
+async def get_current_user_plan(current_user: User = Depends(get_current_user),
+                                entitlements: Entitlements = Depends(get_entitlements)):
     """Get current user's plan details"""
-    plan = get_user_plan(current_user)
+    plan = get_user_plan(entitlements)
     
     # Get current usage counts
     contacts_count = await db.contacts.count_documents({"user_id": current_user.id})
@@ -528,15 +664,16 @@ async def get_current_user_plan(current_user: User = Depends(get_current_user)):
         "usage": {
             "contacts": contacts_count,
             "accounts": accounts_count,
-            "contacts_limit_reached": not check_plan_limits(current_user, "contacts", contacts_count),
-            "accounts_limit_reached": not check_plan_limits(current_user, "accounts", accounts_count)
+            "contacts_limit_reached": not check_plan_limits(entitlements, "contacts", contacts_count),
+            "accounts_limit_reached": not check_plan_limits(entitlements, "accounts", accounts_count)
         }
     }
 
 @api_router.get("/users/plan")
-async def get_user_plan(current_user: User = Depends(get_current_user)):
+async def get_user_plan(current_user: User = Depends(get_current_user),
+                        entitlements: Entitlements = Depends(get_entitlements)):
     """Get current user's subscription plan"""
-    plan = get_user_plan(current_user)
+    plan = get_user_plan(entitlements)
     
     # Get usage statistics
     contacts_count = await db.contacts.count_documents({"user_id": current_user.id})
@@ -549,11 +686,32 @@ async def get_user_plan(current_user: User = Depends(get_current_user)):
             "accounts": accounts_count
         },
         "limits": {
-            "contacts_limit_reached": not check_plan_limits(current_user, "contacts", contacts_count),
-            "accounts_limit_reached": not check_plan_limits(current_user, "accounts", accounts_count)
+            "contacts_limit_reached": not check_plan_limits(entitlements, "contacts", contacts_count),
+            "accounts_limit_reached": not check_plan_limits(entitlements, "accounts", accounts_count)
         }
     }
 
+@api_router.get("/users/company", response_model=CompanyProfile)
+async def get_company_profile(current_user: User = Depends(get_current_user)):
+    """Get the company details used as seller on the user's invoices"""
+    return current_user.company or CompanyProfile()
+
+@api_router.put("/users/company", response_model=CompanyProfile)
+async def update_company_profile(company: CompanyProfile, current_user: User = Depends(get_current_user)):
+    """Update the company details used as seller on the user's invoices"""
+    company.vat_number = normalize_vat_number(company.vat_number)
+    await db.users.update_one({"id": current_user.id}, {"$set": {"company": company.dict()}})
+    return company
+
+# Expired subscriptions are downgraded by a scheduled batch job (see subscription_expiry.py)
+SUBSCRIPTION_EXPIRY_INTERVAL = float(os.environ.get('SUBSCRIPTION_EXPIRY_INTERVAL', '900'))
+
+subscription_expiry = SubscriptionExpiry(
+    db,
+    on_downgrade=entitlement_cache.invalidate,
+    interval=SUBSCRIPTION_EXPIRY_INTERVAL
+)
+
 # Internationalization routes
 @api_router.get("/translations/{language}")
 async def get_translations_by_language(language: str):
@@ -579,27 +737,150 @@ async def get_supported_languages():
         "default": "en"
     }
 
+# Custom field values are validated by schemas compiled per tenant and entity type (see custom_fields.py)
+async def load_custom_field_definitions(tenant_id: str, entity_type: str) -> List[dict]:
+    return await db.custom_fields.find(definitions_query(tenant_id, entity_type), {"_id": 0}).to_list(1000)
+
+custom_field_schemas = CustomFieldSchemas(load_custom_field_definitions)
+
+async def validate_custom_fields(user_id: str, entity_type: str, values: Optional[dict],
+                                 stored: Optional[dict] = None) -> dict:
+    schema = await custom_field_schemas.get(user_id, entity_type)
+    try:
+        return schema.validate(values, stored)
+    except CustomFieldError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def entity_query(user_id: str, entity_type: str, request: Request) -> dict:
+    """List query for a user's entities, with cf.<field_name> filters on filterable custom fields"""
+    query = {"user_id": user_id}
+    filters = {key: value for key, value in request.query_params.items() if key.startswith(FILTER_PREFIX)}
+    if filters:
+        schema = await custom_field_schemas.get(user_id, entity_type)
+        try:
+            query.update(schema.filters(filters))
+        except CustomFieldError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return query
+
+async def ensure_custom_field_index(entity_type: str, field_name: str):
+    keys, options = index_spec(field_name)
+    await db[entity_type].create_index(keys, **options)
+
+async def ensure_custom_field_indexes():
+    """Partial indexes for filterable fields defined before they were created on demand"""
+    pipeline = [
+        {"$match": {"filterable": True}},
+        {"$group": {"_id": {"entity_type": "$entity_type", "field_name": "$field_name"}}}
+    ]
+    async for field in db.custom_fields.aggregate(pipeline):
+        await ensure_custom_field_index(field["_id"]["entity_type"], field["_id"]["field_name"])
+
+async def create_custom_field_definition(field_data: dict, tenant_id: Optional[str], created_by: str) -> CustomField:
+    try:
+        check_definition(field_data.get("entity_type"), field_data.get("field_name"),
+                         field_data.get("field_type"), field_data.get("field_options"))
+    except CustomFieldError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    existing = await db.custom_fields.find_one({
+        "entity_type": field_data["entity_type"],
+        "field_name": field_data["field_name"],
+        "tenant_id": tenant_id
+    })
+    if existing:
+        raise HTTPException(status_code=400, detail="A custom field with this name already exists")
+    
+    custom_field = CustomField(
+        entity_type=field_data["entity_type"],
+        field_name=field_data["field_name"],
+        field_type=field_data["field_type"],
+        field_options=field_data.get("field_options"),
+        required=field_data.get("required", False),
+        filterable=field_data.get("filterable", False),
+        tenant_id=tenant_id,
+        created_by=created_by
+    )
+    await db.custom_fields.insert_one(custom_field.dict())
+    if custom_field.filterable:
+        await ensure_custom_field_index(custom_field.entity_type, custom_field.field_name)
+    custom_field_schemas.invalidate(tenant_id)
+    return custom_field
+
+async def delete_custom_field_definition(field: dict):
+    """Remove a definition, its stored values and, once unused, its filter index"""
+    await db.custom_fields.delete_one({"id": field["id"]})
+    entity_type, field_name, tenant_id = field["entity_type"], field["field_name"], field.get("tenant_id")
+    remaining = await db.custom_fields.find(
+        {"entity_type": entity_type, "field_name": field_name}, {"_id": 0, "tenant_id": 1, "filterable": 1}
+    ).to_list(None)
+    
+    # Values stay where another definition with the same name still applies
+    path = f"custom_fields.{field_name}"
+    if not any(other.get("tenant_id") is None for other in remaining):
+        if tenant_id is not None:
+            owners = {"user_id": tenant_id}
+        else:
+            owners = {"user_id": {"$nin": [other["tenant_id"] for other in remaining]}}
+        await db[entity_type].update_many({**owners, path: {"$exists": True}}, {"$unset": {path: ""}})
+    
+    if field.get("filterable") and not any(other.get("filterable") for other in remaining):
+        try:
+            await db[entity_type].drop_index(index_spec(field_name)[1]["name"])
+        except OperationFailure:
+            pass  # Already gone
+    custom_field_schemas.invalidate(tenant_id)
+
+@api_router.get("/custom-fields")
+async def get_tenant_custom_fields(entity_type: str, current_user: User = Depends(get_current_user)):
+    """Custom fields that apply to the current user's entities of ``entity_type``"""
+    if entity_type not in ENTITY_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported entity type: {entity_type}")
+    schema = await custom_field_schemas.get(current_user.id, entity_type)
+    return [CustomField(**field) for field in schema.definitions.values()]
+
+@api_router.post("/custom-fields")
+async def create_tenant_custom_field(field_data: dict, current_user: User = Depends(get_current_user),
+                                     entitlements: Entitlements = Depends(get_entitlements)):
+    if not has_feature_access(entitlements, "custom_fields"):
+        plan = get_user_plan(entitlements)
+        raise HTTPException(
+            status_code=403,
+            detail=f"Custom fields not available in {plan.name} plan. Upgrade to Enterprise to define your own fields."
+        )
+    return await create_custom_field_definition(field_data, current_user.id, current_user.id)
+
+@api_router.delete("/custom-fields/{field_id}")
+async def delete_tenant_custom_field(field_id: str, current_user: User = Depends(get_current_user)):
+    field = await db.custom_fields.find_one({"id": field_id, "tenant_id": current_user.id})
+    if not field:
+        raise HTTPException(status_code=404, detail="Custom field not found")
+    await delete_custom_field_definition(field)
+    return {"message": "Custom field deleted successfully"}
+
 # Contact routes
 @api_router.post("/contacts", response_model=Contact)
-async def create_contact(contact_data: ContactCreate, current_user: User = Depends(get_current_user)):
+async def create_contact(contact_data: ContactCreate, current_user: User = Depends(get_current_user),
+                         entitlements: Entitlements = Depends(get_entitlements)):
     # Check plan limits
     current_contacts = await db.contacts.count_documents({"user_id": current_user.id})
-    if not check_plan_limits(current_user, "contacts", current_contacts):
-        plan = get_user_plan(current_user)
+    if not check_plan_limits(entitlements, "contacts", current_contacts):
+        plan = get_user_plan(entitlements)
         raise HTTPException(
             status_code=403, 
             detail=f"Plan limit reached. {plan.name} plan allows maximum {plan.limits['contacts_max']} contacts. Upgrade to Professional for unlimited contacts."
         )
     
     contact_dict = contact_data.dict()
+    contact_dict["custom_fields"] = await validate_custom_fields(current_user.id, "contacts", contact_data.custom_fields)
     contact_dict["user_id"] = current_user.id
     contact = Contact(**contact_dict)
     await db.contacts.insert_one(contact.dict())
     return contact
 
 @api_router.get("/contacts", response_model=List[Contact])
-async def get_contacts(current_user: User = Depends(get_current_user)):
-    contacts = await db.contacts.find({"user_id": current_user.id}).to_list(1000)
+async def get_contacts(request: Request, current_user: User = Depends(get_current_user)):
+    contacts = await db.contacts.find(await entity_query(current_user.id, "contacts", request)).to_list(1000)
     return [Contact(**contact) for contact in contacts]
 
 @api_router.get("/contacts/{contact_id}", response_model=Contact)
@@ -616,6 +897,8 @@ async def update_contact(contact_id: str, contact_data: ContactCreate, current_u
         raise HTTPException(status_code=404, detail="Contact not found")
     
     update_data = contact_data.dict()
+    update_data["custom_fields"] = await validate_custom_fields(
+        current_user.id, "contacts", contact_data.custom_fields, contact.get("custom_fields"))
     update_data["updated_at"] = datetime.now(timezone.utc)
     
     await db.contacts.update_one({"id": contact_id}, {"$set": update_data})
@@ -630,26 +913,44 @@ async def delete_contact(contact_id: str, current_user: User = Depends(get_curre
     return {"message": "Contact deleted"}
 
 # Account routes
+def account_document(account: Account) -> dict:
+    """Mongo document for an account, with the normalized VAT number used for indexed lookups"""
+    return {**account.dict(), "vat_key": normalize_vat_number(account.vat_number)}
+
+async def backfill_account_vat_keys(batch_size: int = 1000):
+    """Add vat_key to accounts created before it was maintained"""
+    cursor = db.accounts.find({"vat_key": {"$exists": False}}, {"id": 1, "vat_number": 1})
+    ops = []
+    async for account in cursor:
+        ops.append(UpdateOne({"id": account["id"]}, {"$set": {"vat_key": normalize_vat_number(account.get("vat_number"))}}))
+        if len(ops) >= batch_size:
+            await db.accounts.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        await db.accounts.bulk_write(ops, ordered=False)
+
 @api_router.post("/accounts", response_model=Account)
-async def create_account(account_data: AccountCreate, current_user: User = Depends(get_current_user)):
+async def create_account(account_data: AccountCreate, current_user: User = Depends(get_current_user),
+                         entitlements: Entitlements = Depends(get_entitlements)):
     # Check plan limits
     current_accounts = await db.accounts.count_documents({"user_id": current_user.id})
-    if not check_plan_limits(current_user, "accounts", current_accounts):
-        plan = get_user_plan(current_user)
+    if not check_plan_limits(entitlements, "accounts", current_accounts):
+        plan = get_user_plan(entitlements)
         raise HTTPException(
             status_code=403, 
             detail=f"Plan limit reached. {plan.name} plan allows maximum {plan.limits['accounts_max']} accounts. Upgrade to Professional for unlimited accounts."
         )
     
     account_dict = account_data.dict()
+    account_dict["custom_fields"] = await validate_custom_fields(current_user.id, "accounts", account_data.custom_fields)
     account_dict["user_id"] = current_user.id
     account = Account(**account_dict)
-    await db.accounts.insert_one(account.dict())
+    await db.accounts.insert_one(account_document(account))
     return account
 
 @api_router.get("/accounts", response_model=List[Account])
-async def get_accounts(current_user: User = Depends(get_current_user)):
-    accounts = await db.accounts.find({"user_id": current_user.id}).to_list(1000)
+async def get_accounts(request: Request, current_user: User = Depends(get_current_user)):
+    accounts = await db.accounts.find(await entity_query(current_user.id, "accounts", request)).to_list(1000)
     return [Account(**account) for account in accounts]
 
 @api_router.get("/accounts/{account_id}", response_model=Account)
@@ -666,7 +967,14 @@ async def update_account(account_id: str, account_data: AccountCreate, current_u
         raise HTTPException(status_code=404, detail="Account not found")
     
     update_data = account_data.dict()
+    update_data["custom_fields"] = await validate_custom_fields(
+        current_user.id, "accounts", account_data.custom_fields, account.get("custom_fields"))
+    update_data["vat_key"] = normalize_vat_number(account_data.vat_number)
     update_data["updated_at"] = datetime.now(timezone.utc)
+    if update_data["vat_key"] != normalize_vat_number(account.get("vat_number")):
+        # A new VAT number has not been checked against VIES yet
+        update_data["vat_valid"] = None
+        update_data["vat_checked_at"] = None
     
     await db.accounts.update_one({"id": account_id}, {"$set": update_data})
     updated_account = await db.accounts.find_one({"id": account_id})
@@ -681,35 +989,147 @@ async def delete_account(account_id: str, current_user: User = Depends(get_curre
 
 # VIES VAT validation route
 @api_router.get("/accounts/vies-lookup/{vat_number}", response_model=VIESResponse)
-async def vies_lookup(vat_number: str, current_user: User = Depends(get_current_user)):
+async def vies_lookup(vat_number: str, current_user: User = Depends(get_current_user),
+                      entitlements: Entitlements = Depends(get_entitlements)):
     """Validate VAT number and retrieve company information from VIES"""
     # Check if user has access to VIES integration
-    if not has_feature_access(current_user, "vies_integration"):
-        plan = get_user_plan(current_user)
+    if not has_feature_access(entitlements, "vies_integration"):
+        plan = get_user_plan(entitlements)
         raise HTTPException(
             status_code=403, 
             detail=f"VIES integration not available in {plan.name} plan. Upgrade to Professional to access EU company data auto-completion."
         )
     
     try:
+        start_deadline(UPSTREAM_REQUEST_BUDGET)
         vies_data = await validate_vat_with_vies(vat_number)
         return vies_data
+    except UpstreamUnavailableError:
+        raise
+    except ViesUnavailableError as e:
+        logger.warning(f"VIES lookup unavailable: {e}")
+        # The outage is cached for this long, so retrying sooner gets the same answer
+        retry_after = int(vies_cache.ttls[VIES_UNAVAILABLE].total_seconds())
+        raise HTTPException(status_code=503, detail="VIES is temporarily unavailable, please retry shortly",
+                            headers={"Retry-After": str(max(1, retry_after))})
     except Exception as e:
         logger.error(f"VIES lookup error: {e}")
         raise HTTPException(status_code=500, detail="Failed to validate VAT number with VIES")
 
+# Batch VAT validation
+VIES_BATCH_CONCURRENCY_PER_COUNTRY = int(os.environ.get('VIES_BATCH_CONCURRENCY_PER_COUNTRY', '2'))
+
+# Strong references to fire-and-forget tasks so they are not garbage collected mid-run
+background_tasks = set()
+
+def spawn_background_task(coro):
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+class VATBatchRequest(BaseModel):
+    account_ids: Optional[List[str]] = None  # None = all accounts of the user
+
+async def lookup_vat_status(clean_vat: str):
+    """Cached VIES lookup returning (status, payload)"""
+    return await vies_cache.lookup(clean_vat, lambda: query_vies(clean_vat))
+
+async def run_vat_validation_job(job_id: str, user_id: str, account_ids: Optional[List[str]]):
+    query = {"user_id": user_id, "vat_key": {"$ne": None}}
+    if account_ids is not None:
+        query["id"] = {"$in": account_ids}
+
+    async def progress(summary: dict):
+        await db.vat_validation_jobs.update_one({"id": job_id}, {"$set": summary})
+
+    try:
+        numbers = [a["vat_key"] async for a in db.accounts.find(query, {"vat_key": 1})]
+        summary = await run_vat_batch(
+            db, user_id, numbers, lookup_vat_status,
+            per_country_limit=VIES_BATCH_CONCURRENCY_PER_COUNTRY,
+            progress=progress
+        )
+        await db.vat_validation_jobs.update_one(
+            {"id": job_id},
+            {"$set": {**summary, "accounts": len(numbers), "status": "completed", "finished_at": datetime.now(timezone.utc)}}
+        )
+    except Exception as e:
+        logger.error(f"VAT validation job {job_id} failed: {e}")
+        await db.vat_validation_jobs.update_one(
+            {"id": job_id},
+            {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.now(timezone.utc)}}
+        )
+
+@api_router.post("/accounts/vat/validate-batch")
+async def start_vat_validation(batch_request: VATBatchRequest, current_user: User = Depends(get_current_user),
+                               entitlements: Entitlements = Depends(get_entitlements)):
+    """Validate the VAT numbers of many accounts in the background"""
+    if not has_feature_access(entitlements, "vies_integration"):
+        plan = get_user_plan(entitlements)
+        raise HTTPException(
+            status_code=403, 
+            detail=f"VIES integration not available in {plan.name} plan. Upgrade to Professional to access EU company data auto-completion."
+        )
+    
+    job = {
+        "id": str(uuid.uuid4()),
+        "user_id": current_user.id,
+        "status": "running",
+        "created_at": datetime.now(timezone.utc)
+    }
+    await db.vat_validation_jobs.insert_one(job)
+    spawn_background_task(run_vat_validation_job(job["id"], current_user.id, batch_request.account_ids))
+    
+    return {"job_id": job["id"], "status": "running"}
+
+@api_router.get("/accounts/vat/validate-batch/{job_id}")
+async def get_vat_validation_job(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await db.vat_validation_jobs.find_one({"id": job_id, "user_id": current_user.id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Validation job not found")
+    return job
+
+# Scheduled VAT re-validation
+VAT_REVALIDATION_ENABLED = os.environ.get('VAT_REVALIDATION_ENABLED', 'true').lower() == 'true'
+VAT_REVALIDATION_RATE = float(os.environ.get('VAT_REVALIDATION_RATE', '0.5'))  # VIES requests per second
+VAT_REVALIDATION_MAX_AGE_DAYS = int(os.environ.get('VAT_REVALIDATION_MAX_AGE_DAYS', '30'))
+
+async def report_vat_status_change(change: dict):
+    if not change["vat_valid"]:
+        logger.warning(f"VAT number {change['vat_number']} of account {change['account_id']} is no longer valid")
+
+vat_revalidator = VatRevalidator(
+    db,
+    lookup_vat_status,
+    rate=VAT_REVALIDATION_RATE,
+    max_age=timedelta(days=VAT_REVALIDATION_MAX_AGE_DAYS),
+    on_change=report_vat_status_change
+)
+
+@api_router.get("/accounts/vat/changes")
+async def get_vat_status_changes(since: Optional[datetime] = None, limit: int = 100,
+                                 current_user: User = Depends(get_current_user)):
+    """VAT numbers whose VIES status changed during re-validation, newest first"""
+    query = {"user_id": current_user.id}
+    if since:
+        query["detected_at"] = {"$gt": since}
+    changes = await db.vat_status_changes.find(query, {"_id": 0}).sort("detected_at", -1).to_list(min(limit, 1000))
+    return changes
+
 # Product routes
 @api_router.post("/products", response_model=Product)
 async def create_product(product_data: ProductCreate, current_user: User = Depends(get_current_user)):
     product_dict = product_data.dict()
+    product_dict["custom_fields"] = await validate_custom_fields(current_user.id, "products", product_data.custom_fields)
     product_dict["user_id"] = current_user.id
     product = Product(**product_dict)
     await db.products.insert_one(product.dict())
     return product
 
 @api_router.get("/products", response_model=List[Product])
-async def get_products(current_user: User = Depends(get_current_user)):
-    products = await db.products.find({"user_id": current_user.id}).to_list(1000)
+async def get_products(request: Request, current_user: User = Depends(get_current_user)):
+    products = await db.products.find(await entity_query(current_user.id, "products", request)).to_list(1000)
     return [Product(**product) for product in products]
 
 @api_router.get("/products/{product_id}", response_model=Product)
@@ -726,6 +1146,8 @@ async def update_product(product_id: str, product_data: ProductCreate, current_u
         raise HTTPException(status_code=404, detail="Product not found")
     
     update_data = product_data.dict()
+    update_data["custom_fields"] = await validate_custom_fields(
+        current_user.id, "products", product_data.custom_fields, product.get("custom_fields"))
     update_data["updated_at"] = datetime.now(timezone.utc)
     
     await db.products.update_one({"id": product_id}, {"$set": update_data})
@@ -740,19 +1162,122 @@ async def delete_product(product_id: str, current_user: User = Depends(get_curre
     return {"message": "Product deleted"}
 
 # Calendar routes
+RECURRENCE_MAX_OCCURRENCES = int(os.environ.get('RECURRENCE_MAX_OCCURRENCES', '1000'))
+recurring_series = SeriesCache()
+
+REMINDER_HORIZON = float(os.environ.get('REMINDER_HORIZON', '600'))
+REMINDER_REFILL_INTERVAL = float(os.environ.get('REMINDER_REFILL_INTERVAL', '30'))
+REMINDER_KEEPALIVE = float(os.environ.get('REMINDER_KEEPALIVE', '25'))
+reminder_hub = ReminderHub(db.reminder_notifications)
+reminder_scheduler = ReminderScheduler(db, reminder_hub.publish, horizon=REMINDER_HORIZON,
+                                       refill_interval=REMINDER_REFILL_INTERVAL)
+
+def calendar_event_document(event: CalendarEvent) -> dict:
+    """Mongo document for an event, flagged when it is too long for the bounded window scan
+
+    Recurring masters are kept out of the window scan and found by their series bounds instead.
+    Every event carries the fire time of its next reminder.
+    """
+    document = {**event.dict(), "long_span": is_long_span(event.start_date, event.end_date)}
+    if event.rrule:
+        document.update(series_fields(document))
+    document.update(reminder_fields(document))
+    return document
+
+def check_event_dates(event_data: CalendarEventCreate):
+    if event_data.end_date < event_data.start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if event_data.rrule:
+        try:
+            RecurringSeries(event_data.dict())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+async def find_window_events(user_id: str, start: datetime, end: datetime, projection: Optional[dict] = None) -> List[dict]:
+    """Single events and expanded occurrences of recurring ones overlapping [start, end)"""
+    events = await db.calendar_events.find(window_query(user_id, start, end), projection).to_list(None)
+    masters = await db.calendar_events.find(masters_query(user_id, start, end), {"_id": 0}).to_list(None)
+    return events + expand(masters, recurring_series, start, end, RECURRENCE_MAX_OCCURRENCES)
+
+FREEBUSY_CACHE_TTL = float(os.environ.get('FREEBUSY_CACHE_TTL', '60'))
+busy_indexes = BusyIndexes(find_window_events, ttl=FREEBUSY_CACHE_TTL)
+
+def event_window(start: Optional[datetime], end: Optional[datetime]):
+    if start is None or end is None:
+        raise HTTPException(status_code=400, detail="start and end are required together")
+    try:
+        return check_window(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @api_router.post("/calendar/events", response_model=CalendarEvent)
 async def create_event(event_data: CalendarEventCreate, current_user: User = Depends(get_current_user)):
+    check_event_dates(event_data)
     event_dict = event_data.dict()
     event_dict["user_id"] = current_user.id
     event = CalendarEvent(**event_dict)
-    await db.calendar_events.insert_one(event.dict())
+    document = calendar_event_document(event)
+    await db.calendar_events.insert_one(document)
+    reminder_scheduler.schedule(document)
+    busy_indexes.invalidate(current_user.id)
     return event
 
 @api_router.get("/calendar/events", response_model=List[CalendarEvent])
-async def get_events(current_user: User = Depends(get_current_user)):
-    events = await db.calendar_events.find({"user_id": current_user.id}).to_list(1000)
+async def get_events(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                     current_user: User = Depends(get_current_user)):
+    """Events overlapping [start, end), oldest first; without a window, up to 1000 events"""
+    if start is None and end is None:
+        events = await db.calendar_events.find({"user_id": current_user.id}).to_list(1000)
+        return [CalendarEvent(**event) for event in events]
+    
+    start, end = event_window(start, end)
+    events = await find_window_events(current_user.id, start, end)
+    sort_by_start(events)
     return [CalendarEvent(**event) for event in events]
 
+@api_router.get("/calendar/events/counts")
+async def get_event_counts(start: datetime, end: datetime, tz: str = "UTC",
+                           current_user: User = Depends(get_current_user)):
+    """Number of events per day of the window, for month heatmaps"""
+    start, end = event_window(start, end)
+    try:
+        zone = ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown time zone: {tz}")
+    
+    events = await find_window_events(current_user.id, start, end, {"_id": 0, "start_date": 1, "end_date": 1})
+    return {"tz": tz, "counts": day_counts(events, start, end, zone)}
+
+@api_router.get("/calendar/freebusy")
+async def get_freebusy(start: datetime, end: datetime, duration_minutes: int = 30,
+                       proposed_start: Optional[datetime] = None, proposed_end: Optional[datetime] = None,
+                       exclude_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    """Busy blocks, free slots and double-booked events of the window
+    
+    With a proposed time, also the events it would overlap (other than ``exclude_id``,
+    the event being edited, or its occurrences).
+    """
+    start, end = event_window(start, end)
+    if duration_minutes < 1:
+        raise HTTPException(status_code=400, detail="duration_minutes must be at least 1")
+    
+    index = await busy_indexes.get(current_user.id, start, end)
+    result = {
+        "busy": [{"start": s, "end": e} for s, e in index.busy_within(start, end)],
+        "free": [{"start": s, "end": e} for s, e in index.free_slots(start, end, timedelta(minutes=duration_minutes))],
+        "conflicts": [{"event_ids": [first, second]} for first, second in index.conflicts(start, end)]
+    }
+    
+    if proposed_start is not None or proposed_end is not None:
+        proposed_start, proposed_end = event_window(proposed_start, proposed_end)
+        proposed_index = await busy_indexes.get(current_user.id, proposed_start, proposed_end)
+        result["overlapping"] = [
+            {"event_id": interval.event_id, "start": interval.start, "end": interval.end}
+            for interval in proposed_index.overlapping(proposed_start, proposed_end)
+            if not exclude_id or interval.event_id.split(":")[0] != exclude_id
+        ]
+    return result
+
 @api_router.get("/calendar/events/{event_id}", response_model=CalendarEvent)
 async def get_event(event_id: str, current_user: User = Depends(get_current_user)):
     event = await db.calendar_events.find_one({"id": event_id, "user_id": current_user.id})
@@ -766,10 +1291,20 @@ async def update_event(event_id: str, event_data: CalendarEventCreate, current_u
     if not event:
         raise HTTPException(status_code=404, detail="Event not found")
     
+    check_event_dates(event_data)
     update_data = event_data.dict()
+    update_data["long_span"] = is_long_span(event_data.start_date, event_data.end_date)
     update_data["updated_at"] = datetime.now(timezone.utc)
+    update = {"$set": update_data}
+    if event_data.rrule:
+        update_data.update(series_fields({**event, **update_data}))
+    else:
+        update["$unset"] = {"recurring": "", "series_start": "", "series_end": "", "recurrence_exceptions": ""}
+    update_data.update(reminder_fields({**event, **update_data}))
     
-    await db.calendar_events.update_one({"id": event_id}, {"$set": update_data})
+    await db.calendar_events.update_one({"id": event_id}, update)
+    reminder_scheduler.schedule({"id": event_id, **update_data})
+    busy_indexes.invalidate(current_user.id)
     updated_event = await db.calendar_events.find_one({"id": event_id})
     return CalendarEvent(**updated_event)
 
@@ -778,8 +1313,199 @@ async def delete_event(event_id: str, current_user: User = Depends(get_current_u
     result = await db.calendar_events.delete_one({"id": event_id, "user_id": current_user.id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Event not found")
+    await record_tombstone(db, current_user.id, event_id)
+    busy_indexes.invalidate(current_user.id)
     return {"message": "Event deleted"}
 
+# Calendar feed (ICS subscription and CalDAV sync)
+ICS_FEED_PAST_DAYS = int(os.environ.get('ICS_FEED_PAST_DAYS', '90'))
+
+def calendar_feed_paths(token: str) -> dict:
+    return {"token": token, "ics_path": f"/api/calendar/feed/{token}.ics", "caldav_path": f"/api/caldav/{token}/"}
+
+@api_router.get("/calendar/feed")
+async def get_calendar_feed(current_user: User = Depends(get_current_user)):
+    feed = await db.calendar_feeds.find_one({"user_id": current_user.id})
+    if not feed:
+        raise HTTPException(status_code=404, detail="No calendar feed")
+    return calendar_feed_paths(feed["token"])
+
+@api_router.post("/calendar/feed")
+async def rotate_calendar_feed(current_user: User = Depends(get_current_user)):
+    """Create the user's feed token, or replace it so the old feed URLs stop working"""
+    token = secrets.token_urlsafe(32)
+    await db.calendar_feeds.update_one(
+        {"user_id": current_user.id},
+        {"$set": {"token": token, "created_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return calendar_feed_paths(token)
+
+@api_router.delete("/calendar/feed")
+async def revoke_calendar_feed(current_user: User = Depends(get_current_user)):
+    await db.calendar_feeds.delete_one({"user_id": current_user.id})
+    return {"message": "Calendar feed revoked"}
+
+async def calendar_feed_user(token: str) -> str:
+    feed = await db.calendar_feeds.find_one({"token": token}, {"_id": 0, "user_id": 1})
+    if not feed:
+        raise HTTPException(status_code=404, detail="Calendar feed not found")
+    return feed["user_id"]
+
+@api_router.get("/calendar/feed/{token}.ics")
+async def get_calendar_feed_ics(token: str, request: Request):
+    """The user's events as an ICS subscription; 304 while nothing changed"""
+    user_id = await calendar_feed_user(token)
+    latest = await latest_change(db, user_id)
+    headers = {"ETag": entity_tag(latest), "Cache-Control": "private, no-cache"}
+    if latest is not None:
+        headers["Last-Modified"] = http_date(latest)
+    if not_modified(request.headers.get("if-none-match"), request.headers.get("if-modified-since"), latest):
+        return Response(status_code=304, headers=headers)
+    
+    since = datetime.now(timezone.utc) - timedelta(days=ICS_FEED_PAST_DAYS)
+    events = db.calendar_events.find(feed_query(user_id, since), {"_id": 0}).sort("start_date", 1)
+    return StreamingResponse(iter_calendar(events), media_type=CALENDAR_CONTENT_TYPE, headers=headers)
+
+def caldav_href(token: str, event_id: str) -> str:
+    return f"/api/caldav/{token}/{event_id}.ics"
+
+@api_router.api_route("/caldav/{token}/", methods=["OPTIONS", "PROPFIND", "REPORT"])
+async def caldav_collection(token: str, request: Request):
+    """CalDAV collection: PROPFIND lists events, REPORT answers sync-collection and calendar-multiget"""
+    dav_headers = {"DAV": "1, 3, calendar-access", "Allow": "OPTIONS, GET, PROPFIND, REPORT"}
+    if request.method == "OPTIONS":
+        return Response(headers=dav_headers)
+    user_id = await calendar_feed_user(token)
+    latest = await latest_change(db, user_id)
+    collection_href = f"/api/caldav/{token}/"
+    
+    if request.method == "PROPFIND":
+        depth = request.headers.get("depth", "0")
+        
+        async def listing():
+            yield collection_href, collection_props(latest)
+            if depth != "0":
+                async for event in db.calendar_events.find({"user_id": user_id}, {"_id": 0, "id": 1, "updated_at": 1}):
+                    yield caldav_href(token, event["id"]), resource_props(event, with_data=False)
+        
+        return StreamingResponse(iter_multistatus(listing()), status_code=207,
+                                 media_type="application/xml; charset=utf-8", headers=dav_headers)
+    
+    try:
+        kind, client_token, hrefs, wants_data = parse_report(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    projection = {"_id": 0} if wants_data else {"_id": 0, "id": 1, "updated_at": 1}
+    
+    if kind == "sync-collection":
+        if client_token:
+            try:
+                since = parse_sync_token(client_token)
+            except ValueError:
+                since = None
+            # Deletions older than the tombstones are unknown: the client must resync
+            if since is None or since < datetime.now(timezone.utc) - TOMBSTONE_RETENTION:
+                return Response(SYNC_TOKEN_ERROR, status_code=403, media_type="application/xml; charset=utf-8")
+            query = changes_query(user_id, since)
+        else:
+            since, query = None, {"user_id": user_id}
+        
+        async def changes():
+            async for event in db.calendar_events.find(query, projection):
+                yield caldav_href(token, event["id"]), resource_props(event, wants_data)
+            if since is not None:
+                async for tombstone in db.calendar_tombstones.find(tombstones_query(user_id, since), {"_id": 0}):
+                    yield caldav_href(token, tombstone["event_id"]), None
+        
+        return StreamingResponse(iter_multistatus(changes(), sync_token(latest)), status_code=207,
+                                 media_type="application/xml; charset=utf-8", headers=dav_headers)
+    
+    if kind == "calendar-multiget":
+        event_ids = [event_id for event_id in map(event_id_from_href, hrefs) if event_id]
+        
+        async def resources():
+            found = set()
+            async for event in db.calendar_events.find({"user_id": user_id, "id": {"$in": event_ids}}, projection):
+                found.add(event["id"])
+                yield caldav_href(token, event["id"]), resource_props(event, wants_data)
+            for event_id in event_ids:
+                if event_id not in found:
+                    yield caldav_href(token, event_id), None
+        
+        return StreamingResponse(iter_multistatus(resources()), status_code=207,
+                                 media_type="application/xml; charset=utf-8", headers=dav_headers)
+    
+    raise HTTPException(status_code=501, detail=f"Unsupported REPORT: {kind}")
+
+@api_router.get("/caldav/{token}/{event_id}.ics")
+async def get_caldav_event(token: str, event_id: str, request: Request):
+    user_id = await calendar_feed_user(token)
+    event = await db.calendar_events.find_one({"id": event_id, "user_id": user_id}, {"_id": 0})
+    if not event:
+        raise HTTPException(status_code=404, detail="Event not found")
+    headers = {"ETag": entity_tag(event.get("updated_at"))}
+    if not_modified(request.headers.get("if-none-match"), None, event.get("updated_at")):
+        return Response(status_code=304, headers=headers)
+    return Response(event_resource(event), media_type=CALENDAR_CONTENT_TYPE, headers=headers)
+
+async def set_occurrence_exception(event_id: str, user_id: str, original_start: datetime, exception: dict) -> dict:
+    """Store an edited or cancelled occurrence on its recurring master"""
+    master = await db.calendar_events.find_one({"id": event_id, "user_id": user_id, "recurring": True}, {"_id": 0})
+    if not master:
+        raise HTTPException(status_code=404, detail="Recurring event not found")
+    if not recurring_series.get(master).is_occurrence(original_start):
+        raise HTTPException(status_code=404, detail="Occurrence not found")
+    
+    key = exception_key(original_start)
+    master["recurrence_exceptions"] = {**master.get("recurrence_exceptions", {}), key: exception}
+    update_data = {f"recurrence_exceptions.{key}": exception, "updated_at": datetime.now(timezone.utc),
+                   **series_fields(master), **reminder_fields(master)}
+    await db.calendar_events.update_one({"id": event_id}, {"$set": update_data})
+    reminder_scheduler.schedule({"id": event_id, **update_data})
+    busy_indexes.invalidate(user_id)
+    return {"id": f"{event_id}:{key}", "recurrence_id": event_id, "exception": exception}
+
+@api_router.get("/reminders/stream")
+async def stream_reminders(request: Request, current_user: User = Depends(get_current_user)):
+    """Server-sent events with the user's calendar reminders as they fire
+
+    A reconnecting EventSource sends the id of the last reminder it got and is sent those it missed.
+    """
+    queue = reminder_hub.subscribe(current_user.id, request.headers.get("last-event-id"))
+    
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    notification = await asyncio.wait_for(queue.get(), timeout=REMINDER_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    # Comments keep proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_message(notification)
+        finally:
+            reminder_hub.unsubscribe(current_user.id, queue)
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@api_router.put("/calendar/events/{event_id}/occurrences/{original_start}")
+async def update_occurrence(event_id: str, original_start: datetime, occurrence_data: CalendarOccurrenceUpdate,
+                            current_user: User = Depends(get_current_user)):
+    """Edit one occurrence of a recurring event, leaving the rest of the series unchanged"""
+    override = occurrence_data.dict(exclude_none=True)
+    if ("start_date" in override) != ("end_date" in override):
+        raise HTTPException(status_code=400, detail="start_date and end_date are moved together")
+    if "start_date" in override and override["end_date"] < override["start_date"]:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    return await set_occurrence_exception(event_id, current_user.id, original_start, override)
+
+@api_router.delete("/calendar/events/{event_id}/occurrences/{original_start}")
+async def cancel_occurrence(event_id: str, original_start: datetime, current_user: User = Depends(get_current_user)):
+    return await set_occurrence_exception(event_id, current_user.id, original_start, {"cancelled": True})
+
 # Invoice creation models
 class InvoiceItemCreate(BaseModel):
     product_id: str
@@ -794,6 +1520,29 @@ class InvoiceCreate(BaseModel):
     due_date: Optional[datetime] = None
     notes: Optional[str] = None
     invoice_type: str = "invoice"
+    custom_fields: Optional[Dict[str, Any]] = None
+
+# Invoice due dates are projected into calendar events by a background consumer
+invoice_due_events = InvoiceDueEvents(db)
+invoice_events = EventConsumer(db.invoice_events, invoice_due_events.handle, name="Invoice due")
+INVOICE_EVENT_DELAY = float(os.environ.get('INVOICE_EVENT_DELAY', '60'))
+
+async def publish_invoice_change(invoice_id: str, user_id: str) -> str:
+    """Record an invoice change before writing it; the consumer's copy only runs if sync_invoice_change never does"""
+    event_id = str(uuid.uuid4())
+    await invoice_events.publish(event_id, {"invoice_id": invoice_id, "user_id": user_id},
+                                 delay=INVOICE_EVENT_DELAY)
+    return event_id
+
+async def sync_invoice_change(event_id: str, invoice_id: str, user_id: str):
+    """Project the invoice as written and mark its change record done"""
+    try:
+        await invoice_due_events.handle({"invoice_id": invoice_id, "user_id": user_id})
+    except Exception as e:
+        # The invoice is written; the consumer retries the recorded change
+        logger.error(f"Invoice due sync error: {e}")
+        return
+    await invoice_events.complete(event_id)
 
 # Invoice routes
 @api_router.post("/invoices", response_model=Invoice)
@@ -809,6 +1558,7 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
     total_amount = subtotal + tax_amount
     
     invoice_dict = invoice_data.dict()
+    invoice_dict["custom_fields"] = await validate_custom_fields(current_user.id, "invoices", invoice_data.custom_fields)
     invoice_dict.update({
         "user_id": current_user.id,
         "invoice_number": invoice_number,
@@ -818,12 +1568,14 @@ async def create_invoice(invoice_data: InvoiceCreate, current_user: User = Depen
     })
     
     invoice = Invoice(**invoice_dict)
+    change_id = await publish_invoice_change(invoice.id, current_user.id)
     await db.invoices.insert_one(invoice.dict())
+    await sync_invoice_change(change_id, invoice.id, current_user.id)
     return invoice
 
 @api_router.get("/invoices", response_model=List[Invoice])
-async def get_invoices(current_user: User = Depends(get_current_user)):
-    invoices = await db.invoices.find({"user_id": current_user.id}).to_list(1000)
+async def get_invoices(request: Request, current_user: User = Depends(get_current_user)):
+    invoices = await db.invoices.find(await entity_query(current_user.id, "invoices", request)).to_list(1000)
     return [Invoice(**invoice) for invoice in invoices]
 
 @api_router.get("/invoices/{invoice_id}", response_model=Invoice)
@@ -846,6 +1598,8 @@ async def update_invoice(invoice_id: str, invoice_data: InvoiceCreate, current_u
     total_amount = subtotal + tax_amount
     
     update_data = invoice_data.dict()
+    update_data["custom_fields"] = await validate_custom_fields(
+        current_user.id, "invoices", invoice_data.custom_fields, invoice.get("custom_fields"))
     update_data.update({
         "subtotal": subtotal,
         "tax_amount": tax_amount,
@@ -853,13 +1607,21 @@ async def update_invoice(invoice_id: str, invoice_data: InvoiceCreate, current_u
         "updated_at": datetime.now(timezone.utc)
     })
     
+    change_id = await publish_invoice_change(invoice_id, current_user.id)
     await db.invoices.update_one({"id": invoice_id}, {"$set": update_data})
+    await sync_invoice_change(change_id, invoice_id, current_user.id)
     updated_invoice = await db.invoices.find_one({"id": invoice_id})
     return Invoice(**updated_invoice)
 
 @api_router.delete("/invoices/{invoice_id}")
 async def delete_invoice(invoice_id: str, current_user: User = Depends(get_current_user)):
+    invoice = await db.invoices.find_one({"id": invoice_id, "user_id": current_user.id}, {"_id": 0, "id": 1})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+
+    change_id = await publish_invoice_change(invoice_id, current_user.id)
     result = await db.invoices.delete_one({"id": invoice_id, "user_id": current_user.id})
+    await sync_invoice_change(change_id, invoice_id, current_user.id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Invoice not found")
     return {"message": "Invoice deleted"}
@@ -1023,6 +1785,217 @@ async def generate_invoice_pdf_endpoint(invoice_id: str, current_user: User = De
         "filename": f"{invoice['invoice_number']}.pdf"
     }
 
+# Peppol UBL export
+class UBLBatchRequest(BaseModel):
+    invoice_ids: Optional[List[str]] = None  # None = all invoices of the user
+
+def require_peppol_access(entitlements: Entitlements):
+    if not has_feature_access(entitlements, "peppol_invoicing"):
+        plan = get_user_plan(entitlements)
+        raise HTTPException(
+            status_code=403,
+            detail=f"Peppol invoicing not available in {plan.name} plan. Upgrade to Professional to send e-invoices."
+        )
+
+async def iter_ubl_batches(invoices, supplier: dict, batch_size: int = 500):
+    """Attach account and product data to invoices, loading related documents per batch instead of per invoice"""
+    batch = []
+    async for invoice in invoices:
+        batch.append(invoice)
+        if len(batch) >= batch_size:
+            yield await _load_ubl_batch(batch, supplier)
+            batch = []
+    if batch:
+        yield await _load_ubl_batch(batch, supplier)
+
+async def iter_ubl_documents(invoices, supplier: dict, batch_size: int = 500):
+    async for batch in iter_ubl_batches(invoices, supplier, batch_size):
+        for document in batch:
+            yield document
+
+async def _load_ubl_batch(invoices: list, supplier: dict) -> list:
+    account_ids = list({invoice["account_id"] for invoice in invoices})
+    product_ids = list({item["product_id"] for invoice in invoices for item in invoice["items"]})
+    accounts = {a["id"]: a async for a in db.accounts.find({"id": {"$in": account_ids}})}
+    products = {p["id"]: p async for p in db.products.find({"id": {"$in": product_ids}}, {"id": 1, "name": 1})}
+    return [
+        (
+            invoice,
+            accounts.get(invoice["account_id"]) or {},
+            supplier,
+            [products[item["product_id"]] for item in invoice["items"] if item["product_id"] in products]
+        )
+        for invoice in invoices
+    ]
+
+@api_router.get("/invoices/{invoice_id}/ubl")
+async def export_invoice_ubl(invoice_id: str, current_user: User = Depends(get_current_user),
+                             entitlements: Entitlements = Depends(get_entitlements)):
+    """Export an invoice as a Peppol BIS Billing 3.0 UBL document"""
+    require_peppol_access(entitlements)
+
+    invoice = await db.invoices.find_one({"id": invoice_id, "user_id": current_user.id})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+
+    (invoice, account, supplier, products), = await _load_ubl_batch([invoice], supplier_party(current_user.dict()))
+    return StreamingResponse(
+        iter_invoice_ubl(invoice, account, supplier, products),
+        media_type="application/xml",
+        headers={"Content-Disposition": f'attachment; filename="{ubl_filename(invoice)}"'}
+    )
+
+@api_router.post("/invoices/ubl/batch")
+async def export_invoices_ubl_batch(batch_request: UBLBatchRequest, current_user: User = Depends(get_current_user),
+                                    entitlements: Entitlements = Depends(get_entitlements)):
+    """Export many invoices as a zip of UBL documents"""
+    require_peppol_access(entitlements)
+
+    query = {"user_id": current_user.id}
+    if batch_request.invoice_ids is not None:
+        query["id"] = {"$in": batch_request.invoice_ids}
+
+    batches = iter_ubl_batches(db.invoices.find(query), supplier_party(current_user.dict()))
+    first = await anext(batches, None)
+    if first is None:
+        raise HTTPException(status_code=404, detail="No invoices found")
+
+    async def stream_zip():
+        # One batch in memory at a time: rendered in the threadpool, streamed, then the next is loaded
+        archive = UBLZipStream()
+        batch = first
+        while batch is not None:
+            yield await run_in_threadpool(archive.write, batch)
+            batch = await anext(batches, None)
+        yield archive.close()
+
+    return StreamingResponse(
+        stream_zip(),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="invoices-ubl.zip"'}
+    )
+
+# Peppol delivery
+PEPPOL_ACCESS_POINT_URL = os.environ.get('PEPPOL_ACCESS_POINT_URL', 'http://localhost:8099')  # fake_access_point.py
+PEPPOL_ACCESS_POINT_TOKEN = os.environ.get('PEPPOL_ACCESS_POINT_TOKEN')
+PEPPOL_DISPATCH_WORKERS = int(os.environ.get('PEPPOL_DISPATCH_WORKERS', '1'))
+PEPPOL_ACCESS_POINT_CONCURRENCY = int(os.environ.get('PEPPOL_ACCESS_POINT_CONCURRENCY', '4'))
+
+async def render_peppol_document(job: dict) -> bytes:
+    """Render the UBL document for a queued Peppol job"""
+    invoice = await db.invoices.find_one({"id": job["invoice_id"]})
+    if not invoice:
+        raise ValueError("Invoice no longer exists")
+    user = await db.users.find_one({"id": invoice["user_id"]}, {"password_hash": 0})
+    (invoice, account, supplier, products), = await _load_ubl_batch([invoice], supplier_party(user or {}))
+    return b"".join(iter_invoice_ubl(invoice, account, supplier, products))
+
+peppol_dispatcher = PeppolDispatcher(
+    db,
+    render_peppol_document,
+    {DEFAULT_ACCESS_POINT: AccessPointClient(lambda: http_clients.get("peppol"), token=PEPPOL_ACCESS_POINT_TOKEN)},
+    concurrency_per_access_point=PEPPOL_ACCESS_POINT_CONCURRENCY
+)
+
+@api_router.post("/invoices/{invoice_id}/peppol/send")
+async def send_invoice_peppol(invoice_id: str, resend: bool = False, current_user: User = Depends(get_current_user),
+                              entitlements: Entitlements = Depends(get_entitlements)):
+    """Queue an invoice for delivery through the Peppol network; ``resend`` delivers a sent invoice again"""
+    require_peppol_access(entitlements)
+
+    invoice = await db.invoices.find_one({"id": invoice_id, "user_id": current_user.id})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+
+    document, = await _load_ubl_batch([invoice], supplier_party(current_user.dict()))
+    report, queued = await peppol_dispatcher.submit(document, resend=resend)
+    if not report.valid:
+        raise HTTPException(status_code=422, detail=report.to_dict())
+    if not queued:
+        raise HTTPException(status_code=409, detail="Invoice is being sent or was already sent; use resend=true to send it again")
+
+    return {"message": "Invoice queued for Peppol delivery", "peppol_status": "pending"}
+
+@api_router.get("/invoices/{invoice_id}/peppol/validate")
+async def validate_invoice_peppol(invoice_id: str, current_user: User = Depends(get_current_user)):
+    """Check an invoice against the EN16931 business rules"""
+    invoice = await db.invoices.find_one({"id": invoice_id, "user_id": current_user.id})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+
+    document, = await _load_ubl_batch([invoice], supplier_party(current_user.dict()))
+    return validate_invoice(*document).to_dict()
+
+@api_router.post("/invoices/peppol/validate")
+async def validate_invoices_peppol(batch_request: UBLBatchRequest, current_user: User = Depends(get_current_user)):
+    """Check many invoices against the EN16931 business rules"""
+    query = {"user_id": current_user.id}
+    if batch_request.invoice_ids is not None:
+        query["id"] = {"$in": batch_request.invoice_ids}
+
+    reports = []
+    documents = []
+    async for document in iter_ubl_documents(db.invoices.find(query), supplier_party(current_user.dict())):
+        documents.append(document)
+        if len(documents) >= 500:
+            reports.extend(validate_invoices(documents))
+            documents = []
+    reports.extend(validate_invoices(documents))
+
+    invalid = sum(1 for report in reports if not report.valid)
+    return {
+        "checked": len(reports),
+        "valid": len(reports) - invalid,
+        "invalid": invalid,
+        "reports": [report.to_dict() for report in reports if not report.valid or report.warnings]
+    }
+
+@api_router.get("/invoices/{invoice_id}/peppol")
+async def get_invoice_peppol_delivery(invoice_id: str, current_user: User = Depends(get_current_user)):
+    """Get the Peppol delivery state of an invoice"""
+    job = await db.peppol_outbox.find_one(
+        {"invoice_id": invoice_id, "user_id": current_user.id},
+        {"_id": 0, "claimed_by": 0, "lease_until": 0}
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Invoice has not been queued for Peppol delivery")
+    return job
+
+# Inbound UBL purchase invoices
+async def ingest_ubl_for_user(user_id: str, sources, chunk_size: int = 200) -> dict:
+    """Ingest (name, source) UBL pairs as purchase invoices of a user"""
+    def make_account(fields: dict) -> dict:
+        return account_document(Account(user_id=user_id, **fields))
+
+    def make_purchase(fields: dict) -> dict:
+        return PurchaseInvoice(user_id=user_id, **fields).dict()
+
+    return await ingest_ubl_sources(db, user_id, sources, make_account, make_purchase, chunk_size=chunk_size)
+
+@api_router.post("/purchases/ubl")
+async def upload_purchase_invoices(files: List[UploadFile] = File(...), current_user: User = Depends(get_current_user),
+                                   entitlements: Entitlements = Depends(get_entitlements)):
+    """Import supplier UBL invoices as purchase invoices"""
+    require_peppol_access(entitlements)
+
+    stats = await ingest_ubl_for_user(current_user.id, ((f.filename, f.file) for f in files))
+    return {"message": f"Imported {stats['imported']} purchase invoices", **stats}
+
+@api_router.get("/purchases", response_model=List[PurchaseInvoice])
+async def get_purchase_invoices(account_id: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    query = {"user_id": current_user.id}
+    if account_id:
+        query["account_id"] = account_id
+    purchases = await db.purchase_invoices.find(query).sort("issue_date", -1).to_list(1000)
+    return [PurchaseInvoice(**purchase) for purchase in purchases]
+
+@api_router.get("/purchases/{purchase_id}", response_model=PurchaseInvoice)
+async def get_purchase_invoice(purchase_id: str, current_user: User = Depends(get_current_user)):
+    purchase = await db.purchase_invoices.find_one({"id": purchase_id, "user_id": current_user.id})
+    if not purchase:
+        raise HTTPException(status_code=404, detail="Purchase invoice not found")
+    return PurchaseInvoice(**purchase)
+
 # Payment packages definition
 PAYMENT_PACKAGES = {
     "premium": {
@@ -1049,10 +2022,59 @@ if not paypal_client_id or not paypal_client_secret:
 # PayPal API URLs
 PAYPAL_API_BASE = "https://api-m.sandbox.paypal.com" if paypal_environment == "sandbox" else "https://api-m.paypal.com"
 
-async def get_paypal_access_token():
-    """Get PayPal access token"""
-    if not paypal_client_id or not paypal_client_secret:
-        return None
+# Shared outbound HTTP clients (see http_clients.py), opened at startup and closed on shutdown
+HTTP2_ENABLED = os.environ.get('HTTP2_ENABLED', 'false').lower() == 'true'
+
+def upstream_config(name: str, base_url: str, timeout: float, max_connections: int) -> UpstreamConfig:
+    """Upstream settings, overridable with <NAME>_HTTP_TIMEOUT / <NAME>_HTTP_MAX_CONNECTIONS"""
+    max_connections = int(os.environ.get(f'{name}_HTTP_MAX_CONNECTIONS', str(max_connections)))
+    return UpstreamConfig(
+        base_url=base_url,
+        timeout=float(os.environ.get(f'{name}_HTTP_TIMEOUT', str(timeout))),
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        http2=HTTP2_ENABLED
+    )
+
+http_clients = HttpClients({
+    "paypal": upstream_config("PAYPAL", PAYPAL_API_BASE, timeout=10.0, max_connections=20),
+    "vies": upstream_config("VIES", "https://ec.europa.eu/taxation_customs/vies/services", timeout=10.0, max_connections=10),
+    "auth": upstream_config("AUTH", "https://demobackend.emergentagent.com/auth/v1", timeout=10.0, max_connections=10),
+    "peppol": upstream_config("PEPPOL", PEPPOL_ACCESS_POINT_URL, timeout=30.0,
+                              max_connections=PEPPOL_ACCESS_POINT_CONCURRENCY),
+})
+
+# Circuit breakers per upstream (see circuit_breaker.py): once an upstream keeps failing,
+# calls fail fast with 503 instead of tying up workers until the timeout
+UPSTREAM_REQUEST_BUDGET = float(os.environ.get('UPSTREAM_REQUEST_BUDGET_SECONDS', '8'))
+
+def upstream_breaker(name: str, timeout: float) -> CircuitBreaker:
+    """Breaker settings, overridable with <NAME>_BREAKER_FAILURES / <NAME>_BREAKER_RECOVERY_SECONDS"""
+    return CircuitBreaker(
+        name.lower(),
+        failure_threshold=int(os.environ.get(f'{name}_BREAKER_FAILURES', '5')),
+        recovery_timeout=float(os.environ.get(f'{name}_BREAKER_RECOVERY_SECONDS', '30')),
+        timeout=timeout
+    )
+
+breakers = {
+    "paypal": upstream_breaker("PAYPAL", http_clients.upstreams["paypal"].timeout),
+    "vies": upstream_breaker("VIES", http_clients.upstreams["vies"].timeout),
+    "auth": upstream_breaker("AUTH", http_clients.upstreams["auth"].timeout),
+    "stripe": upstream_breaker("STRIPE", float(os.environ.get('STRIPE_HTTP_TIMEOUT', '10')))
+}
+
+def upstream_failed(response: httpx.Response) -> bool:
+    """Responses that count against an upstream's breaker"""
+    return response.status_code >= 500 or response.status_code == 429
+
+def stripe_client_error(error: Exception) -> bool:
+    """Stripe rejected the request itself (declined card, bad parameters); Stripe is up"""
+    status = getattr(error, "http_status", None) or getattr(error, "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status != 429
+
+async def fetch_paypal_access_token():
+    """Exchange the client credentials for a PayPal access token and its lifetime"""
     
     auth = base64.b64encode(f"{paypal_client_id}:{paypal_client_secret}".encode()).decode()
     
@@ -1065,12 +2087,46 @@ async def get_paypal_access_token():
     
     data = "grant_type=client_credentials"
     
-    async with httpx.AsyncClient() as client:
-        response = await client.post(f"{PAYPAL_API_BASE}/v1/oauth2/token", headers=headers, data=data)
-        if response.status_code == 200:
-            return response.json()["access_token"]
+    response = await breakers["paypal"].call(
+        lambda: http_clients.get("paypal").post("/v1/oauth2/token", headers=headers, content=data),
+        is_failure=upstream_failed
+    )
+    if response.status_code == 200:
+        token = response.json()
+        return token["access_token"], float(token.get("expires_in", 3600))
+    logger.error(f"PayPal token request failed: {response.status_code} - {response.text}")
     return None
 
+# PayPal tokens last hours; reuse them until PAYPAL_TOKEN_REFRESH_MARGIN seconds before they expire
+paypal_tokens = AccessTokenCache(
+    fetch_paypal_access_token,
+    refresh_margin=float(os.environ.get('PAYPAL_TOKEN_REFRESH_MARGIN', '300'))
+)
+
+async def get_paypal_access_token():
+    """Get PayPal access token"""
+    if not paypal_client_id or not paypal_client_secret:
+        return None
+    return await paypal_tokens.get()
+
+async def paypal_request(method: str, path: str, headers: Optional[dict] = None, **kwargs) -> httpx.Response:
+    """Authenticated PayPal API call; a 401 drops the cached token and retries once with a fresh one"""
+    for _ in range(2):
+        access_token = await get_paypal_access_token()
+        if not access_token:
+            raise HTTPException(status_code=500, detail="Failed to authenticate with PayPal")
+        
+        response = await breakers["paypal"].call(
+            lambda: http_clients.get("paypal").request(
+                method, path, headers={**(headers or {}), "Authorization": f"Bearer {access_token}"}, **kwargs
+            ),
+            is_failure=upstream_failed
+        )
+        if response.status_code != 401:
+            break
+        paypal_tokens.invalidate(access_token)
+    return response
+
 # Password hashing utilities
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt"""
@@ -1085,151 +2141,120 @@ def generate_session_token() -> str:
     """Generate a secure session token"""
     return secrets.token_urlsafe(32)
 
+# VIES lookups are cached per normalized VAT number (see vies_cache.py)
+vies_cache = ViesCache(
+    db.vies_cache,
+    valid_ttl=timedelta(hours=int(os.environ.get('VIES_CACHE_VALID_HOURS', '168'))),
+    invalid_ttl=timedelta(minutes=int(os.environ.get('VIES_CACHE_INVALID_MINUTES', '60'))),
+    unavailable_ttl=timedelta(seconds=int(os.environ.get('VIES_CACHE_UNAVAILABLE_SECONDS', '60')))
+)
+
 async def validate_vat_with_vies(vat_number: str) -> VIESResponse:
-    """Validate VAT number using VIES and retrieve company information"""
+    """Validate VAT number using VIES and retrieve company information
+
+    Raises ViesUnavailableError when VIES cannot answer, so an outage is never
+    reported as an invalid number.
+    """
     try:
         # Clean and validate VAT number format
-        clean_vat = vat_number.replace(" ", "").replace("-", "").upper()
+        clean_vat = normalize_vat_number(vat_number)
         
         # Check if it's a valid EU VAT number
-        if not vat.is_valid(clean_vat):
+        if not clean_vat or not vat.is_valid(clean_vat):
             return VIESResponse(valid=False)
         
-        # Extract country code and number
-        country_code = clean_vat[:2]
-        vat_num = clean_vat[2:]
-        
-        # VIES SOAP request
-        soap_request = f"""<?xml version="1.0" encoding="UTF-8"?>
-        <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
-                       xmlns:tns1="urn:ec.europa.eu:taxud:vies:services:checkVat:types">
-            <soap:Header>
-            </soap:Header>
-            <soap:Body>
-                <tns1:checkVat>
-                    <tns1:countryCode>{country_code}</tns1:countryCode>
-                    <tns1:vatNumber>{vat_num}</tns1:vatNumber>
-                </tns1:checkVat>
-            </soap:Body>
-        </soap:Envelope>"""
-        
-        headers = {
-            'Content-Type': 'text/xml; charset=utf-8',
-            'SOAPAction': 'checkVat'
-        }
-        
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(
-                'https://ec.europa.eu/taxation_customs/vies/services/checkVatService',
-                data=soap_request,
-                headers=headers
-            )
-        
-        if response.status_code == 200:
-            # Parse SOAP response
-            root = ET.fromstring(response.text)
-            
-            # Find the checkVatResponse element
-            ns = {'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
-                  'tns': 'urn:ec.europa.eu:taxud:vies:services:checkVat:types'}
-            
-            check_vat_response = root.find('.//tns:checkVatResponse', ns)
-            
-            if check_vat_response is not None:
-                valid_elem = check_vat_response.find('tns:valid', ns)
-                name_elem = check_vat_response.find('tns:name', ns)
-                address_elem = check_vat_response.find('tns:address', ns)
-                date_elem = check_vat_response.find('tns:requestDate', ns)
-                
-                is_valid = valid_elem.text.lower() == 'true' if valid_elem is not None else False
-                company_name = name_elem.text if name_elem is not None and name_elem.text else None
-                full_address = address_elem.text if address_elem is not None and address_elem.text else None
-                request_date = date_elem.text if date_elem is not None else None
-                
-                # Parse address into components (basic parsing)
-                street, street_nr, box, postal_code, city = parse_vies_address(full_address)
-                
-                return VIESResponse(
-                    valid=is_valid,
-                    name=company_name,
-                    address=full_address,
-                    street=street,
-                    street_nr=street_nr,
-                    box=box,
-                    postal_code=postal_code,
-                    city=city,
-                    country=get_country_name(country_code),
-                    country_code=country_code,
-                    request_date=request_date
-                )
-        
-        return VIESResponse(valid=False)
+        status, payload = await lookup_vat_status(clean_vat)
+        if status == VIES_UNAVAILABLE:
+            raise ViesUnavailableError(f"VIES could not answer for {clean_vat[:2]}")
+        return VIESResponse(**payload)
         
+    except (ViesUnavailableError, UpstreamUnavailableError):
+        raise
     except Exception as e:
         logger.error(f"VIES validation error: {e}")
         return VIESResponse(valid=False)
 
-def parse_vies_address(address: str) -> tuple:
-    """Parse VIES address into components"""
-    if not address:
-        return None, None, None, None, None
-    
-    # This is a basic parser - you might want to enhance it based on your needs
-    lines = address.strip().split('\n')
-    
-    street = None
-    street_nr = None
-    box = None
-    postal_code = None
-    city = None
-    
-    if len(lines) >= 1:
-        # First line usually contains street and number
-        first_line = lines[0].strip()
-        # Try to extract street number (basic regex)
-        import re
-        
-        # Look for patterns like "123" or "123A" at the end of the line
-        match = re.search(r'(.+?)\s+(\d+[A-Za-z]?)$', first_line)
-        if match:
-            street = match.group(1).strip()
-            street_nr = match.group(2).strip()
-        else:
-            street = first_line
-    
-    if len(lines) >= 2:
-        # Last line usually contains postal code and city
-        last_line = lines[-1].strip()
-        # Look for postal code pattern (varies by country)
-        match = re.search(r'^(\d{4,5})\s+(.+)$', last_line)
-        if match:
-            postal_code = match.group(1).strip()
-            city = match.group(2).strip()
-        else:
-            city = last_line
+async def query_vies(clean_vat: str) -> dict:
+    """Query the VIES SOAP service; raises ViesUnavailableError when VIES cannot answer"""
+    # Extract country code and number
+    country_code = clean_vat[:2]
+    vat_num = clean_vat[2:]
+    
+    # VIES SOAP request
+    soap_request = f"""<?xml version="1.0" encoding="UTF-8"?>
+    <soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"
+                   xmlns:tns1="urn:ec.europa.eu:taxud:vies:services:checkVat:types">
+        <soap:Header>
+        </soap:Header>
+        <soap:Body>
+            <tns1:checkVat>
+                <tns1:countryCode>{country_code}</tns1:countryCode>
+                <tns1:vatNumber>{vat_num}</tns1:vatNumber>
+            </tns1:checkVat>
+        </soap:Body>
+    </soap:Envelope>"""
     
-    # Check for box number in middle lines
-    if len(lines) > 2:
-        for line in lines[1:-1]:
-            if 'box' in line.lower() or 'boîte' in line.lower() or 'bus' in line.lower():
-                box_match = re.search(r'(\d+)', line)
-                if box_match:
-                    box = box_match.group(1)
+    headers = {
+        'Content-Type': 'text/xml; charset=utf-8',
+        'SOAPAction': 'checkVat'
+    }
     
-    return street, street_nr, box, postal_code, city
+    try:
+        # SOAP faults come back as HTTP 500; only other server errors mean VIES itself is down
+        response = await breakers["vies"].call(
+            lambda: http_clients.get("vies").post('/checkVatService', content=soap_request, headers=headers),
+            is_failure=lambda r: r.status_code >= 500 and "faultstring" not in r.text
+        )
+    except (httpx.HTTPError, UpstreamUnavailableError) as e:
+        raise ViesUnavailableError(f"VIES request failed: {e}")
+    
+    if response.status_code != 200:
+        # SOAP faults: INVALID_INPUT is a definitive answer, anything else (MS_UNAVAILABLE, TIMEOUT, ...) is not
+        if "INVALID_INPUT" in response.text:
+            return VIESResponse(valid=False).dict()
+        raise ViesUnavailableError(f"VIES returned {response.status_code}")
+    
+    # Parse SOAP response
+    root = ET.fromstring(response.text)
+    
+    # Find the checkVatResponse element
+    ns = {'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
+          'tns': 'urn:ec.europa.eu:taxud:vies:services:checkVat:types'}
+    
+    check_vat_response = root.find('.//tns:checkVatResponse', ns)
+    if check_vat_response is None:
+        raise ViesUnavailableError("VIES response has no checkVatResponse")
+    
+    valid_elem = check_vat_response.find('tns:valid', ns)
+    name_elem = check_vat_response.find('tns:name', ns)
+    address_elem = check_vat_response.find('tns:address', ns)
+    date_elem = check_vat_response.find('tns:requestDate', ns)
+    
+    is_valid = valid_elem.text.lower() == 'true' if valid_elem is not None else False
+    company_name = name_elem.text if name_elem is not None and name_elem.text else None
+    full_address = address_elem.text if address_elem is not None and address_elem.text else None
+    request_date = date_elem.text if date_elem is not None else None
+    
+    # Parse address into components using the member state's address format
+    street, street_nr, box, postal_code, city = parse_vies_address(full_address, country_code)
+    
+    return VIESResponse(
+        valid=is_valid,
+        name=company_name,
+        address=full_address,
+        street=street,
+        street_nr=street_nr,
+        box=box,
+        postal_code=postal_code,
+        city=city,
+        country=get_country_name(country_code),
+        country_code=country_code,
+        request_date=request_date
+    ).dict()
 
 def get_country_name(country_code: str) -> str:
     """Get country name from country code"""
-    country_map = {
-        'AT': 'Austria', 'BE': 'Belgium', 'BG': 'Bulgaria', 'CY': 'Cyprus',
-        'CZ': 'Czech Republic', 'DE': 'Germany', 'DK': 'Denmark', 'EE': 'Estonia',
-        'ES': 'Spain', 'FI': 'Finland', 'FR': 'France', 'GR': 'Greece',
-        'HR': 'Croatia', 'HU': 'Hungary', 'IE': 'Ireland', 'IT': 'Italy',
-        'LT': 'Lithuania', 'LU': 'Luxembourg', 'LV': 'Latvia', 'MT': 'Malta',
-        'NL': 'Netherlands', 'PL': 'Poland', 'PT': 'Portugal', 'RO': 'Romania',
-        'SE': 'Sweden', 'SI': 'Slovenia', 'SK': 'Slovakia'
-    }
-    return country_map.get(country_code, country_code)
+    return EU_COUNTRY_NAMES.get(country_code, country_code)
 
 # Subscription Plans Configuration
 SUBSCRIPTION_PLANS = {
@@ -1320,13 +2345,13 @@ SUBSCRIPTION_PLANS = {
     )
 }
 
-def get_user_plan(user: User) -> SubscriptionPlan:
-    """Get user's current subscription plan"""
-    return SUBSCRIPTION_PLANS.get(user.current_plan, SUBSCRIPTION_PLANS["starter"])
+def get_user_plan(entitlements: Entitlements) -> SubscriptionPlan:
+    """Get user's effective subscription plan (stored plan or one granted by a role)"""
+    return SUBSCRIPTION_PLANS.get(entitlements.plan_id, SUBSCRIPTION_PLANS["starter"])
 
-def check_plan_limits(user: User, resource_type: str, current_count: int = 0) -> bool:
+def check_plan_limits(entitlements: Entitlements, resource_type: str, current_count: int = 0) -> bool:
     """Check if user can create more resources based on their plan"""
-    plan = get_user_plan(user)
+    plan = get_user_plan(entitlements)
     
     if resource_type == "contacts":
         max_allowed = plan.limits.get("contacts_max", 0)
@@ -1343,10 +2368,9 @@ def check_plan_limits(user: User, resource_type: str, current_count: int = 0) ->
     
     return current_count < max_allowed
 
-def has_feature_access(user: User, feature: str) -> bool:
+def has_feature_access(entitlements: Entitlements, feature: str) -> bool:
     """Check if user has access to a specific feature"""
-    plan = get_user_plan(user)
-    return plan.limits.get(feature, False)
+    return entitlements.has_feature(feature)
 
 # Internationalization Configuration
 TRANSLATIONS = {
@@ -2197,6 +3221,114 @@ def get_translations(language: str = "en") -> dict:
     """Get translations for specified language"""
     return TRANSLATIONS.get(language, TRANSLATIONS["en"])
 
+# Stripe clients are reused per webhook URL instead of being built for every request
+stripe_clients = {}
+
+def get_stripe_checkout(webhook_url: str = "") -> StripeCheckout:
+    stripe_checkout = stripe_clients.get(webhook_url)
+    if stripe_checkout is None:
+        stripe_checkout = stripe_clients[webhook_url] = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+    return stripe_checkout
+
+async def grant_role(user_id: str, role: str, granted_by: str) -> bool:
+    """Grant a role unless the user already has it; safe against concurrent grants"""
+    user_role = UserRole(user_id=user_id, role=role, granted_by=granted_by)
+    try:
+        result = await db.user_roles.update_one(
+            {"user_id": user_id, "role": role},
+            {"$setOnInsert": user_role.dict()},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    if result.upserted_id is None:
+        return False
+    await entitlements_changed(user_id)
+    return True
+
+async def ensure_user_role_index():
+    """Unique (user_id, role) index, dropping duplicate grants left by the old check-then-insert"""
+    pipeline = [
+        {"$group": {"_id": {"user_id": "$user_id", "role": "$role"}, "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ]
+    async for duplicate in db.user_roles.aggregate(pipeline):
+        await db.user_roles.delete_many({"_id": {"$in": duplicate["ids"][1:]}})
+    await db.user_roles.create_index([("user_id", 1), ("role", 1)], unique=True)
+
+PAYMENT_EVENT_TYPES = {"checkout.session.completed", "payment_intent.succeeded", "checkout.status", "paypal.capture"}
+
+async def process_payment_event(event: dict):
+    """Apply a payment event (Stripe webhook, Stripe status check or PayPal capture)"""
+    if event["event_type"] not in PAYMENT_EVENT_TYPES:
+        return
+    
+    # Update payment transaction
+    update = {"payment_status": event["payment_status"], "updated_at": datetime.now(timezone.utc)}
+    if event.get("payment_id"):
+        update["payment_id"] = event["payment_id"]
+    await db.payment_transactions.update_one({"session_id": event["session_id"]}, {"$set": update})
+    
+    # If payment successful, ensure user has premium role
+    if event["payment_status"] == "paid":
+        payment_transaction = await db.payment_transactions.find_one(
+            {"session_id": event["session_id"]}, {"user_id": 1}
+        )
+        if payment_transaction:
+            await grant_role(payment_transaction["user_id"], "premium_user", "system")
+    
+    # Release clients long-polling on this session
+    payment_status_watcher.notify(event["session_id"])
+
+# Every payment event is recorded once under a unique event_id; Stripe webhooks are applied by
+# the background consumer, status checks and captures apply their own event inline
+payment_events = EventConsumer(db.payment_events, process_payment_event, name="Payment")
+
+async def apply_payment_event(event_id: str, event: dict):
+    """Record and apply an event now; duplicates of an applied event are skipped"""
+    # Delay the consumer's copy so it only runs if this request dies before finishing
+    if await payment_events.publish(event_id, event, delay=60):
+        await process_payment_event(event)
+        await payment_events.complete(event_id)
+
+async def load_checkout_status(session_id: str) -> Optional[dict]:
+    """Payment status as recorded by webhooks and earlier checks"""
+    return await db.payment_transactions.find_one({"session_id": session_id}, {"_id": 0, "payment_status": 1})
+
+async def fetch_checkout_status(session_id: str) -> dict:
+    """Ask Stripe for the session status and record any change"""
+    checkout_status: CheckoutStatusResponse = await breakers["stripe"].call(
+        lambda: get_stripe_checkout().get_checkout_status(session_id),
+        is_client_error=stripe_client_error
+    )
+    
+    # Update payment transaction (and upgrade the user once paid) if status changed
+    recorded = await load_checkout_status(session_id)
+    if recorded and checkout_status.payment_status != recorded["payment_status"]:
+        await apply_payment_event(f"stripe:{session_id}:{checkout_status.payment_status}", {
+            "source": "stripe",
+            "event_type": "checkout.status",
+            "session_id": session_id,
+            "payment_status": checkout_status.payment_status
+        })
+    
+    return {
+        "status": checkout_status.status,
+        "payment_status": checkout_status.payment_status,
+        "amount_total": checkout_status.amount_total,
+        "currency": checkout_status.currency
+    }
+
+# Clients wait on /payments/checkout/status/{id}/wait; Stripe is only asked as a fallback,
+# once per session at a time, and its answer is reused for PAYMENT_STATUS_CACHE_SECONDS
+payment_status_watcher = PaymentStatusWatcher(
+    load_checkout_status,
+    fetch_checkout_status,
+    upstream_ttl=float(os.environ.get('PAYMENT_STATUS_CACHE_SECONDS', '5')),
+    upstream_interval=float(os.environ.get('PAYMENT_STATUS_UPSTREAM_INTERVAL', '10'))
+)
+PAYMENT_STATUS_MAX_WAIT = 30
+
 # Payment routes
 @api_router.post("/payments/checkout/session")
 async def create_checkout_session(request: Request, checkout_req: CheckoutRequest, current_user: User = Depends(get_current_user)):
@@ -2208,12 +3340,13 @@ async def create_checkout_session(request: Request, checkout_req: CheckoutReques
         raise HTTPException(status_code=400, detail="Invalid package")
     
     package = PAYMENT_PACKAGES[checkout_req.package_id]
+    start_deadline(UPSTREAM_REQUEST_BUDGET)
     
     try:
         # Initialize Stripe checkout
         host_url = str(request.base_url).rstrip('/')
         webhook_url = f"{host_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
+        stripe_checkout = get_stripe_checkout(webhook_url)
         
         # Create checkout session request
         checkout_session_req = CheckoutSessionRequest(
@@ -2229,7 +3362,10 @@ async def create_checkout_session(request: Request, checkout_req: CheckoutReques
         )
         
         # Create checkout session
-        session: CheckoutSessionResponse = await stripe_checkout.create_checkout_session(checkout_session_req)
+        session: CheckoutSessionResponse = await breakers["stripe"].call(
+            lambda: stripe_checkout.create_checkout_session(checkout_session_req),
+            is_client_error=stripe_client_error
+        )
         
         # Create payment transaction record
         payment_transaction = PaymentTransaction(
@@ -2246,6 +3382,8 @@ async def create_checkout_session(request: Request, checkout_req: CheckoutReques
         
         return {"url": session.url, "session_id": session.session_id}
     
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error creating checkout session: {e}")
         raise HTTPException(status_code=500, detail="Failed to create checkout session")
@@ -2254,6 +3392,7 @@ async def create_checkout_session(request: Request, checkout_req: CheckoutReques
 async def get_checkout_status(session_id: str, current_user: User = Depends(get_current_user)):
     if not stripe_api_key:
         raise HTTPException(status_code=500, detail="Payment system not configured")
+    start_deadline(UPSTREAM_REQUEST_BUDGET)
     
     try:
         # Find payment transaction
@@ -2265,49 +3404,27 @@ async def get_checkout_status(session_id: str, current_user: User = Depends(get_
         if not payment_transaction:
             raise HTTPException(status_code=404, detail="Payment transaction not found")
         
-        # Get status from Stripe
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-        checkout_status: CheckoutStatusResponse = await stripe_checkout.get_checkout_status(session_id)
-        
-        # Update payment transaction if status changed
-        if checkout_status.payment_status != payment_transaction["payment_status"]:
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {
-                    "$set": {
-                        "payment_status": checkout_status.payment_status,
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                }
-            )
-            
-            # If payment successful, upgrade user to premium
-            if checkout_status.payment_status == "paid":
-                # Check if user role already exists to prevent duplicate upgrades
-                existing_role = await db.user_roles.find_one({
-                    "user_id": current_user.id,
-                    "role": "premium_user"
-                })
-                
-                if not existing_role:
-                    user_role = UserRole(
-                        user_id=current_user.id,
-                        role="premium_user",
-                        granted_by="system"
-                    )
-                    await db.user_roles.insert_one(user_role.dict())
-        
-        return {
-            "status": checkout_status.status,
-            "payment_status": checkout_status.payment_status,
-            "amount_total": checkout_status.amount_total,
-            "currency": checkout_status.currency
-        }
+        # Get status from Stripe, shared with concurrent checks of the same session
+        return await payment_status_watcher.upstream_status(session_id)
     
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error getting checkout status: {e}")
         raise HTTPException(status_code=500, detail="Failed to get checkout status")
 
+@api_router.get("/payments/checkout/status/{session_id}/wait")
+async def wait_for_checkout_status(session_id: str, timeout: float = 25, current_user: User = Depends(get_current_user)):
+    """Long-poll: answers as soon as the payment is paid or expired, or with the current status after timeout"""
+    payment_transaction = await db.payment_transactions.find_one(
+        {"session_id": session_id, "user_id": current_user.id}, {"_id": 0, "payment_status": 1}
+    )
+    if not payment_transaction:
+        raise HTTPException(status_code=404, detail="Payment transaction not found")
+    
+    status = await payment_status_watcher.wait(session_id, min(max(timeout, 0), PAYMENT_STATUS_MAX_WAIT))
+    return {"session_id": session_id, **(status or payment_transaction)}
+
 @api_router.post("/webhook/stripe")
 async def stripe_webhook(request: Request):
     if not stripe_api_key:
@@ -2320,42 +3437,16 @@ async def stripe_webhook(request: Request):
         if not stripe_signature:
             raise HTTPException(status_code=400, detail="Missing Stripe signature")
         
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-        webhook_response = await stripe_checkout.handle_webhook(body, stripe_signature)
-        
-        # Process webhook event
-        if webhook_response.event_type in ["checkout.session.completed", "payment_intent.succeeded"]:
-            # Update payment transaction
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {
-                    "$set": {
-                        "payment_status": webhook_response.payment_status,
-                        "payment_id": webhook_response.event_id,
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                }
-            )
-            
-            # If payment successful, ensure user has premium role
-            if webhook_response.payment_status == "paid":
-                payment_transaction = await db.payment_transactions.find_one({
-                    "session_id": webhook_response.session_id
-                })
-                
-                if payment_transaction:
-                    existing_role = await db.user_roles.find_one({
-                        "user_id": payment_transaction["user_id"],
-                        "role": "premium_user"
-                    })
-                    
-                    if not existing_role:
-                        user_role = UserRole(
-                            user_id=payment_transaction["user_id"],
-                            role="premium_user",
-                            granted_by="system"
-                        )
-                        await db.user_roles.insert_one(user_role.dict())
+        # Verify the signature, record the event and acknowledge; payment_events applies it in the background
+        webhook_response = await get_stripe_checkout().handle_webhook(body, stripe_signature)
+        
+        await payment_events.publish(f"stripe:{webhook_response.event_id}", {
+            "source": "stripe",
+            "event_type": webhook_response.event_type,
+            "session_id": webhook_response.session_id,
+            "payment_status": webhook_response.payment_status,
+            "payment_id": webhook_response.event_id
+        })
         
         return {"status": "success"}
     
@@ -2374,13 +3465,9 @@ async def create_paypal_order(request: Request, order_req: PayPalOrderRequest, c
         raise HTTPException(status_code=400, detail="Invalid package")
     
     package = PAYMENT_PACKAGES[order_req.package_id]
+    start_deadline(UPSTREAM_REQUEST_BUDGET)
     
     try:
-        # Get PayPal access token
-        access_token = await get_paypal_access_token()
-        if not access_token:
-            raise HTTPException(status_code=500, detail="Failed to authenticate with PayPal")
-        
         # Create PayPal order
         order_data = {
             "intent": "CAPTURE",
@@ -2403,17 +3490,16 @@ async def create_paypal_order(request: Request, order_req: PayPalOrderRequest, c
         
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {access_token}",
             "Accept": "application/json",
             "Prefer": "return=representation"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{PAYPAL_API_BASE}/v2/checkout/orders",
-                headers=headers,
-                json=order_data
-            )
+        response = await paypal_request(
+            "POST",
+            "/v2/checkout/orders",
+            headers=headers,
+            json=order_data
+        )
         
         if response.status_code == 201:
             order_response = response.json()
@@ -2451,6 +3537,8 @@ async def create_paypal_order(request: Request, order_req: PayPalOrderRequest, c
             logger.error(f"PayPal order creation failed: {response.status_code} - {response.text}")
             raise HTTPException(status_code=500, detail="Failed to create PayPal order")
     
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error creating PayPal order: {e}")
         raise HTTPException(status_code=500, detail="Failed to create PayPal order")
@@ -2459,66 +3547,46 @@ async def create_paypal_order(request: Request, order_req: PayPalOrderRequest, c
 async def capture_paypal_order(order_id: str, current_user: User = Depends(get_current_user)):
     if not paypal_client_id or not paypal_client_secret:
         raise HTTPException(status_code=500, detail="PayPal payment system not configured")
+    start_deadline(UPSTREAM_REQUEST_BUDGET)
     
     try:
-        # Get PayPal access token
-        access_token = await get_paypal_access_token()
-        if not access_token:
-            raise HTTPException(status_code=500, detail="Failed to authenticate with PayPal")
-        
         headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {access_token}",
             "Accept": "application/json",
             "Prefer": "return=representation"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{PAYPAL_API_BASE}/v2/checkout/orders/{order_id}/capture",
-                headers=headers,
-                json={}
-            )
+        response = await paypal_request(
+            "POST",
+            f"/v2/checkout/orders/{order_id}/capture",
+            headers=headers,
+            json={}
+        )
         
         if response.status_code == 201:
             order_data = response.json()
+            payment_status = "paid" if order_data["status"] == "COMPLETED" else "pending"
             
-            # Update payment transaction
-            await db.payment_transactions.update_one(
-                {"session_id": order_id, "user_id": current_user.id},
-                {
-                    "$set": {
-                        "payment_status": "paid" if order_data["status"] == "COMPLETED" else "pending",
-                        "payment_id": order_data["id"],
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                }
-            )
-            
-            # If payment successful, upgrade user to premium
-            if order_data["status"] == "COMPLETED":
-                existing_role = await db.user_roles.find_one({
-                    "user_id": current_user.id,
-                    "role": "premium_user"
-                })
-                
-                if not existing_role:
-                    user_role = UserRole(
-                        user_id=current_user.id,
-                        role="premium_user",
-                        granted_by="system"
-                    )
-                    await db.user_roles.insert_one(user_role.dict())
+            # Update payment transaction (and upgrade the user once paid); retried captures are skipped
+            await apply_payment_event(f"paypal:{order_id}:{payment_status}", {
+                "source": "paypal",
+                "event_type": "paypal.capture",
+                "session_id": order_id,
+                "payment_status": payment_status,
+                "payment_id": order_data["id"]
+            })
             
             return {
                 "order_id": order_data["id"],
                 "status": order_data["status"],
-                "payment_status": "paid" if order_data["status"] == "COMPLETED" else "pending"
+                "payment_status": payment_status
             }
         else:
             logger.error(f"PayPal capture failed: {response.status_code} - {response.text}")
             raise HTTPException(status_code=500, detail="Failed to capture PayPal payment")
     
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error capturing PayPal order: {e}")
         raise HTTPException(status_code=500, detail="Failed to capture PayPal payment")
@@ -2527,6 +3595,7 @@ async def capture_paypal_order(order_id: str, current_user: User = Depends(get_c
 async def get_paypal_order_status(order_id: str, current_user: User = Depends(get_current_user)):
     if not paypal_client_id or not paypal_client_secret:
         raise HTTPException(status_code=500, detail="PayPal payment system not configured")
+    start_deadline(UPSTREAM_REQUEST_BUDGET)
     
     try:
         # Check our database first
@@ -2539,20 +3608,15 @@ async def get_paypal_order_status(order_id: str, current_user: User = Depends(ge
             raise HTTPException(status_code=404, detail="Payment transaction not found")
         
         # Get status from PayPal
-        access_token = await get_paypal_access_token()
-        if not access_token:
-            raise HTTPException(status_code=500, detail="Failed to authenticate with PayPal")
-        
         headers = {
-            "Authorization": f"Bearer {access_token}",
             "Accept": "application/json"
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{PAYPAL_API_BASE}/v2/checkout/orders/{order_id}",
-                headers=headers
-            )
+        response = await paypal_request(
+            "GET",
+            f"/v2/checkout/orders/{order_id}",
+            headers=headers
+        )
         
         if response.status_code == 200:
             order_data = response.json()
@@ -2582,42 +3646,46 @@ async def get_paypal_order_status(order_id: str, current_user: User = Depends(ge
             logger.error(f"PayPal status check failed: {response.status_code} - {response.text}")
             raise HTTPException(status_code=500, detail="Failed to get PayPal order status")
     
+    except UpstreamUnavailableError:
+        raise
     except Exception as e:
         logger.error(f"Error getting PayPal order status: {e}")
         raise HTTPException(status_code=500, detail="Failed to get PayPal order status")
 
 # Admin routes
+ADMIN_USERS_MAX_PAGE = 1000
+
+async def ensure_admin_indexes():
+    # Paid-payment totals in the admin user listing are joined on these
+    await db.payment_transactions.create_index([("user_id", 1), ("payment_status", 1)])
+    await db.users.create_index("created_at")
+
 @api_router.get("/admin/users")
-async def get_all_users(current_user: User = Depends(get_current_user)):
-    # Check if user is admin
-    user_role = await db.user_roles.find_one({"user_id": current_user.id, "role": "admin"})
-    if not user_role:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
-    users = await db.users.find({}).to_list(1000)
-    
-    # Get roles for each user
-    for user in users:
-        roles = await db.user_roles.find({"user_id": user["id"]}).to_list(10)
-        user["roles"] = [role["role"] for role in roles]
-        
-        # Get payment info
-        payments = await db.payment_transactions.find({
-            "user_id": user["id"],
-            "payment_status": "paid"
-        }).to_list(10)
-        user["payments_count"] = len(payments)
-        user["total_paid"] = sum(p["amount"] for p in payments)
+async def get_all_users(response: Response, search: Optional[str] = None, sort: str = "created_at",
+                        order: str = "desc", skip: int = 0, limit: int = 100,
+                        current_user: User = Depends(require_admin)):
+    """One page of users with roles and payment totals
+
+    The match count is in X-Total-Count, the sign-in method and admin counts
+    of all matching users in X-User-Counts (JSON).
+    """
+    limit = min(max(limit, 1), ADMIN_USERS_MAX_PAGE)
+    try:
+        pipeline = user_listing_pipeline(search, sort, order != "asc", max(skip, 0), limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
+    users, counts = await asyncio.gather(
+        db.users.aggregate(pipeline).to_list(limit),
+        db.users.aggregate(user_counts_pipeline(search)).to_list(1)
+    )
+    counts = counts[0] if counts else {"total": 0}
+    response.headers["X-Total-Count"] = str(counts.pop("total"))
+    response.headers["X-User-Counts"] = json.dumps(counts)
     return users
 
 @api_router.post("/admin/users/{user_id}/role")
-async def assign_user_role(user_id: str, role_data: dict, current_user: User = Depends(get_current_user)):
-    # Check if user is admin
-    user_role = await db.user_roles.find_one({"user_id": current_user.id, "role": "admin"})
-    if not user_role:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def assign_user_role(user_id: str, role_data: dict, current_user: User = Depends(require_admin)):
     # Validate user exists
     user = await db.users.find_one({"id": user_id})
     if not user:
@@ -2633,23 +3701,13 @@ async def assign_user_role(user_id: str, role_data: dict, current_user: User = D
         raise HTTPException(status_code=400, detail="User already has this role")
     
     # Create new role
-    new_role = UserRole(
-        user_id=user_id,
-        role=role_data["role"],
-        granted_by=current_user.id
-    )
-    
-    await db.user_roles.insert_one(new_role.dict())
+    if not await grant_role(user_id, role_data["role"], current_user.id):
+        raise HTTPException(status_code=400, detail="User already has this role")
     
     return {"message": "Role assigned successfully"}
 
 @api_router.delete("/admin/users/{user_id}/role/{role}")
-async def remove_user_role(user_id: str, role: str, current_user: User = Depends(get_current_user)):
-    # Check if user is admin
-    user_role = await db.user_roles.find_one({"user_id": current_user.id, "role": "admin"})
-    if not user_role:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def remove_user_role(user_id: str, role: str, current_user: User = Depends(require_admin)):
     result = await db.user_roles.delete_one({
         "user_id": user_id,
         "role": role
@@ -2657,59 +3715,31 @@ async def remove_user_role(user_id: str, role: str, current_user: User = Depends
     
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Role not found")
+    await entitlements_changed(user_id)
     
     return {"message": "Role removed successfully"}
 
 @api_router.get("/admin/custom-fields")
-async def get_custom_fields(current_user: User = Depends(get_current_user)):
-    # Check if user is admin
-    user_role = await db.user_roles.find_one({"user_id": current_user.id, "role": "admin"})
-    if not user_role:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def get_custom_fields(current_user: User = Depends(require_admin)):
     custom_fields = await db.custom_fields.find({}).to_list(1000)
     return [CustomField(**field) for field in custom_fields]
 
 @api_router.post("/admin/custom-fields")
-async def create_custom_field(field_data: dict, current_user: User = Depends(get_current_user)):
-    # Check if user is admin
-    user_role = await db.user_roles.find_one({"user_id": current_user.id, "role": "admin"})
-    if not user_role:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
-    custom_field = CustomField(
-        entity_type=field_data["entity_type"],
-        field_name=field_data["field_name"],
-        field_type=field_data["field_type"],
-        field_options=field_data.get("field_options"),
-        required=field_data.get("required", False),
-        created_by=current_user.id
-    )
-    
-    await db.custom_fields.insert_one(custom_field.dict())
-    return custom_field
+async def create_custom_field(field_data: dict, current_user: User = Depends(require_admin)):
+    # Without a tenant_id the field applies to every tenant
+    return await create_custom_field_definition(field_data, field_data.get("tenant_id"), current_user.id)
 
 @api_router.delete("/admin/custom-fields/{field_id}")
-async def delete_custom_field(field_id: str, current_user: User = Depends(get_current_user)):
-    # Check if user is admin
-    user_role = await db.user_roles.find_one({"user_id": current_user.id, "role": "admin"})
-    if not user_role:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
-    result = await db.custom_fields.delete_one({"id": field_id})
-    
-    if result.deleted_count == 0:
+async def delete_custom_field(field_id: str, current_user: User = Depends(require_admin)):
+    field = await db.custom_fields.find_one({"id": field_id})
+    if not field:
         raise HTTPException(status_code=404, detail="Custom field not found")
     
+    await delete_custom_field_definition(field)
     return {"message": "Custom field deleted successfully"}
 
 @api_router.post("/admin/users")
-async def create_user(user_data: UserCreate, current_user: User = Depends(get_current_user)):
-    # Check if user is admin
-    user_role = await db.user_roles.find_one({"user_id": current_user.id, "role": "admin"})
-    if not user_role:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def create_user(user_data: UserCreate, current_user: User = Depends(require_admin)):
     # Check if user already exists
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
@@ -2727,22 +3757,12 @@ async def create_user(user_data: UserCreate, current_user: User = Depends(get_cu
     
     # Assign roles if provided
     for role in user_data.roles:
-        user_role = UserRole(
-            user_id=user.id,
-            role=role,
-            granted_by=current_user.id
-        )
-        await db.user_roles.insert_one(user_role.dict())
+        await grant_role(user.id, role, current_user.id)
     
     return {"message": "User created successfully", "user_id": user.id}
 
 @api_router.put("/admin/users/{user_id}/status")
-async def toggle_user_status(user_id: str, status_data: dict, current_user: User = Depends(get_current_user)):
-    # Check if user is admin
-    user_role = await db.user_roles.find_one({"user_id": current_user.id, "role": "admin"})
-    if not user_role:
-        raise HTTPException(status_code=403, detail="Admin access required")
-    
+async def toggle_user_status(user_id: str, status_data: dict, current_user: User = Depends(require_admin)):
     # Update user status
     result = await db.users.update_one(
         {"id": user_id},
@@ -2754,6 +3774,43 @@ async def toggle_user_status(user_id: str, status_data: dict, current_user: User
     
     return {"message": "User status updated successfully"}
 
+# Revenue reports read daily rollups that a background job maintains (see revenue_rollups.py)
+REVENUE_ROLLUP_INTERVAL = float(os.environ.get('REVENUE_ROLLUP_INTERVAL', '3600'))
+REVENUE_REPORT_MAX_DAYS = 731
+
+revenue_rollups = RevenueRollups(
+    db,
+    {plan_id: plan.price for plan_id, plan in SUBSCRIPTION_PLANS.items()},
+    interval=REVENUE_ROLLUP_INTERVAL
+)
+
+@api_router.get("/admin/reports/revenue")
+async def get_revenue_report(start: Optional[date] = None, end: Optional[date] = None,
+                             current_user: User = Depends(require_admin)):
+    """MRR, churn, plan distribution and payment success rates; defaults to the last 30 days"""
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= REVENUE_REPORT_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Reports cover at most {REVENUE_REPORT_MAX_DAYS} days")
+    
+    return await revenue_rollups.report(start, end)
+
+@api_router.get("/admin/metrics")
+async def get_admin_metrics(current_user: User = Depends(require_admin)):
+    return {
+        "vies_cache": vies_cache.metrics(),
+        "paypal_token_cache": paypal_tokens.stats,
+        "circuit_breakers": {name: breaker.metrics() for name, breaker in breakers.items()},
+        "payment_status": payment_status_watcher.metrics(),
+        "entitlements": entitlement_cache.metrics(),
+        "custom_field_schemas": custom_field_schemas.stats,
+        "recurring_series": recurring_series.stats,
+        "reminders": {**reminder_scheduler.stats, **reminder_hub.stats},
+        "busy_indexes": busy_indexes.stats
+    }
+
 # Basic dashboard stats
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
@@ -2774,12 +3831,23 @@ async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
 # Include the router in the main app
 app.include_router(api_router)
 
+@app.exception_handler(UpstreamUnavailableError)
+async def upstream_unavailable_handler(request: Request, exc: UpstreamUnavailableError):
+    """Fail fast with 503 when an upstream breaker is open or the request ran out of time"""
+    headers = {"Retry-After": str(max(1, round(exc.retry_after)))} if exc.retry_after else None
+    return JSONResponse(
+        status_code=503,
+        content={"detail": f"{exc.upstream} is temporarily unavailable, please retry shortly"},
+        headers=headers
+    )
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-User-Counts"],
 )
 
 # Configure logging
@@ -2789,6 +3857,52 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_background_workers():
+    await http_clients.start()
+    await peppol_dispatcher.ensure_indexes()
+    await ensure_inbound_indexes(db)
+    await vies_cache.ensure_indexes()
+    await vat_revalidator.ensure_indexes()
+    await payment_events.ensure_indexes()
+    await ensure_user_role_index()
+    await ensure_admin_indexes()
+    await revenue_rollups.ensure_indexes()
+    await subscription_expiry.ensure_indexes()
+    await ensure_custom_field_indexes()
+    await ensure_calendar_indexes(db.calendar_events)
+    await backfill_long_span(db.calendar_events)
+    await ensure_recurrence_indexes(db.calendar_events)
+    await reminder_scheduler.ensure_indexes()
+    await reminder_hub.ensure_indexes()
+    await ensure_feed_indexes(db)
+    await invoice_events.ensure_indexes()
+    await invoice_due_events.ensure_indexes()
+    await backfill_reminders(db.calendar_events)
+    await backfill_account_vat_keys()
+    if PEPPOL_DISPATCH_WORKERS > 0:
+        peppol_dispatcher.start(workers=PEPPOL_DISPATCH_WORKERS)
+    if VAT_REVALIDATION_ENABLED:
+        vat_revalidator.start()
+    payment_events.start()
+    revenue_rollups.start()
+    subscription_expiry.start()
+    subscription_expiry.start_backfill()
+    reminder_hub.start()
+    reminder_scheduler.start()
+    invoice_events.start()
+    invoice_due_events.start_backfill()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await peppol_dispatcher.stop()
+    await vat_revalidator.stop()
+    await payment_events.stop()
+    await revenue_rollups.stop()
+    await subscription_expiry.stop()
+    await reminder_scheduler.stop()
+    await reminder_hub.stop()
+    await invoice_events.stop()
+    await invoice_due_events.stop()
+    await http_clients.close()
     client.close()
\ No newline at end of file
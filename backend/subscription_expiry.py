@@ -0,0 +1,209 @@
+"""Scheduled expiry of subscriptions and downgrade of their users.
+
+Active subscriptions whose ``expires_at`` has passed are taken in chunks of
+``batch_size`` through the ``(status, expires_at)`` index. For each chunk
+the affected users are downgraded first, with one ``bulk_write``, to the plan
+of their newest subscription that is still running (or the default plan),
+and only then are the subscriptions marked expired. A pass that dies between
+the two steps therefore finds the same subscriptions again, and the
+downgrade is conditional on the user still being on an expired plan, so
+running it twice is harmless.
+
+A JobLease keeps concurrent workers from processing the same chunk; the
+lease checkpoint holds the pass cutoff, so a pass resumed by another worker
+finishes the same set of subscriptions.
+
+Choosing a plan cancels the user's other active subscriptions; those left
+active by earlier versions are cancelled by a one-time backfill, guarded by
+its own JobLease, so the fallback never returns a user to a plan they left.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from entitlements import VERSION_FIELD
+from job_lease import JobLease
+
+logger = logging.getLogger(__name__)
+
+
+def expired_query(cutoff: datetime) -> dict:
+    return {"status": "active", "expires_at": {"$lte": cutoff}}
+
+
+def running_query(user_ids: Iterable[str], now: datetime) -> dict:
+    """Active subscriptions of ``user_ids`` that have not expired"""
+    return {"user_id": {"$in": list(user_ids)}, "status": "active",
+            "$or": [{"expires_at": None}, {"expires_at": {"$gt": now}}]}
+
+
+def downgrade_ops(expired: List[dict], running: List[dict], default_plan: str) -> Dict[str, UpdateOne]:
+    """User updates, keyed by user id, for a chunk of expired subscriptions
+
+    ``running`` must be sorted newest first. A user moves to the plan of
+    their newest running subscription (or ``default_plan``), but only while
+    their current plan is one that just expired, so a plan chosen since then
+    is left alone.
+    """
+    expired_plans: Dict[str, Set[str]] = {}
+    for subscription in expired:
+        expired_plans.setdefault(subscription["user_id"], set()).add(subscription["plan_id"])
+
+    targets: Dict[str, str] = {}
+    for subscription in running:
+        targets.setdefault(subscription["user_id"], subscription["plan_id"])
+
+    ops = {}
+    for user_id, plans in expired_plans.items():
+        target = targets.get(user_id, default_plan)
+        plans = sorted(plans - {target})
+        if plans:
+            ops[user_id] = UpdateOne({"id": user_id, "current_plan": {"$in": plans}},
+                                     {"$set": {"current_plan": target}, "$inc": {VERSION_FIELD: 1}})
+    return ops
+
+
+class SubscriptionExpiry:
+    def __init__(self, db, on_downgrade: Optional[Callable[[str], None]] = None, default_plan: str = "starter",
+                 batch_size: int = 500, interval: float = 900, lease: Optional[JobLease] = None,
+                 backfill_lease: Optional[JobLease] = None):
+        self.db = db
+        self.on_downgrade = on_downgrade
+        self.default_plan = default_plan
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lease = lease or JobLease(db.job_leases, "subscription_expiry")
+        self.backfill_lease = backfill_lease or JobLease(db.job_leases, "subscription_replaced_backfill")
+        self._task: Optional[asyncio.Task] = None
+        self._backfill_task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.db.user_subscriptions.create_index([("status", ASCENDING), ("expires_at", ASCENDING)])
+        await self.db.user_subscriptions.create_index([("user_id", ASCENDING), ("started_at", DESCENDING)])
+
+    def start_backfill(self):
+        self._backfill_task = asyncio.create_task(self._backfill())
+
+    async def _backfill(self):
+        try:
+            await self.backfill()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Replaced subscription backfill error: {e}")
+
+    async def backfill(self) -> Optional[dict]:
+        """Cancel replaced subscriptions once; None if another worker holds the lease"""
+        checkpoint = await self.backfill_lease.acquire()
+        if checkpoint is None:
+            return None
+        if not checkpoint.get("done"):
+            # Safe to repeat: a pass that dies here simply runs again on the next start
+            checkpoint = {"done": True, "cancelled": await self.cancel_replaced()}
+            await self.backfill_lease.save(checkpoint)
+        await self.backfill_lease.release()
+        return {"cancelled": checkpoint.get("cancelled", 0)}
+
+    async def cancel_replaced(self) -> int:
+        """Cancel active subscriptions superseded by a newer one of the same user"""
+        pipeline = [
+            {"$match": {"status": "active"}},
+            {"$sort": {"user_id": ASCENDING, "started_at": DESCENDING}},
+            {"$group": {"_id": "$user_id", "ids": {"$push": "$id"}, "latest": {"$first": "$started_at"},
+                        "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ]
+        cancelled = 0
+        async for replaced in self.db.user_subscriptions.aggregate(pipeline):
+            result = await self.db.user_subscriptions.update_many(
+                {"id": {"$in": replaced["ids"][1:]}, "status": "active"},
+                {"$set": {"status": "cancelled", "expires_at": replaced["latest"],
+                          "updated_at": datetime.now(timezone.utc)}}
+            )
+            cancelled += result.modified_count
+        if cancelled:
+            logger.info(f"Cancelled {cancelled} replaced subscriptions")
+        return cancelled
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping.set()
+        for task in (self._task, self._backfill_task):
+            if task:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._task = self._backfill_task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.run_pass()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Subscription expiry error: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_pass(self) -> Optional[dict]:
+        """Expire every subscription due at the pass cutoff; None if another worker holds the lease"""
+        checkpoint = await self.lease.acquire()
+        if checkpoint is None:
+            return None
+
+        if "cutoff" not in checkpoint:
+            checkpoint = {"cutoff": datetime.now(timezone.utc), "expired": 0, "downgraded": 0}
+        cutoff = checkpoint["cutoff"]
+        if cutoff.tzinfo is None:
+            cutoff = cutoff.replace(tzinfo=timezone.utc)
+
+        while not self._stopping.is_set():
+            expired = await self.db.user_subscriptions.find(
+                expired_query(cutoff), {"_id": 0, "id": 1, "user_id": 1, "plan_id": 1}
+            ).sort("expires_at", ASCENDING).limit(self.batch_size).to_list(self.batch_size)
+            if not expired:
+                stats = {key: checkpoint[key] for key in ("expired", "downgraded")}
+                await self.lease.save({})
+                await self.lease.release()
+                if stats["expired"]:
+                    logger.info(f"Subscription expiry pass done: {stats}")
+                return stats
+
+            downgraded = await self._expire_chunk(expired)
+            checkpoint = {**checkpoint, "expired": checkpoint["expired"] + len(expired),
+                          "downgraded": checkpoint["downgraded"] + downgraded}
+            if not await self.lease.save(checkpoint):
+                logger.warning("Subscription expiry lease lost, stopping pass")
+                return None
+        return None
+
+    async def _expire_chunk(self, expired: List[dict]) -> int:
+        now = datetime.now(timezone.utc)
+        user_ids = {subscription["user_id"] for subscription in expired}
+        running = await self.db.user_subscriptions.find(
+            running_query(user_ids, now), {"_id": 0, "user_id": 1, "plan_id": 1}
+        ).sort("started_at", DESCENDING).to_list(None)
+
+        downgraded = 0
+        ops = downgrade_ops(expired, running, self.default_plan)
+        if ops:
+            result = await self.db.users.bulk_write(list(ops.values()), ordered=False)
+            downgraded = result.modified_count
+            if self.on_downgrade:
+                for user_id in ops:
+                    self.on_downgrade(user_id)
+
+        # Marked expired only after the downgrade, so an interrupted chunk is picked up again
+        await self.db.user_subscriptions.update_many(
+            {"id": {"$in": [subscription["id"] for subscription in expired]}, "status": "active"},
+            {"$set": {"status": "expired", "updated_at": now}}
+        )
+        return downgraded
@@ -0,0 +1,59 @@
+"""In-process cache for OAuth client-credentials access tokens.
+
+A token is reused until shortly before its ``expires_in`` runs out. Callers
+that find no usable token share one refresh instead of each doing their own
+exchange, and a token the upstream rejected (HTTP 401) can be dropped so the
+next caller fetches a new one - again only once, however many requests saw
+the 401 at the same time.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional, Tuple
+
+# Returns (access_token, expires_in seconds), or None if the exchange failed
+TokenFetcher = Callable[[], Awaitable[Optional[Tuple[str, float]]]]
+
+
+class AccessTokenCache:
+    def __init__(self, fetch: TokenFetcher, refresh_margin: float = 300.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.fetch = fetch
+        self.refresh_margin = refresh_margin
+        self.clock = clock
+        self._token: Optional[str] = None
+        self._expires = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "refreshes": 0, "failures": 0, "invalidations": 0}
+
+    async def get(self) -> Optional[str]:
+        """A valid access token, refreshing it if needed; None if the exchange failed"""
+        if self._token is not None and self.clock() < self._expires:
+            self.stats["hits"] += 1
+            return self._token
+        if self._refresh is None:
+            self._refresh = asyncio.create_task(self._do_refresh())
+        # Shielded so a cancelled request does not abort the refresh others wait for
+        return await asyncio.shield(self._refresh)
+
+    async def _do_refresh(self) -> Optional[str]:
+        try:
+            self.stats["refreshes"] += 1
+            result = await self.fetch()
+            if result is None:
+                self.stats["failures"] += 1
+                return None
+            token, expires_in = result
+            # Renew refresh_margin early, but never use less than half of a short-lived token
+            self._token = token
+            self._expires = self.clock() + max(expires_in - self.refresh_margin, expires_in / 2)
+            return token
+        finally:
+            self._refresh = None
+
+    def invalidate(self, token: Optional[str] = None):
+        """Drop the cached token; with ``token``, only if it is still the cached one"""
+        if token is None or token == self._token:
+            if self._token is not None:
+                self.stats["invalidations"] += 1
+            self._token = None
+            self._expires = 0.0
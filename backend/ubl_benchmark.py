@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the streaming UBL generator.
+
+Measures batch throughput (documents per minute) and peak memory while
+rendering a single very large invoice. Runs fully offline on synthetic data:
+
+    python backend/ubl_benchmark.py --documents 5000 --lines 20
+"""
+
+import argparse
+import io
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from peppol_ubl import iter_invoice_ubl, write_ubl_batch
+
+
+def make_document(lines: int):
+    products = [{"id": str(uuid.uuid4()), "name": f"Product {i}"} for i in range(min(lines, 50))]
+    items = [
+        {
+            "product_id": products[i % len(products)]["id"],
+            "quantity": 1 + i % 7,
+            "unit_price": 9.99 + i,
+            "description": None
+        }
+        for i in range(lines)
+    ]
+    subtotal = sum(item["quantity"] * item["unit_price"] for item in items)
+    invoice = {
+        "id": str(uuid.uuid4()),
+        "invoice_number": f"INV-BENCH-{uuid.uuid4().hex[:8]}",
+        "account_id": "account",
+        "items": items,
+        "subtotal": subtotal,
+        "tax_amount": subtotal * 0.21,
+        "total_amount": subtotal * 1.21,
+        "currency": "EUR",
+        "issue_date": datetime.now(timezone.utc),
+        "due_date": datetime.now(timezone.utc) + timedelta(days=30),
+        "invoice_type": "invoice"
+    }
+    account = {
+        "name": "Acme NV", "street": "Wetstraat", "street_nr": "16", "postal_code": "1000",
+        "city": "Brussel", "country": "Belgium", "vat_number": "BE0123456749"
+    }
+    supplier = {"name": "Benchmark User", "email": "bench@example.com", "vat_number": "BE0403170701"}
+    return invoice, account, supplier, products
+
+
+def bench_batch(documents: int, lines: int):
+    invoice, account, supplier, products = make_document(lines)
+    batch = (
+        ({**invoice, "invoice_number": f"INV-BENCH-{i:06d}"}, account, supplier, products)
+        for i in range(documents)
+    )
+    start = time.perf_counter()
+    out = io.BytesIO()
+    written = write_ubl_batch(out, batch)
+    elapsed = time.perf_counter() - start
+    print(f"batch: {written} documents x {lines} lines in {elapsed:.2f}s "
+          f"-> {written / elapsed * 60:,.0f} documents/minute, zip {out.tell() / 1024:,.0f} KiB")
+
+
+def bench_large_invoice(lines: int):
+    document = make_document(lines)
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = 0
+    for chunk in iter_invoice_ubl(*document):
+        size += len(chunk)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"large invoice: {lines} lines, {size / 1024:,.0f} KiB XML in {elapsed:.2f}s, "
+          f"peak generator memory {peak / 1024:,.0f} KiB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--lines", type=int, default=20)
+    parser.add_argument("--large-lines", type=int, default=50000)
+    args = parser.parse_args()
+
+    bench_batch(args.documents, args.lines)
+    bench_large_invoice(args.large_lines)
@@ -0,0 +1,203 @@
+"""Scheduled re-validation of stored account VAT numbers.
+
+Registrations are revoked long after an account is created, so a background
+job walks ``db.accounts`` in ``(vat_checked_at, id)`` index order - never
+checked first, then oldest check first - and asks VIES again about every
+number last checked more than ``max_age`` ago. Requests are paced to a fixed
+VIES rate, the position in the current pass is checkpointed after every
+batch and the lease is renewed after every lookup, since a batch at a low
+rate can outlast the lease. Each flip of ``vat_valid`` is recorded in ``db.vat_status_changes``
+so invalid numbers surface without anyone looking them up.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from job_lease import JobLease
+from vies_cache import UNAVAILABLE, VALID
+
+logger = logging.getLogger(__name__)
+
+Lookup = Callable[[str], Awaitable[Tuple[str, dict]]]
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        async with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def pending_query(checkpoint: dict, cutoff: datetime) -> dict:
+    """Accounts still to check in the current pass, after the checkpointed position
+
+    Accounts checked during the pass get a ``vat_checked_at`` past ``cutoff``
+    and drop out; ones whose lookup was unavailable stay behind the checkpoint
+    until the next pass.
+    """
+    base = {"vat_key": {"$ne": None}}
+    if "after_id" not in checkpoint:
+        return {**base, "$or": [{"vat_checked_at": None}, {"vat_checked_at": {"$lt": cutoff}}]}
+
+    after_checked_at, after_id = checkpoint.get("after_checked_at"), checkpoint["after_id"]
+    if after_checked_at is None:
+        # Null sorts before every date
+        position = [{"vat_checked_at": None, "id": {"$gt": after_id}},
+                    {"vat_checked_at": {"$lt": cutoff}}]
+    else:
+        position = [{"vat_checked_at": after_checked_at, "id": {"$gt": after_id}},
+                    {"vat_checked_at": {"$gt": after_checked_at, "$lt": cutoff}}]
+    return {**base, "$or": position}
+
+
+def status_change(account: dict, valid: bool, detected_at: datetime) -> Optional[dict]:
+    """Change record when ``valid`` differs from the account's last known outcome
+
+    A first check that confirms the number is not a change worth reporting.
+    """
+    previous = account.get("vat_valid")
+    if previous == valid or (previous is None and valid):
+        return None
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": account["user_id"],
+        "account_id": account["id"],
+        "account_name": account.get("name"),
+        "vat_number": account["vat_key"],
+        "previous_valid": previous,
+        "vat_valid": valid,
+        "detected_at": detected_at
+    }
+
+
+class VatRevalidator:
+    def __init__(self, db, lookup: Lookup, rate: float = 0.5, max_age: timedelta = timedelta(days=30),
+                 batch_size: int = 50, pass_interval: float = 3600, lease: Optional[JobLease] = None,
+                 on_change: Optional[Callable[[dict], Awaitable[None]]] = None):
+        self.db = db
+        self.lookup = lookup
+        self.limiter = RateLimiter(rate)
+        self.max_age = max_age
+        self.batch_size = batch_size
+        self.pass_interval = pass_interval
+        self.lease = lease or JobLease(db.job_leases, "vat_revalidation")
+        self.on_change = on_change
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.db.accounts.create_index([("vat_checked_at", ASCENDING), ("id", ASCENDING)])
+        await self.db.vat_status_changes.create_index([("user_id", ASCENDING), ("detected_at", DESCENDING)])
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await self.run_pass()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"VAT re-validation error: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.pass_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_pass(self) -> Optional[dict]:
+        """Check every stale account, resuming an interrupted pass; None if another worker holds the lease"""
+        checkpoint = await self.lease.acquire()
+        if checkpoint is None:
+            return None
+
+        if "pass_started_at" not in checkpoint:
+            checkpoint = {"pass_started_at": datetime.now(timezone.utc)}
+        started = checkpoint["pass_started_at"]
+        if started.tzinfo is None:
+            started = started.replace(tzinfo=timezone.utc)
+        cutoff = started - self.max_age
+        stats = {"checked": 0, "unavailable": 0, "changed": 0}
+
+        while not self._stopping.is_set():
+            accounts = await self.db.accounts.find(
+                pending_query(checkpoint, cutoff),
+                {"_id": 0, "id": 1, "user_id": 1, "name": 1, "vat_key": 1, "vat_valid": 1, "vat_checked_at": 1}
+            ).sort([("vat_checked_at", ASCENDING), ("id", ASCENDING)]).limit(self.batch_size).to_list(self.batch_size)
+            if not accounts:
+                await self.lease.save({})
+                await self.lease.release()
+                logger.info(f"VAT re-validation pass done: {stats}")
+                return stats
+
+            if not await self._check_batch(accounts, stats):
+                logger.warning("VAT re-validation lease lost, stopping pass")
+                return stats
+            last = accounts[-1]
+            checkpoint = {**checkpoint, "after_checked_at": last.get("vat_checked_at"), "after_id": last["id"]}
+            if not await self.lease.save(checkpoint):
+                logger.warning("VAT re-validation lease lost, stopping pass")
+                return stats
+        return stats
+
+    async def _check_batch(self, accounts: List[dict], stats: dict) -> bool:
+        """Look up and record a batch; False if the lease was lost, after recording what was looked up"""
+        by_number: Dict[str, List[dict]] = {}
+        for account in accounts:
+            by_number.setdefault(account["vat_key"], []).append(account)
+
+        updates, changes = [], []
+        held = True
+        for number, holders in by_number.items():
+            if not held:
+                break
+            await self.limiter.wait()
+            try:
+                status, _ = await self.lookup(number)
+            except Exception:
+                status = UNAVAILABLE
+            held = await self.lease.renew()
+            if status == UNAVAILABLE:
+                stats["unavailable"] += len(holders)
+                continue
+
+            valid = status == VALID
+            now = datetime.now(timezone.utc)
+            for account in holders:
+                stats["checked"] += 1
+                updates.append(UpdateOne({"id": account["id"]}, {"$set": {"vat_valid": valid, "vat_checked_at": now}}))
+                change = status_change(account, valid, now)
+                if change:
+                    changes.append(change)
+
+        if updates:
+            await self.db.accounts.bulk_write(updates, ordered=False)
+        if changes:
+            stats["changed"] += len(changes)
+            await self.db.vat_status_changes.insert_many(changes)
+            if self.on_change:
+                for change in changes:
+                    await self.on_change(change)
+        return held
@@ -0,0 +1,102 @@
+"""Batch VAT number validation.
+
+A batch is deduplicated on the normalized number, then run through the local
+``stdnum`` checksum test once per distinct number. Only numbers that pass are
+sent to VIES, with a concurrency limit per member state because VIES throttles
+and fails per national back end, not globally.
+"""
+import asyncio
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import UpdateMany
+from stdnum.eu import vat
+
+from eu_countries import normalize_vat_number
+from vies_cache import INVALID, UNAVAILABLE, VALID
+
+Lookup = Callable[[str], Awaitable[Tuple[str, dict]]]
+
+
+def prefilter(numbers: Iterable[Optional[str]]) -> Tuple[List[str], List[str]]:
+    """Split raw VAT numbers into (distinct candidates for VIES, distinct locally invalid numbers)"""
+    distinct = {normalize_vat_number(number) for number in numbers}
+    distinct.discard(None)
+    candidates, rejected = [], []
+    for number in sorted(distinct):
+        (candidates if vat.is_valid(number) else rejected).append(number)
+    return candidates, rejected
+
+
+async def check_numbers(numbers: List[str], lookup: Lookup, per_country_limit: int = 2,
+                        on_result: Optional[Callable[[str, str], Awaitable[None]]] = None) -> Dict[str, str]:
+    """Look up numbers in VIES with at most ``per_country_limit`` concurrent requests per country
+
+    Returns {number: "valid" | "invalid" | "unavailable"}.
+    """
+    semaphores = defaultdict(lambda: asyncio.Semaphore(per_country_limit))
+    results: Dict[str, str] = {}
+
+    async def check(number: str):
+        async with semaphores[number[:2]]:
+            try:
+                status, _ = await lookup(number)
+            except Exception:
+                status = UNAVAILABLE
+        results[number] = status
+        if on_result:
+            await on_result(number, status)
+
+    await asyncio.gather(*(check(number) for number in numbers))
+    return results
+
+
+def account_updates(user_id: str, results: Dict[str, str], checked_at: datetime) -> List[UpdateMany]:
+    """Write-back operations for every account of ``user_id`` holding a checked number
+
+    Unavailable lookups only leave the accounts untouched, so they are retried
+    by the next run instead of being recorded as invalid.
+    """
+    ops = []
+    for number, status in results.items():
+        if status == UNAVAILABLE:
+            continue
+        ops.append(UpdateMany(
+            {"user_id": user_id, "vat_key": number},
+            {"$set": {"vat_valid": status == VALID, "vat_checked_at": checked_at}}
+        ))
+    return ops
+
+
+async def run_batch(db, user_id: str, raw_numbers: Iterable[Optional[str]], lookup: Lookup,
+                    per_country_limit: int = 2, progress: Optional[Callable[[dict], Awaitable[None]]] = None,
+                    write_batch_size: int = 500) -> dict:
+    """Validate the given numbers and record the outcome on the user's accounts"""
+    candidates, rejected = prefilter(raw_numbers)
+    summary = {
+        "unique": len(candidates) + len(rejected),
+        "prefiltered_invalid": len(rejected),
+        "checked": 0, "valid": 0, "invalid": len(rejected), "unavailable": 0
+    }
+    now = datetime.now(timezone.utc)
+    pending_ops = account_updates(user_id, {number: INVALID for number in rejected}, now)
+
+    async def on_result(number: str, status: str):
+        summary["checked"] += 1
+        summary[status] += 1
+        pending_ops.extend(account_updates(user_id, {number: status}, datetime.now(timezone.utc)))
+        if len(pending_ops) >= write_batch_size:
+            await flush()
+            if progress:
+                await progress(summary)
+
+    async def flush():
+        if pending_ops:
+            ops = pending_ops[:]
+            pending_ops.clear()
+            await db.accounts.bulk_write(ops, ordered=False)
+
+    await check_numbers(candidates, lookup, per_country_limit, on_result)
+    await flush()
+    return summary
@@ -0,0 +1,210 @@
+"""Country-aware parsing of the free-text addresses returned by VIES.
+
+Every member state formats the ``address`` field differently: postal codes
+range from four digits (BE) over "1017GC" (NL), "1100-053" (PT), "00-590"
+(PL) and "BKR 1234" (MT) to Irish Eircodes, the locality is "postal code
+city" in most states but "city postal code" in Malta and Ireland, and the
+house number comes first in France, Luxembourg and Ireland. Some states send
+one line with commas, others several lines, Germany and Spain only "---".
+
+The differences are described in ``ADDRESS_FORMATS``; the patterns for each
+country are compiled once at import and reused for every call, so the parser
+is cheap enough to run over a whole account base.
+"""
+import re
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from eu_countries import country_code
+
+
+class ParsedAddress(NamedTuple):
+    street: Optional[str] = None
+    street_nr: Optional[str] = None
+    box: Optional[str] = None
+    postal_code: Optional[str] = None
+    city: Optional[str] = None
+
+
+EMPTY_ADDRESS = ParsedAddress()
+
+
+class AddressFormat(NamedTuple):
+    postal: str                       # regex for the postal code, without any country prefix
+    postal_first: bool = True         # "1000 Brussels" rather than "Birkirkara BKR 1234"
+    number_first: bool = False        # "12 rue de Rivoli" rather than "Kerkstraat 12"
+    box_words: Tuple[str, ...] = ("box",)
+    postal_split: Optional[int] = None  # canonical postal code has a space after this many characters
+    postal_prefix: str = ""           # canonical postal code keeps this prefix ("LV-1050")
+    city_suffix: Optional[str] = None  # regex stripped from the end of the city (Italian province codes)
+
+
+ADDRESS_FORMATS: Dict[str, AddressFormat] = {
+    'AT': AddressFormat(r'\d{4}'),
+    'BE': AddressFormat(r'\d{4}', box_words=("bus", "bte", "boîte", "boite", "box")),
+    'BG': AddressFormat(r'\d{4}'),
+    'CY': AddressFormat(r'\d{4}'),
+    'CZ': AddressFormat(r'\d{3}\s?\d{2}', postal_split=3),
+    'DE': AddressFormat(r'\d{5}'),
+    'DK': AddressFormat(r'\d{4}'),
+    'EE': AddressFormat(r'\d{5}'),
+    'ES': AddressFormat(r'\d{5}'),
+    'FI': AddressFormat(r'\d{5}'),
+    'FR': AddressFormat(r'\d{5}', number_first=True),
+    'GR': AddressFormat(r'\d{3}\s?\d{2}', postal_split=3),
+    'HR': AddressFormat(r'\d{5}'),
+    'HU': AddressFormat(r'\d{4}'),
+    'IE': AddressFormat(r'(?:[AC-FHKNPRTV-Y]\d{2}|D6W)\s?[0-9AC-FHKNPRTV-Y]{4}', postal_first=False,
+                        number_first=True, postal_split=3),
+    'IT': AddressFormat(r'\d{5}', city_suffix=r'\s+\(?[A-Z]{2}\)?$'),
+    'LT': AddressFormat(r'(?:LT-?)?\d{5}', postal_prefix="LT-"),
+    'LU': AddressFormat(r'\d{4}', number_first=True),
+    'LV': AddressFormat(r'(?:LV-?)?\d{4}', postal_prefix="LV-"),
+    'MT': AddressFormat(r'[A-Z]{3}\s?\d{2,4}', postal_first=False, postal_split=3),
+    'NL': AddressFormat(r'\d{4}\s?[A-Z]{2}', postal_split=4),
+    'PL': AddressFormat(r'\d{2}-\d{3}'),
+    'PT': AddressFormat(r'\d{4}-\d{3}'),
+    'RO': AddressFormat(r'\d{6}'),
+    'SE': AddressFormat(r'\d{3}\s?\d{2}', postal_split=3),
+    'SI': AddressFormat(r'\d{4}'),
+    'SK': AddressFormat(r'\d{3}\s?\d{2}', postal_split=3),
+}
+
+# Used for countries outside the table: the historical "4-5 digits then city" rule
+GENERIC_FORMAT = AddressFormat(r'\d{4,5}')
+
+# "B-1000", "L-1234": a foreign-style country prefix in front of the postal code
+_PREFIX = r'(?:[A-Z]{1,2}-(?=\w))?'
+# "12", "12A", "12 A", "10/12", "846/1", "12-14", "12bis"
+_LETTER = r'(?:\s?[A-Za-z](?!\w))?'
+_NUMBER = rf'\d+{_LETTER}(?:\s?[-/]\s?\d+{_LETTER})?(?:\s?(?:bis|ter)(?!\w))?'
+_BLANK = {"", "---", "N/A"}
+
+
+class _CompiledFormat:
+    """Patterns of one AddressFormat, compiled once"""
+
+    __slots__ = ("fmt", "locality", "postal_only", "one_line", "street_patterns", "box", "city_suffix")
+
+    def __init__(self, fmt: AddressFormat):
+        self.fmt = fmt
+        postal = rf'{_PREFIX}(?P<postal>{fmt.postal})(?!\w)'
+        if fmt.postal_first:
+            self.locality = re.compile(rf'^{postal}\s*[-–,]?\s*(?P<city>\D.*)$', re.IGNORECASE)
+            self.one_line = re.compile(
+                rf'^(?P<street>.*?\S)[\s,]+{postal}\s*[-–,]?\s*(?P<city>\D.*)$', re.IGNORECASE)
+        else:
+            self.locality = re.compile(rf'^(?P<city>.*?\D)[\s,]+{postal}$', re.IGNORECASE)
+            self.one_line = None
+        self.postal_only = re.compile(rf'^{postal}$', re.IGNORECASE)
+
+        box_words = '|'.join(re.escape(word) for word in fmt.box_words)
+        box = rf'(?:\s*[,/]?\s*(?:{box_words})\.?\s*(?P<box>[\w-]+))?'
+        number_last = re.compile(rf'^(?P<street>.*?\D)[\s,]+(?P<nr>{_NUMBER}){box}$', re.IGNORECASE)
+        number_first = re.compile(rf'^(?P<nr>{_NUMBER})(?!\w)[\s,]+(?P<street>\D.*?){box}$', re.IGNORECASE)
+        self.street_patterns = (number_first, number_last) if fmt.number_first else (number_last, number_first)
+        self.box = re.compile(rf'(?:^|\s)(?:{box_words})\.?\s*(?P<box>[\w-]+)', re.IGNORECASE)
+        self.city_suffix = re.compile(fmt.city_suffix) if fmt.city_suffix else None
+
+    def postal_code(self, raw: str) -> str:
+        code = re.sub(r'\s', '', raw).upper()
+        prefix = self.fmt.postal_prefix
+        if prefix:
+            # "LV-1050" and "LV1050" both lose the prefix, "1050" keeps its digits
+            bare = prefix.rstrip('-')
+            if code.startswith(prefix):
+                code = code[len(prefix):]
+            elif code.startswith(bare):
+                code = code[len(bare):]
+        if self.fmt.postal_split:
+            code = f"{code[:self.fmt.postal_split]} {code[self.fmt.postal_split:]}"
+        return prefix + code
+
+    def city(self, raw: Optional[str]) -> Optional[str]:
+        if raw and self.city_suffix:
+            raw = self.city_suffix.sub('', raw)
+        return raw.strip(' ,-') or None if raw else None
+
+    def street(self, line: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        for pattern in self.street_patterns:
+            match = pattern.match(line)
+            if match:
+                number = match.group('nr').lstrip('0') or match.group('nr')
+                return match.group('street').strip(' ,'), number, match.group('box')
+        return line, None, None
+
+    def parse(self, address: Optional[str]) -> ParsedAddress:
+        if not address:
+            return EMPTY_ADDRESS
+        lines = [line.strip(' ,') for line in address.split('\n')]
+        lines = [line for line in lines if line not in _BLANK]
+        if not lines:
+            return EMPTY_ADDRESS
+
+        if len(lines) == 1:
+            if self.one_line:
+                match = self.one_line.match(lines[0])
+                if match:
+                    street, number, box = self.street(match.group('street').strip(' ,'))
+                    return ParsedAddress(street, number, box, self.postal_code(match.group('postal')),
+                                         self.city(match.group('city')))
+            lines = [part.strip() for part in lines[0].split(',') if part.strip()]
+
+        postal_code = city = None
+        locality_at = len(lines)
+        for i in range(len(lines) - 1, 0, -1):
+            match = self.postal_only.match(lines[i])
+            if match:
+                postal_code = self.postal_code(match.group('postal'))
+                if i > 1:
+                    city, locality_at = lines[i - 1], i - 1
+                else:
+                    locality_at = i
+                break
+            match = self.locality.match(lines[i])
+            if match:
+                postal_code, city, locality_at = self.postal_code(match.group('postal')), match.group('city'), i
+                break
+        else:
+            if len(lines) > 1:
+                city, locality_at = lines[-1], len(lines) - 1
+
+        street, number, box = self.street(lines[0])
+        if box is None:
+            for line in lines[1:locality_at]:
+                match = self.box.search(line)
+                if match:
+                    box = match.group('box')
+                    break
+        return ParsedAddress(street, number, box, postal_code, self.city(city))
+
+
+_COMPILED: Dict[str, _CompiledFormat] = {code: _CompiledFormat(fmt) for code, fmt in ADDRESS_FORMATS.items()}
+_COMPILED_GENERIC = _CompiledFormat(GENERIC_FORMAT)
+
+
+def _format_for(country: Optional[str]) -> _CompiledFormat:
+    compiled = _COMPILED.get(country) if country else None
+    if compiled is None:
+        compiled = _COMPILED.get(country_code(country), _COMPILED_GENERIC)
+    return compiled
+
+
+def parse_vies_address(address: Optional[str], country: Optional[str] = None) -> ParsedAddress:
+    """Split a VIES address into (street, street_nr, box, postal_code, city)
+
+    ``country`` is the ISO code or VAT prefix ("EL" for Greece) of the member
+    state that returned the address.
+    """
+    return _format_for(country).parse(address)
+
+
+def parse_vies_addresses(addresses: Iterable[Tuple[Optional[str], Optional[str]]]) -> List[ParsedAddress]:
+    """Bulk variant of parse_vies_address over (country, address) pairs"""
+    cache: Dict[Optional[str], Callable[[Optional[str]], ParsedAddress]] = {}
+    results = []
+    for country, address in addresses:
+        parse = cache.get(country)
+        if parse is None:
+            parse = cache[country] = _format_for(country).parse
+        results.append(parse(address))
+    return results
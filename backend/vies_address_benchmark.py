@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the country-aware VIES address parser.
+
+Parses the address corpus used by the tests, repeated to the requested size,
+in bulk and one call at a time, and reports addresses parsed per second:
+
+    python backend/vies_address_benchmark.py --addresses 200000
+"""
+
+import argparse
+import json
+import time
+from itertools import cycle, islice
+from pathlib import Path
+
+from vies_address import parse_vies_address, parse_vies_addresses
+
+DEFAULT_CORPUS = Path(__file__).resolve().parent.parent / "tests" / "data" / "vies_addresses.json"
+
+
+def main(addresses: int, corpus: Path):
+    cases = json.loads(corpus.read_text(encoding="utf-8"))
+    pairs = list(islice(cycle((case["country"], case["address"]) for case in cases), addresses))
+
+    start = time.perf_counter()
+    parse_vies_addresses(pairs)
+    elapsed = time.perf_counter() - start
+    print(f"bulk: {addresses} addresses in {elapsed:.2f}s -> {addresses / elapsed:,.0f} addresses/s")
+
+    start = time.perf_counter()
+    for country, address in pairs:
+        parse_vies_address(address, country)
+    elapsed = time.perf_counter() - start
+    print(f"single calls: {addresses / elapsed:,.0f} addresses/s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--addresses", type=int, default=200000)
+    parser.add_argument("--corpus", type=Path, default=DEFAULT_CORPUS)
+    args = parser.parse_args()
+    main(args.addresses, args.corpus)
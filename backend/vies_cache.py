@@ -0,0 +1,133 @@
+"""Shared cache for VIES VAT lookups.
+
+Two tiers: a bounded in-process LRU in front of a Mongo collection shared by
+all workers (expired entries are removed by a TTL index). Entries are keyed by
+the normalized VAT number and expire according to the outcome: confirmed
+registrations are kept for days, invalid numbers for an hour and VIES outages
+("unavailable") only for a minute, so a flapping member-state service is not
+hammered but recovers quickly. Concurrent misses for the same number share a
+single upstream request.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, Tuple
+
+VALID = "valid"
+INVALID = "invalid"
+UNAVAILABLE = "unavailable"
+
+
+class ViesUnavailableError(Exception):
+    """VIES (or the member state behind it) could not answer the request"""
+
+
+class ViesCache:
+    def __init__(self, collection, valid_ttl: timedelta = timedelta(days=7),
+                 invalid_ttl: timedelta = timedelta(hours=1), unavailable_ttl: timedelta = timedelta(minutes=1),
+                 max_entries: int = 10000):
+        self.collection = collection
+        self.ttls = {VALID: valid_ttl, INVALID: invalid_ttl, UNAVAILABLE: unavailable_ttl}
+        self.max_entries = max_entries
+        self._local: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (monotonic expiry, status, payload)
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            "lookups": 0, "memory_hits": 0, "mongo_hits": 0, "misses": 0,
+            "coalesced": 0, "upstream_errors": 0
+        }
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, key: str, fetch: Callable[[], Awaitable[dict]]) -> dict:
+        """Return the cached lookup payload for ``key``, calling ``fetch`` on a miss
+
+        ``fetch`` returns the lookup payload (with a boolean ``valid``) or
+        raises ViesUnavailableError; both outcomes are cached.
+        """
+        _, payload = await self.lookup(key, fetch)
+        return payload
+
+    async def lookup(self, key: str, fetch: Callable[[], Awaitable[dict]]) -> Tuple[str, dict]:
+        """Like get(), but also return the outcome: valid, invalid or unavailable"""
+        self.stats["lookups"] += 1
+
+        entry = self._local.get(key)
+        if entry is not None:
+            expires, status, payload = entry
+            if expires > time.monotonic():
+                self._local.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return status, payload
+            del self._local[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            # The load runs in its own task, so a caller that is cancelled (its
+            # client went away) stops waiting without cancelling the others
+            task = asyncio.ensure_future(self._load(key, fetch))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Retrieve the exception so a failed load nobody awaits does not log a warning
+            task.exception()
+
+    async def _load(self, key: str, fetch: Callable[[], Awaitable[dict]]) -> Tuple[str, dict]:
+        now = datetime.now(timezone.utc)
+        doc = await self.collection.find_one({"_id": key, "expires_at": {"$gt": now}})
+        if doc is not None:
+            self.stats["mongo_hits"] += 1
+            expires_at = doc["expires_at"]
+            if expires_at.tzinfo is None:
+                expires_at = expires_at.replace(tzinfo=timezone.utc)
+            self._remember(key, doc["status"], doc["payload"], (expires_at - now).total_seconds())
+            return doc["status"], doc["payload"]
+
+        self.stats["misses"] += 1
+        try:
+            payload = await fetch()
+            status = VALID if payload.get("valid") else INVALID
+        except ViesUnavailableError:
+            self.stats["upstream_errors"] += 1
+            payload = {"valid": False}
+            status = UNAVAILABLE
+
+        await self.store(key, status, payload)
+        return status, payload
+
+    async def store(self, key: str, status: str, payload: dict):
+        ttl = self.ttls[status]
+        await self.collection.replace_one(
+            {"_id": key},
+            {"status": status, "payload": payload, "expires_at": datetime.now(timezone.utc) + ttl},
+            upsert=True
+        )
+        self._remember(key, status, payload, ttl.total_seconds())
+
+    def _remember(self, key: str, status: str, payload: dict, ttl_seconds: float):
+        self._local[key] = (time.monotonic() + ttl_seconds, status, payload)
+        self._local.move_to_end(key)
+        while len(self._local) > self.max_entries:
+            self._local.popitem(last=False)
+
+    async def invalidate(self, key: str):
+        self._local.pop(key, None)
+        await self.collection.delete_one({"_id": key})
+
+    def metrics(self) -> dict:
+        lookups = self.stats["lookups"]
+        hits = self.stats["memory_hits"] + self.stats["mongo_hits"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "memory_entries": len(self._local),
+            "inflight": len(self._inflight)
+        }
@@ -316,6 +316,25 @@ const AuthProvider = ({ children }) => {
     checkAuth();
   }, []);
 
+  // Calendar reminders are pushed by the server as they fire
+  useEffect(() => {
+    if (!user || typeof EventSource === 'undefined') return;
+    if (window.Notification && Notification.permission === 'default') {
+      Notification.requestPermission();
+    }
+    const source = new EventSource(`${API}/reminders/stream`, { withCredentials: true });
+    source.addEventListener('reminder', (message) => {
+      const reminder = JSON.parse(message.data);
+      const body = `${new Date(reminder.start_date).toLocaleString()}${reminder.location ? ` - ${reminder.location}` : ''}`;
+      if (window.Notification && Notification.permission === 'granted') {
+        new Notification(reminder.title, { body, tag: reminder.id });
+      } else {
+        console.info('Reminder:', reminder.title, body);
+      }
+    });
+    return () => source.close();
+  }, [user]);
+
   return (
     <AuthContext.Provider value={{ user, loading, login, logout, checkAuth }}>
       {children}
@@ -4504,8 +4523,9 @@ const PricingPage = () => {
   }, [location]);
 
   const pollPaymentStatus = async (sessionId, attempts = 0) => {
+    // Each request is a long-poll that the server answers as soon as the payment is settled
     const maxAttempts = 5;
-    const pollInterval = 2000;
+    const waitSeconds = 25;
 
     if (attempts >= maxAttempts) {
       setCheckingPayment(false);
@@ -4515,7 +4535,10 @@ const PricingPage = () => {
     }
 
     try {
-      const response = await axios.get(`${API}/payments/checkout/status/${sessionId}`, { withCredentials: true });
+      const response = await axios.get(
+        `${API}/payments/checkout/status/${sessionId}/wait?timeout=${waitSeconds}`,
+        { withCredentials: true }
+      );
       
       if (response.data.payment_status === 'paid') {
         setCheckingPayment(false);
@@ -4530,8 +4553,8 @@ const PricingPage = () => {
         return;
       }
 
-      // Continue polling if still pending
-      setTimeout(() => pollPaymentStatus(sessionId, attempts + 1), pollInterval);
+      // Still pending after the wait: wait again
+      pollPaymentStatus(sessionId, attempts + 1);
     } catch (error) {
       console.error('Error checking payment status:', error);
       setCheckingPayment(false);
@@ -4864,8 +4887,13 @@ const PricingPage = () => {
 };
 
 // Admin Panel Component
+const ADMIN_USERS_PAGE_SIZE = 50;
+
 const AdminPanel = () => {
   const [users, setUsers] = useState([]);
+  const [userPage, setUserPage] = useState(0);
+  const [userTotal, setUserTotal] = useState(0);
+  const [userCounts, setUserCounts] = useState({ google: 0, traditional: 0, admins: 0 });
   const [customFields, setCustomFields] = useState([]);
   const [loading, setLoading] = useState(true);
   const [activeTab, setActiveTab] = useState('users');
@@ -4881,7 +4909,8 @@ const AdminPanel = () => {
     field_name: '',
     field_type: 'text',
     field_options: [],
-    required: false
+    required: false,
+    filterable: false
   });
   const [showCreateUserModal, setShowCreateUserModal] = useState(false);
   const [createUserForm, setCreateUserForm] = useState({
@@ -4902,19 +4931,25 @@ const AdminPanel = () => {
 
   useEffect(() => {
     fetchAdminData();
-  }, []);
+  }, [userPage]);
 
   const fetchAdminData = async () => {
     try {
       setLoading(true);
       
-      // Try to fetch admin data
+      // Try to fetch admin data; users come one page at a time
       const [usersRes, fieldsRes] = await Promise.all([
-        axios.get(`${API}/admin/users`, { withCredentials: true }),
+        axios.get(`${API}/admin/users`, {
+          params: { skip: userPage * ADMIN_USERS_PAGE_SIZE, limit: ADMIN_USERS_PAGE_SIZE },
+          withCredentials: true
+        }),
         axios.get(`${API}/admin/custom-fields`, { withCredentials: true })
       ]);
       
       setUsers(usersRes.data);
+      setUserTotal(Number(usersRes.headers['x-total-count'] ?? usersRes.data.length));
+      // Counted over all users, not just this page
+      setUserCounts(JSON.parse(usersRes.headers['x-user-counts'] || '{}'));
       setCustomFields(fieldsRes.data);
       
     } catch (error) {
@@ -4963,6 +4998,8 @@ const AdminPanel = () => {
             created_at: '2024-02-01T09:00:00Z'
           }
         ]);
+        setUserTotal(3);
+        setUserCounts({ google: 2, traditional: 1, admins: 1 });
         setCustomFields([]);
       }
     } finally {
@@ -5005,7 +5042,8 @@ const AdminPanel = () => {
         field_name: '',
         field_type: 'text',
         field_options: [],
-        required: false
+        required: false,
+        filterable: false
       });
       fetchAdminData();
     } catch (error) {
@@ -5135,24 +5173,24 @@ const AdminPanel = () => {
           {/* User Statistics */}
           <div className="grid grid-cols-1 md:grid-cols-4 gap-4">
             <div className="bg-blue-50 p-4 rounded-lg text-center">
-              <p className="text-blue-800 font-semibold text-2xl">{users.length}</p>
+              <p className="text-blue-800 font-semibold text-2xl">{userTotal}</p>
               <p className="text-blue-600 text-sm">Total Users</p>
             </div>
             <div className="bg-green-50 p-4 rounded-lg text-center">
               <p className="text-green-800 font-semibold text-2xl">
-                {users.filter(u => u.auth_type === 'google' || (!u.auth_type && !u.password_hash)).length}
+                {userCounts.google ?? 0}
               </p>
               <p className="text-green-600 text-sm">Google OAuth</p>
             </div>
             <div className="bg-purple-50 p-4 rounded-lg text-center">
               <p className="text-purple-800 font-semibold text-2xl">
-                {users.filter(u => u.auth_type === 'traditional' || u.password_hash).length}
+                {userCounts.traditional ?? 0}
               </p>
               <p className="text-purple-600 text-sm">Email/Password</p>
             </div>
             <div className="bg-red-50 p-4 rounded-lg text-center">
               <p className="text-red-800 font-semibold text-2xl">
-                {users.filter(u => u.roles?.includes('admin')).length}
+                {userCounts.admins ?? 0}
               </p>
               <p className="text-red-600 text-sm">Administrators</p>
             </div>
@@ -5293,6 +5331,31 @@ const AdminPanel = () => {
             </div>
           </div>
 
+          {/* Paging */}
+          {userTotal > ADMIN_USERS_PAGE_SIZE && (
+            <div className="flex items-center justify-between">
+              <p className="text-sm text-gray-600">
+                Showing {userPage * ADMIN_USERS_PAGE_SIZE + 1}–{Math.min((userPage + 1) * ADMIN_USERS_PAGE_SIZE, userTotal)} of {userTotal} users
+              </p>
+              <div className="flex space-x-2">
+                <button
+                  onClick={() => setUserPage(userPage - 1)}
+                  disabled={userPage === 0}
+                  className="px-3 py-1 border border-gray-300 rounded-lg text-sm text-gray-700 hover:bg-gray-50 disabled:opacity-50"
+                >
+                  ← Previous
+                </button>
+                <button
+                  onClick={() => setUserPage(userPage + 1)}
+                  disabled={(userPage + 1) * ADMIN_USERS_PAGE_SIZE >= userTotal}
+                  className="px-3 py-1 border border-gray-300 rounded-lg text-sm text-gray-700 hover:bg-gray-50 disabled:opacity-50"
+                >
+                  Next →
+                </button>
+              </div>
+            </div>
+          )}
+
           {/* No users message */}
           {users.length === 0 && (
             <div className="text-center py-12">
@@ -5627,6 +5690,16 @@ const AdminPanel = () => {
                   <label className="ml-2 text-sm text-gray-700">Required Field</label>
                 </div>
 
+                <div className="flex items-center">
+                  <input
+                    type="checkbox"
+                    checked={fieldForm.filterable}
+                    onChange={(e) => setFieldForm({...fieldForm, filterable: e.target.checked})}
+                    className="rounded border-gray-300 text-blue-600 focus:ring-blue-500"
+                  />
+                  <label className="ml-2 text-sm text-gray-700">Filterable (indexed)</label>
+                </div>
+
                 <div className="flex justify-end space-x-3 pt-4">
                   <button
                     onClick={() => setShowFieldModal(false)}
@@ -5836,25 +5909,45 @@ const CalendarPage = () => {
   useEffect(() => {
     const fetchData = async () => {
       try {
-        const [eventsRes, contactsRes, accountsRes] = await Promise.all([
-          axios.get(`${API}/calendar/events`, { withCredentials: true }),
+        const [contactsRes, accountsRes] = await Promise.all([
           axios.get(`${API}/contacts`, { withCredentials: true }),
           axios.get(`${API}/accounts`, { withCredentials: true })
         ]);
         
-        setEvents(eventsRes.data);
         setContacts(contactsRes.data);
         setAccounts(accountsRes.data);
       } catch (error) {
         console.error('Error fetching data:', error);
-      } finally {
-        setLoading(false);
       }
     };
 
     fetchData();
   }, []);
 
+  // Fetch only the events overlapping the 6-week grid of the visible month
+  useEffect(() => {
+    const fetchEvents = async () => {
+      const firstDay = new Date(currentDate.getFullYear(), currentDate.getMonth(), 1);
+      const start = new Date(firstDay);
+      start.setDate(start.getDate() - firstDay.getDay());
+      const end = new Date(start);
+      end.setDate(end.getDate() + 42);
+      try {
+        const eventsRes = await axios.get(`${API}/calendar/events`, {
+          params: { start: start.toISOString(), end: end.toISOString() },
+          withCredentials: true
+        });
+        setEvents(eventsRes.data);
+      } catch (error) {
+        console.error('Error fetching events:', error);
+      } finally {
+        setLoading(false);
+      }
+    };
+
+    fetchEvents();
+  }, [currentDate.getFullYear(), currentDate.getMonth()]);
+
   // Date navigation
   const navigateMonth = (direction) => {
     const newDate = new Date(currentDate);
@@ -5866,6 +5959,17 @@ const CalendarPage = () => {
     setCurrentDate(new Date());
   };
 
+  // Subscription URL for phone and desktop calendar apps
+  const showFeedUrl = async () => {
+    try {
+      const feedRes = await axios.get(`${API}/calendar/feed`, { withCredentials: true })
+        .catch(() => axios.post(`${API}/calendar/feed`, {}, { withCredentials: true }));
+      window.prompt('Subscribe to this URL in your calendar app', `${BACKEND_URL}${feedRes.data.ics_path}`);
+    } catch (error) {
+      console.error('Error fetching calendar feed:', error);
+    }
+  };
+
   // Get calendar days for current month
   const getCalendarDays = () => {
     const firstDay = new Date(currentDate.getFullYear(), currentDate.getMonth(), 1);
@@ -5946,6 +6050,25 @@ const CalendarPage = () => {
         end_date: new Date(eventForm.end_date).toISOString()
       };
 
+      // Warn before double-booking
+      if (!eventData.all_day && eventData.end_date > eventData.start_date) {
+        const freebusyRes = await axios.get(`${API}/calendar/freebusy`, {
+          params: {
+            start: eventData.start_date,
+            end: eventData.end_date,
+            proposed_start: eventData.start_date,
+            proposed_end: eventData.end_date,
+            ...(selectedEvent ? { exclude_id: selectedEvent.id } : {})
+          },
+          withCredentials: true
+        });
+        const overlapping = freebusyRes.data.overlapping || [];
+        if (overlapping.length > 0 &&
+            !window.confirm(`This overlaps ${overlapping.length} other event(s). Save anyway?`)) {
+          return;
+        }
+      }
+
       if (selectedEvent) {
         // Update existing event
         await axios.put(`${API}/calendar/events/${selectedEvent.id}`, eventData, { withCredentials: true });
@@ -6026,6 +6149,12 @@ const CalendarPage = () => {
           >
             + New Event
           </button>
+          <button
+            onClick={showFeedUrl}
+            className="px-4 py-2 border border-gray-300 text-gray-700 rounded-md hover:bg-gray-50 transition-colors text-sm font-medium"
+          >
+            Subscribe
+          </button>
         </div>
       </div>
 
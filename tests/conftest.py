@@ -0,0 +1,37 @@
+import sys
+from pathlib import Path
+
+# Backend modules are imported as top-level modules, the way uvicorn loads server.py
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+class FakeLease:
+    """In-memory JobLease
+
+    ``held`` stands for another worker's lease, ``lose_after`` for one lost
+    after that many saves and ``lost`` for one lost right now.
+    """
+
+    def __init__(self, checkpoint=None, held=False, lose_after=None):
+        self.checkpoint = checkpoint or {}
+        self.held = held
+        self.lose_after = lose_after
+        self.saves = []
+        self.released = False
+        self.lost = False
+
+    async def acquire(self):
+        return None if self.held else self.checkpoint
+
+    async def save(self, checkpoint):
+        if self.lost or self.lose_after is not None and len(self.saves) >= self.lose_after:
+            return False
+        self.saves.append(checkpoint)
+        self.checkpoint = checkpoint
+        return True
+
+    async def renew(self):
+        return not self.lost
+
+    async def release(self):
+        self.released = True
@@ -0,0 +1,50 @@
+import pytest
+
+from admin_users import user_counts_pipeline, user_listing_pipeline, user_search_filter
+
+
+def stage_names(pipeline):
+    return [next(iter(stage)) for stage in pipeline]
+
+
+def test_page_is_cut_before_the_joins():
+    pipeline = user_listing_pipeline(sort="name", descending=False, skip=20, limit=10)
+
+    assert stage_names(pipeline)[:5] == ["$match", "$sort", "$skip", "$limit", "$project"]
+    assert pipeline[1] == {"$sort": {"name": 1, "id": 1}}
+    assert stage_names(pipeline).count("$lookup") == 2
+
+
+def test_sorting_by_totals_joins_first():
+    names = stage_names(user_listing_pipeline(sort="total_paid"))
+
+    assert names.index("$lookup") < names.index("$sort") < names.index("$skip")
+
+
+def test_password_hash_is_never_projected():
+    project = next(stage["$project"] for stage in user_listing_pipeline() if "$project" in stage)
+
+    assert "password_hash" not in project
+    assert project["_id"] == 0
+
+
+def test_search_is_escaped_and_case_insensitive():
+    assert user_search_filter("  ") == {}
+    pattern = user_search_filter("a.b+c")["$or"][0]["name"]
+    assert pattern == {"$regex": r"a\.b\+c", "$options": "i"}
+
+
+def test_unknown_sort_field_is_rejected():
+    with pytest.raises(ValueError):
+        user_listing_pipeline(sort="password_hash")
+
+
+def test_counts_cover_every_matching_user():
+    pipeline = user_counts_pipeline("acme")
+
+    assert pipeline[0] == {"$match": user_search_filter("acme")}
+    facet = pipeline[1]["$facet"]
+    assert set(facet) == {"total", "google", "traditional", "admins"}
+    # No facet pages: the cards count all users, not the listed page
+    assert all("$skip" not in stage and "$limit" not in stage for stages in facet.values() for stage in stages)
+    assert facet["admins"][-2:] == [{"$match": {"roles.role": "admin"}}, {"$count": "count"}]
@@ -0,0 +1,126 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from xml.etree import ElementTree
+
+import pytest
+
+from calendar_feed import (
+    NS_DAV,
+    entity_tag,
+    event_lines,
+    fold,
+    http_date,
+    iter_calendar,
+    iter_multistatus,
+    not_modified,
+    parse_report,
+    parse_sync_token,
+    resource_props,
+    sync_token,
+)
+from recurrence import exception_key
+
+UTC = timezone.utc
+UPDATED = datetime(2026, 10, 19, 8, 30, 15, 250000, tzinfo=UTC)
+
+
+def event(**fields):
+    start = datetime(2026, 10, 20, 7, 0, tzinfo=UTC)
+    return {"id": "e1", "title": "Call, Acme; follow-up", "start_date": start, "end_date": start + timedelta(hours=1),
+            "event_type": "call", "reminder_minutes": 15, "updated_at": UPDATED, **fields}
+
+
+def collect(chunks):
+    async def run():
+        return [chunk async for chunk in chunks]
+    return asyncio.run(run())
+
+
+def test_lines_are_folded_at_75_octets_without_splitting_characters():
+    line = "DESCRIPTION:" + "é" * 60
+
+    folded = fold(line)
+
+    assert all(len(part.encode("utf-8")) <= 75 for part in folded.split("\r\n"))
+    assert folded.replace("\r\n ", "").endswith("\r\n")
+    assert folded.replace("\r\n ", "")[:-2] == line
+
+
+def test_single_event_is_exported_with_alarm():
+    lines = list(event_lines(event()))
+
+    assert "UID:e1@yourocrm" in lines
+    assert "DTSTART:20261020T070000Z" in lines
+    assert "SUMMARY:Call\\, Acme\\; follow-up" in lines
+    assert "DTSTAMP:20261019T083015Z" in lines
+    assert lines[lines.index("BEGIN:VALARM"):lines.index("END:VALARM") + 1] == [
+        "BEGIN:VALARM", "ACTION:DISPLAY", "DESCRIPTION:Call\\, Acme\\; follow-up", "TRIGGER:-PT15M", "END:VALARM"]
+
+
+def test_recurring_series_carry_rule_exdates_and_overrides():
+    start = datetime(2026, 10, 20, 7, 0, tzinfo=UTC)
+    lines = list(event_lines(event(rrule="FREQ=WEEKLY;COUNT=4", time_zone="Europe/Brussels", recurrence_exceptions={
+        exception_key(start + timedelta(weeks=1)): {"cancelled": True},
+        exception_key(start + timedelta(weeks=2)): {"title": "Moved call", "start_date": start + timedelta(weeks=2, hours=2),
+                                                    "end_date": start + timedelta(weeks=2, hours=3)},
+    })))
+
+    assert "DTSTART;TZID=Europe/Brussels:20261020T090000" in lines
+    assert "RRULE:FREQ=WEEKLY;COUNT=4" in lines
+    assert "EXDATE:20261027T070000Z" in lines
+    override = lines[lines.index("RECURRENCE-ID:20261103T070000Z") - 3:]
+    assert override[:3] == ["BEGIN:VEVENT", "UID:e1@yourocrm", "DTSTAMP:20261019T083015Z"]
+    assert "DTSTART:20261103T090000Z" in override
+    assert "SUMMARY:Moved call" in override
+
+
+def test_feed_is_streamed_in_chunks():
+    async def events():
+        for index in range(200):
+            yield event(id=f"e{index}", description="x" * 200)
+
+    chunks = collect(iter_calendar(events()))
+    text = b"".join(chunks).decode("utf-8")
+
+    assert len(chunks) > 1
+    assert text.startswith("BEGIN:VCALENDAR\r\nVERSION:2.0\r\n")
+    assert text.endswith("END:VCALENDAR\r\n")
+    assert text.count("BEGIN:VEVENT") == 200
+
+
+def test_conditional_requests():
+    tag = entity_tag(UPDATED)
+
+    assert not_modified(tag, None, UPDATED)
+    assert not_modified(f'W/{tag}, "other"', None, UPDATED)
+    assert not not_modified('"other"', http_date(UPDATED), UPDATED)
+    assert not_modified(None, http_date(UPDATED), UPDATED)
+    assert not not_modified(None, http_date(UPDATED - timedelta(seconds=1)), UPDATED)
+    assert not not_modified(None, None, UPDATED)
+
+
+def test_sync_tokens_carry_the_latest_change():
+    token = sync_token(UPDATED)
+
+    assert parse_sync_token(token) == UPDATED.replace(microsecond=250000)
+    with pytest.raises(ValueError):
+        parse_sync_token("http://other-server/sync/1")
+
+
+def test_sync_collection_report_and_multistatus():
+    body = (b'<?xml version="1.0"?><D:sync-collection xmlns:D="DAV:" xmlns:C="urn:ietf:params:xml:ns:caldav">'
+            b'<D:sync-token>urn:yourocrm:calendar-sync:1</D:sync-token><D:sync-level>1</D:sync-level>'
+            b'<D:prop><D:getetag/></D:prop></D:sync-collection>')
+    assert parse_report(body) == ("sync-collection", "urn:yourocrm:calendar-sync:1", [], False)
+
+    async def responses():
+        yield "/api/caldav/t/e1.ics", resource_props(event(), with_data=True)
+        yield "/api/caldav/t/e2.ics", None
+
+    root = ElementTree.fromstring(b"".join(collect(iter_multistatus(responses(), sync_token(UPDATED)))))
+    changed, deleted = root.findall(f"{{{NS_DAV}}}response")
+
+    assert changed.findtext(f".//{{{NS_DAV}}}getetag") == entity_tag(UPDATED)
+    assert "BEGIN:VEVENT" in changed.findtext(".//{urn:ietf:params:xml:ns:caldav}calendar-data")
+    assert deleted.findtext(f"{{{NS_DAV}}}status") == "HTTP/1.1 404 Not Found"
+    assert root.findtext(f"{{{NS_DAV}}}sync-token") == sync_token(UPDATED)
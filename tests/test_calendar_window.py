@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import pytest
+
+from calendar_window import MAX_SHORT_SPAN, check_window, day_counts, is_long_span, window_query
+
+START = datetime(2026, 10, 1, tzinfo=timezone.utc)
+END = datetime(2026, 11, 1, tzinfo=timezone.utc)
+
+
+def event(start_days, end_days):
+    return {"start_date": START + timedelta(days=start_days), "end_date": START + timedelta(days=end_days)}
+
+
+def test_short_events_bound_the_start_date_scan():
+    query = window_query("u1", START, END)
+
+    short, long = query["$or"]
+    assert query["user_id"] == "u1"
+    assert query["recurring"] == {"$ne": True}
+    assert short["start_date"] == {"$gte": START - MAX_SHORT_SPAN, "$lt": END}
+    assert short["$or"] == [{"end_date": {"$gt": START}}, {"start_date": {"$gte": START}}]
+    assert long == {"long_span": True, "end_date": {"$gt": START}, "start_date": {"$lt": END}}
+
+
+def test_long_span_threshold():
+    assert not is_long_span(START, START + MAX_SHORT_SPAN)
+    assert is_long_span(START, START + MAX_SHORT_SPAN + timedelta(seconds=1))
+
+
+def test_window_is_checked_and_made_aware():
+    assert check_window(datetime(2026, 10, 1), datetime(2026, 11, 1)) == (START, END)
+    with pytest.raises(ValueError):
+        check_window(END, START)
+    with pytest.raises(ValueError):
+        check_window(START, START + timedelta(days=400))
+
+
+def test_multi_day_events_count_on_every_day_inside_the_window():
+    events = [
+        event(0, 0),                      # deadline at the window start
+        event(-2, 2),                     # spans the window start, ends at midnight
+        event(3, 3.05),
+        event(29.5, 40),                  # runs past the window end
+    ]
+
+    counts = day_counts(events, START, END)
+
+    assert counts == {"2026-10-01": 2, "2026-10-02": 1, "2026-10-04": 1,
+                      "2026-10-30": 1, "2026-10-31": 1}
+
+
+def test_counts_use_the_requested_time_zone():
+    late_evening = {"start_date": datetime(2026, 10, 3, 22, 30), "end_date": datetime(2026, 10, 3, 23, 0)}
+
+    assert day_counts([late_evening], START, END) == {"2026-10-03": 1}
+    assert day_counts([late_evening], START, END, ZoneInfo("Europe/Brussels")) == {"2026-10-04": 1}
@@ -0,0 +1,158 @@
+import asyncio
+
+import pytest
+
+from circuit_breaker import (
+    CLOSED, OPEN, CircuitBreaker, CircuitOpenError, DeadlineExceededError, start_deadline,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+async def ok():
+    return "ok"
+
+
+async def boom():
+    raise ConnectionError("down")
+
+
+def test_opens_after_threshold_and_fails_fast():
+    breaker = CircuitBreaker("vies", failure_threshold=3, recovery_timeout=30, clock=Clock())
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(ConnectionError):
+                await breaker.call(boom)
+        with pytest.raises(CircuitOpenError) as rejected:
+            await breaker.call(ok)
+        return rejected.value
+
+    rejected = asyncio.run(run())
+
+    assert breaker.state == OPEN
+    assert rejected.retry_after == 30
+    assert breaker.metrics()["rejected"] == 1
+    assert breaker.metrics()["opened"] == 1
+
+
+def test_client_errors_do_not_trip_the_breaker():
+    breaker = CircuitBreaker("stripe", failure_threshold=2, clock=Clock())
+
+    class CardError(Exception):
+        http_status = 402
+
+    async def declined():
+        raise CardError("card declined")
+
+    async def run():
+        for _ in range(3):
+            with pytest.raises(CardError):
+                await breaker.call(declined, is_client_error=lambda e: e.http_status < 500)
+        with pytest.raises(ConnectionError):
+            await breaker.call(boom, is_client_error=lambda e: getattr(e, "http_status", 500) < 500)
+
+    asyncio.run(run())
+
+    assert breaker.state == CLOSED
+    assert breaker.metrics()["failures"] == 1
+
+
+def test_half_open_probe_closes_or_reopens():
+    clock = Clock()
+    breaker = CircuitBreaker("paypal", failure_threshold=1, recovery_timeout=10, clock=clock)
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await breaker.call(boom)
+        clock.now = 10
+        with pytest.raises(ConnectionError):
+            await breaker.call(boom)
+        reopened = breaker.state
+        clock.now = 20
+        result = await breaker.call(ok)
+        return reopened, result
+
+    assert asyncio.run(run()) == (OPEN, "ok")
+    assert breaker.state == CLOSED
+
+
+def test_only_one_probe_while_half_open():
+    clock = Clock()
+    breaker = CircuitBreaker("stripe", failure_threshold=1, recovery_timeout=10, clock=clock)
+
+    async def slow():
+        await asyncio.sleep(0.01)
+        return "ok"
+
+    async def run():
+        with pytest.raises(ConnectionError):
+            await breaker.call(boom)
+        clock.now = 10
+        return await asyncio.gather(breaker.call(slow), breaker.call(slow), return_exceptions=True)
+
+    probe, second = asyncio.run(run())
+
+    assert probe == "ok"
+    assert isinstance(second, CircuitOpenError)
+    assert breaker.state == CLOSED
+
+
+def test_flagged_results_count_as_failures():
+    breaker = CircuitBreaker("auth", failure_threshold=2)
+
+    async def run():
+        for _ in range(2):
+            assert await breaker.call(ok, is_failure=lambda result: True) == "ok"
+
+    asyncio.run(run())
+    assert breaker.state == OPEN
+
+
+def test_deadline_budget_bounds_calls():
+    breaker = CircuitBreaker("vies", timeout=10)
+
+    async def hang():
+        await asyncio.sleep(1)
+
+    async def run():
+        start_deadline(0.05)
+        with pytest.raises(DeadlineExceededError):
+            await breaker.call(hang)
+        # Budget used up: later calls are rejected without being attempted
+        with pytest.raises(DeadlineExceededError):
+            await breaker.call(ok)
+
+    asyncio.run(run())
+    assert breaker.metrics()["deadline_timeouts"] == 1
+    assert breaker.metrics()["deadline_rejected"] == 1
+    assert breaker.state == CLOSED
+
+
+def test_only_the_breaker_timeout_counts_as_a_failure():
+    breaker = CircuitBreaker("vies", failure_threshold=2, timeout=0.05)
+
+    async def hang():
+        await asyncio.sleep(1)
+
+    async def request(budget):
+        start_deadline(budget)
+        with pytest.raises(DeadlineExceededError):
+            await breaker.call(hang)
+
+    # Requests with little budget left do not open the breaker on a healthy upstream
+    for _ in range(3):
+        asyncio.run(request(0.01))
+    assert breaker.state == CLOSED
+    assert breaker.metrics()["failures"] == 0
+
+    for _ in range(2):
+        asyncio.run(request(5))
+    assert breaker.state == OPEN
+    assert breaker.metrics()["timeouts"] == 2
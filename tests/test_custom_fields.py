@@ -0,0 +1,116 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from custom_fields import (
+    CustomFieldError,
+    CustomFieldSchema,
+    CustomFieldSchemas,
+    check_definition,
+    index_spec,
+    merge_definitions,
+)
+
+DEFINITIONS = [
+    {"field_name": "industry", "field_type": "select", "field_options": ["retail", "it"], "filterable": True},
+    {"field_name": "model_id", "field_type": "text", "required": True},
+    {"field_name": "since", "field_type": "date"},
+    {"field_name": "score", "field_type": "number", "filterable": True},
+]
+
+
+def test_values_are_validated_and_made_storable():
+    schema = CustomFieldSchema("contacts", DEFINITIONS)
+
+    values = schema.validate({"industry": "it", "model_id": "X1", "since": "2026-01-02", "score": "3"})
+
+    assert values == {"industry": "it", "model_id": "X1", "score": 3.0,
+                      "since": datetime(2026, 1, 2, tzinfo=timezone.utc)}
+
+
+@pytest.mark.parametrize("values, message", [
+    ({}, "model_id: Field required"),
+    ({"model_id": "X1", "unknown": 1}, "unknown: Extra inputs are not permitted"),
+    ({"model_id": "X1", "industry": "food"}, "industry"),
+    ({"model_id": "X1", "score": "many"}, "score"),
+])
+def test_invalid_values_are_rejected(values, message):
+    schema = CustomFieldSchema("contacts", DEFINITIONS)
+
+    with pytest.raises(CustomFieldError, match=message):
+        schema.validate(values)
+
+
+def test_submitted_values_are_merged_over_stored_ones():
+    schema = CustomFieldSchema("contacts", DEFINITIONS)
+    stored = schema.validate({"model_id": "X1", "since": "2026-01-02", "score": 3})
+
+    assert schema.validate(None, stored) == stored
+    assert schema.validate({"score": None, "industry": "it"}, stored) == {
+        "model_id": "X1", "since": datetime(2026, 1, 2, tzinfo=timezone.utc), "industry": "it"}
+    with pytest.raises(CustomFieldError, match="model_id"):
+        schema.validate({"model_id": None}, stored)
+
+
+def test_only_filterable_fields_filter():
+    schema = CustomFieldSchema("accounts", DEFINITIONS)
+
+    assert schema.filters({"cf.industry": "it", "cf.score": "2.5"}) == {
+        "custom_fields.industry": "it", "custom_fields.score": 2.5}
+    with pytest.raises(CustomFieldError, match="not filterable"):
+        schema.filters({"cf.since": "2026-01-01"})
+    with pytest.raises(CustomFieldError, match="Unknown"):
+        schema.filters({"cf.colour": "red"})
+    with pytest.raises(CustomFieldError, match="Invalid value"):
+        schema.filters({"cf.score": "high"})
+
+
+def test_definitions_are_checked_and_indexed():
+    with pytest.raises(CustomFieldError):
+        check_definition("contacts", "Industry Type", "text", None)
+    with pytest.raises(CustomFieldError):
+        check_definition("contacts", "industry", "select", [])
+    with pytest.raises(CustomFieldError):
+        check_definition("calendar_events", "industry", "text", None)
+
+    keys, options = index_spec("industry")
+    assert keys == [("user_id", 1), ("custom_fields.industry", 1)]
+    assert options["partialFilterExpression"] == {"custom_fields.industry": {"$exists": True}}
+
+
+def test_tenant_definitions_override_global_ones():
+    merged = merge_definitions([
+        {"field_name": "industry", "field_type": "select", "field_options": ["it"], "tenant_id": "u1"},
+        {"field_name": "industry", "field_type": "text", "tenant_id": None},
+        {"field_name": "score", "field_type": "number", "tenant_id": None},
+    ])
+
+    assert [(d["field_name"], d["field_type"]) for d in merged] == [("industry", "select"), ("score", "number")]
+
+
+def test_schemas_are_compiled_once_until_invalidated():
+    loads = []
+
+    async def load(tenant_id, entity_type):
+        loads.append((tenant_id, entity_type))
+        return DEFINITIONS
+
+    async def run():
+        schemas = CustomFieldSchemas(load)
+        first = await schemas.get("u1", "contacts")
+        assert await schemas.get("u1", "contacts") is first
+        await schemas.get("u2", "contacts")
+
+        schemas.invalidate("u1")
+        await schemas.get("u1", "contacts")
+        await schemas.get("u2", "contacts")
+
+        schemas.invalidate()
+        await schemas.get("u2", "contacts")
+        return schemas
+
+    schemas = asyncio.run(run())
+
+    assert loads == [("u1", "contacts"), ("u2", "contacts"), ("u1", "contacts"), ("u2", "contacts")]
+    assert schemas.stats["hits"] == 2
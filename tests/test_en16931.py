@@ -0,0 +1,71 @@
+from en16931 import validate_invoice, validate_invoices
+from tests.test_peppol_ubl import ACCOUNT, PRODUCTS, make_invoice
+
+SELLER = {"name": "Jane Seller", "email": "jane@example.com", "vat_number": "BE0403170701", "country": "BE"}
+
+
+def rule_ids(report):
+    return sorted(v.rule_id for v in report.errors)
+
+
+def test_complete_invoice_is_valid():
+    report = validate_invoice(make_invoice(), ACCOUNT, SELLER, PRODUCTS)
+
+    assert report.valid
+    assert report.errors == []
+
+
+def test_missing_parties_and_due_date():
+    invoice = make_invoice(due_date=None)
+    seller = {"name": "No Company"}
+    buyer = {"name": "", "country": None}
+
+    report = validate_invoice(invoice, buyer, seller, PRODUCTS)
+
+    assert rule_ids(report) == sorted([
+        "BR-07", "BR-09", "BR-11", "BR-S-02", "BR-CO-25", "PEPPOL-EN16931-R020", "PEPPOL-EN16931-R010",
+    ])
+    assert [v.rule_id for v in report.warnings] == ["BR-IC-BUYER-VAT"]
+
+
+def test_stored_totals_do_not_reject_the_document():
+    # The stored totals are never sent: the document carries totals derived from the lines
+    report = validate_invoice(make_invoice(subtotal=120.0, total_amount=150.0), ACCOUNT, SELLER, PRODUCTS)
+
+    assert report.valid
+
+
+def test_many_lines_with_sub_cent_prices_are_valid():
+    items = [{"product_id": "p1", "quantity": 1, "unit_price": 0.105} for _ in range(10)]
+    subtotal = sum(item["quantity"] * item["unit_price"] for item in items)
+    invoice = make_invoice(items=items, subtotal=subtotal, tax_amount=subtotal * 0.21, total_amount=subtotal * 1.21)
+
+    assert validate_invoice(invoice, ACCOUNT, SELLER, PRODUCTS).valid
+
+
+def test_line_rules_report_line_number():
+    items = [
+        {"product_id": "p1", "quantity": 1, "unit_price": 10.0},
+        {"product_id": "unknown", "quantity": 1, "unit_price": -5.0},
+    ]
+    invoice = make_invoice(items=items, subtotal=5.0, tax_amount=1.05, total_amount=6.05)
+
+    report = validate_invoice(invoice, ACCOUNT, SELLER, PRODUCTS)
+
+    assert {(v.rule_id, v.line) for v in report.errors} == {("BR-25", 2), ("BR-27", 2)}
+    assert report.to_dict()["errors"][0]["field"].startswith("items[2]")
+
+
+def test_greek_vat_prefix_is_el():
+    assert validate_invoice(make_invoice(), {**ACCOUNT, "vat_number": "EL094259216"}, SELLER, PRODUCTS).valid
+    report = validate_invoice(make_invoice(), {**ACCOUNT, "vat_number": "123456789"}, SELLER, PRODUCTS)
+    assert "BR-CO-09" in rule_ids(report)
+
+
+def test_batch_returns_report_per_invoice():
+    documents = [(make_invoice(invoice_number=f"INV-{i}"), ACCOUNT, SELLER, PRODUCTS) for i in range(3)]
+
+    reports = validate_invoices(documents)
+
+    assert [r.invoice_number for r in reports] == ["INV-0", "INV-1", "INV-2"]
+    assert all(r.valid for r in reports)
@@ -0,0 +1,135 @@
+import asyncio
+
+from entitlements import EntitlementCache, effective_plan, resolve_entitlements
+
+PLAN_LIMITS = {
+    "starter": {"vies_integration": False, "contacts_max": 100},
+    "professional": {"vies_integration": True, "contacts_max": -1},
+    "enterprise": {"vies_integration": True, "custom_fields": True, "contacts_max": -1},
+}
+
+
+def test_roles_raise_the_effective_plan():
+    assert effective_plan("starter", []) == "starter"
+    assert effective_plan("starter", ["premium_user"]) == "professional"
+    assert effective_plan("professional", ["enterprise_user", "premium_user"]) == "enterprise"
+    assert effective_plan("enterprise", ["premium_user"]) == "enterprise"
+    assert effective_plan(None, ["admin"]) == "starter"
+    assert effective_plan("unknown", []) == "starter"
+
+
+def test_premium_role_unlocks_features():
+    entitlements = resolve_entitlements("u1", "starter", ["premium_user", "admin"], PLAN_LIMITS)
+
+    assert entitlements.plan_id == "professional"
+    assert entitlements.current_plan == "starter"
+    assert entitlements.is_admin
+    assert entitlements.has_feature("vies_integration")
+    assert not entitlements.has_feature("custom_fields")
+    assert entitlements.limit("contacts_max") == -1
+
+
+def make_cache(state, loads, **kwargs):
+    async def load(user_id):
+        loads.append(user_id)
+        entitlements = resolve_entitlements(user_id, state["plan"], state["roles"], PLAN_LIMITS,
+                                            state.get("version", 0))
+        await asyncio.sleep(0.01)
+        return entitlements
+
+    return EntitlementCache(load, **kwargs)
+
+
+def test_concurrent_misses_share_one_load():
+    state = {"plan": "starter", "roles": []}
+    loads = []
+
+    async def run():
+        cache = make_cache(state, loads)
+        await asyncio.gather(*(cache.get("u1") for _ in range(10)))
+        await cache.get("u1", "starter")
+        return cache
+
+    cache = asyncio.run(run())
+
+    assert loads == ["u1"]
+    assert cache.stats["hits"] == 1
+    assert cache.stats["coalesced"] == 9
+
+
+def test_invalidation_and_plan_changes_reload():
+    state = {"plan": "starter", "roles": []}
+    loads = []
+
+    async def run():
+        cache = make_cache(state, loads)
+        assert not (await cache.get("u1")).is_admin
+
+        state["roles"] = ["admin"]
+        assert not (await cache.get("u1")).is_admin  # still cached
+        cache.invalidate("u1")
+        assert (await cache.get("u1")).is_admin
+
+        # The user document now says enterprise (changed by another process)
+        state["plan"] = "enterprise"
+        return await cache.get("u1", "enterprise")
+
+    entitlements = asyncio.run(run())
+
+    assert entitlements.plan_id == "enterprise"
+    assert len(loads) == 3
+
+
+def test_role_change_in_another_process_reloads_on_version():
+    state = {"plan": "starter", "roles": ["admin"], "version": 3}
+    loads = []
+
+    async def run():
+        cache = make_cache(state, loads)
+        assert (await cache.get("u1", "starter", 3)).is_admin
+
+        # Another worker revoked the role and bumped the version; the plan is unchanged
+        state.update(roles=[], version=4)
+        demoted = await cache.get("u1", "starter", 4)
+        cached = await cache.get("u1", "starter", 4)
+        return demoted, cached, cache
+
+    demoted, cached, cache = asyncio.run(run())
+
+    assert not demoted.is_admin and cached is demoted
+    assert len(loads) == 2
+    assert cache.stats["stale"] == 1
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    state = {"plan": "starter", "roles": []}
+    loads = []
+
+    async def run():
+        cache = make_cache(state, loads)
+        pending = asyncio.create_task(cache.get("u1"))
+        await asyncio.sleep(0.005)  # the load has read the old roles
+        state["roles"] = ["enterprise_user"]
+        cache.invalidate("u1")
+        stale = await pending
+        return stale, await cache.get("u1")
+
+    stale, fresh = asyncio.run(run())
+
+    assert stale.plan_id == "starter"
+    assert fresh.plan_id == "enterprise"
+    assert len(loads) == 2
+
+
+def test_least_recently_used_entries_are_evicted():
+    state = {"plan": "starter", "roles": []}
+    loads = []
+
+    async def run():
+        cache = make_cache(state, loads, max_entries=2)
+        for user_id in ("u1", "u2", "u1", "u3", "u1", "u2"):
+            await cache.get(user_id)
+
+    asyncio.run(run())
+
+    assert loads == ["u1", "u2", "u3", "u2"]
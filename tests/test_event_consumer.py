@@ -0,0 +1,93 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from event_consumer import FAILED, PENDING, PROCESSED, PROCESSING, EventConsumer
+
+
+class FakeEvents:
+    """Just enough of a Motor collection for EventConsumer's queries"""
+
+    def __init__(self):
+        self.docs = []
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if all(doc.get(key) == value for key, value in query.items()):
+                doc.update(update.get("$set", {}))
+                return SimpleNamespace(upserted_id=None)
+        if upsert:
+            doc = {"_id": len(self.docs) + 1, **query, **update["$setOnInsert"]}
+            self.docs.append(doc)
+            return SimpleNamespace(upserted_id=doc["_id"])
+        return SimpleNamespace(upserted_id=None)
+
+    async def find_one_and_update(self, query, update, sort=None, return_document=None):
+        now = datetime.now(timezone.utc)
+        for doc in sorted(self.docs, key=lambda d: d["next_attempt_at"]):
+            due = doc["status"] == PENDING and doc["next_attempt_at"] <= now
+            stale = doc["status"] == PROCESSING and doc["lease_until"] < now
+            if due or stale:
+                doc.update(update["$set"])
+                doc["attempts"] += update["$inc"]["attempts"]
+                return dict(doc)
+        return None
+
+
+def test_duplicate_events_are_recorded_once_and_handled_once():
+    handled = []
+
+    async def handler(event):
+        handled.append(event["event_id"])
+
+    async def run():
+        consumer = EventConsumer(FakeEvents(), handler)
+        first = await consumer.publish("evt_1", {"event_type": "checkout.session.completed"})
+        again = await consumer.publish("evt_1", {"event_type": "checkout.session.completed"})
+        await consumer.process_pending()
+        await consumer.process_pending()
+        return consumer, first, again
+
+    consumer, first, again = asyncio.run(run())
+
+    assert (first, again) == (True, False)
+    assert handled == ["evt_1"]
+    assert consumer.collection.docs[0]["status"] == PROCESSED
+
+
+def test_failures_are_retried_with_backoff_then_given_up():
+    async def handler(event):
+        raise RuntimeError("mongo hiccup")
+
+    async def run():
+        consumer = EventConsumer(FakeEvents(), handler, batch_size=1, max_attempts=2, base_delay=0)
+        await consumer.publish("evt_1", {})
+        await consumer.process_pending()
+        retried = dict(consumer.collection.docs[0])
+        await consumer.process_pending()
+        return retried, consumer.collection.docs[0]
+
+    retried, final = asyncio.run(run())
+
+    assert (retried["status"], retried["attempts"], retried["last_error"]) == (PENDING, 1, "mongo hiccup")
+    assert (final["status"], final["attempts"]) == (FAILED, 2)
+
+
+def test_inline_handled_events_are_left_alone_by_the_consumer():
+    handled = []
+
+    async def handler(event):
+        handled.append(event["event_id"])
+
+    async def run():
+        consumer = EventConsumer(FakeEvents(), handler)
+        await consumer.publish("paypal:order-1:paid", {}, delay=60)
+        claimed = await consumer.process_pending()
+        await consumer.complete("paypal:order-1:paid")
+        duplicate = await consumer.publish("paypal:order-1:paid", {}, delay=60)
+        return consumer, claimed, duplicate
+
+    consumer, claimed, duplicate = asyncio.run(run())
+
+    assert (claimed, duplicate, handled) == (0, False, [])
+    assert consumer.collection.docs[0]["status"] == PROCESSED
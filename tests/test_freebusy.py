@@ -0,0 +1,94 @@
+import asyncio
+import random
+from datetime import datetime, timedelta, timezone
+
+from freebusy import BusyIndexes, Interval, IntervalIndex, busy_intervals
+
+UTC = timezone.utc
+DAY = datetime(2026, 10, 19, tzinfo=UTC)
+
+
+def at(hours):
+    return DAY + timedelta(hours=hours)
+
+
+def meeting(event_id, start, end, **fields):
+    return {"id": event_id, "start_date": at(start), "end_date": at(end), **fields}
+
+
+def random_intervals(count, seed=7):
+    rng = random.Random(seed)
+    intervals = []
+    for index in range(count):
+        start = rng.randrange(0, 24 * 60 * 30)
+        intervals.append(Interval(DAY + timedelta(minutes=start),
+                                  DAY + timedelta(minutes=start + rng.choice([15, 30, 60, 90, 600])), f"e{index}"))
+    return intervals
+
+
+def test_overlap_queries_match_a_full_scan():
+    intervals = random_intervals(500)
+    index = IntervalIndex(intervals)
+    rng = random.Random(3)
+
+    for _ in range(200):
+        start = DAY + timedelta(minutes=rng.randrange(0, 24 * 60 * 30))
+        end = start + timedelta(minutes=rng.randrange(1, 600))
+        expected = sorted(i for i in intervals if i.start < end and i.end > start)
+        assert index.overlapping(start, end) == expected
+
+
+def test_conflicts_match_pairwise_comparison():
+    intervals = random_intervals(300)
+    index = IntervalIndex(intervals)
+    start, end = DAY + timedelta(days=3), DAY + timedelta(days=10)
+
+    in_window = [i for i in intervals if i.start < end and i.end > start]
+    expected = {frozenset((a.event_id, b.event_id)) for n, a in enumerate(in_window) for b in in_window[n + 1:]
+                if a.start < b.end and b.start < a.end}
+
+    assert {frozenset(pair) for pair in index.conflicts(start, end)} == expected
+
+
+def test_free_slots_between_busy_blocks():
+    index = IntervalIndex(busy_intervals([
+        meeting("a", 9, 10), meeting("b", 9.5, 11), meeting("c", 11, 11.25), meeting("d", 14, 15),
+    ]))
+
+    assert index.busy_within(at(8), at(18)) == [(at(9), at(11.25)), (at(14), at(15))]
+    assert index.free_slots(at(8), at(18), timedelta(minutes=60)) == [
+        (at(8), at(9)), (at(11.25), at(14)), (at(15), at(18))]
+    assert index.free_slots(at(10), at(14.5), timedelta(minutes=180)) == []
+
+
+def test_all_day_and_point_events_do_not_block_time():
+    intervals = busy_intervals([
+        meeting("all-day", 0, 24, all_day=True),
+        meeting("due", 12, 12),
+        {"id": "naive", "start_date": datetime(2026, 10, 19, 9), "end_date": datetime(2026, 10, 19, 10)},
+    ])
+
+    assert intervals == [Interval(at(9), at(10), "naive")]
+
+
+def test_indexes_are_reused_inside_the_window_until_invalidated():
+    loads = []
+
+    async def load(user_id, start, end):
+        loads.append((user_id, start, end))
+        return [meeting("a", 9, 10)]
+
+    async def run():
+        indexes = BusyIndexes(load)
+        first = await indexes.get("u1", at(8), at(12))
+        assert await indexes.get("u1", at(13), at(17)) is first
+        await indexes.get("u2", at(8), at(12))
+        indexes.invalidate("u1")
+        await indexes.get("u1", at(8), at(12))
+        return indexes
+
+    indexes = asyncio.run(run())
+
+    assert loads == [("u1", DAY, DAY + timedelta(days=1)), ("u2", DAY, DAY + timedelta(days=1)),
+                     ("u1", DAY, DAY + timedelta(days=1))]
+    assert indexes.stats == {"hits": 1, "builds": 3, "invalidations": 1}
@@ -0,0 +1,35 @@
+import asyncio
+
+import httpx
+
+from http_clients import HttpClients, UpstreamConfig
+
+
+def test_clients_are_shared_per_upstream_and_closed():
+    seen = []
+
+    def handler(request):
+        seen.append(str(request.url))
+        return httpx.Response(200, json={"ok": True})
+
+    async def run():
+        clients = HttpClients(
+            {"paypal": UpstreamConfig("https://paypal.test", timeout=3.0),
+             "vies": UpstreamConfig("https://vies.test/services")},
+            transport=httpx.MockTransport(handler)
+        )
+        await clients.start()
+        paypal = clients.get("paypal")
+        assert clients.get("paypal") is paypal
+        assert clients.get("vies") is not paypal
+        assert paypal.timeout.read == 3.0
+
+        await paypal.get("/v2/checkout/orders/1")
+        await clients.get("vies").post("/checkVatService", content="<x/>")
+        await clients.close()
+        return paypal
+
+    paypal = asyncio.run(run())
+
+    assert paypal.is_closed
+    assert seen == ["https://paypal.test/v2/checkout/orders/1", "https://vies.test/services/checkVatService"]
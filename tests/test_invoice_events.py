@@ -0,0 +1,112 @@
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from invoice_events import InvoiceDueEvents, due_event_fields
+from tests.conftest import FakeLease
+
+NOW = datetime(2026, 10, 19, tzinfo=timezone.utc)
+DUE = datetime(2026, 11, 18, tzinfo=timezone.utc)
+
+
+def invoice(number, **fields):
+    return {"_id": number, "id": f"inv-{number}", "user_id": "u1", "invoice_number": f"INV-2026-{number:04d}",
+            "total_amount": 121.0, "due_date": DUE, "status": "sent", **fields}
+
+
+def matches(doc, query):
+    return all(doc.get(key) == value for key, value in query.items())
+
+
+class FakeCollection:
+    """Equality filters, upserts and deletes; just what the due-event sync writes"""
+
+    def __init__(self, docs=()):
+        self.docs = [dict(doc) for doc in docs]
+        self.batches = []
+
+    async def find_one(self, query, projection=None):
+        return next((dict(doc) for doc in self.docs if matches(doc, query)), None)
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(update["$set"])
+                return
+        if upsert:
+            self.docs.append({**query, **update["$set"], **update.get("$setOnInsert", {})})
+
+    async def bulk_write(self, ops, ordered=True):
+        self.batches.append(len(ops))
+
+    async def find_one_and_delete(self, query, projection=None):
+        for doc in self.docs:
+            if matches(doc, query):
+                self.docs.remove(doc)
+                return doc
+        return None
+
+
+class FakeInvoices(FakeCollection):
+    def find(self, query):
+        after = query.get("_id", {}).get("$gt", 0)
+        docs = [doc for doc in self.docs if doc["_id"] > after and doc.get("due_date")
+                and doc.get("status") not in query["status"]["$nin"]]
+        cursor = SimpleNamespace()
+        cursor.sort = lambda *args: cursor
+        cursor.limit = lambda n: SimpleNamespace(to_list=lambda _: asyncio.sleep(0, sorted(
+            docs, key=lambda doc: doc["_id"])[:n]))
+        return cursor
+
+
+def fake_db(invoices, events=()):
+    return SimpleNamespace(invoices=FakeInvoices(invoices), calendar_events=FakeCollection(events),
+                           calendar_tombstones=FakeCollection(), job_leases=None)
+
+
+def test_only_open_invoices_with_a_due_date_get_an_event():
+    fields = due_event_fields(invoice(1), NOW)
+
+    assert fields["title"] == "Invoice INV-2026-0001 due"
+    assert fields["start_date"] == fields["end_date"] == DUE
+    assert fields["description"] == "Amount due: 121.00"
+    assert due_event_fields(invoice(1, due_date=None), NOW) is None
+    assert due_event_fields(invoice(1, status="paid"), NOW) is None
+    assert due_event_fields(None, NOW) is None
+
+
+def test_changes_project_the_current_invoice_state():
+    db = fake_db([invoice(1)], events=[{"id": "manual", "user_id": "u1", "related_id": "inv-1",
+                                        "event_type": "invoice_due", "title": "Chase Acme"}])
+    sync = InvoiceDueEvents(db, lease=FakeLease())
+
+    async def run():
+        await sync.handle({"invoice_id": "inv-1", "user_id": "u1"})
+        adopted = dict(db.calendar_events.docs[0])
+        db.invoices.docs.clear()
+        await sync.handle({"invoice_id": "inv-1", "user_id": "u1"})
+        # A replayed change for a deleted invoice is a no-op
+        await sync.handle({"invoice_id": "inv-1", "user_id": "u1"})
+        return adopted
+
+    adopted = asyncio.run(run())
+
+    assert adopted["id"] == "manual"
+    assert adopted["title"] == "Invoice INV-2026-0001 due"
+    assert db.calendar_events.docs == []
+    assert [(t["user_id"], t["event_id"]) for t in db.calendar_tombstones.docs] == [("u1", "manual")]
+
+
+def test_backfill_resumes_from_its_checkpoint_and_runs_once():
+    db = fake_db([invoice(n) for n in range(1, 6)] + [invoice(6, status="cancelled"), invoice(7, due_date=None)])
+    lease = FakeLease({"last_id": 2, "upserted": 2})
+    sync = InvoiceDueEvents(db, batch_size=2, lease=lease)
+
+    result = asyncio.run(sync.backfill())
+
+    assert result == {"upserted": 5}
+    assert db.calendar_events.batches == [2, 1]
+    assert lease.saves == [{"last_id": 4, "upserted": 4}, {"last_id": 5, "upserted": 5},
+                           {"done": True, "upserted": 5}]
+    assert asyncio.run(sync.backfill()) == {"upserted": 5}
+    assert db.calendar_events.batches == [2, 1]
@@ -0,0 +1,75 @@
+import asyncio
+import time
+
+from payment_status import CoalescingCache, PaymentStatusWatcher
+
+
+def test_concurrent_misses_share_one_fetch_and_are_cached():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"payment_status": "unpaid"}
+
+    async def run():
+        cache = CoalescingCache(ttl=60)
+        results = await asyncio.gather(*(cache.get("cs_1", fetch) for _ in range(10)))
+        results.append(await cache.get("cs_1", fetch))
+        return cache, results
+
+    cache, results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(result == {"payment_status": "unpaid"} for result in results)
+    assert cache.stats == {"hits": 1, "fetches": 1, "coalesced": 9}
+
+
+def test_waiters_return_when_notified():
+    stored = {"payment_status": "pending"}
+    upstream_calls = []
+
+    async def load(session_id):
+        return dict(stored)
+
+    async def fetch(session_id):
+        upstream_calls.append(session_id)
+        return {"payment_status": "pending"}
+
+    async def run():
+        watcher = PaymentStatusWatcher(load, fetch, poll_interval=5, upstream_interval=60)
+        waiters = [asyncio.create_task(watcher.wait("cs_1", timeout=10)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        stored["payment_status"] = "paid"
+        watcher.notify("cs_1")
+        start = time.monotonic()
+        results = await asyncio.gather(*waiters)
+        return watcher, results, time.monotonic() - start
+
+    watcher, results, elapsed = asyncio.run(run())
+
+    assert [r["payment_status"] for r in results] == ["paid"] * 3
+    assert elapsed < 1
+    assert upstream_calls == []
+    assert watcher.metrics()["waiters"] == 0
+
+
+def test_upstream_fallback_is_shared_and_ends_wait():
+    upstream_calls = []
+
+    async def load(session_id):
+        return {"payment_status": "pending"}
+
+    async def fetch(session_id):
+        upstream_calls.append(session_id)
+        await asyncio.sleep(0.01)
+        return {"status": "expired", "payment_status": "unpaid"}
+
+    async def run():
+        watcher = PaymentStatusWatcher(load, fetch, poll_interval=0.01, upstream_interval=0.02)
+        return await asyncio.gather(*(watcher.wait("cs_1", timeout=5) for _ in range(5)))
+
+    results = asyncio.run(run())
+
+    assert all(result["status"] == "expired" for result in results)
+    assert upstream_calls == ["cs_1"]
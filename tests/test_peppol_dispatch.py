@@ -0,0 +1,200 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from http_clients import HttpClients, UpstreamConfig
+from peppol_dispatch import (
+    DEFAULT_ACCESS_POINT,
+    FAILED,
+    QUEUED,
+    SENDING,
+    SENT,
+    AccessPointClient,
+    AccessPointError,
+    PeppolDispatcher,
+)
+from peppol_ubl import supplier_party
+from tests.test_peppol_ubl import ACCOUNT, PRODUCTS, make_invoice
+
+NOW = datetime(2026, 10, 19, 12, tzinfo=timezone.utc)
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(key)
+            for op, operand in condition.items():
+                if op == "$ne" and value == operand or op == "$nin" and value in operand:
+                    return False
+                if op == "$lte" and not value <= operand or op == "$lt" and not value < operand:
+                    return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+class FakeCollection:
+    """The filters and updates the dispatcher issues, with a unique index on invoice_id"""
+
+    def __init__(self, docs=()):
+        self.docs = [dict(doc) for doc in docs]
+
+    async def update_one(self, query, update, upsert=False):
+        for doc in self.docs:
+            if matches(doc, query):
+                doc.update(update["$set"])
+                return
+        if upsert:
+            if any(doc.get("invoice_id") == query["invoice_id"] for doc in self.docs):
+                raise DuplicateKeyError("invoice_id")
+            self.docs.append({"invoice_id": query["invoice_id"], **update["$set"], **update["$setOnInsert"]})
+
+    async def find_one_and_update(self, query, update, sort=None, return_document=None):
+        candidates = sorted((doc for doc in self.docs if matches(doc, query)), key=lambda doc: doc["next_attempt_at"])
+        if not candidates:
+            return None
+        doc = candidates[0]
+        doc.update(update["$set"])
+        for key, amount in update["$inc"].items():
+            doc[key] = doc.get(key, 0) + amount
+        return dict(doc)
+
+
+class FakeDb:
+    def __init__(self, jobs=()):
+        self.peppol_outbox = FakeCollection(jobs)
+        self.invoices = FakeCollection()
+
+
+def dispatcher(db, **options):
+    return PeppolDispatcher(db, None, {DEFAULT_ACCESS_POINT: None}, **options)
+
+
+def job(invoice_id, status, **fields):
+    return {"id": f"job-{invoice_id}", "invoice_id": invoice_id, "user_id": "u1", "access_point": DEFAULT_ACCESS_POINT,
+            "status": status, "attempts": 0, "next_attempt_at": NOW, **fields}
+
+
+def test_enqueue_skips_invoices_being_sent_or_already_sent():
+    db = FakeDb([job("sending", SENDING), job("sent", SENT), job("failed", FAILED, attempts=8)])
+    queue = dispatcher(db)
+
+    async def run():
+        return [await queue.enqueue({"id": invoice_id, "user_id": "u1"})
+                for invoice_id in ("new", "failed", "sending", "sent")]
+
+    assert asyncio.run(run()) == [True, True, False, False]
+    statuses = {doc["invoice_id"]: (doc["status"], doc["attempts"]) for doc in db.peppol_outbox.docs}
+    assert statuses == {"new": (QUEUED, 0), "failed": (QUEUED, 0), "sending": (SENDING, 0), "sent": (SENT, 0)}
+
+    assert asyncio.run(queue.enqueue({"id": "sent", "user_id": "u1"}, resend=True))
+    assert asyncio.run(queue.enqueue({"id": "sending", "user_id": "u1"}, resend=True)) is False
+    jobs = {doc["invoice_id"]: doc for doc in db.peppol_outbox.docs}
+    assert jobs["sent"]["status"] == QUEUED
+    # First deliveries dedupe on the invoice id; a resend must not be dropped as a duplicate
+    assert jobs["new"]["document_id"] == "new"
+    assert jobs["sent"]["document_id"] not in ("sent", None)
+
+
+def test_access_point_requests_use_the_shared_pool():
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(202, json={"message_id": "msg-1"})
+
+    async def run():
+        clients = HttpClients({"peppol": UpstreamConfig("https://ap.example")}, transport=httpx.MockTransport(handler))
+        access_point = AccessPointClient(lambda: clients.get("peppol"), token="secret")
+        message_id = await access_point.send("doc-1", b"<Invoice/>")
+        await clients.close()
+        return message_id
+
+    assert asyncio.run(run()) == "msg-1"
+    assert str(requests[0].url) == "https://ap.example/documents"
+    assert requests[0].headers["X-Document-ID"] == "doc-1"
+    assert requests[0].headers["Authorization"] == "Bearer secret"
+
+
+def test_submit_queues_a_complete_invoice_from_the_company_profile():
+    user = {"id": "u1", "name": "Jane Seller", "email": "jane@example.com", "auth_type": "traditional",
+            "current_plan": "professional", "company": None}
+    db = FakeDb()
+    queue = dispatcher(db)
+    invoice = make_invoice(user_id="u1")
+
+    report, queued = asyncio.run(queue.submit((invoice, ACCOUNT, supplier_party(user), PRODUCTS)))
+
+    assert not queued
+    assert {"BR-09", "BR-S-02"} <= {v.rule_id for v in report.errors}
+    assert db.peppol_outbox.docs == []
+
+    user["company"] = {"legal_name": "Seller NV", "vat_number": "BE0403170701", "street": "Kerkstraat",
+                       "street_nr": "1", "postal_code": "9000", "city": "Gent", "country": "Belgium"}
+    report, queued = asyncio.run(queue.submit((invoice, ACCOUNT, supplier_party(user), PRODUCTS)))
+
+    assert report.valid and queued
+    assert [(doc["invoice_id"], doc["status"]) for doc in db.peppol_outbox.docs] == [("inv-1", QUEUED)]
+
+
+def test_claim_takes_due_jobs_and_jobs_whose_lease_lapsed():
+    now = datetime.now(timezone.utc)
+    db = FakeDb([
+        job("due", QUEUED, next_attempt_at=now - timedelta(seconds=5)),
+        job("later", QUEUED, next_attempt_at=now + timedelta(minutes=5)),
+        job("abandoned", SENDING, attempts=1, lease_until=now - timedelta(seconds=1), claimed_by="dead-worker"),
+        job("in-flight", SENDING, attempts=1, lease_until=now + timedelta(minutes=5), claimed_by="other-worker"),
+    ])
+    queue = dispatcher(db, lease_seconds=60)
+
+    claimed = asyncio.run(queue._claim_batch())
+
+    assert sorted((j["invoice_id"], j["attempts"]) for j in claimed) == [("abandoned", 2), ("due", 1)]
+    assert all(j["status"] == SENDING and j["claimed_by"] == queue.worker_id for j in claimed)
+    assert all(j["lease_until"] > now + timedelta(seconds=50) for j in claimed)
+    assert asyncio.run(queue._claim_batch()) == []
+
+
+def test_outcomes_send_retry_with_backoff_or_dead_letter():
+    queue = dispatcher(FakeDb(), max_attempts=3)
+    queue.backoff = lambda attempts: 60 * attempts
+    owned = lambda j: {"id": j["id"], "claimed_by": queue.worker_id, "status": SENDING}
+    sent, retry, exhausted, rejected = (job("a", SENDING, attempts=1), job("b", SENDING, attempts=2),
+                                        job("c", SENDING, attempts=3), job("d", SENDING, attempts=1))
+
+    outbox_ops, invoice_ops = queue.outcome_ops([
+        (sent, "msg-1", None),
+        (retry, None, AccessPointError("Access point returned 503")),
+        (exhausted, None, AccessPointError("Access point returned 503")),
+        (rejected, None, AccessPointError("Access point returned 400", retryable=False)),
+    ], NOW)
+
+    assert outbox_ops == [
+        UpdateOne(owned(sent), {"$set": {"status": SENT, "message_id": "msg-1", "sent_at": NOW,
+                                         "last_error": None, "updated_at": NOW}}),
+        UpdateOne(owned(retry), {"$set": {"status": QUEUED, "last_error": "Access point returned 503", "updated_at": NOW,
+                                          "next_attempt_at": NOW + timedelta(seconds=120)}}),
+        UpdateOne(owned(exhausted), {"$set": {"status": FAILED, "last_error": "Access point returned 503",
+                                              "updated_at": NOW}}),
+        UpdateOne(owned(rejected), {"$set": {"status": FAILED, "last_error": "Access point returned 400",
+                                             "updated_at": NOW}}),
+    ]
+    assert invoice_ops == [
+        UpdateOne({"id": "a"}, {"$set": {"peppol_status": "sent", "peppol_message_id": "msg-1", "updated_at": NOW}}),
+        UpdateOne({"id": "c"}, {"$set": {"peppol_status": "failed", "updated_at": NOW}}),
+        UpdateOne({"id": "d"}, {"$set": {"peppol_status": "failed", "updated_at": NOW}}),
+    ]
+
+
+def test_backoff_doubles_up_to_the_cap():
+    queue = dispatcher(FakeDb(), base_delay=30, max_delay=300)
+
+    assert 15 <= queue.backoff(1) <= 30
+    assert 60 <= queue.backoff(3) <= 120
+    assert 150 <= queue.backoff(10) <= 300
@@ -0,0 +1,136 @@
+import asyncio
+import io
+import uuid
+import xml.etree.ElementTree as ET
+from types import SimpleNamespace
+
+import pytest
+
+from peppol_inbound import UBLParseError, ingest_parsed_chunk, new_ingest_stats, parse_ubl_invoice, purchase_fields
+from peppol_ubl import iter_invoice_ubl
+from tests.test_peppol_ubl import make_invoice
+
+SUPPLIER = {
+    "name": "Fournisseur SA", "street": "Rue Haute", "street_nr": "5", "postal_code": "1000",
+    "city": "Bruxelles", "country": "Belgium", "vat_number": "BE0403170701",
+}
+
+
+def ubl(invoice, supplier=SUPPLIER):
+    return io.BytesIO(b"".join(iter_invoice_ubl(invoice, {"name": "Us"}, supplier)))
+
+
+def test_parses_generated_invoice():
+    document = parse_ubl_invoice(ubl(make_invoice()))
+
+    assert document["document_type"] == "invoice"
+    assert document["supplier_invoice_number"] == "INV-2025-0001"
+    assert document["issue_date"].isoformat() == "2025-03-01T00:00:00+00:00"
+    assert document["supplier"]["vat_number"] == "BE0403170701"
+    assert document["supplier"]["country_code"] == "BE"
+    assert document["supplier"]["street"] == "Rue Haute 5"
+    assert (document["subtotal"], document["tax_amount"], document["total_amount"]) == (115.0, 24.15, 139.15)
+    assert [(i["quantity"], i["unit_price"]) for i in document["items"]] == [(2.0, 50.0), (1.5, 10.0)]
+
+
+def test_credit_note_lines():
+    document = parse_ubl_invoice(ubl(make_invoice(invoice_type="credit_note")))
+
+    assert document["document_type"] == "credit_note"
+    assert len(document["items"]) == 2
+    assert document["due_date"] is None
+
+
+def test_line_ids_do_not_leak_into_header():
+    items = [{"product_id": f"p{i}", "quantity": 1, "unit_price": 1.0} for i in range(500)]
+    document = parse_ubl_invoice(ubl(make_invoice(items=items)))
+
+    assert document["supplier_invoice_number"] == "INV-2025-0001"
+    assert [item["line_id"] for item in document["items"]][-1] == "500"
+
+
+def test_elements_are_released_while_parsing(monkeypatch):
+    roots = []
+    original = ET.iterparse
+
+    def tracking_iterparse(source, events=None):
+        for event, elem in original(source, events):
+            if not roots:
+                roots.append(elem)
+            yield event, elem
+
+    monkeypatch.setattr(ET, "iterparse", tracking_iterparse)
+    parse_ubl_invoice(ubl(make_invoice()))
+
+    assert len(roots[0]) == 0
+
+
+def test_purchase_fields_normalize_vat():
+    document = parse_ubl_invoice(ubl(make_invoice(), {**SUPPLIER, "vat_number": "be 0403.170.701"}))
+
+    fields = purchase_fields(document, "acc-1", "inbox/a.xml")
+
+    assert fields["supplier_vat_number"] == "BE0403170701"
+    assert fields["account_id"] == "acc-1"
+
+
+@pytest.mark.parametrize("payload", [b"<Invoice", b"<Order xmlns='urn:x'/>", b"<Invoice xmlns='urn:x'/>"])
+def test_rejects_invalid_documents(payload):
+    with pytest.raises(UBLParseError):
+        parse_ubl_invoice(io.BytesIO(payload))
+
+
+class FakeAccounts:
+    """Finds that yield to other tasks, and upserts keyed like the unique supplier index"""
+
+    def __init__(self):
+        self.docs = []
+
+    async def find(self, query, projection=None):
+        await asyncio.sleep(0)
+        for doc in list(self.docs):
+            if all(doc.get(key) == value or isinstance(value, dict) and doc.get(key) in value["$in"]
+                   for key, value in query.items()):
+                yield doc
+
+    async def bulk_write(self, ops, ordered=True):
+        await asyncio.sleep(0)
+        upserted = 0
+        for op in ops:
+            if not any(all(doc.get(key) == value for key, value in op._filter.items()) for doc in self.docs):
+                self.docs.append(dict(op._doc["$setOnInsert"]))
+                upserted += 1
+        return SimpleNamespace(upserted_count=upserted)
+
+
+class FakePurchases:
+    def __init__(self):
+        self.docs = []
+
+    async def insert_many(self, records, ordered=True):
+        self.docs.extend(records)
+        return SimpleNamespace(inserted_ids=[record["id"] for record in records])
+
+
+def test_concurrent_ingests_create_one_supplier_account():
+    db = SimpleNamespace(accounts=FakeAccounts(), purchase_invoices=FakePurchases())
+    stats = new_ingest_stats()
+
+    def make_account(fields):
+        return {"id": str(uuid.uuid4()), "user_id": "u1", **fields}
+
+    def make_purchase(fields):
+        return {"id": str(uuid.uuid4()), "user_id": "u1", **fields}
+
+    def chunk(name):
+        return [(name, parse_ubl_invoice(ubl(make_invoice())), None)]
+
+    async def run():
+        await asyncio.gather(*(ingest_parsed_chunk(db, "u1", chunk(name), make_account, make_purchase, stats)
+                               for name in ("upload.xml", "inbox/cli.xml")))
+
+    asyncio.run(run())
+
+    assert len(db.accounts.docs) == 1 and stats["accounts_created"] == 1
+    assert db.accounts.docs[0]["supplier_vat_key"] == "BE0403170701"
+    assert {record["account_id"] for record in db.purchase_invoices.docs} == {db.accounts.docs[0]["id"]}
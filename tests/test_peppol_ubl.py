@@ -0,0 +1,139 @@
+import io
+import xml.etree.ElementTree as ET
+import zipfile
+from datetime import datetime, timezone
+
+from peppol_ubl import (
+    NS_CAC, NS_CBC, UBLZipStream, iter_invoice_ubl, party_endpoint, supplier_party, write_ubl_batch
+)
+
+NS = {"cac": NS_CAC, "cbc": NS_CBC}
+
+
+def make_invoice(**overrides):
+    invoice = {
+        "id": "inv-1",
+        "invoice_number": "INV-2025-0001",
+        "account_id": "acc-1",
+        "items": [
+            {"product_id": "p1", "quantity": 2, "unit_price": 50.0, "description": None},
+            {"product_id": "p2", "quantity": 1.5, "unit_price": 10.0, "description": "Consulting & support"},
+        ],
+        "subtotal": 115.0,
+        "tax_amount": 24.15,
+        "total_amount": 139.15,
+        "currency": "EUR",
+        "issue_date": datetime(2025, 3, 1, tzinfo=timezone.utc),
+        "due_date": datetime(2025, 3, 31, tzinfo=timezone.utc),
+        "invoice_type": "invoice",
+    }
+    invoice.update(overrides)
+    return invoice
+
+
+ACCOUNT = {
+    "name": "Acme NV", "street": "Wetstraat", "street_nr": "16", "box": "3",
+    "postal_code": "1000", "city": "Brussel", "country": "Belgium", "vat_number": "be 0123.456.749",
+}
+SUPPLIER = {"name": "Jane Seller", "email": "jane@example.com"}
+PRODUCTS = [{"id": "p1", "name": "Widget"}]
+
+
+def render(invoice, chunk_size=16 * 1024):
+    return b"".join(iter_invoice_ubl(invoice, ACCOUNT, SUPPLIER, PRODUCTS, chunk_size=chunk_size))
+
+
+def test_invoice_document_structure():
+    root = ET.fromstring(render(make_invoice()))
+
+    assert root.tag.endswith("}Invoice")
+    assert root.findtext("cbc:ID", namespaces=NS) == "INV-2025-0001"
+    assert root.findtext("cbc:IssueDate", namespaces=NS) == "2025-03-01"
+    assert root.findtext("cbc:DueDate", namespaces=NS) == "2025-03-31"
+    assert root.findtext("cbc:InvoiceTypeCode", namespaces=NS) == "380"
+
+    customer = root.find("cac:AccountingCustomerParty/cac:Party", NS)
+    endpoint = customer.find("cbc:EndpointID", NS)
+    assert (endpoint.get("schemeID"), endpoint.text) == ("9925", "BE0123456749")
+    assert customer.findtext("cac:PostalAddress/cbc:StreetName", namespaces=NS) == "Wetstraat 16"
+    assert customer.findtext("cac:PostalAddress/cac:Country/cbc:IdentificationCode", namespaces=NS) == "BE"
+
+    supplier_endpoint = root.find("cac:AccountingSupplierParty/cac:Party/cbc:EndpointID", NS)
+    assert supplier_endpoint.get("schemeID") == "EM"
+
+    assert root.findtext("cac:TaxTotal/cac:TaxSubtotal/cac:TaxCategory/cbc:Percent", namespaces=NS) == "21"
+    assert root.findtext("cac:LegalMonetaryTotal/cbc:PayableAmount", namespaces=NS) == "139.15"
+
+    lines = root.findall("cac:InvoiceLine", NS)
+    assert [line.findtext("cac:Item/cbc:Name", namespaces=NS) for line in lines] == ["Widget", "Consulting & support"]
+    assert lines[1].findtext("cbc:InvoicedQuantity", namespaces=NS) == "1.5"
+    assert lines[1].findtext("cbc:LineExtensionAmount", namespaces=NS) == "15.00"
+
+
+def test_credit_note_uses_credit_note_root():
+    root = ET.fromstring(render(make_invoice(invoice_type="credit_note")))
+
+    assert root.tag.endswith("}CreditNote")
+    assert root.findtext("cbc:CreditNoteTypeCode", namespaces=NS) == "381"
+    assert root.find("cbc:DueDate", NS) is None
+    assert len(root.findall("cac:CreditNoteLine", NS)) == 2
+
+
+def test_large_invoice_is_streamed_in_chunks():
+    items = [{"product_id": "p1", "quantity": 1, "unit_price": 1.0} for _ in range(2000)]
+    invoice = make_invoice(items=items, subtotal=2000.0, tax_amount=420.0, total_amount=2420.0)
+
+    chunks = list(iter_invoice_ubl(invoice, ACCOUNT, SUPPLIER, PRODUCTS, chunk_size=4096))
+
+    assert len(chunks) > 10
+    assert max(len(chunk) for chunk in chunks) < 8192
+    assert len(ET.fromstring(b"".join(chunks)).findall("cac:InvoiceLine", NS)) == 2000
+
+
+def test_party_endpoint_falls_back_to_email():
+    assert party_endpoint({"vat_number": "EL094259216"}) == ("9933", "EL094259216")
+    assert party_endpoint({"email": "a@b.c"}) == ("EM", "a@b.c")
+    assert party_endpoint({}) is None
+
+
+def test_batch_writes_one_zip_entry_per_document():
+    out = io.BytesIO()
+    documents = [
+        (make_invoice(invoice_number=f"INV-2025-{i:04d}"), ACCOUNT, SUPPLIER, PRODUCTS) for i in range(5)
+    ]
+
+    assert write_ubl_batch(out, documents) == 5
+
+    with zipfile.ZipFile(out) as archive:
+        assert sorted(archive.namelist()) == [f"INV-2025-{i:04d}.xml" for i in range(5)]
+        ET.fromstring(archive.read("INV-2025-0003.xml"))
+
+
+def test_supplier_party_comes_from_the_company_profile():
+    user = {"name": "Jane Seller", "email": "jane@example.com", "password_hash": "x", "company": {
+        "legal_name": "Seller BV", "vat_number": "NL123456789B01", "street": "Damrak", "street_nr": "1",
+        "postal_code": "1012 LG", "city": "Amsterdam", "country": "Netherlands"}}
+
+    party = supplier_party(user)
+
+    assert party["name"] == "Seller BV"
+    assert party["email"] == "jane@example.com"
+    assert party["vat_number"] == "NL123456789B01"
+    assert "password_hash" not in party
+    assert supplier_party({"name": "Jane Seller", "email": "jane@example.com"})["name"] == "Jane Seller"
+
+
+def test_zip_stream_emits_the_archive_batch_by_batch():
+    archive = UBLZipStream()
+    chunks = []
+    for batch in range(3):
+        documents = [(make_invoice(invoice_number=f"INV-2025-{batch}{i:03d}"), ACCOUNT, SUPPLIER, PRODUCTS)
+                     for i in range(4)]
+        chunks.append(archive.write(documents))
+    chunks.append(archive.close())
+
+    assert all(chunks[:3])
+    assert archive.count == 12
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as archive:
+        assert len(archive.namelist()) == 12
+        ET.fromstring(archive.read("INV-2025-2003.xml"))
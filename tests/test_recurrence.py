@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from recurrence import RecurringSeries, SeriesCache, exception_key, masters_query, parse_rrule
+
+UTC = timezone.utc
+
+
+def master(rrule, start=datetime(2026, 1, 5, 9, 0, tzinfo=UTC), hours=1, **fields):
+    return {"id": "m1", "user_id": "u1", "title": "Standup", "rrule": rrule,
+            "start_date": start, "end_date": start + timedelta(hours=hours), **fields}
+
+
+def starts(series, start, end):
+    return [occurrence["start_date"] for occurrence in series.occurrences(start, end)]
+
+
+@pytest.mark.parametrize("rrule", [
+    "FREQ=HOURLY",
+    "FREQ=DAILY;BYDAY=MO",
+    "FREQ=WEEKLY;BYDAY=XX",
+    "FREQ=MONTHLY;BYMONTHDAY=0",
+    "FREQ=DAILY;COUNT=3;UNTIL=20260101",
+    "FREQ=DAILY;INTERVAL=0",
+    "FREQ=DAILY;BYSETPOS=1",
+])
+def test_unsupported_rules_are_rejected(rrule):
+    with pytest.raises(ValueError):
+        parse_rrule(rrule)
+
+
+def test_daily_series_jumps_to_the_window():
+    series = RecurringSeries(master("FREQ=DAILY;INTERVAL=2"))
+    window = datetime(2036, 3, 1, tzinfo=UTC)
+
+    result = starts(series, window, window + timedelta(days=6))
+
+    assert len(result) == 3
+    assert (result[0] - series.first_start).days % 2 == 0
+    assert result[0] >= window
+
+
+def test_weekly_count_is_kept_across_skipped_weeks():
+    # Monday 5 January, then Mondays and Thursdays: 6 occurrences end on Thursday 22 January
+    series = RecurringSeries(master("FREQ=WEEKLY;BYDAY=MO,TH;COUNT=6"))
+
+    in_window = starts(series, datetime(2026, 1, 19, tzinfo=UTC), datetime(2026, 3, 1, tzinfo=UTC))
+
+    assert in_window == [datetime(2026, 1, 19, 9, tzinfo=UTC), datetime(2026, 1, 22, 9, tzinfo=UTC)]
+    assert series.bounds() == (series.first_start, datetime(2026, 1, 22, 10, tzinfo=UTC))
+
+
+def test_monthly_days_skip_short_months_and_count_from_the_end():
+    last_day = RecurringSeries(master("FREQ=MONTHLY;BYMONTHDAY=-1", start=datetime(2026, 1, 31, 9, tzinfo=UTC)))
+    thirty_first = RecurringSeries(master("FREQ=MONTHLY", start=datetime(2026, 1, 31, 9, tzinfo=UTC)))
+    window = (datetime(2026, 2, 1, tzinfo=UTC), datetime(2026, 5, 1, tzinfo=UTC))
+
+    assert [d.day for d in starts(last_day, *window)] == [28, 31, 30]
+    assert [d.month for d in starts(thirty_first, *window)] == [3]
+
+
+def test_local_time_is_kept_across_daylight_saving():
+    series = RecurringSeries(master("FREQ=WEEKLY", start=datetime(2026, 3, 23, 8, tzinfo=UTC),
+                                    time_zone="Europe/Brussels"))
+
+    result = starts(series, datetime(2026, 3, 23, tzinfo=UTC), datetime(2026, 4, 1, tzinfo=UTC))
+
+    # 09:00 CET, then 09:00 CEST after the change on 29 March
+    assert result == [datetime(2026, 3, 23, 8, tzinfo=UTC), datetime(2026, 3, 30, 7, tzinfo=UTC)]
+
+
+def test_exceptions_cancel_edit_and_move_occurrences():
+    moved_from = datetime(2026, 1, 7, 9, tzinfo=UTC)
+    series = RecurringSeries(master("FREQ=DAILY;COUNT=5", recurrence_exceptions={
+        exception_key(datetime(2026, 1, 5, 9, tzinfo=UTC)): {"cancelled": True},
+        exception_key(datetime(2026, 1, 6, 9, tzinfo=UTC)): {"title": "Planning"},
+        exception_key(moved_from): {"start_date": datetime(2026, 2, 2, 9), "end_date": datetime(2026, 2, 2, 10)},
+    }))
+
+    january = list(series.occurrences(datetime(2026, 1, 1, tzinfo=UTC), datetime(2026, 2, 1, tzinfo=UTC)))
+    february = list(series.occurrences(datetime(2026, 2, 1, tzinfo=UTC), datetime(2026, 3, 1, tzinfo=UTC)))
+
+    assert [(o["start_date"].day, o["title"]) for o in january] == [(6, "Planning"), (8, "Standup"), (9, "Standup")]
+    assert january[0]["id"] == "m1:20260106T090000Z"
+    assert [(o["id"], o["original_start"]) for o in february] == [("m1:20260107T090000Z", moved_from)]
+    assert series.bounds() == (series.first_start, datetime(2026, 2, 2, 10, tzinfo=UTC))
+
+
+def test_occurrences_are_bounded_per_request():
+    series = RecurringSeries(master("FREQ=DAILY", hours=0))
+
+    result = list(series.occurrences(datetime(2026, 1, 1, tzinfo=UTC), datetime(2027, 1, 1, tzinfo=UTC), limit=10))
+
+    assert len(result) == 10
+    assert series.bounds()[1] is None
+
+
+def test_occurrence_starts_are_recognized():
+    series = RecurringSeries(master("FREQ=WEEKLY;BYDAY=MO;UNTIL=20260131"))
+
+    assert series.is_occurrence(datetime(2026, 1, 26, 9))
+    assert not series.is_occurrence(datetime(2026, 1, 26, 10, tzinfo=UTC))
+    assert not series.is_occurrence(datetime(2026, 2, 2, 9, tzinfo=UTC))
+
+
+def test_series_are_parsed_once_per_version():
+    cache = SeriesCache(max_entries=1)
+    first = master("FREQ=DAILY", updated_at=datetime(2026, 1, 1))
+
+    assert cache.get(first) is cache.get(dict(first))
+    cache.get({**first, "updated_at": datetime(2026, 1, 2)})
+    cache.get(first)
+
+    assert cache.stats == {"hits": 1, "parses": 3}
+
+
+def test_masters_query_uses_series_bounds():
+    start, end = datetime(2026, 1, 1, tzinfo=UTC), datetime(2026, 2, 1, tzinfo=UTC)
+
+    assert masters_query("u1", start, end) == {
+        "user_id": "u1", "recurring": True, "series_start": {"$lt": end},
+        "$or": [{"series_end": None}, {"series_end": {"$gt": start}}]}
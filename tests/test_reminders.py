@@ -0,0 +1,233 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from recurrence import exception_key
+from reminders import ReminderHub, ReminderScheduler, reminder_fields, sse_message
+from tests.conftest import FakeLease
+
+UTC = timezone.utc
+NOW = datetime(2026, 10, 19, 9, 0, tzinfo=UTC)
+
+
+def event(start, minutes=30, **fields):
+    return {"id": "e1", "user_id": "u1", "title": "Call", "start_date": start,
+            "end_date": start + timedelta(hours=1), "reminder_minutes": minutes, **fields}
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda doc: doc[key])
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, n):
+        return self.docs
+
+
+class FakeEvents:
+    """Just enough of a collection for the scheduler's equality and $lte filters"""
+
+    def __init__(self, docs):
+        self.docs = {doc["id"]: dict(doc) for doc in docs}
+
+    def _matches(self, doc, query):
+        for key, condition in query.items():
+            if isinstance(condition, dict):
+                if doc.get(key) is None or doc[key] > condition["$lte"]:
+                    return False
+            elif doc.get(key) != condition:
+                return False
+        return True
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(doc) for doc in self.docs.values() if self._matches(doc, query)])
+
+    async def find_one(self, query, projection=None):
+        docs = await self.find(query).to_list(None)
+        return docs[0] if docs else None
+
+    async def update_one(self, query, update):
+        for doc in self.docs.values():
+            if self._matches(doc, query):
+                doc.update(update["$set"])
+                return SimpleNamespace(modified_count=1)
+        return SimpleNamespace(modified_count=0)
+
+
+def scheduler(events, delivered):
+    async def deliver(notification):
+        delivered.append(notification)
+
+    db = SimpleNamespace(calendar_events=events, job_leases=None)
+    return ReminderScheduler(db, deliver, lease=FakeLease())
+
+
+def test_fire_time_follows_reminder_minutes():
+    start = NOW + timedelta(hours=2)
+
+    assert reminder_fields(event(start), NOW) == {"remind_at": start - timedelta(minutes=30), "remind_for": start}
+    assert reminder_fields(event(start, minutes=None), NOW) == {"remind_at": None, "remind_for": None}
+    assert reminder_fields(event(NOW - timedelta(minutes=1)), NOW)["remind_at"] is None
+
+
+def test_recurring_events_remind_for_the_next_kept_occurrence():
+    start = datetime(2026, 10, 19, 10, 0, tzinfo=UTC)
+    daily = event(start, minutes=15, rrule="FREQ=DAILY", recurrence_exceptions={
+        exception_key(start + timedelta(days=1)): {"cancelled": True}})
+
+    assert reminder_fields(daily, NOW)["remind_for"] == start
+    assert reminder_fields(daily, start)["remind_for"] == start + timedelta(days=2)
+
+
+def test_each_reminder_fires_once_across_schedulers():
+    due = event(datetime.now(UTC) + timedelta(minutes=10))
+    events = FakeEvents([{**due, **reminder_fields(due)}])
+    delivered = []
+    first, second = scheduler(events, delivered), scheduler(events, delivered)
+
+    async def run():
+        # Both loaded the reminder (a lease handover); only one claim wins
+        for each in (first, second):
+            await each.refill(datetime.now(UTC))
+        await first.fire_due()
+        await second.fire_due()
+
+    asyncio.run(run())
+
+    assert [n["event_id"] for n in delivered] == ["e1"]
+    assert events.docs["e1"]["remind_at"] is None
+    assert second.stats["stale"] == 1
+
+
+def test_edited_events_are_not_fired_at_their_old_time():
+    due = event(datetime.now(UTC) + timedelta(minutes=10))
+    events = FakeEvents([{**due, **reminder_fields(due)}])
+    delivered = []
+    reminders = scheduler(events, delivered)
+
+    async def run():
+        await reminders.refill(datetime.now(UTC))
+        reminders._holding = True
+        moved = event(datetime.now(UTC) + timedelta(minutes=35))
+        events.docs["e1"].update(reminder_fields(moved))
+        reminders.schedule(events.docs["e1"])
+        await reminders.fire_due()
+
+    asyncio.run(run())
+
+    assert delivered == []
+    assert reminders.stats["stale"] == 1
+    assert len(reminders._heap) == 1
+
+
+def test_stream_messages_and_hub_deduplication():
+    notification = {"id": "n1", "user_id": "u1", "event_id": "e1", "title": "Call",
+                    "start_date": NOW, "created_at": datetime.now(UTC)}
+
+    message = sse_message(notification)
+    assert message.startswith("id: n1\nevent: reminder\ndata: ")
+    assert json.loads(message.split("data: ")[1]) == {"id": "n1", "event_id": "e1", "title": "Call",
+                                                      "start_date": NOW.isoformat(),
+                                                      "created_at": notification["created_at"].isoformat()}
+
+    class Notifications:
+        def find(self, query, projection=None):
+            return FakeCursor([dict(notification)])
+
+    async def run():
+        hub = ReminderHub(Notifications())
+        queue = hub.subscribe("u1")
+        pushed = [await hub.poll(), await hub.poll()]
+        hub.unsubscribe("u1", queue)
+        return pushed, queue.qsize()
+
+    assert asyncio.run(run()) == ([1, 0], 1)
+
+
+class FakeNotifications:
+    """Upserts keyed on (event_id, start_date) and the hub's created_at queries"""
+
+    def __init__(self):
+        self.docs = []
+
+    def _matches(self, doc, query):
+        for key, condition in query.items():
+            value = doc.get(key)
+            if not isinstance(condition, dict):
+                if value != condition:
+                    return False
+            elif any(op == "$gt" and not value > operand or op == "$gte" and not value >= operand
+                     or op == "$ne" and value == operand or op == "$in" and value not in operand
+                     for op, operand in condition.items()):
+                return False
+        return True
+
+    async def update_one(self, query, update, upsert=False):
+        if any(self._matches(doc, query) for doc in self.docs):
+            return SimpleNamespace(upserted_id=None)
+        self.docs.append({**query, **update["$setOnInsert"]})
+        return SimpleNamespace(upserted_id=len(self.docs))
+
+    async def find_one(self, query, projection=None):
+        return next((dict(doc) for doc in self.docs if self._matches(doc, query)), None)
+
+    def find(self, query, projection=None):
+        return FakeCursor([dict(doc) for doc in self.docs if self._matches(doc, query)])
+
+
+def test_a_reminder_whose_claim_failed_fires_again_without_a_duplicate():
+    due = event(datetime.now(UTC) + timedelta(minutes=10))
+    events = FakeEvents([{**due, **reminder_fields(due)}])
+    hub = ReminderHub(FakeNotifications())
+    db = SimpleNamespace(calendar_events=events, job_leases=None)
+    claim = events.update_one
+
+    async def lost_claim(query, update):
+        raise ConnectionError("worker died")
+
+    async def run():
+        crashed = ReminderScheduler(db, hub.publish, lease=FakeLease())
+        await crashed.refill(datetime.now(UTC))
+        events.update_one = lost_claim
+        try:
+            await crashed.fire_due()
+        except ConnectionError:
+            pass
+        events.update_one = claim
+        successor = ReminderScheduler(db, hub.publish, lease=FakeLease())
+        await successor.refill(datetime.now(UTC))
+        return await successor.fire_due()
+
+    assert asyncio.run(run()) == 1
+    assert [n["event_id"] for n in hub.collection.docs] == ["e1"]
+    assert hub.stats["published"] == 1
+    assert events.docs["e1"]["remind_at"] is None
+
+
+def test_a_reconnected_stream_replays_what_it_missed():
+    notifications = FakeNotifications()
+    created = datetime.now(UTC) - timedelta(minutes=9, seconds=1)
+    for n in range(4):
+        notifications.docs.append({"id": f"n{n}", "user_id": "u1", "event_id": f"e{n}", "start_date": NOW,
+                                   "created_at": created + timedelta(minutes=n * 3)})
+
+    async def run():
+        hub = ReminderHub(notifications)
+        # The last reminder is recent enough for the poll to find it too
+        first = hub.subscribe("u1", last_event_id="n1")
+        other_tab = hub.subscribe("u1")
+        await hub.poll()
+        return [[queue.get_nowait()["id"] for _ in range(queue.qsize())] for queue in (first, other_tab)]
+
+    replayed, live = asyncio.run(run())
+
+    assert replayed == ["n2", "n3"]
+    assert live == ["n3"]
@@ -0,0 +1,130 @@
+import asyncio
+from datetime import datetime, timezone
+
+from entitlements import PLAN_ORDER, ROLE_PLANS
+from revenue_rollups import (
+    RevenueRollups,
+    churned_subscriptions_pipeline,
+    payments_pipeline,
+    revenue_report,
+    snapshot_pipeline,
+    success_rate,
+)
+from tests.conftest import FakeLease
+
+PLAN_PRICES = {"starter": 0.0, "professional": 14.99, "enterprise": 39.99}
+
+
+def test_pipelines_merge_into_the_daily_rollups():
+    since = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+    payments = payments_pipeline(since)
+    churned = churned_subscriptions_pipeline(None, PLAN_PRICES)
+
+    assert payments[0] == {"$match": {"created_at": {"$gte": since}}}
+    assert churned[0]["$match"] == {"status": {"$in": ["expired", "cancelled"]}, "expires_at": {"$ne": None}}
+    for pipeline in (payments, churned):
+        assert pipeline[-1]["$merge"]["into"] == "revenue_daily"
+        assert pipeline[-1]["$merge"]["whenMatched"] == "merge"
+
+
+def test_snapshot_counts_plans_granted_by_roles():
+    pipeline = snapshot_pipeline("2026-10-19", PLAN_PRICES)
+    lookup, unwind, by_user = pipeline[1:4]
+    role_rank = by_user["$group"]["rank"]["$max"]["$max"][1]["$switch"]
+
+    assert lookup["$lookup"]["from"] == "user_roles"
+    assert unwind["$unwind"]["preserveNullAndEmptyArrays"]
+    # Same role to plan mapping as resolve_entitlements, e.g. premium_user counts as professional
+    assert {branch["case"]["$eq"][1]: PLAN_ORDER[branch["then"]] for branch in role_rank["branches"]} == ROLE_PLANS
+    assert role_rank["default"] == -1
+    assert pipeline[5]["$group"]["_id"] == "$plan"
+
+
+def test_report_totals_and_rates():
+    rollups = [
+        {"_id": "2026-10-01",
+         "payments": {"attempts": 4, "paid": 2, "failed": 1, "expired": 0, "revenue": 29.98},
+         "new_subscriptions": {"count": 2, "mrr": 29.98, "by_plan": {"professional": 2}},
+         "snapshot": {"users": 10, "paying_users": 4, "mrr": 69.96, "plans": {"starter": 6, "professional": 4}},
+         "active_subscriptions": 6},
+        {"_id": "2026-10-02",
+         "churned_subscriptions": {"count": 2, "mrr": 29.98, "by_plan": {"professional": 2}}},
+        {"_id": "2026-10-03",
+         "payments": {"attempts": 1, "paid": 1, "failed": 0, "expired": 0, "revenue": 39.99},
+         "snapshot": {"users": 11, "paying_users": 4, "mrr": 94.96, "plans": {"starter": 7, "professional": 3,
+                                                                              "enterprise": 1}}},
+    ]
+
+    report = revenue_report(rollups)
+
+    assert (report["from"], report["to"]) == ("2026-10-01", "2026-10-03")
+    assert report["mrr"] == 94.96
+    assert report["plan_distribution"] == {"starter": 7, "professional": 3, "enterprise": 1}
+    assert report["payment_success_rate"] == 0.75
+    # Two churned subscriptions out of six active plus two new
+    assert report["subscription_churn_rate"] == 0.25
+    assert round(report["totals"]["revenue"], 2) == 69.97
+    assert [day["success_rate"] for day in report["days"]] == [0.6667, None, 1.0]
+    assert [day["mrr"] for day in report["days"]] == [69.96, None, 94.96]
+
+
+def test_empty_report():
+    report = revenue_report([])
+
+    assert report["mrr"] is None
+    assert report["subscription_churn_rate"] is None
+    assert report["days"] == []
+    assert success_rate({"paid": 0}) is None
+
+
+class FakeCursor:
+    async def to_list(self, length):
+        return []
+
+
+class FakeCollection:
+    def __init__(self, name, calls):
+        self.name = name
+        self.calls = calls
+
+    def aggregate(self, pipeline):
+        self.calls.append((self.name, pipeline))
+        return FakeCursor()
+
+
+class FakeDb:
+    def __init__(self):
+        self.calls = []
+
+    def __getattr__(self, name):
+        return FakeCollection(name, self.calls)
+
+    def __getitem__(self, name):
+        return FakeCollection(name, self.calls)
+
+
+def test_first_run_backfills_and_later_runs_look_back():
+    db = FakeDb()
+    lease = FakeLease({})
+    rollups = RevenueRollups(db, PLAN_PRICES, lookback_days=3, lease=lease)
+
+    asyncio.run(rollups.run())
+    assert [name for name, _ in db.calls] == ["payment_transactions", "user_subscriptions",
+                                              "user_subscriptions", "users", "user_subscriptions"]
+    assert db.calls[0][1][0] == {"$match": {}}
+    assert lease.released
+
+    lease.checkpoint = {"last_run": datetime(2026, 10, 19, 14, 30)}
+    db.calls.clear()
+    stats = asyncio.run(rollups.run())
+    assert stats["since"] == datetime(2026, 10, 16, tzinfo=timezone.utc)
+    assert db.calls[0][1][0] == {"$match": {"created_at": {"$gte": stats["since"]}}}
+
+
+def test_run_skips_while_another_worker_holds_the_lease():
+    db = FakeDb()
+    rollups = RevenueRollups(db, PLAN_PRICES, lease=FakeLease(held=True))
+
+    assert asyncio.run(rollups.run()) is None
+    assert db.calls == []
@@ -0,0 +1,193 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from pymongo import UpdateOne
+
+from subscription_expiry import SubscriptionExpiry, downgrade_ops, expired_query, running_query
+from tests.conftest import FakeLease
+
+NOW = datetime(2026, 10, 19, tzinfo=timezone.utc)
+
+
+def subscription(user_id, plan_id):
+    return {"id": f"{user_id}-{plan_id}", "user_id": user_id, "plan_id": plan_id}
+
+
+def test_queries_use_status_and_expiry():
+    assert expired_query(NOW) == {"status": "active", "expires_at": {"$lte": NOW}}
+    running = running_query({"u1"}, NOW)
+    assert running["user_id"] == {"$in": ["u1"]}
+    assert running["$or"] == [{"expires_at": None}, {"expires_at": {"$gt": NOW}}]
+
+
+def test_users_fall_back_to_default_or_newest_running_plan():
+    expired = [subscription("u1", "enterprise"), subscription("u2", "professional"),
+               subscription("u2", "enterprise")]
+    running = [subscription("u2", "professional"), subscription("u2", "starter")]
+
+    ops = downgrade_ops(expired, running, "starter")
+
+    assert ops["u1"] == UpdateOne({"id": "u1", "current_plan": {"$in": ["enterprise"]}},
+                                  {"$set": {"current_plan": "starter"}, "$inc": {"entitlements_version": 1}})
+    # u2 still has a running professional subscription: only an enterprise plan is downgraded
+    assert ops["u2"] == UpdateOne({"id": "u2", "current_plan": {"$in": ["enterprise"]}},
+                                  {"$set": {"current_plan": "professional"}, "$inc": {"entitlements_version": 1}})
+
+
+def test_no_update_when_the_same_plan_is_still_running():
+    expired = [subscription("u1", "professional")]
+    running = [subscription("u1", "professional")]
+
+    assert downgrade_ops(expired, running, "starter") == {}
+    assert downgrade_ops([subscription("u2", "starter")], [], "starter") == {}
+
+
+def matches(doc, query):
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, branch) for branch in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = doc.get(key)
+            for op, operand in condition.items():
+                if op == "$in" and value not in operand:
+                    return False
+                # Range operators never match a missing value
+                if op == "$lte" and (value is None or value > operand):
+                    return False
+                if op == "$gt" and (value is None or value <= operand):
+                    return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+class FakeSubscriptions:
+    """The finds and the expired mark of a pass; every write is appended to ``log``"""
+
+    def __init__(self, docs, log):
+        self.docs = [dict(doc) for doc in docs]
+        self.log = log
+        self.fail_mark = False
+
+    def find(self, query, projection=None):
+        docs = [dict(doc) for doc in self.docs if matches(doc, query)]
+        cursor = SimpleNamespace()
+
+        def sort(field, direction):
+            docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+            return cursor
+
+        cursor.sort = sort
+        cursor.limit = lambda n: SimpleNamespace(to_list=lambda _: asyncio.sleep(0, docs[:n]))
+        cursor.to_list = lambda _: asyncio.sleep(0, docs)
+        return cursor
+
+    async def update_many(self, query, update):
+        if self.fail_mark:
+            raise ConnectionError("primary stepped down")
+        ids = [doc["id"] for doc in self.docs if matches(doc, query)]
+        self.log.append(("mark", ids))
+        for doc in self.docs:
+            if doc["id"] in ids:
+                doc.update(update["$set"])
+
+
+class FakeUsers:
+    def __init__(self, log):
+        self.log = log
+
+    async def bulk_write(self, ops, ordered=True):
+        self.log.append(("downgrade", sorted(op._filter["id"] for op in ops)))
+        return SimpleNamespace(modified_count=len(ops))
+
+
+def expiry(subscriptions, lease, **options):
+    log = []
+    db = SimpleNamespace(user_subscriptions=FakeSubscriptions(subscriptions, log), users=FakeUsers(log))
+    options.setdefault("backfill_lease", FakeLease())
+    return SubscriptionExpiry(db, lease=lease, **options), log
+
+
+def stored(user_id, plan_id, expires_in_days, started_days_ago=30):
+    # Passes take their cutoff from the clock
+    now = datetime.now(timezone.utc)
+    return {"id": f"{user_id}-{plan_id}", "user_id": user_id, "plan_id": plan_id, "status": "active",
+            "started_at": now - timedelta(days=started_days_ago),
+            "expires_at": now + timedelta(days=expires_in_days) if expires_in_days is not None else None}
+
+
+def test_users_are_downgraded_before_their_subscriptions_are_marked_expired():
+    subscriptions = [stored("u1", "enterprise", -2), stored("u2", "professional", -1),
+                     stored("u2", "starter", None, started_days_ago=60)]
+    job, log = expiry(subscriptions, FakeLease())
+
+    job.db.user_subscriptions.fail_mark = True
+    try:
+        asyncio.run(job.run_pass())
+    except ConnectionError:
+        pass
+    # A pass that dies before the mark leaves the subscriptions for the next one
+    assert log == [("downgrade", ["u1", "u2"])]
+    assert [doc["status"] for doc in job.db.user_subscriptions.docs] == ["active"] * 3
+
+    job.db.user_subscriptions.fail_mark = False
+    job.lease = FakeLease()
+    log.clear()
+    stats = asyncio.run(job.run_pass())
+
+    assert log == [("downgrade", ["u1", "u2"]), ("mark", ["u1-enterprise", "u2-professional"])]
+    assert stats == {"expired": 2, "downgraded": 2}
+    assert job.lease.saves[-1] == {} and job.lease.released
+
+
+def test_a_resumed_pass_keeps_the_checkpointed_cutoff_and_counts():
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=1)
+    subscriptions = [
+        {**stored("u1", "enterprise", 0), "expires_at": cutoff - timedelta(minutes=5)},
+        # Expired after the interrupted pass started: left for the next pass
+        {**stored("u2", "enterprise", 0), "expires_at": cutoff + timedelta(minutes=5)},
+    ]
+    lease = FakeLease({"cutoff": cutoff.replace(tzinfo=None), "expired": 3, "downgraded": 2})
+    job, log = expiry(subscriptions, lease)
+
+    assert asyncio.run(job.run_pass()) == {"expired": 4, "downgraded": 3}
+    assert log == [("downgrade", ["u1"]), ("mark", ["u1-enterprise"])]
+    assert lease.saves[0]["cutoff"] == cutoff.replace(tzinfo=None)
+
+
+def test_a_pass_stops_when_its_lease_is_lost_or_held():
+    subscriptions = [stored(f"u{n}", "enterprise", -n) for n in range(1, 4)]
+    lease = FakeLease(lose_after=1)
+    job, log = expiry(subscriptions, lease, batch_size=1)
+
+    assert asyncio.run(job.run_pass()) is None
+    assert [entry[0] for entry in log] == ["downgrade", "mark", "downgrade", "mark"]
+    assert [checkpoint["expired"] for checkpoint in lease.saves] == [1]
+    assert not lease.released
+
+    job.lease = FakeLease(held=True)
+    log.clear()
+    assert asyncio.run(job.run_pass()) is None
+    assert log == []
+
+
+def test_replaced_subscriptions_are_cancelled_once_under_a_lease():
+    job, _ = expiry([], FakeLease())
+    runs = []
+
+    async def cancel_replaced():
+        runs.append(1)
+        return 3
+
+    job.cancel_replaced = cancel_replaced
+    assert asyncio.run(job.backfill()) == {"cancelled": 3}
+    assert job.backfill_lease.saves == [{"done": True, "cancelled": 3}] and job.backfill_lease.released
+
+    # Later starts find the done checkpoint; a held lease means another worker runs it
+    job.backfill_lease = FakeLease({"done": True, "cancelled": 3})
+    assert asyncio.run(job.backfill()) == {"cancelled": 3}
+    job.backfill_lease = FakeLease(held=True)
+    assert asyncio.run(job.backfill()) is None
+    assert runs == [1]
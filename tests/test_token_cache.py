@@ -0,0 +1,80 @@
+import asyncio
+
+from token_cache import AccessTokenCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_concurrent_callers_share_one_refresh():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return f"token-{len(calls)}", 32400
+
+    async def run():
+        cache = AccessTokenCache(fetch)
+        return await asyncio.gather(*(cache.get() for _ in range(20)))
+
+    assert asyncio.run(run()) == ["token-1"] * 20
+    assert len(calls) == 1
+
+
+def test_refreshes_before_expiry():
+    clock = Clock()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return f"token-{len(calls)}", 3600
+
+    async def run():
+        cache = AccessTokenCache(fetch, refresh_margin=300, clock=clock)
+        first = await cache.get()
+        clock.now = 3299
+        still = await cache.get()
+        clock.now = 3300
+        renewed = await cache.get()
+        return first, still, renewed
+
+    assert asyncio.run(run()) == ("token-1", "token-1", "token-2")
+
+
+def test_invalidate_only_drops_the_rejected_token():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return f"token-{len(calls)}", 3600
+
+    async def run():
+        cache = AccessTokenCache(fetch)
+        stale = await cache.get()
+        cache.invalidate(stale)
+        fresh = await cache.get()
+        # A second request that saw the same 401 late must not discard the fresh token
+        cache.invalidate(stale)
+        return fresh, await cache.get()
+
+    assert asyncio.run(run()) == ("token-2", "token-2")
+    assert len(calls) == 2
+
+
+def test_failed_exchange_is_not_cached():
+    results = [None, ("token", 3600)]
+
+    async def fetch():
+        return results.pop(0)
+
+    async def run():
+        cache = AccessTokenCache(fetch)
+        return await cache.get(), await cache.get()
+
+    assert asyncio.run(run()) == (None, "token")
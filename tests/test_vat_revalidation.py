@@ -0,0 +1,83 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from vat_revalidation import RateLimiter, VatRevalidator, pending_query, status_change
+from vies_cache import VALID
+from tests.conftest import FakeLease
+
+CUTOFF = datetime(2026, 1, 1, tzinfo=timezone.utc)
+ACCOUNT = {"id": "a1", "user_id": "u1", "name": "ACME", "vat_key": "BE0403170701"}
+
+
+def test_rate_limiter_spaces_calls():
+    async def run():
+        limiter = RateLimiter(rate=50)
+        start = time.monotonic()
+        for _ in range(6):
+            await limiter.wait()
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 5 / 50 * 0.9
+
+
+def test_pending_query_resumes_after_checkpoint():
+    fresh = pending_query({}, CUTOFF)
+    assert fresh["$or"] == [{"vat_checked_at": None}, {"vat_checked_at": {"$lt": CUTOFF}}]
+
+    unchecked = pending_query({"after_checked_at": None, "after_id": "a5"}, CUTOFF)
+    assert {"vat_checked_at": None, "id": {"$gt": "a5"}} in unchecked["$or"]
+
+    checked_at = datetime(2025, 6, 1, tzinfo=timezone.utc)
+    resumed = pending_query({"after_checked_at": checked_at, "after_id": "a5"}, CUTOFF)
+    assert resumed["$or"] == [
+        {"vat_checked_at": checked_at, "id": {"$gt": "a5"}},
+        {"vat_checked_at": {"$gt": checked_at, "$lt": CUTOFF}},
+    ]
+
+
+def test_only_flips_and_first_invalid_results_are_changes():
+    now = datetime.now(timezone.utc)
+
+    assert status_change({**ACCOUNT, "vat_valid": True}, True, now) is None
+    assert status_change(ACCOUNT, True, now) is None
+    assert status_change(ACCOUNT, False, now)["previous_valid"] is None
+
+    change = status_change({**ACCOUNT, "vat_valid": True}, False, now)
+    assert (change["account_id"], change["previous_valid"], change["vat_valid"]) == ("a1", True, False)
+
+
+class FakeAccounts:
+    def __init__(self, docs):
+        self.docs = docs
+        self.updates = []
+
+    def find(self, query, projection=None):
+        cursor = SimpleNamespace()
+        cursor.sort = lambda keys: cursor
+        cursor.limit = lambda n: SimpleNamespace(to_list=lambda _: asyncio.sleep(0, self.docs[:n]))
+        return cursor
+
+    async def bulk_write(self, ops, ordered=True):
+        self.updates.extend(op._filter["id"] for op in ops)
+
+
+def test_a_batch_stops_looking_up_once_the_lease_is_lost():
+    accounts = FakeAccounts([{**ACCOUNT, "id": f"a{n}", "vat_key": f"BE040317070{n}"} for n in range(4)])
+    lease = FakeLease()
+    looked_up = []
+
+    async def lookup(number):
+        looked_up.append(number)
+        # A slow batch outlasted the lease and another worker took it
+        lease.lost = len(looked_up) == 2
+        return VALID, {}
+
+    revalidator = VatRevalidator(SimpleNamespace(accounts=accounts), lookup, rate=0, lease=lease)
+
+    stats = asyncio.run(revalidator.run_pass())
+
+    assert looked_up == ["BE0403170700", "BE0403170701"]
+    assert accounts.updates == ["a0", "a1"]
+    assert stats["checked"] == 2 and lease.saves == []
@@ -0,0 +1,56 @@
+import asyncio
+
+from vat_validation import check_numbers, prefilter, run_batch
+
+
+class FakeAccounts:
+    def __init__(self):
+        self.ops = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.ops.extend(ops)
+
+
+class FakeDB:
+    def __init__(self):
+        self.accounts = FakeAccounts()
+
+
+def test_prefilter_dedupes_and_rejects_bad_checksums():
+    candidates, rejected = prefilter(["BE 0403.170.701", "be0403170701", "BE0403170702", None, ""])
+
+    assert candidates == ["BE0403170701"]
+    assert rejected == ["BE0403170702"]
+
+
+def test_concurrency_is_limited_per_country():
+    active, peak = {}, {}
+
+    async def lookup(number):
+        country = number[:2]
+        active[country] = active.get(country, 0) + 1
+        peak[country] = max(peak.get(country, 0), active[country])
+        await asyncio.sleep(0.01)
+        active[country] -= 1
+        return "valid", {"valid": True}
+
+    numbers = [f"BE{i}" for i in range(6)] + [f"NL{i}" for i in range(6)]
+    results = asyncio.run(check_numbers(numbers, lookup, per_country_limit=2))
+
+    assert peak == {"BE": 2, "NL": 2}
+    assert set(results.values()) == {"valid"}
+
+
+def test_unavailable_numbers_are_not_written_back():
+    async def lookup(number):
+        if number.startswith("NL"):
+            raise RuntimeError("timeout")
+        return "valid", {"valid": True}
+
+    db = FakeDB()
+    summary = asyncio.run(run_batch(db, "u1", ["BE0403170701", "NL004495445B01", "BE0403170702"], lookup))
+
+    assert summary == {"unique": 3, "prefiltered_invalid": 1, "checked": 2,
+                       "valid": 1, "invalid": 1, "unavailable": 1}
+    written = {op._filter["vat_key"]: op._doc["$set"]["vat_valid"] for op in db.accounts.ops}
+    assert written == {"BE0403170701": True, "BE0403170702": False}
@@ -0,0 +1,30 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from eu_countries import EU_COUNTRY_NAMES
+from vies_address import ADDRESS_FORMATS, ParsedAddress, parse_vies_address, parse_vies_addresses
+
+CORPUS = json.loads((Path(__file__).parent / "data" / "vies_addresses.json").read_text(encoding="utf-8"))
+
+
+@pytest.mark.parametrize("case", CORPUS, ids=lambda case: f"{case['country']}:{case['address'][:24]}")
+def test_corpus(case):
+    assert parse_vies_address(case["address"], case["country"]) == ParsedAddress(*case["expected"])
+
+
+def test_every_eu_country_has_a_format():
+    assert set(EU_COUNTRY_NAMES) <= set(ADDRESS_FORMATS)
+
+
+def test_bulk_matches_single_parse():
+    pairs = [(case["country"], case["address"]) for case in CORPUS]
+
+    assert parse_vies_addresses(pairs) == [parse_vies_address(address, country) for country, address in pairs]
+
+
+def test_unknown_country_falls_back_to_generic_rule():
+    assert parse_vies_address("Main Street 5\n12345 Springfield", "XX") == \
+        ("Main Street", "5", None, "12345", "Springfield")
+    assert parse_vies_address(None, "BE") == (None, None, None, None, None)
@@ -0,0 +1,151 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+from vies_cache import ViesCache, ViesUnavailableError
+
+
+class FakeCollection:
+    """In-memory stand-in for the few Motor collection methods the cache uses"""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, query):
+        doc = self.docs.get(query["_id"])
+        if doc and doc["expires_at"] > query["expires_at"]["$gt"]:
+            return doc
+        return None
+
+    async def replace_one(self, query, doc, upsert=False):
+        self.docs[query["_id"]] = doc
+
+    async def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+
+def test_concurrent_lookups_share_one_request():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"valid": True, "name": "ACME"}
+
+    async def run():
+        cache = ViesCache(FakeCollection())
+        results = await asyncio.gather(*(cache.get("BE0403170701", fetch) for _ in range(10)))
+        return cache, results
+
+    cache, results = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert all(result["name"] == "ACME" for result in results)
+    assert cache.metrics()["coalesced"] == 9
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.02)
+        return {"valid": True, "name": "ACME"}
+
+    async def run():
+        cache = ViesCache(FakeCollection())
+        leader = asyncio.ensure_future(cache.get("BE0403170701", fetch))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(cache.get("BE0403170701", fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        results = await asyncio.gather(*waiters)
+        return cache, leader, results
+
+    cache, leader, results = asyncio.run(run())
+
+    assert leader.cancelled()
+    assert [result["name"] for result in results] == ["ACME"] * 3
+    assert len(calls) == 1
+    assert cache.metrics()["inflight"] == 0
+
+
+def test_failed_load_reaches_every_waiter():
+    async def fetch():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def run():
+        cache = ViesCache(FakeCollection())
+        return cache, await asyncio.gather(*(cache.get("BE0403170701", fetch) for _ in range(3)),
+                                           return_exceptions=True)
+
+    cache, results = asyncio.run(run())
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    assert cache.metrics()["inflight"] == 0
+
+
+def test_ttl_depends_on_outcome():
+    collection = FakeCollection()
+    cache = ViesCache(collection, valid_ttl=timedelta(days=7), invalid_ttl=timedelta(hours=1),
+                      unavailable_ttl=timedelta(minutes=1))
+
+    async def valid():
+        return {"valid": True}
+
+    async def invalid():
+        return {"valid": False}
+
+    async def unavailable():
+        raise ViesUnavailableError("MS_UNAVAILABLE")
+
+    async def run():
+        await cache.get("A", valid)
+        await cache.get("B", invalid)
+        return await cache.get("C", unavailable)
+
+    assert asyncio.run(run()) == {"valid": False}
+
+    now = datetime.now(timezone.utc)
+    ttl = {key: doc["expires_at"] - now for key, doc in collection.docs.items()}
+    assert timedelta(days=6) < ttl["A"] <= timedelta(days=7)
+    assert timedelta(minutes=59) < ttl["B"] <= timedelta(hours=1)
+    assert ttl["C"] <= timedelta(minutes=1)
+    assert collection.docs["C"]["status"] == "unavailable"
+    assert cache.metrics()["upstream_errors"] == 1
+
+
+def test_shared_tier_serves_other_workers_and_hit_ratio():
+    collection = FakeCollection()
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        return {"valid": True}
+
+    async def run():
+        worker_a = ViesCache(collection)
+        worker_b = ViesCache(collection)
+        await worker_a.get("NL123456789B01", fetch)
+        await worker_a.get("NL123456789B01", fetch)
+        await worker_b.get("NL123456789B01", fetch)
+        return worker_a, worker_b
+
+    worker_a, worker_b = asyncio.run(run())
+
+    assert len(calls) == 1
+    assert worker_a.metrics()["hit_ratio"] == 0.5
+    assert worker_b.metrics()["mongo_hits"] == 1
+
+
+def test_local_tier_is_bounded():
+    async def fetch():
+        return {"valid": True}
+
+    async def run():
+        cache = ViesCache(FakeCollection(), max_entries=3)
+        for i in range(10):
+            await cache.get(f"K{i}", fetch)
+        return cache
+
+    assert asyncio.run(run()).metrics()["memory_entries"] == 3